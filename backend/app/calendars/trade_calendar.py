@@ -2,8 +2,9 @@
 import os
 from datetime import date, datetime
 from threading import Lock
-from typing import Optional, Union, List
+from typing import Optional, Union, List, Iterator, Iterable
 
+import numpy as np
 import pandas as pd
 from loguru import logger
 
@@ -29,6 +30,7 @@ class TradeCalendar:
                 if cls._instance is None:
                     cls._instance = super().__new__(cls)
                     cls._instance._dt_index = None
+                    cls._instance._days = None
                     cls._instance._initialized = False
         return cls._instance
 
@@ -56,6 +58,8 @@ class TradeCalendar:
 
                 # 只维护一份数据：排序的 DatetimeIndex
                 self._dt_index = pd.to_datetime(sorted(trade_dates_str)).sort_values()
+                # 同一份数据的 datetime64[D] 视图，供区间/批量接口直接 searchsorted
+                self._days = self._dt_index.values.astype('datetime64[D]')
                 self._initialized = True
 
                 logger.info("Trade calendar loaded from %s, total %d days",
@@ -66,6 +70,7 @@ class TradeCalendar:
                 # 加载失败，重置状态，以便下次可以重试
                 self._initialized = False
                 self._dt_index = None
+                self._days = None
                 raise e
 
     def _ensure_loaded(self):
@@ -78,6 +83,7 @@ class TradeCalendar:
         with self._lock:
             self._initialized = False
             self._dt_index = None
+            self._days = None
             self._load()
         logger.warning("Trade calendar reloaded")
 
@@ -263,6 +269,123 @@ class TradeCalendar:
         return max(0, right_idx - left_idx)
 
 
+    # ------------------------------------------------------------------
+    # 区间 / 批量接口：一次 searchsorted 取代逐日 next_trade_day 循环
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def _to_day_array(cls, dates: Iterable) -> np.ndarray:
+        """将日期序列统一转换为 datetime64[D] 数组。"""
+        if isinstance(dates, np.ndarray) and np.issubdtype(dates.dtype, np.datetime64):
+            return dates.astype('datetime64[D]')
+        if isinstance(dates, (pd.DatetimeIndex, pd.Series)):
+            return np.asarray(dates, dtype='datetime64[ns]').astype('datetime64[D]')
+        return np.array([cls._normalize_date(d) for d in dates], dtype='datetime64[D]')
+
+    def count_trade_days_between_many(self, start_dates: Iterable, end_dates: Iterable,
+                                      inclusive: bool = True) -> np.ndarray:
+        """
+        count_trade_days_between 的批量版本，起止日期逐元素配对。
+
+        :return: int64 数组；start > end 的位置为 0
+        """
+        self._ensure_loaded()
+        starts = self._to_day_array(start_dates)
+        ends = self._to_day_array(end_dates)
+        left_idx = self._days.searchsorted(starts, side='left' if inclusive else 'right')
+        right_idx = self._days.searchsorted(ends, side='right' if inclusive else 'left')
+        return np.maximum(right_idx - left_idx, 0).astype(np.int64)
+
+    def trade_days_between(
+            self,
+            start_date: Union[str, date, datetime],
+            end_date: Union[str, date, datetime],
+            inclusive: bool = True
+    ) -> np.ndarray:
+        """
+        返回两个日期之间的所有交易日。
+
+        :param start_date: 起始日期
+        :param end_date: 结束日期
+        :param inclusive: 是否包含起止当天（若它们本身是交易日）
+        :return: 升序的 datetime64[D] 数组；start_date > end_date 时为空数组
+        """
+        self._ensure_loaded()
+        start = np.datetime64(self._normalize_date(start_date), 'D')
+        end = np.datetime64(self._normalize_date(end_date), 'D')
+
+        left_idx = self._days.searchsorted(start, side='left' if inclusive else 'right')
+        right_idx = self._days.searchsorted(end, side='right' if inclusive else 'left')
+        if right_idx <= left_idx:
+            return self._days[:0]
+        return self._days[left_idx:right_idx]
+
+    def iter_trade_days(
+            self,
+            start_date: Union[str, date, datetime],
+            end_date: Union[str, date, datetime],
+            inclusive: bool = True
+    ) -> Iterator[date]:
+        """按顺序迭代两个日期之间的交易日（date 对象）。"""
+        return iter(self.trade_days_between(start_date, end_date, inclusive).tolist())
+
+    def trade_day_index(self, date_input: Optional[Union[str, date, datetime]] = None, side: str = 'left') -> int:
+        """
+        返回日期在交易日历中的位置。
+
+        :param side: 'left' 返回第一个不早于该日期的交易日位置，
+                     'right' 返回第一个晚于该日期的交易日位置
+        :return: 位置索引；两个交易日之差即为它们之间的交易日数
+        """
+        self._ensure_loaded()
+        target = np.datetime64(self._normalize_date(date_input), 'D')
+        return int(self._days.searchsorted(target, side=side))
+
+    def trade_day_at(self, index: int) -> Optional[date]:
+        """按位置索引取交易日，越界返回 None。"""
+        self._ensure_loaded()
+        if 0 <= index < len(self._days):
+            return self._days[index].item()
+        return None
+
+    def offset_trade_days(self, dates: Iterable, n: int) -> np.ndarray:
+        """
+        批量交易日偏移。
+
+        :param dates: 日期序列（date / 字符串 / datetime64 数组）
+        :param n: 偏移量。n > 0 返回之后第 n 个交易日，n < 0 返回之前第 |n| 个交易日，
+                  n = 0 返回当天或之后最近的交易日。
+                  与 next_trade_day / prev_trade_day 一致：offset(d, 1) == next_trade_day(d)。
+        :return: datetime64[D] 数组，越界位置为 NaT
+        """
+        self._ensure_loaded()
+        days = self._to_day_array(dates)
+        if n > 0:
+            idx = self._days.searchsorted(days, side='right') - 1 + n
+        else:
+            idx = self._days.searchsorted(days, side='left') + n
+
+        valid = (idx >= 0) & (idx < len(self._days))
+        result = np.full(days.shape, np.datetime64('NaT'), dtype='datetime64[D]')
+        result[valid] = self._days[idx[valid]]
+        return result
+
+    def offset_trade_day(self, date_input: Optional[Union[str, date, datetime]], n: int) -> Optional[date]:
+        """单个日期的交易日偏移，越界返回 None。"""
+        shifted = self.offset_trade_days([self._normalize_date(date_input)], n)[0]
+        return None if np.isnat(shifted) else shifted.item()
+
+    def is_trade_days(self, dates: Iterable) -> np.ndarray:
+        """批量判断是否为交易日，返回与输入等长的 bool 数组。"""
+        self._ensure_loaded()
+        days = self._to_day_array(dates)
+        idx = self._days.searchsorted(days, side='left')
+        hit = idx < len(self._days)
+        result = np.zeros(days.shape, dtype=bool)
+        result[hit] = self._days[idx[hit]] == days[hit]
+        return result
+
+
 trade_calendar = TradeCalendar()
 
 if __name__ == '__main__':
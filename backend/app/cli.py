@@ -20,11 +20,11 @@ from app.models import AnalyticsWindow, Benchmark
 
 # Default seed data
 DEFAULT_ANALYTICS_WINDOWS = [
-    {'window_key': 'ALL', 'window_type': 'expanding', 'window_days': None, 'description': 'Since Inception'},
-    {'window_key': 'R21', 'window_type': 'rolling', 'window_days': 21, 'description': 'Last 21 Trading Days (~1 Month)'},
-    {'window_key': 'R63', 'window_type': 'rolling', 'window_days': 63, 'description': 'Last 63 Trading Days (~3 Months)'},
-    {'window_key': 'R126', 'window_type': 'rolling', 'window_days': 126, 'description': 'Last 126 Trading Days (~6 Months)'},
-    {'window_key': 'R252', 'window_type': 'rolling', 'window_days': 252, 'description': 'Last 252 Trading Days (~1 Year)'},
+    {'window_key': 'ALL', 'window_type': 'expanding', 'window_days': None, 'materialize_policy': 'ALL_DATES', 'description': 'Since Inception'},
+    {'window_key': 'R21', 'window_type': 'rolling', 'window_days': 21, 'materialize_policy': 'ALL_DATES', 'description': 'Last 21 Trading Days (~1 Month)'},
+    {'window_key': 'R63', 'window_type': 'rolling', 'window_days': 63, 'materialize_policy': 'ALL_DATES', 'description': 'Last 63 Trading Days (~3 Months)'},
+    {'window_key': 'R126', 'window_type': 'rolling', 'window_days': 126, 'materialize_policy': 'ALL_DATES', 'description': 'Last 126 Trading Days (~6 Months)'},
+    {'window_key': 'R252', 'window_type': 'rolling', 'window_days': 252, 'materialize_policy': 'ALL_DATES', 'description': 'Last 252 Trading Days (~1 Year)'},
 ]
 
 DEFAULT_BENCHMARKS = [
@@ -118,6 +118,8 @@ class Config:
     REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD')
     CACHE_TYPE = 'SimpleCache'  # 使用内存缓存
     CACHE_DEFAULT_TIMEOUT = 300  # 缓存默认超时时间（秒
+    # 持仓快照并行计算进程数，0 表示使用 CPU 核数
+    SNAPSHOT_WORKERS = int(os.getenv('SNAPSHOT_WORKERS', 0))
 
 
 class DevelopmentConfig(Config):
@@ -147,6 +147,8 @@ class ErrorMessageEnum(str, Enum):
     OPERATION_FAILED = "操作失败"
     NO_FILE_UPLOAD = "没有上传文件"
     CRAWL_NO_INFO = "未爬取到相关信息"
+    INVALID_DATE_RANGE = "开始日期不能晚于结束日期"
+    INVALID_PARAM = "参数不合法"
 
     @property
     def view(self):
@@ -168,6 +170,10 @@ class ErrorMessageEnum(str, Enum):
             return lazy_gettext('NO_FILE_UPLOAD')
         elif self == ErrorMessageEnum.CRAWL_NO_INFO:
             return lazy_gettext('CRAWL_NO_INFO')
+        elif self == ErrorMessageEnum.INVALID_DATE_RANGE:
+            return lazy_gettext('INVALID_DATE_RANGE')
+        elif self == ErrorMessageEnum.INVALID_PARAM:
+            return lazy_gettext('INVALID_PARAM')
         return self.name
 
 
@@ -241,10 +247,97 @@ class AnalyticsWindowEnum(str, Enum):
         }
 
 
+class AnalyticsMaterializeEnum(str, Enum):
+    """
+    分析窗口的物化策略
+    """
+    ALL_DATES = "ALL_DATES"
+    """
+    每个日期都落库 (默认)
+    """
+    LATEST = "LATEST"
+    """
+    只保留最新日期一行
+    """
+    ON_READ = "ON_READ"
+    """
+    不落库，读取时基于缓存数组即时计算
+    """
+
+
+class SnapshotEngineEnum(str, Enum):
+    """
+    持仓快照计算引擎
+    """
+    DECIMAL = "DECIMAL"
+    """
+    逐日 Decimal 循环 (基准实现)
+    """
+    VECTOR = "VECTOR"
+    """
+    NumPy 向量化重放
+    """
+    FIXED = "FIXED"
+    """
+    定点整数 (int64, 4 位小数) 向量化重放与组合汇总
+    """
+    VERIFY = "VERIFY"
+    """
+    同时计算 Decimal 与定点整数结果并校验一致，写入 Decimal 结果
+    """
+
+
+class SnapshotPipelineModeEnum(str, Enum):
+    """
+    快照流水线重算模式
+    """
+    FULL = "FULL"
+    """
+    全量：从最早交易日重算所有层
+    """
+    DIRTY = "DIRTY"
+    """
+    增量：只从交易变更记录的脏数据水位线起重算
+    """
+
+
+class SnapshotChunkModeEnum(str, Enum):
+    """
+    持仓快照流式分块方式
+    """
+    HOLDING = "HOLDING"
+    """
+    按持仓分块：每批持仓独立计算全区间并入库
+    """
+    DATE = "DATE"
+    """
+    按日期分块：所有持仓逐个日期块计算入库，持仓状态跨块传递
+    """
+
+
+class SnapshotDiffModeEnum(str, Enum):
+    """
+    快照批量写入的变更判定方式
+    """
+    VALUE = "VALUE"
+    """
+    逐列比较新旧值
+    """
+    HASH = "HASH"
+    """
+    只比较 row_hash 列 (表需有 row_hash 列)
+    """
+
+
 # Excluded enums that should not be exposed via API
 _ENUM_EXCLUDE_SET = {
     'ErrorMessageEnum',  # Error messages, not for UI display
     'AnalyticsWindowEnum',  # Analytics internal use
+    'AnalyticsMaterializeEnum',  # Analytics window materialization policy, internal use
+    'SnapshotEngineEnum',  # Snapshot engine selection, internal use
+    'SnapshotPipelineModeEnum',  # Snapshot pipeline mode, internal use
+    'SnapshotChunkModeEnum',  # Snapshot streaming chunk mode, internal use
+    'SnapshotDiffModeEnum',  # Snapshot diff-write mode, internal use
 }
 
 
@@ -0,0 +1,141 @@
+# app/engine/analytics_state.py
+"""
+扩张窗口 (ALL / CUR) 的可持久化累加状态
+
+每日增量只需把新的一行 push 进状态，即可得到与 RollingMetricsEngine 全量计算同口径的指标：
+1. 求和类指标 (收益、分红、胜率) 直接累加；TWRR 累加 log(1 + r)，非正因子单独计数；
+2. 波动率 / 下行波动率用 Welford 在线均值与二阶矩；
+3. 回撤 / 反弹维护净值、峰值 (最后一次)、最低值与当前最大回撤，修复日在净值回到回撤峰值时写入。
+"""
+from dataclasses import dataclass, fields
+from datetime import date
+from typing import Dict, Optional
+
+import numpy as np
+
+
+@dataclass
+class ExpandingState:
+    """字段与 HoldingAnalyticsState 的状态列同名"""
+    last_date: Optional[date] = None
+    window_start_date: Optional[date] = None
+    cycle: Optional[int] = None
+    row_count: int = 0
+
+    # 1. 收益 / 分红
+    log_sum: float = 0.0
+    zero_count: int = 0
+    pnl_sum: float = 0.0
+    cash_dividend_sum: float = 0.0
+    reinvest_dividend_sum: float = 0.0
+    win_count: int = 0
+
+    # 2. Welford: 全部收益与负收益
+    ret_mean: float = 0.0
+    ret_m2: float = 0.0
+    neg_count: int = 0
+    neg_mean: float = 0.0
+    neg_m2: float = 0.0
+
+    # 3. 净值 / 回撤 / 反弹
+    nav: float = 1.0
+    peak_nav: Optional[float] = None
+    peak_date: Optional[date] = None
+    trough_nav: Optional[float] = None
+    max_runup: Optional[float] = None
+    mdd: Optional[float] = None
+    mdd_start: Optional[date] = None
+    mdd_end: Optional[date] = None
+    mdd_peak_nav: Optional[float] = None
+    recovery_date: Optional[date] = None
+
+    # 4. 上一次的 XIRR 解，作为下一次 Newton 的初值
+    last_irr: Optional[float] = None
+
+    @classmethod
+    def from_row(cls, row) -> 'ExpandingState':
+        state = cls()
+        for f in fields(cls):
+            value = getattr(row, f.name)
+            if value is not None:
+                setattr(state, f.name, value)
+        return state
+
+    def to_dict(self) -> Dict:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    def push(self, day: date, ret: float, pnl: float, cash_dividend: float, reinvest_dividend: float):
+        """追加一天的数据 (日期须严格递增)"""
+        if self.row_count == 0:
+            self.window_start_date = day
+        self.row_count += 1
+        self.last_date = day
+
+        # 1. 收益 / 分红
+        factor = 1.0 + ret
+        if factor > 0:
+            self.log_sum += float(np.log(factor))
+        else:
+            self.zero_count += 1
+        self.pnl_sum += pnl
+        self.cash_dividend_sum += cash_dividend
+        self.reinvest_dividend_sum += reinvest_dividend
+        if ret > 0:
+            self.win_count += 1
+
+        # 2. Welford
+        delta = ret - self.ret_mean
+        self.ret_mean += delta / self.row_count
+        self.ret_m2 += delta * (ret - self.ret_mean)
+        if ret < 0:
+            self.neg_count += 1
+            delta = ret - self.neg_mean
+            self.neg_mean += delta / self.neg_count
+            self.neg_m2 += delta * (ret - self.neg_mean)
+
+        # 3. 回撤：峰值取最后一次；回撤并列时保留更早的谷底
+        self.nav = factor if self.row_count == 1 else self.nav * factor
+        nav = self.nav
+        if (self.recovery_date is None and self.mdd_end is not None
+                and self.mdd_peak_nav is not None and nav >= self.mdd_peak_nav):
+            self.recovery_date = day
+        if self.peak_nav is None or nav >= self.peak_nav:
+            self.peak_nav, self.peak_date = nav, day
+        drawdown = nav / self.peak_nav - 1.0 if self.peak_nav > 0 else 0.0
+        if self.mdd is None or drawdown < self.mdd:
+            self.mdd, self.mdd_start, self.mdd_end = drawdown, self.peak_date, day
+            self.mdd_peak_nav = self.peak_nav
+            self.recovery_date = None
+
+        # 反弹：当前净值相对历史最低净值
+        if self.trough_nav is None or nav < self.trough_nav:
+            self.trough_nav = nav
+        if self.trough_nav > 0:
+            runup = nav / self.trough_nav - 1.0
+            self.max_runup = runup if self.max_runup is None else max(self.max_runup, runup)
+
+    def metrics(self, annual_factor: int, min_annualization_days: int) -> Dict:
+        """当前状态下的原始指标 (与 RollingMetricsEngine.compute 同口径的标量)"""
+        n = self.row_count
+        has_zero = self.zero_count > 0
+        twrr_ann = np.nan
+        if n >= min_annualization_days:
+            twrr_ann = -1.0 if has_zero else float(np.expm1(self.log_sum * annual_factor / n))
+        sqrt_af = np.sqrt(annual_factor)
+        return {
+            'count': n,
+            'twrr_cum': -1.0 if has_zero else float(np.expm1(self.log_sum)),
+            'twrr_ann': twrr_ann,
+            'cum_pnl': self.pnl_sum,
+            'total_cash_div': self.cash_dividend_sum,
+            'total_reinvest_div': self.reinvest_dividend_sum,
+            'volatility': np.sqrt(self.ret_m2 / (n - 1)) * sqrt_af if n > 1 else np.nan,
+            'downside_std': (np.sqrt(self.neg_m2 / (self.neg_count - 1)) * sqrt_af
+                             if self.neg_count > 1 else np.nan),
+            'mdd': np.nan if self.mdd is None else self.mdd,
+            'mdd_start': self.mdd_start,
+            'mdd_end': self.mdd_end,
+            'recovery_date': self.recovery_date,
+            'max_runup': np.nan if self.max_runup is None else self.max_runup,
+            'win_rate': self.win_count / n if n else np.nan,
+        }
@@ -0,0 +1,59 @@
+# app/engine/array_cache.py
+"""
+进程内 LRU 数组缓存 (线程安全)
+
+按键缓存由数据库加载、构建好的列式数组，避免每次请求重新查询与构建：
+1. get 命中且版本一致时直接返回，并把该键移到最近使用的一端；
+2. 未命中或版本变化时调用 loader 重新加载，超过容量淘汰最久未使用的键；
+3. 数据写入方可调用 invalidate 立即使对应键失效。
+"""
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+class ArrayCache:
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, int(max_entries))
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, Any]]' = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable, loader: Callable[[], T], version: Any = None) -> T:
+        """
+        :param loader: 未命中时的加载函数 (在锁外执行，慢查询不阻塞其他键)
+        :param version: 数据版本标识 (如行数 + 最后日期)，与缓存中的不一致时重新加载
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        value = loader()
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """只读取，不更新使用顺序；不存在为 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else entry[1]
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """使单个键 (为空时全部) 失效"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
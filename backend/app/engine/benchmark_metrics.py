@@ -0,0 +1,145 @@
+# app/engine/benchmark_metrics.py
+"""
+基准相对指标批量引擎 (NumPy)
+
+取代 "每个 (日期, 窗口) 各查一次基准与组合收益、用集合对齐后逐个回归" 的做法：
+1. 组合与基准的日收益按日期序数一次对齐 (intersect1d)，只保留两边都有的日期；
+2. 每个目标 (窗口起点, 快照日期) 在对齐序列上的行号区间由 searchsorted 一次求出；
+3. 累计收益由 log(1 + r) 的前缀和相减得到，乘积为 0 的日期单独计数；
+4. 协方差 / 方差由 (去均值后的) 前缀和、前缀平方和、前缀交叉积和相减得到，
+   口径与 np.cov(ddof=1) / np.var(ddof=0) 一致。
+
+所有窗口、所有日期的 Beta / Alpha / 超额收益一次整列算出，不再逐个切片。
+
+BenchmarkSeries 是单个基准的只读日收益序列 (供进程内缓存复用)：构造时预先算好乘积前缀，
+任意区间的切片与累计收益均为 searchsorted + 前缀相减，O(log n)。
+"""
+from typing import Dict, Tuple
+
+import numpy as np
+
+# Beta 的合理区间，超出时截断
+BETA_BOUNDS = (-5.0, 5.0)
+# 基准方差不超过该值时视为 0 (Beta 取 1、Alpha 取 0)
+VARIANCE_EPSILON = 1e-18
+
+
+def _prefix(values: np.ndarray) -> np.ndarray:
+    return np.concatenate(([0.0], np.cumsum(values)))
+
+
+def _product_prefix(returns: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """prod(1 + r) 的前缀：log|1 + r| 前缀和、因子为 0 的个数、因子为负的个数"""
+    factors = 1.0 + returns
+    # 负因子 (日收益 < -100%) 只影响符号，按绝对值取对数
+    with np.errstate(divide='ignore'):
+        log_sum = _prefix(np.where(factors != 0, np.log(np.abs(factors)), 0.0))
+    zeros = np.concatenate(([0], np.cumsum(factors == 0)))
+    negatives = np.concatenate(([0], np.cumsum(factors < 0)))
+    return log_sum, zeros, negatives
+
+
+def _range_cumulative(prefix: Tuple[np.ndarray, np.ndarray, np.ndarray], lo, hi):
+    """由乘积前缀求区间 [lo, hi) 的累计收益 prod(1 + r) - 1"""
+    log_sum, zeros, negatives = prefix
+    sign = np.where((negatives[hi] - negatives[lo]) % 2 == 1, -1.0, 1.0)
+    product = np.where(zeros[hi] - zeros[lo] > 0, 0.0, sign * np.exp(log_sum[hi] - log_sum[lo]))
+    return product - 1.0
+
+
+def _cumulative_returns(returns: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """区间 [lo, hi) 的累计收益 prod(1 + r) - 1"""
+    return _range_cumulative(_product_prefix(returns), lo, hi)
+
+
+class BenchmarkSeries:
+    """
+    单个基准的日收益序列 (只读，可在线程间共享)
+
+    :param days: 日期序数 (升序、不重复)
+    :param returns: 对应的日收益
+    """
+
+    __slots__ = ('days', 'returns', '_prefix')
+
+    def __init__(self, days: np.ndarray, returns: np.ndarray):
+        self.days = np.asarray(days, dtype=np.int64)
+        self.returns = np.asarray(returns, dtype=np.float64)
+        self._prefix = _product_prefix(self.returns)
+        for array in (self.days, self.returns) + self._prefix:
+            array.flags.writeable = False
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def bounds(self, start_day: int, end_day: int) -> Tuple[int, int]:
+        """日期区间 [start_day, end_day] (均包含) 对应的行号区间 [lo, hi)"""
+        lo = int(np.searchsorted(self.days, start_day, side='left'))
+        hi = int(np.searchsorted(self.days, end_day, side='right'))
+        return lo, max(hi, lo)
+
+    def slice(self, start_day: int, end_day: int) -> Tuple[np.ndarray, np.ndarray]:
+        """区间内的 (日期序数, 日收益)，为只读视图"""
+        lo, hi = self.bounds(start_day, end_day)
+        return self.days[lo:hi], self.returns[lo:hi]
+
+    def cumulative_return(self, start_day: int, end_day: int) -> float:
+        """区间内的累计收益 prod(1 + r) - 1，无数据时为 0"""
+        lo, hi = self.bounds(start_day, end_day)
+        return float(_range_cumulative(self._prefix, lo, hi))
+
+
+def benchmark_window_metrics(
+        portfolio_days: np.ndarray,
+        portfolio_returns: np.ndarray,
+        benchmark_days: np.ndarray,
+        benchmark_returns: np.ndarray,
+        start_days: np.ndarray,
+        end_days: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """
+    :param portfolio_days / benchmark_days: 日期序数 (升序、不重复)
+    :param portfolio_returns / benchmark_returns: 对应的日收益
+    :param start_days / end_days: 每个目标的窗口起止日期序数 (均包含)
+    :return: 每个目标一行的指标列；count 为窗口内对齐后的天数，
+             count < 2 的目标不具备回归条件，其余列无意义
+    """
+    # 1. 对齐
+    days, port_idx, bm_idx = np.intersect1d(portfolio_days, benchmark_days, assume_unique=True, return_indices=True)
+    port = np.asarray(portfolio_returns, dtype=np.float64)[port_idx]
+    bm = np.asarray(benchmark_returns, dtype=np.float64)[bm_idx]
+
+    # 2. 窗口行号区间 [lo, hi)
+    lo = np.searchsorted(days, start_days, side='left')
+    hi = np.searchsorted(days, end_days, side='right')
+    hi = np.maximum(hi, lo)
+    count = hi - lo
+
+    # 3. 累计收益与超额收益
+    bm_cumulative = _cumulative_returns(bm, lo, hi)
+    port_cumulative = _cumulative_returns(port, lo, hi)
+
+    # 4. 协方差 / 方差 (去均值后相减，减少抵消误差)
+    bm_c = bm - (bm.mean() if len(bm) else 0.0)
+    port_c = port - (port.mean() if len(port) else 0.0)
+    s_b, s_p = _prefix(bm_c), _prefix(port_c)
+    s_bb, s_pb = _prefix(bm_c * bm_c), _prefix(port_c * bm_c)
+    sum_b, sum_p = s_b[hi] - s_b[lo], s_p[hi] - s_p[lo]
+    n = count.astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = ((s_pb[hi] - s_pb[lo]) - sum_p * sum_b / n) / (n - 1)
+        variance = np.maximum((s_bb[hi] - s_bb[lo]) - sum_b * sum_b / n, 0.0) / n
+
+    regress = (count > 1) & (variance > VARIANCE_EPSILON)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = np.where(regress, covariance / variance, 1.0)
+    alpha = np.where(regress, port_cumulative - beta * bm_cumulative, 0.0)
+
+    return {
+        'count': count,
+        'benchmark_cumulative_return': bm_cumulative,
+        'portfolio_cumulative_return': port_cumulative,
+        'excess_return': port_cumulative - bm_cumulative,
+        'beta': np.clip(beta, *BETA_BOUNDS),
+        'alpha': alpha,
+    }
@@ -0,0 +1,64 @@
+# app/engine/drawdown.py
+"""
+回撤 / 修复 / 反弹 数组内核 (NumPy)
+
+取代 "nav_series.cummax() -> 回撤序列 -> idxmin -> running_max.loc[:谷底] 找峰值 -> 再扫一遍找修复日"
+以及单独一次 cummin 求最大反弹的做法：一次调用、全部为 O(n) 的数组运算，返回下标而非日期，
+分析快照服务与按需计算的接口均可复用。
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+
+class DrawdownStats(NamedTuple):
+    """下标均相对输入序列；不存在为 -1，数值缺失为 NaN"""
+    max_drawdown: float
+    peak: int
+    """回撤峰值：谷底之前最后一次处于该峰值的位置"""
+    trough: int
+    """回撤谷底：回撤最深的第一个位置"""
+    recovery: int
+    """修复：谷底之后净值首次回到峰值的位置"""
+    duration: int
+    """峰值到谷底的行数"""
+    max_runup: float
+
+
+def drawdown_stats(returns: np.ndarray) -> DrawdownStats:
+    """
+    由日收益率序列计算最大回撤、峰值 / 谷底 / 修复下标、回撤持续行数与最大反弹。
+    口径与原 pandas 实现一致：净值为 (1 + r) 的累乘，回撤 = 净值 / 历史最高 - 1。
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    n = len(returns)
+    if not n:
+        return DrawdownStats(np.nan, -1, -1, -1, 0, np.nan)
+
+    positions = np.arange(n)
+    nav = np.cumprod(1.0 + returns)
+
+    # 1. 最大回撤与谷底 (argmin 取第一次，与 idxmin 一致)
+    running_max = np.maximum.accumulate(nav)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdown = nav / running_max - 1.0
+    if np.isnan(drawdown).all():
+        return DrawdownStats(np.nan, -1, -1, -1, 0, np.nan)
+    trough = int(np.nanargmin(drawdown))
+    max_drawdown = float(drawdown[trough])
+
+    # 2. 峰值：每个位置之前最后一次创新高 (含持平) 的位置
+    last_high = np.maximum.accumulate(np.where(nav >= running_max, positions, 0))
+    peak = int(last_high[trough])
+
+    # 3. 修复：谷底之后第一个不低于峰值的位置
+    recovered = np.flatnonzero(nav[trough + 1:] >= nav[peak])
+    recovery = trough + 1 + int(recovered[0]) if len(recovered) else -1
+
+    # 4. 最大反弹：净值相对历史最低 (最低为 0 时无意义)
+    running_min = np.minimum.accumulate(nav)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        runup = np.where(running_min > 0, nav / running_min - 1.0, np.nan)
+    max_runup = float(np.nanmax(runup)) if not np.isnan(runup).all() else np.nan
+
+    return DrawdownStats(max_drawdown, peak, trough, recovery, trough - peak, max_runup)
@@ -0,0 +1,119 @@
+# app/engine/fixed_point.py
+"""
+定点整数运算 (NumPy int64)
+
+金额统一表示为 "值 x 10^4" 的 int64 数组，与 Numeric(18,4) 列的精度一致：
+1. 加减、累加 (cumsum / 按日汇总) 在整数上完成，结果与 Decimal 逐笔累加完全相同；
+2. 乘除只在需要时进行，并以 ROUND_HALF_EVEN (与 Decimal.quantize 的默认舍入一致) 取整；
+3. 超出 int64 安全范围时抛出 FixedPointOverflow，由调用方回退到 Decimal 路径。
+
+入参若为 float (如 TradeArrays / NavSeries)，其原值本身是不超过 4 位小数的十进制数，
+在 FLOAT_EXACT_LIMIT 以内 rint(x * 10^4) 可无损还原。
+"""
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+SCALE_DIGITS = 4
+SCALE = 10 ** SCALE_DIGITS
+
+# float -> 定点无损还原的绝对值上限
+FLOAT_EXACT_LIMIT = 1e11
+_INT64_MAX = np.iinfo(np.int64).max
+
+
+class FixedPointOverflow(ArithmeticError):
+    """数值超出定点整数的安全范围"""
+
+
+class FixedPointMismatch(AssertionError):
+    """校验模式下定点结果与 Decimal 结果不一致"""
+
+
+def to_fixed(values: Iterable[Optional[Decimal]], digits: int = SCALE_DIGITS) -> np.ndarray:
+    """Decimal (None 视为 0) -> 定点 int64，按 digits 位小数精确取整"""
+    result = []
+    for value in values:
+        scaled = Decimal(value or 0).scaleb(digits).to_integral_value(rounding=ROUND_HALF_EVEN)
+        if abs(scaled) > _INT64_MAX:
+            raise FixedPointOverflow(f"{value} exceeds fixed-point range")
+        result.append(int(scaled))
+    return np.array(result, dtype=np.int64)
+
+
+def from_float(values, digits: int = SCALE_DIGITS) -> np.ndarray:
+    """不超过 digits 位小数的 float 数组 -> 定点 int64 (NaN 视为 0)"""
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0)
+    if len(values) and np.abs(values).max() >= FLOAT_EXACT_LIMIT:
+        raise FixedPointOverflow("float input exceeds exact fixed-point range")
+    return np.rint(values * 10 ** digits).astype(np.int64)
+
+
+def to_decimals(values: np.ndarray, digits: int = SCALE_DIGITS) -> List[Decimal]:
+    """定点 int64 -> Decimal，小数位数与列精度一致"""
+    return [Decimal(v).scaleb(-digits) for v in np.asarray(values, dtype=np.int64).tolist()]
+
+
+def check_product(a: np.ndarray, b: np.ndarray):
+    """a * b 逐元素不会溢出 int64"""
+    a, b = np.asarray(a), np.asarray(b)
+    if a.size and b.size and int(np.abs(a).max()) * int(np.abs(b).max()) > _INT64_MAX:
+        raise FixedPointOverflow("fixed-point product exceeds int64")
+
+
+def scaled_div(numerator: np.ndarray, denominator, digits: int = 0) -> np.ndarray:
+    """
+    numerator / denominator，结果保留 digits 位小数 (定点) 并 ROUND_HALF_EVEN 取整；分母为 0 的位置结果为 0。
+    逐位长除：中间值不超过 10 * |denominator|，不必先乘 10^digits。
+    """
+    numerator = np.asarray(numerator, dtype=np.int64)
+    denominator = np.broadcast_to(np.asarray(denominator, dtype=np.int64), numerator.shape)
+    zero = denominator == 0
+    den = np.where(zero, 1, np.abs(denominator))
+    if den.size and int(den.max()) > _INT64_MAX // 10:
+        raise FixedPointOverflow("fixed-point divisor exceeds int64")
+
+    num = np.where(denominator < 0, -numerator, numerator)
+    quotient, remainder = np.divmod(num, den)
+    for _ in range(digits):
+        if quotient.size and int(np.abs(quotient).max()) > _INT64_MAX // 10:
+            raise FixedPointOverflow("fixed-point quotient exceeds int64")
+        digit, remainder = np.divmod(remainder * 10, den)
+        quotient = quotient * 10 + digit
+
+    twice = 2 * remainder
+    up = (twice > den) | ((twice == den) & (quotient % 2 != 0))
+    return np.where(zero, 0, quotient + up)
+
+
+def div_half_even(numerator: int, denominator: int) -> int:
+    """Python 整数除法 (不受 int64 限制)，ROUND_HALF_EVEN 取整"""
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+    quotient, remainder = divmod(numerator, denominator)
+    twice = 2 * remainder
+    if twice > denominator or (twice == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+def assert_fixed_matches(expected: Sequence, actual: Sequence, scales: Dict[str, int], label: str = ''):
+    """
+    校验模式：逐行逐列比较 Decimal 路径 (expected) 与定点路径 (actual) 的对象，按列精度量化后必须相等。
+    """
+    if len(expected) != len(actual):
+        raise FixedPointMismatch(f"{label}: {len(expected)} rows from Decimal path, {len(actual)} from fixed-point")
+    for exp_row, act_row in zip(expected, actual):
+        if exp_row.snapshot_date != act_row.snapshot_date:
+            raise FixedPointMismatch(f"{label}: date {exp_row.snapshot_date} != {act_row.snapshot_date}")
+        for name, digits in scales.items():
+            quantum = Decimal(1).scaleb(-digits)
+            exp_value = getattr(exp_row, name)
+            act_value = getattr(act_row, name)
+            exp_value = None if exp_value is None else Decimal(exp_value).quantize(quantum)
+            act_value = None if act_value is None else Decimal(act_value).quantize(quantum)
+            if exp_value != act_value:
+                raise FixedPointMismatch(
+                    f"{label}: {name} on {exp_row.snapshot_date}: Decimal {exp_value} != fixed-point {act_value}"
+                )
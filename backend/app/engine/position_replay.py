@@ -0,0 +1,669 @@
+# app/engine/position_replay.py
+"""
+向量化持仓重放引擎 (NumPy)
+
+与 HoldingSnapshotService._calculate_range 计算完全相同的快照列，
+区别在于不再逐日修改 Decimal 状态、逐日实例化 ORM 对象，而是：
+1. 交易事件 (稀疏) 先折算成逐笔累计数组 (份额、成本、累计买卖、分红、已实现盈亏)；
+2. 再通过 searchsorted / bincount 一次性映射到整个交易日网格 (稠密)。
+
+Decimal 逐日循环仍然是基准实现，本引擎使用 float64，写库前按列精度量化；
+replay_position_fixed 为定点整数版本 (见 app.engine.fixed_point)，输出即为 4 位小数的精确值。
+"""
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.constant.biz_enums import TradeTypeEnum, DividendTypeEnum
+from app.engine import fixed_point as fp
+
+# 份额视为 0 的阈值 (份额列精度为 4 位小数)
+SHARE_EPSILON = 1e-8
+
+# 交易类型编码
+KIND_IGNORED = 0
+KIND_BUY = 1
+KIND_SELL = 2
+KIND_CASH_DIVIDEND = 3
+KIND_REINVEST_DIVIDEND = 4
+
+_ZERO = Decimal('0')
+_QUANTUM = Decimal(1).scaleb(-fp.SCALE_DIGITS)
+
+# 输出列，与 HoldingSnapshot 的字段名保持一致
+AMOUNT_COLUMNS = (
+    'holding_shares', 'hos_holding_cost', 'avg_cost', 'market_price', 'hos_market_value',
+    'hos_daily_buy_amount', 'hos_total_buy_amount', 'hos_daily_sell_amount', 'hos_total_sell_amount',
+    'hos_net_external_cash_flow', 'hos_realized_pnl', 'hos_unrealized_pnl',
+    'hos_daily_pnl', 'hos_daily_pnl_ratio', 'hos_total_pnl', 'hos_total_pnl_ratio',
+    'hos_daily_cash_dividend', 'hos_daily_reinvest_dividend',
+    'hos_total_cash_dividend', 'hos_total_reinvest_dividend', 'hos_total_dividend',
+)
+
+
+class OversellError(ValueError):
+    """卖出时已无可用份额 (与 Decimal 路径的超卖校验一致)"""
+
+    def __init__(self, trade_index: int, shares_available: float):
+        self.trade_index = trade_index
+        self.shares_available = shares_available
+        super().__init__(f"Sell exceeds: trade #{trade_index}, only {shares_available} shares are available.")
+
+    def __reduce__(self):
+        # 保证跨进程传回时字段完整
+        return self.__class__, (self.trade_index, self.shares_available)
+
+
+def _to_float(value) -> float:
+    return float(value) if value is not None else 0.0
+
+
+@dataclass
+class TradeArrays:
+    """交易记录的列式表示 (纯数据，可跨进程传递)"""
+    dates: np.ndarray  # datetime64[D]
+    kinds: np.ndarray  # int8, KIND_*
+    shares: np.ndarray
+    cash_amounts: np.ndarray
+    amounts: np.ndarray
+    cycles: np.ndarray  # float64, NaN 表示 tr_cycle 为空
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    @classmethod
+    def from_trades(cls, trades: Sequence) -> 'TradeArrays':
+        """从 Trade 对象 (或具有相同属性的对象) 构建，顺序保持不变"""
+        kinds = []
+        for t in trades:
+            if t.tr_type == TradeTypeEnum.BUY.value:
+                kinds.append(KIND_BUY)
+            elif t.tr_type == TradeTypeEnum.SELL.value:
+                kinds.append(KIND_SELL)
+            elif t.tr_type == TradeTypeEnum.DIVIDEND.value and t.dividend_type == DividendTypeEnum.CASH:
+                kinds.append(KIND_CASH_DIVIDEND)
+            elif t.tr_type == TradeTypeEnum.DIVIDEND.value and t.dividend_type == DividendTypeEnum.REINVEST:
+                kinds.append(KIND_REINVEST_DIVIDEND)
+            else:
+                kinds.append(KIND_IGNORED)
+
+        return cls(
+            dates=np.array([t.tr_date for t in trades], dtype='datetime64[D]'),
+            kinds=np.array(kinds, dtype=np.int8),
+            shares=np.array([_to_float(t.tr_shares) for t in trades], dtype=np.float64),
+            cash_amounts=np.array([_to_float(t.cash_amount) for t in trades], dtype=np.float64),
+            amounts=np.array([_to_float(t.tr_amount) for t in trades], dtype=np.float64),
+            cycles=np.array([t.tr_cycle if t.tr_cycle is not None else np.nan for t in trades], dtype=np.float64),
+        )
+
+
+@dataclass
+class InitialPosition:
+    """热启动状态 (对应 PositionState + 前一日市值)"""
+    shares: float = 0.0
+    holding_cost: float = 0.0
+    total_buy_amount: float = 0.0
+    total_sell_amount: float = 0.0
+    total_cash_dividend: float = 0.0
+    total_reinvest_amount: float = 0.0
+    realized_pnl: float = 0.0
+    market_value: Optional[float] = None
+    tr_cycle: float = np.nan
+
+    @classmethod
+    def from_snapshot(cls, snap) -> 'InitialPosition':
+        return cls(
+            shares=_to_float(snap.holding_shares),
+            holding_cost=_to_float(snap.hos_holding_cost),
+            total_buy_amount=_to_float(snap.hos_total_buy_amount),
+            total_sell_amount=_to_float(snap.hos_total_sell_amount),
+            total_cash_dividend=_to_float(snap.hos_total_cash_dividend),
+            total_reinvest_amount=_to_float(snap.hos_total_reinvest_dividend),
+            realized_pnl=_to_float(snap.hos_realized_pnl),
+            market_value=_to_float(snap.hos_market_value),
+            tr_cycle=np.nan if snap.tr_cycle is None else float(snap.tr_cycle),
+        )
+
+
+@dataclass
+class ReplayColumns:
+    """重放结果：每个输出快照一行"""
+    dates: np.ndarray  # datetime64[D]
+    columns: Dict[str, np.ndarray]
+    is_cleared: np.ndarray  # int8
+    tr_cycles: np.ndarray  # float64, NaN 表示空
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def snapshot_dates(self) -> List[date]:
+        return self.dates.astype(object).tolist()
+
+
+def _empty_result() -> ReplayColumns:
+    return ReplayColumns(
+        dates=np.array([], dtype='datetime64[D]'),
+        columns={name: np.array([], dtype=np.float64) for name in AMOUNT_COLUMNS},
+        is_cleared=np.array([], dtype=np.int8),
+        tr_cycles=np.array([], dtype=np.float64),
+    )
+
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    out = np.zeros_like(numerator, dtype=np.float64)
+    np.divide(numerator, denominator, out=out, where=mask & (denominator != 0))
+    return out
+
+
+def _map_trades(days: np.ndarray, navs: np.ndarray, target_start: np.datetime64, trades: TradeArrays):
+    """
+    交易映射到网格：只认落在网格日期上的交易；
+    目标区间内缺失净值的日期与基准实现一致，当天交易不入账。
+    返回 (需要输出快照的日期掩码, 入账交易下标, 入账交易对应的网格下标)
+    """
+    n = len(days)
+    in_target = days >= target_start
+    has_nav = ~np.isnan(navs)
+
+    t_idx = np.searchsorted(days, trades.dates, side='left')
+    keep = (t_idx < n) & (trades.kinds != KIND_IGNORED)
+    keep[keep] &= days[t_idx[keep]] == trades.dates[keep]
+    keep[keep] &= ~(in_target[t_idx[keep]] & ~has_nav[t_idx[keep]])
+
+    sel = np.flatnonzero(keep)
+    return in_target & has_nav, sel, t_idx[sel]
+
+
+def _carry_gap(per_day: np.ndarray, first: int) -> np.ndarray:
+    """
+    热启动检查点早于目标区间前一交易日时，回溯期 (first 之前) 的流量计入第一个输出行，
+    使该行的日盈亏相对检查点市值计算时扣除回溯期的外部现金流与现金分红
+    """
+    out = per_day.copy()
+    out[first] += per_day[:first].sum()
+    return out
+
+
+def _cycle_column(
+        trades: TradeArrays,
+        sel: np.ndarray,
+        td: np.ndarray,
+        last: np.ndarray,
+        e: np.ndarray,
+        initial_cycle: float
+) -> np.ndarray:
+    """持仓周期：取截至当日最后一笔入账交易的周期 (含回溯期)，此前沿用热启动快照的周期"""
+    n = len(last)
+    trade_count = np.bincount(td, minlength=n) if len(td) else np.zeros(n, dtype=np.int64)
+    cycle_day = np.full(n, np.nan)
+    if len(td):
+        traded_days = np.flatnonzero(trade_count > 0)
+        cycle_day[traded_days] = trades.cycles[sel][last[traded_days]]
+    src = np.maximum.accumulate(np.where(trade_count > 0, np.arange(n), -1))[e]
+    return np.where(src >= 0, cycle_day[np.maximum(src, 0)], initial_cycle)
+
+
+def replay_position(
+        days: np.ndarray,
+        navs: np.ndarray,
+        target_start: np.datetime64,
+        trades: TradeArrays,
+        initial: Optional[InitialPosition] = None
+) -> ReplayColumns:
+    """
+    在交易日网格上重放单只持仓。
+
+    :param days: 重放网格 (datetime64[D]，升序)，从回溯起点到 target_end
+    :param navs: 与 days 对齐的单位净值，缺失为 NaN
+    :param target_start: 目标区间起点，之前的日期只应用交易不输出快照
+    :param trades: 按 tr_date 升序的交易数组
+    :param initial: 热启动状态，为空则从零开始
+    :return: 目标区间内有净值的每个交易日一行
+    """
+    warm = initial is not None
+    initial = initial or InitialPosition()
+    n = len(days)
+    if n == 0:
+        return _empty_result()
+
+    # 1. 交易映射到网格
+    emit, sel, td = _map_trades(days, navs, target_start, trades)
+    kind = trades.kinds[sel]
+    sh = trades.shares[sel]
+    cash = trades.cash_amounts[sel]
+    amt = trades.amounts[sel]
+    m = len(sel)
+
+    is_buy = kind == KIND_BUY
+    is_sell = kind == KIND_SELL
+    is_cash_div = kind == KIND_CASH_DIVIDEND
+    is_reinvest = kind == KIND_REINVEST_DIVIDEND
+
+    # 2. 逐笔累计：份额
+    d_shares = np.where(is_buy | is_reinvest, sh, np.where(is_sell, -sh, 0.0))
+    shares_after = initial.shares + np.cumsum(d_shares)
+    shares_before = shares_after - d_shares
+
+    oversold = is_sell & (shares_before <= SHARE_EPSILON)
+    if oversold.any():
+        first = int(np.argmax(oversold))
+        raise OversellError(int(sel[first]), float(shares_before[first]))
+
+    # 3. 移动平均成本：cost_k = f_k * cost_{k-1} + b_k
+    #    f_k 为卖出后的剩余份额比例，b_k 为买入金额；清仓处分段重新累计
+    cleared = is_sell & (np.abs(shares_after) <= SHARE_EPSILON)
+    partial_sell = is_sell & ~cleared
+    factor = np.ones(m)
+    factor[partial_sell] = shares_after[partial_sell] / shares_before[partial_sell]
+    buy_amount = np.where(is_buy, cash, 0.0)
+
+    positions = np.arange(m)
+    seg_begin = np.r_[True, cleared[:-1]] if m else np.array([], dtype=bool)
+    start_idx = np.maximum.accumulate(np.where(seg_begin, positions, 0)) if m else positions
+    prod_all = np.cumprod(factor)
+    prod_before_seg = np.where(start_idx > 0, prod_all[np.maximum(start_idx - 1, 0)], 1.0)
+    prod_seg = prod_all / prod_before_seg
+    scaled_sum = np.cumsum(buy_amount / prod_seg)
+    sum_before_seg = np.where(start_idx > 0, scaled_sum[np.maximum(start_idx - 1, 0)], 0.0)
+    seg_init_cost = np.where(start_idx == 0, initial.holding_cost, 0.0)
+    cost_after = prod_seg * (seg_init_cost + scaled_sum - sum_before_seg)
+    cost_after[cleared] = 0.0
+    cost_before = np.r_[initial.holding_cost, cost_after][:m]
+
+    # 4. 已实现盈亏与现金流
+    realized = np.zeros(m)
+    realized[is_sell] = cash[is_sell] - cost_before[is_sell] * sh[is_sell] / shares_before[is_sell]
+    sell_amount = np.where(is_sell, cash, 0.0)
+    cash_div = np.where(is_cash_div, amt, 0.0)
+    reinvest = np.where(is_reinvest, amt, 0.0)
+
+    # 5. 逐笔 -> 逐日：取每日最后一笔交易后的累计状态，每日流量用 bincount 汇总
+    last = np.searchsorted(td, np.arange(n), side='right') - 1
+
+    def at_day(per_trade_cum: np.ndarray, init_value: float) -> np.ndarray:
+        if m == 0:
+            return np.full(n, init_value, dtype=np.float64)
+        return np.where(last >= 0, per_trade_cum[np.maximum(last, 0)], init_value)
+
+    def daily(per_trade: np.ndarray) -> np.ndarray:
+        return np.bincount(td, weights=per_trade, minlength=n) if m else np.zeros(n)
+
+    shares_day = at_day(shares_after, initial.shares)
+    cost_day = at_day(cost_after, initial.holding_cost)
+    total_buy = at_day(initial.total_buy_amount + np.cumsum(buy_amount), initial.total_buy_amount)
+    total_sell = at_day(initial.total_sell_amount + np.cumsum(sell_amount), initial.total_sell_amount)
+    total_cash_div = at_day(initial.total_cash_dividend + np.cumsum(cash_div), initial.total_cash_dividend)
+    total_reinvest = at_day(initial.total_reinvest_amount + np.cumsum(reinvest), initial.total_reinvest_amount)
+    realized_day = at_day(initial.realized_pnl + np.cumsum(realized), initial.realized_pnl)
+
+    daily_buy = daily(buy_amount)
+    daily_sell = daily(sell_amount)
+    daily_cash_div = daily(cash_div)
+    daily_reinvest = daily(reinvest)
+
+    # 6. 只保留需要输出快照的日期
+    e = np.flatnonzero(emit)
+    if len(e) == 0:
+        return _empty_result()
+    if warm:
+        daily_buy, daily_sell, daily_cash_div, daily_reinvest = (
+            _carry_gap(flow, e[0]) for flow in (daily_buy, daily_sell, daily_cash_div, daily_reinvest)
+        )
+
+    nav_e = navs[e]
+    shares_e = shares_day[e]
+    cost_e = cost_day[e]
+    total_buy_e = total_buy[e]
+    realized_e = realized_day[e]
+    total_div_e = total_cash_div[e] + total_reinvest[e]
+    net_external_e = daily_sell[e] - daily_buy[e]
+    cash_div_e = daily_cash_div[e]
+
+    pos = shares_e > SHARE_EPSILON
+    market_value = np.where(pos, shares_e * nav_e, 0.0)
+    holding_cost = np.where(pos, cost_e, 0.0)
+    unrealized = market_value - holding_cost
+    total_pnl = np.where(pos, unrealized, 0.0) + realized_e + total_div_e
+
+    # 前一快照市值：首行取热启动快照，其余取上一输出行
+    init_mv = initial.market_value if initial.market_value is not None else np.nan
+    prev_mv = np.r_[init_mv, market_value[:-1]]
+    has_prev = np.nan_to_num(prev_mv, nan=0.0) > 0
+
+    daily_pnl = np.where(
+        has_prev,
+        market_value - np.nan_to_num(prev_mv) + net_external_e + cash_div_e,
+        np.where(pos, total_pnl, 0.0)
+    )
+    daily_pnl_ratio = np.where(
+        has_prev,
+        _safe_divide(daily_pnl, prev_mv, has_prev),
+        _safe_divide(daily_pnl, total_buy_e, pos & (total_buy_e > 0))
+    )
+    total_pnl_ratio = np.where(
+        pos,
+        _safe_divide(total_pnl, total_buy_e, total_buy_e > 0),
+        _safe_divide(realized_e, total_buy_e, total_buy_e > 0)
+    )
+
+    # 7. 持仓周期
+    tr_cycles = _cycle_column(trades, sel, td, last, e, initial.tr_cycle)
+
+    columns = {
+        'holding_shares': np.where(pos, shares_e, 0.0),
+        'hos_holding_cost': holding_cost,
+        'avg_cost': _safe_divide(cost_e, shares_e, pos),
+        'market_price': nav_e,
+        'hos_market_value': market_value,
+        'hos_daily_buy_amount': daily_buy[e],
+        'hos_total_buy_amount': total_buy_e,
+        'hos_daily_sell_amount': daily_sell[e],
+        'hos_total_sell_amount': total_sell[e],
+        'hos_net_external_cash_flow': net_external_e,
+        'hos_realized_pnl': realized_e,
+        'hos_unrealized_pnl': np.where(pos, unrealized, 0.0),
+        'hos_daily_pnl': daily_pnl,
+        'hos_daily_pnl_ratio': daily_pnl_ratio,
+        'hos_total_pnl': total_pnl,
+        'hos_total_pnl_ratio': total_pnl_ratio,
+        'hos_daily_cash_dividend': cash_div_e,
+        'hos_daily_reinvest_dividend': daily_reinvest[e],
+        'hos_total_cash_dividend': total_cash_div[e],
+        'hos_total_reinvest_dividend': total_reinvest[e],
+        'hos_total_dividend': total_div_e,
+    }
+
+    return ReplayColumns(
+        dates=days[e],
+        columns=columns,
+        is_cleared=(~pos).astype(np.int8),
+        tr_cycles=tr_cycles,
+    )
+
+
+def _fixed_cost_basis(
+        initial_cost: int,
+        initial_realized: int,
+        is_sell: np.ndarray,
+        buy_amount: np.ndarray,
+        sell_shares: np.ndarray,
+        shares_before: np.ndarray,
+        proceeds: np.ndarray
+) -> Tuple[List[Decimal], List[Decimal]]:
+    """
+    逐笔推进移动平均成本与累计已实现盈亏。
+    与 HoldingSnapshotService._apply_trades 完全相同的 Decimal 运算 (成本 / 份额 x 卖出份额，当前上下文精度)，
+    定点输入可无损还原为 Decimal，因此结果逐位一致 (含清仓时的残余成本)；交易稀疏，逐笔推进的开销可以忽略。
+    返回 (每笔后的持仓成本, 每笔后的累计已实现盈亏)
+    """
+    cost, realized = fp.to_decimals([initial_cost, initial_realized])
+    cost_after, realized_after = [], []
+    for sold, bought, sold_shares, before, cash in zip(
+            is_sell.tolist(), fp.to_decimals(buy_amount), fp.to_decimals(sell_shares),
+            fp.to_decimals(shares_before), fp.to_decimals(proceeds)):
+        if sold:
+            cost_sold = cost / before * sold_shares
+            cost -= cost_sold
+            realized += (cash - cost_sold)
+        else:
+            cost += bought
+        cost_after.append(cost)
+        realized_after.append(realized)
+    return cost_after, realized_after
+
+
+def _is_fixed_exact(values: Sequence[Decimal]) -> bool:
+    """Decimal 值均不超过 4 位小数 (可由定点 int64 精确表示)"""
+    return all(v == v.quantize(_QUANTUM) for v in values)
+
+
+def _decimal_cost_columns(
+        cost: List[Decimal],
+        realized: List[Decimal],
+        shares: np.ndarray,
+        market_value8: np.ndarray,
+        total_div: np.ndarray,
+        total_buy: np.ndarray,
+        has_prev: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """
+    成本或已实现盈亏带有超过 4 位小数的尾数时 (部分卖出无法整除)，
+    按 HoldingSnapshotService._create_snapshot_entity 的 Decimal 公式逐日计算成本派生列，输出时一次取整。
+    有前一日市值时当日盈亏与成本无关，这些行的当日盈亏 (及比例) 返回 0，由调用方沿用定点路径的结果。
+    """
+    rows = {name: [] for name in (
+        'hos_holding_cost', 'avg_cost', 'hos_realized_pnl', 'hos_unrealized_pnl', 'hos_total_pnl',
+        'hos_total_pnl_ratio', 'hos_daily_pnl', 'hos_daily_pnl_ratio'
+    )}
+    for c, r, sh, mv, div, buy, prev in zip(
+            cost, realized, fp.to_decimals(shares), fp.to_decimals(market_value8, 2 * fp.SCALE_DIGITS),
+            fp.to_decimals(total_div), fp.to_decimals(total_buy), has_prev.tolist()):
+        daily = daily_ratio = _ZERO
+        if sh > _ZERO:
+            unrealized = mv - c
+            total = unrealized + r + div
+            total_ratio = total / buy if buy > _ZERO else _ZERO
+            if not prev:
+                daily = total
+                daily_ratio = total_ratio
+            values = (c, c / sh, r, unrealized, total, total_ratio, daily, daily_ratio)
+        else:
+            total = r + div
+            values = (_ZERO, _ZERO, r, _ZERO, total, r / buy if buy > _ZERO else _ZERO, daily, daily_ratio)
+        for name, value in zip(rows, values):
+            rows[name].append(value)
+    return {name: fp.to_fixed(values) for name, values in rows.items()}
+
+
+def replay_position_fixed(
+        days: np.ndarray,
+        navs: np.ndarray,
+        target_start: np.datetime64,
+        trades: TradeArrays,
+        initial: Optional[InitialPosition] = None
+) -> ReplayColumns:
+    """
+    定点整数版本的 replay_position，参数相同。
+    份额、金额、净值换算为 10^4 倍的 int64，累计与按日汇总全部为精确整数运算；
+    市值 (份额 x 净值) 以 8 位小数参与当日盈亏，与 Decimal 路径一致，只在输出时取整；
+    成本与已实现盈亏按 Decimal 路径的运算逐笔推进，超出 4 位小数时成本派生列改按 Decimal 公式计算，与 Decimal 路径逐位一致。
+    输出列均为 4 位小数的定点 int64；超出安全范围时抛出 FixedPointOverflow。
+    """
+    warm = initial is not None
+    initial = initial or InitialPosition()
+    n = len(days)
+    if n == 0:
+        return _empty_result()
+
+    # 1. 交易映射到网格，输入换算为定点
+    emit, sel, td = _map_trades(days, navs, target_start, trades)
+    kind = trades.kinds[sel]
+    sh = fp.from_float(trades.shares[sel])
+    cash = fp.from_float(trades.cash_amounts[sel])
+    amt = fp.from_float(trades.amounts[sel])
+    m = len(sel)
+    (init_shares, init_cost, init_buy, init_sell,
+     init_cash_div, init_reinvest, init_realized) = fp.from_float([
+        initial.shares, initial.holding_cost, initial.total_buy_amount, initial.total_sell_amount,
+        initial.total_cash_dividend, initial.total_reinvest_amount, initial.realized_pnl
+    ]).tolist()
+
+    is_buy = kind == KIND_BUY
+    is_sell = kind == KIND_SELL
+    is_cash_div = kind == KIND_CASH_DIVIDEND
+    is_reinvest = kind == KIND_REINVEST_DIVIDEND
+
+    # 2. 逐笔累计：份额 (精确，清仓即为 0)
+    d_shares = np.where(is_buy | is_reinvest, sh, np.where(is_sell, -sh, 0))
+    shares_after = init_shares + np.cumsum(d_shares)
+    shares_before = shares_after - d_shares
+
+    oversold = is_sell & (shares_before <= 0)
+    if oversold.any():
+        first = int(np.argmax(oversold))
+        raise OversellError(int(sel[first]), shares_before[first] / fp.SCALE)
+
+    # 3. 移动平均成本与已实现盈亏：交易稀疏，逐笔推进
+    buy_amount = np.where(is_buy, cash, 0)
+    sell_amount = np.where(is_sell, cash, 0)
+    cost_dec, realized_dec = _fixed_cost_basis(
+        init_cost, init_realized, is_sell, buy_amount, sh, shares_before, sell_amount
+    )
+    cost_after = fp.to_fixed(cost_dec)
+    realized_after = fp.to_fixed(realized_dec)
+    cash_div = np.where(is_cash_div, amt, 0)
+    reinvest = np.where(is_reinvest, amt, 0)
+
+    # 4. 逐笔 -> 逐日
+    last = np.searchsorted(td, np.arange(n), side='right') - 1
+
+    def at_day(per_trade_cum: np.ndarray, init_value: int) -> np.ndarray:
+        if m == 0:
+            return np.full(n, init_value, dtype=np.int64)
+        return np.where(last >= 0, per_trade_cum[np.maximum(last, 0)], init_value)
+
+    def daily(per_trade: np.ndarray) -> np.ndarray:
+        out = np.zeros(n, dtype=np.int64)
+        np.add.at(out, td, per_trade)
+        return out
+
+    shares_day = at_day(shares_after, init_shares)
+    cost_day = at_day(cost_after, init_cost)
+    total_buy = at_day(init_buy + np.cumsum(buy_amount), init_buy)
+    total_sell = at_day(init_sell + np.cumsum(sell_amount), init_sell)
+    total_cash_div = at_day(init_cash_div + np.cumsum(cash_div), init_cash_div)
+    total_reinvest = at_day(init_reinvest + np.cumsum(reinvest), init_reinvest)
+    realized_day = at_day(realized_after, init_realized)
+
+    daily_buy = daily(buy_amount)
+    daily_sell = daily(sell_amount)
+    daily_cash_div = daily(cash_div)
+    daily_reinvest = daily(reinvest)
+
+    # 5. 只保留需要输出快照的日期；后缀 8 表示 8 位小数 (份额 x 净值 的精确乘积)
+    e = np.flatnonzero(emit)
+    if len(e) == 0:
+        return _empty_result()
+    if warm:
+        daily_buy, daily_sell, daily_cash_div, daily_reinvest = (
+            _carry_gap(flow, e[0]) for flow in (daily_buy, daily_sell, daily_cash_div, daily_reinvest)
+        )
+
+    nav_e = fp.from_float(navs[e])
+    shares_e = shares_day[e]
+    cost_e = cost_day[e]
+    total_buy_e = total_buy[e]
+    realized_e = realized_day[e]
+    total_div_e = total_cash_div[e] + total_reinvest[e]
+    net_external_e = daily_sell[e] - daily_buy[e]
+    cash_div_e = daily_cash_div[e]
+
+    pos = shares_e > 0
+    fp.check_product(shares_e, nav_e)
+    fp.check_product(np.r_[cost_e, realized_e + total_div_e, net_external_e + cash_div_e], [fp.SCALE])
+    market_value8 = np.where(pos, shares_e * nav_e, 0)
+    unrealized8 = np.where(pos, market_value8 - cost_e * fp.SCALE, 0)
+    total_pnl8 = unrealized8 + (realized_e + total_div_e) * fp.SCALE
+
+    init_mv = initial.market_value
+    init_mv4 = fp.from_float([0.0 if init_mv is None else init_mv])
+    fp.check_product(init_mv4, [fp.SCALE])
+    init_mv8 = int(init_mv4[0]) * fp.SCALE
+    prev_mv8 = np.r_[init_mv8, market_value8[:-1]]
+    has_prev = prev_mv8 > 0
+
+    daily_pnl8 = np.where(
+        has_prev,
+        market_value8 - prev_mv8 + (net_external_e + cash_div_e) * fp.SCALE,
+        np.where(pos, total_pnl8, 0)
+    )
+    has_buy = total_buy_e > 0
+    daily_pnl_ratio = np.where(
+        has_prev,
+        fp.scaled_div(daily_pnl8, np.where(has_prev, prev_mv8, 0), fp.SCALE_DIGITS),
+        fp.scaled_div(daily_pnl8, np.where(pos & has_buy, total_buy_e, 0))
+    )
+    total_pnl_ratio = np.where(
+        pos,
+        fp.scaled_div(total_pnl8, np.where(has_buy, total_buy_e, 0)),
+        fp.scaled_div(realized_e, np.where(has_buy, total_buy_e, 0), fp.SCALE_DIGITS)
+    )
+
+    def to_scale(values8: np.ndarray) -> np.ndarray:
+        return fp.scaled_div(values8, fp.SCALE)
+
+    columns = {
+        'holding_shares': np.where(pos, shares_e, 0),
+        'hos_holding_cost': np.where(pos, cost_e, 0),
+        'avg_cost': fp.scaled_div(cost_e, np.where(pos, shares_e, 0), fp.SCALE_DIGITS),
+        'market_price': nav_e,
+        'hos_market_value': to_scale(market_value8),
+        'hos_daily_buy_amount': daily_buy[e],
+        'hos_total_buy_amount': total_buy_e,
+        'hos_daily_sell_amount': daily_sell[e],
+        'hos_total_sell_amount': total_sell[e],
+        'hos_net_external_cash_flow': net_external_e,
+        'hos_realized_pnl': realized_e,
+        'hos_unrealized_pnl': to_scale(unrealized8),
+        'hos_daily_pnl': to_scale(daily_pnl8),
+        'hos_daily_pnl_ratio': daily_pnl_ratio,
+        'hos_total_pnl': to_scale(total_pnl8),
+        'hos_total_pnl_ratio': total_pnl_ratio,
+        'hos_daily_cash_dividend': cash_div_e,
+        'hos_daily_reinvest_dividend': daily_reinvest[e],
+        'hos_total_cash_dividend': total_cash_div[e],
+        'hos_total_reinvest_dividend': total_reinvest[e],
+        'hos_total_dividend': total_div_e,
+    }
+
+    # 6. 成本或已实现盈亏带有超过 4 位小数的尾数时，成本派生列按 Decimal 公式重算 (只取整一次)
+    if not (_is_fixed_exact(cost_dec) and _is_fixed_exact(realized_dec)):
+        init_cost_dec, init_realized_dec = fp.to_decimals([init_cost, init_realized])
+        last_e = last[e].tolist()
+        exact_columns = _decimal_cost_columns(
+            cost=[cost_dec[i] if i >= 0 else init_cost_dec for i in last_e],
+            realized=[realized_dec[i] if i >= 0 else init_realized_dec for i in last_e],
+            shares=shares_e,
+            market_value8=market_value8,
+            total_div=total_div_e,
+            total_buy=total_buy_e,
+            has_prev=has_prev
+        )
+        for name in ('hos_daily_pnl', 'hos_daily_pnl_ratio'):
+            exact_columns[name] = np.where(has_prev, columns[name], exact_columns[name])
+        columns.update(exact_columns)
+
+    return ReplayColumns(
+        dates=days[e],
+        columns=columns,
+        is_cleared=(~pos).astype(np.int8),
+        tr_cycles=_cycle_column(trades, sel, td, last, e, initial.tr_cycle),
+    )
+
+
+@dataclass
+class ReplayJob:
+    """单只持仓的完整重放输入 (纯数据，可序列化后交给子进程)"""
+    ho_id: int
+    days: np.ndarray
+    navs: np.ndarray
+    target_start: np.datetime64
+    trades: TradeArrays
+    initial: Optional[InitialPosition] = None
+    fixed: bool = False
+    """使用定点整数版本 replay_position_fixed"""
+
+
+def run_replay_job(job: ReplayJob) -> ReplayColumns:
+    """进程池入口：模块级函数，便于 pickle"""
+    replay = replay_position_fixed if job.fixed else replay_position
+    return replay(
+        days=job.days,
+        navs=job.navs,
+        target_start=job.target_start,
+        trades=job.trades,
+        initial=job.initial
+    )
@@ -0,0 +1,283 @@
+# app/engine/rolling_metrics.py
+"""
+单遍滚动指标引擎 (NumPy)
+
+取代 "每个目标日期 x 每个窗口切片一次 DataFrame 再从头计算" 的做法：
+1. 求和类指标 (收益、分红、波动率、下行波动率、胜率) 由前缀和 / 前缀平方和按 [start, end] 相减得到；
+2. TWRR 由 log(1 + r) 的前缀和得到，乘积为 0 的日期单独计数；
+3. 回撤 / 反弹由可结合的区段摘要 + 双栈队列维护，窗口起点前移时均摊 O(1)；
+   回撤修复日由 "下一个不低于峰值的位置" (单调栈) 一次性求出；
+   窗口内含非正增长因子 (日收益 <= -100%) 时全局净值归零 / 变号，这些窗口由调用方按切片重算 (见 nonpositive_windows)；
+4. 区间最大 / 最小日收益由稀疏表 O(1) 查询 (按需构建)。
+
+每个窗口只需给出每个目标行的窗口起点 (单调不减)，即可在一次遍历中得到所有日期的指标。
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 区段摘要: (总乘积, 最高净值, 最高位置(最后一次), 最低净值, 最低位置(第一次),
+#           最大回撤, 回撤峰值位置, 回撤谷底位置, 最大反弹)
+_Segment = Tuple[float, float, int, float, int, float, int, int, float]
+
+
+def _leaf(index: int, factor: float) -> _Segment:
+    runup = 0.0 if factor > 0 else np.nan
+    return factor, factor, index, factor, index, 0.0, index, index, runup
+
+
+def _combine(a: _Segment, b: _Segment) -> _Segment:
+    """a 在前、b 在后的两个相邻区段合并，b 的净值按 a 的总乘积缩放"""
+    ta, a_max, a_max_idx, a_min, a_min_idx, a_mdd, a_peak, a_trough, a_runup = a
+    tb, b_max, b_max_idx, b_min, b_min_idx, b_mdd, b_peak, b_trough, b_runup = b
+    b_max *= ta
+    b_min *= ta
+
+    # 最高点取最后一次、最低点取第一次出现的位置
+    max_value, max_idx = (b_max, b_max_idx) if b_max >= a_max else (a_max, a_max_idx)
+    min_value, min_idx = (b_min, b_min_idx) if b_min < a_min else (a_min, a_min_idx)
+
+    # 最大回撤：取值最小者；并列时取谷底更早、峰值更晚者 (与 idxmin / 最后一个峰值一致)
+    best = (a_mdd, a_trough, -a_peak)
+    if ta > 0:
+        best = min(best, (b_mdd, b_trough, -b_peak))
+    if a_max > 0:
+        best = min(best, (b_min / a_max - 1.0, b_min_idx, -a_max_idx))
+
+    # 最大反弹：b 内部的反弹，或 a 的最低点到 b 的最高点
+    runup = a_runup
+    if ta > 0 and not np.isnan(b_runup):
+        runup = b_runup if np.isnan(runup) else max(runup, b_runup)
+    if a_min > 0:
+        cross = b_max / a_min - 1.0
+        runup = cross if np.isnan(runup) else max(runup, cross)
+
+    return ta * tb, max_value, max_idx, min_value, min_idx, best[0], -best[2], best[1], runup
+
+
+class _SegmentQueue:
+    """双栈队列：尾部压入、头部弹出，随时得到队列内全部元素的区段摘要"""
+
+    def __init__(self):
+        self._front: List[_Segment] = []  # 每个元素为 "该位置至前栈底" 的后缀摘要
+        self._back: List[_Segment] = []
+        self._back_agg: Optional[_Segment] = None
+
+    def push(self, seg: _Segment):
+        self._back.append(seg)
+        self._back_agg = seg if self._back_agg is None else _combine(self._back_agg, seg)
+
+    def pop(self):
+        if not self._front:
+            agg = None
+            for seg in reversed(self._back):
+                agg = seg if agg is None else _combine(seg, agg)
+                self._front.append(agg)
+            self._back = []
+            self._back_agg = None
+        self._front.pop()
+
+    def aggregate(self) -> Optional[_Segment]:
+        if self._front and self._back_agg is not None:
+            return _combine(self._front[-1], self._back_agg)
+        if self._front:
+            return self._front[-1]
+        return self._back_agg
+
+
+def next_greater_or_equal(levels: np.ndarray) -> np.ndarray:
+    """每个位置之后第一个不低于该位置净值的下标，不存在为 -1 (单调栈)"""
+    result = np.full(len(levels), -1, dtype=np.int64)
+    stack: List[int] = []
+    for j, value in enumerate(levels.tolist()):
+        while stack and levels[stack[-1]] <= value:
+            result[stack.pop()] = j
+        stack.append(j)
+    return result
+
+
+def rolling_starts(ends: np.ndarray, window_days: int) -> np.ndarray:
+    """滚动窗口：最近 window_days 行"""
+    return np.maximum(ends - window_days + 1, 0)
+
+
+def expanding_starts(ends: np.ndarray) -> np.ndarray:
+    """扩张窗口：从第一行开始"""
+    return np.zeros_like(ends)
+
+
+def segment_starts(keys: np.ndarray, ends: np.ndarray) -> Optional[np.ndarray]:
+    """
+    按连续分段 (如持仓周期) 的窗口：当前行所在分段的第一行。
+    keys 非单调不减时同一分段可能不连续，返回 None 由调用方回退。
+    """
+    if len(keys) > 1 and np.any(np.diff(keys) < 0):
+        return None
+    change = np.r_[True, keys[1:] != keys[:-1]] if len(keys) else np.array([], dtype=bool)
+    first = np.maximum.accumulate(np.where(change, np.arange(len(keys)), 0))
+    return first[ends]
+
+
+class RollingMetricsEngine:
+    """单个序列的滚动指标引擎，前缀数组只构建一次，供所有窗口共用"""
+
+    def __init__(self, returns: np.ndarray, pnl: np.ndarray, cash_dividend: np.ndarray,
+                 reinvest_dividend: np.ndarray):
+        r = np.asarray(returns, dtype=np.float64)
+
+        def prefix(values) -> np.ndarray:
+            return np.r_[0.0, np.cumsum(values, dtype=np.float64)]
+
+        # 1. 收益/分红
+        self._pnl = prefix(pnl)
+        self._cash = prefix(cash_dividend)
+        self._reinvest = prefix(reinvest_dividend)
+
+        # 2. TWRR: log(1 + r) 前缀和，非正的因子单独计数 (窗口乘积为 0)
+        factors = 1.0 + r
+        positive = factors > 0
+        self._factors = factors
+        self._log = prefix(np.log(np.where(positive, factors, 1.0)))
+        self._zeros = prefix(~positive)
+
+        # 3. 波动率: 以全序列均值中心化后的前缀和 / 平方和，减小相消误差
+        centered = r - (r.mean() if len(r) else 0.0)
+        self._s1 = prefix(centered)
+        self._s2 = prefix(centered * centered)
+
+        negative = r < 0
+        neg_values = r[negative]
+        neg_centered = np.where(negative, r - (neg_values.mean() if len(neg_values) else 0.0), 0.0)
+        self._neg_n = prefix(negative)
+        self._neg_s1 = prefix(neg_centered)
+        self._neg_s2 = prefix(neg_centered * neg_centered)
+        self._wins = prefix(r > 0)
+
+        # 4. 回撤修复：净值上的 "下一个不低于" 位置；净值在非正因子处重新起算，
+        #    不含非正因子的窗口落在同一段内，段内净值与窗口净值成比例
+        levels = np.cumprod(factors)
+        for begin, end in zip(*self._positive_runs(positive)):
+            levels[begin:end] = np.cumprod(factors[begin:end])
+        self._recovery = next_greater_or_equal(levels)
+
+        self._returns = r
+        self._extrema: Optional[Tuple[List[np.ndarray], List[np.ndarray]]] = None
+
+    @staticmethod
+    def _positive_runs(positive: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """非正因子之后的各段 [begin, end)；全部为正时为空 (全局净值即可)"""
+        breaks = np.flatnonzero(~positive)
+        if not len(breaks):
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        return breaks + 1, np.r_[breaks[1:], len(positive)]
+
+    @staticmethod
+    def _sample_std(s1: np.ndarray, s2: np.ndarray, n: np.ndarray) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var = (s2 - s1 * s1 / n) / (n - 1)
+        return np.where(n > 1, np.sqrt(np.maximum(var, 0.0)), np.nan)
+
+    def compute(self, starts: np.ndarray, ends: np.ndarray, annual_factor: int,
+                min_annualization_days: int) -> Dict[str, np.ndarray]:
+        """
+        计算每个目标行 [starts[i], ends[i]] 窗口的指标。
+        starts / ends 须单调不减；返回与 ends 对齐的列，缺失值为 NaN (下标列为 -1)。
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        lo, hi = starts, ends + 1
+        n = (hi - lo).astype(np.float64)
+
+        def window_sum(prefix: np.ndarray) -> np.ndarray:
+            return prefix[hi] - prefix[lo]
+
+        log_sum = window_sum(self._log)
+        has_zero = window_sum(self._zeros) > 0
+        twrr_cum = np.where(has_zero, -1.0, np.expm1(log_sum))
+        twrr_ann = np.where(
+            n >= min_annualization_days,
+            np.where(has_zero, -1.0, np.expm1(log_sum * annual_factor / n)),
+            np.nan
+        )
+        sqrt_af = np.sqrt(annual_factor)
+
+        result = {
+            'count': n.astype(np.int64),
+            'twrr_cum': twrr_cum,
+            'twrr_ann': twrr_ann,
+            'cum_pnl': window_sum(self._pnl),
+            'total_cash_div': window_sum(self._cash),
+            'total_reinvest_div': window_sum(self._reinvest),
+            'volatility': self._sample_std(window_sum(self._s1), window_sum(self._s2), n) * sqrt_af,
+            'downside_risk': self._sample_std(
+                window_sum(self._neg_s1), window_sum(self._neg_s2), window_sum(self._neg_n)
+            ) * sqrt_af,
+            'win_rate': window_sum(self._wins) / n,
+        }
+        result.update(self._drawdowns(starts, ends))
+        return result
+
+    def nonpositive_windows(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """每个 [starts[i], ends[i]] 窗口内是否含非正的增长因子 (此时回撤 / 修复日与切片口径不一致)"""
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        return self._zeros[ends + 1] - self._zeros[starts] > 0
+
+    def day_extremes(self, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """每个 [starts[i], ends[i]] 窗口内的最大 / 最小日收益 (稀疏表，窗口起点无须单调)"""
+        if self._extrema is None:
+            highs, lows = [self._returns], [self._returns]
+            width = 1
+            while 2 * width <= len(self._returns):
+                highs.append(np.maximum(highs[-1][:-width], highs[-1][width:]))
+                lows.append(np.minimum(lows[-1][:-width], lows[-1][width:]))
+                width *= 2
+            self._extrema = highs, lows
+
+        highs, lows = self._extrema
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        level = np.floor(np.log2(ends - starts + 1)).astype(np.int64)
+        best = np.empty(len(ends))
+        worst = np.empty(len(ends))
+        for k in np.unique(level).tolist():
+            rows = np.flatnonzero(level == k)
+            lo, hi = starts[rows], ends[rows] - (1 << k) + 1
+            best[rows] = np.maximum(highs[k][lo], highs[k][hi])
+            worst[rows] = np.minimum(lows[k][lo], lows[k][hi])
+        return best, worst
+
+    def _drawdowns(self, starts: np.ndarray, ends: np.ndarray) -> Dict[str, np.ndarray]:
+        """单遍推进窗口，读取每个目标行的回撤 / 反弹摘要"""
+        size = len(ends)
+        mdd = np.full(size, np.nan)
+        runup = np.full(size, np.nan)
+        peak = np.full(size, -1, dtype=np.int64)
+        trough = np.full(size, -1, dtype=np.int64)
+
+        factors = self._factors.tolist()
+        queue = _SegmentQueue()
+        lo = hi = int(starts[0]) if size else 0
+        for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+            if start >= hi:
+                # 窗口整体跳过已入队的部分，直接重建
+                queue = _SegmentQueue()
+                lo = hi = start
+            while hi <= end:
+                queue.push(_leaf(hi, factors[hi]))
+                hi += 1
+            while lo < start:
+                queue.pop()
+                lo += 1
+            seg = queue.aggregate()
+            mdd[i], peak[i], trough[i], runup[i] = seg[5], seg[6], seg[7], seg[8]
+
+        recovery = np.where(peak >= 0, self._recovery[np.maximum(peak, 0)], -1)
+        recovery = np.where((recovery >= 0) & (recovery <= ends), recovery, -1)
+        return {
+            'mdd': mdd,
+            'mdd_peak': peak,
+            'mdd_trough': trough,
+            'mdd_recovery': recovery,
+            'max_runup': runup,
+        }
@@ -0,0 +1,239 @@
+# app/engine/xirr.py
+"""
+批量 XIRR 求解 (NumPy)
+
+把 "每个 (日期, 窗口) 单独构造现金流、用 Python 级 xnpv 调 newton / brentq" 改为：
+1. 所有窗口的现金流按行填充为 (K, M) 矩阵 (不足 M 的位置金额为 0，不影响 NPV)；
+2. NPV 与其导数对 K 组现金流一次性按数组计算，Newton 迭代只对未收敛的行继续；
+3. 未收敛的行以前一行 (即前一个目标日期) 的解为初值再做一轮 Newton；
+4. 仍失败且区间端点异号的行，走向量化二分法兜底。
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+# 求解区间 (与原 newton / bisect / brentq 的区间一致)
+RATE_LOWER = -0.99
+RATE_UPPER = 10.0
+DEFAULT_GUESS = 0.1
+
+NEWTON_TOL = 1e-6
+NEWTON_MAXITER = 50
+BISECT_MAXITER = 60
+
+# 每批矩阵元素上限，控制 (K, M) 临时数组的内存
+MAX_BATCH_CELLS = 2_000_000
+
+
+def build_window_cash_flows(
+        day_ordinals: np.ndarray,
+        flows: np.ndarray,
+        terminal_values: np.ndarray,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        flow_epsilon: float = 0.0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    为每个窗口 [starts[i], ends[i]] 构造现金流：窗口内 |flow| > flow_epsilon 的各行，
+    期末再加上 terminal_values[end] (与期末当日现金流合并为一笔)。
+
+    :return: (days, amounts)，均为 (K, M)；days 为相对本组第一笔现金流的天数
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    flow_rows = np.flatnonzero(np.abs(flows) > flow_epsilon)
+
+    # 期末前 (不含期末当日) 的现金流在 flow_rows 中的区间
+    lo = np.searchsorted(flow_rows, starts, side='left')
+    hi = np.searchsorted(flow_rows, ends, side='left')
+    width = int((hi - lo).max()) if len(ends) else 0
+
+    # 末尾补一个哨兵，越界位置统一指向它再由 valid 屏蔽
+    padded_rows = np.r_[flow_rows, 0]
+    pos = lo[:, None] + np.arange(width)[None, :]
+    valid = pos < hi[:, None]
+    rows = padded_rows[np.minimum(pos, len(flow_rows))]
+
+    terminal_flow = np.where(np.abs(flows[ends]) > flow_epsilon, flows[ends], 0.0)
+    amounts = np.concatenate([
+        np.where(valid, flows[rows], 0.0),
+        (terminal_values[ends] + terminal_flow)[:, None]
+    ], axis=1)
+
+    first_day = np.where(hi > lo, day_ordinals[padded_rows[np.minimum(lo, len(flow_rows))]], day_ordinals[ends])
+    days = np.concatenate([
+        np.where(valid, day_ordinals[rows] - first_day[:, None], 0),
+        (day_ordinals[ends] - first_day)[:, None]
+    ], axis=1).astype(np.float64)
+    return days, amounts
+
+
+def _npv(rates: np.ndarray, times: np.ndarray, amounts: np.ndarray) -> np.ndarray:
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        return (amounts * np.power(1.0 + rates[:, None], -times)).sum(axis=1)
+
+
+def _newton(rates: np.ndarray, times: np.ndarray, amounts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """对每一行同时做 Newton 迭代，返回 (解, 是否收敛)"""
+    rates = rates.copy()
+    converged = np.zeros(len(rates), dtype=bool)
+    active = np.arange(len(rates))
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        for _ in range(NEWTON_MAXITER):
+            if not len(active):
+                break
+            r = rates[active]
+            t = times[active]
+            base = 1.0 + r[:, None]
+            disc = amounts[active] * np.power(base, -t)
+            f = disc.sum(axis=1)
+            fprime = (-t * disc / base).sum(axis=1)
+            step = f / fprime
+            new_r = r - step
+            # 越过 -100% 时折半回退，保持在定义域内
+            new_r = np.where(new_r <= -1.0, (r - 1.0) / 2.0, new_r)
+            ok = np.isfinite(new_r)
+            rates[active] = np.where(ok, new_r, np.nan)
+            done = ok & (np.abs(step) < NEWTON_TOL)
+            converged[active[done]] = True
+            active = active[ok & ~done]
+    return rates, converged & np.isfinite(rates)
+
+
+def _bisect(times: np.ndarray, amounts: np.ndarray) -> np.ndarray:
+    """区间 [RATE_LOWER, RATE_UPPER] 上的向量化二分，端点同号的行返回 NaN"""
+    size = len(amounts)
+    lo = np.full(size, RATE_LOWER)
+    hi = np.full(size, RATE_UPPER)
+    f_lo = _npv(lo, times, amounts)
+    f_hi = _npv(hi, times, amounts)
+    valid = np.sign(f_lo) != np.sign(f_hi)
+    for _ in range(BISECT_MAXITER):
+        mid = (lo + hi) / 2.0
+        f_mid = _npv(mid, times, amounts)
+        same = np.sign(f_mid) == np.sign(f_lo)
+        lo = np.where(same, mid, lo)
+        f_lo = np.where(same, f_mid, f_lo)
+        hi = np.where(same, hi, mid)
+    return np.where(valid, (lo + hi) / 2.0, np.nan)
+
+
+def _initial_guess(years: np.ndarray, amounts: np.ndarray) -> np.ndarray:
+    """简单收益率 / 年数，与原实现的初值一致"""
+    total_in = np.where(amounts < 0, amounts, 0.0).sum(axis=1)
+    total_out = np.where(amounts > 0, amounts, 0.0).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        guess = ((total_out + total_in) / np.abs(total_in)) / years
+    guess = np.where((total_in != 0) & (years > 0), guess, DEFAULT_GUESS)
+    return np.clip(np.nan_to_num(guess, nan=DEFAULT_GUESS), RATE_LOWER, RATE_UPPER)
+
+
+def solve_xirr(
+        days: np.ndarray,
+        amounts: np.ndarray,
+        days_per_year: float = 365.0,
+        min_days: Optional[int] = None,
+        bracketed: bool = False,
+        guess: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    求解每一行现金流的 XIRR，无解为 NaN。
+
+    :param days: (K, M) 相对天数
+    :param amounts: (K, M) 金额，填充位置为 0
+    :param min_days: 首尾跨度不足该天数时不求解
+    :param bracketed: 只求解区间端点异号的现金流 (与 brentq 语义一致)；
+                      否则区间内端点同号 (多根) 时仍接受 Newton 找到的根
+    :param guess: 每行 Newton 初值 (如上一交易日的解)，NaN 的行使用简单年化收益
+    Newton 跑出 [RATE_LOWER, RATE_UPPER] 的解视为未收敛 (原标量实现会把发散值原样返回)
+    """
+    days = np.atleast_2d(np.asarray(days, dtype=np.float64))
+    amounts = np.atleast_2d(np.asarray(amounts, dtype=np.float64))
+    result = np.full(len(amounts), np.nan)
+    if not len(amounts):
+        return result
+
+    # 1. 必须同时有流入与流出
+    span = days.max(axis=1)
+    solvable = np.any(amounts > 0, axis=1) & np.any(amounts < 0, axis=1)
+    if min_days is not None:
+        solvable &= span >= min_days
+    if bracketed:
+        f_lo = _npv(np.full(len(amounts), RATE_LOWER), days / days_per_year, amounts)
+        f_hi = _npv(np.full(len(amounts), RATE_UPPER), days / days_per_year, amounts)
+        solvable &= np.sign(f_lo) != np.sign(f_hi)
+    rows = np.flatnonzero(solvable)
+    if not len(rows):
+        return result
+
+    times = days[rows] / days_per_year
+    flows = amounts[rows]
+
+    # 2. Newton：初值取调用方给定的值，否则取简单年化收益
+    initial = _initial_guess(span[rows] / days_per_year, flows)
+    if guess is not None:
+        seeds = np.asarray(guess, dtype=np.float64)[rows]
+        initial = np.where(np.isfinite(seeds), np.clip(seeds, RATE_LOWER, RATE_UPPER), initial)
+    rates, ok = _newton(initial, times, flows)
+    ok &= (rates >= RATE_LOWER) & (rates <= RATE_UPPER)
+
+    # 3. 热启动：未收敛的行以前一个已收敛行的解为初值重试
+    retry = np.flatnonzero(~ok)
+    if len(retry) and ok.any():
+        last_ok = np.maximum.accumulate(np.where(ok, np.arange(len(ok)), -1))
+        seeds = last_ok[retry]
+        retry = retry[seeds >= 0]
+        if len(retry):
+            warm, warm_ok = _newton(rates[last_ok[retry]], times[retry], flows[retry])
+            warm_ok &= (warm >= RATE_LOWER) & (warm <= RATE_UPPER)
+            rates[retry[warm_ok]] = warm[warm_ok]
+            ok[retry[warm_ok]] = True
+
+    # 4. 二分兜底
+    fallback = np.flatnonzero(~ok)
+    if len(fallback):
+        rates[fallback] = _bisect(times[fallback], flows[fallback])
+
+    result[rows] = rates
+    return result
+
+
+def xirr_windows(
+        day_ordinals: np.ndarray,
+        flows: np.ndarray,
+        terminal_values: np.ndarray,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        days_per_year: float = 365.0,
+        min_days: Optional[int] = None,
+        bracketed: bool = False,
+        flow_epsilon: float = 0.0,
+        guess: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """按窗口批量求 XIRR；行按目标日期升序排列时热启动效果最好；guess 为每个窗口的 Newton 初值"""
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    result = np.full(len(ends), np.nan)
+    if not len(ends):
+        return result
+
+    # 按矩阵大小分批，避免长窗口 x 多日期时临时数组过大
+    flow_count = np.cumsum(np.r_[0, np.abs(flows) > flow_epsilon])
+    widths = flow_count[ends + 1] - flow_count[starts] + 1
+    batch_start = 0
+    while batch_start < len(ends):
+        batch_end = batch_start + 1
+        max_width = widths[batch_start]
+        while batch_end < len(ends):
+            max_width = max(max_width, widths[batch_end])
+            if max_width * (batch_end - batch_start + 1) > MAX_BATCH_CELLS:
+                break
+            batch_end += 1
+        days, amounts = build_window_cash_flows(
+            day_ordinals, flows, terminal_values,
+            starts[batch_start:batch_end], ends[batch_start:batch_end], flow_epsilon
+        )
+        batch_guess = None if guess is None else np.asarray(guess, dtype=np.float64)[batch_start:batch_end]
+        result[batch_start:batch_end] = solve_xirr(days, amounts, days_per_year, min_days, bracketed, batch_guess)
+        batch_start = batch_end
+    return result
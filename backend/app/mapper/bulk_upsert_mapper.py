@@ -0,0 +1,366 @@
+"""
+快照表批量 upsert 持久化层
+取代 "按区间 delete + bulk_save_objects" 的写法：
+- PostgreSQL: COPY 到临时表，再 INSERT ... ON CONFLICT 到已有唯一约束，未变化的行不重写
+- 其他数据库 (SQLite 测试等): 按批查询已有行，executemany 插入/更新
+两条路径都只写入新增、变化与需删除的行，并返回 inserted / updated / unchanged / deleted 计数。
+表有 row_hash 列时默认按行摘要判定变化，只需读取/比较一列。
+"""
+import csv
+import hashlib
+import io
+import uuid
+from dataclasses import dataclass, asdict
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from loguru import logger
+from sqlalchemy import Numeric, UniqueConstraint, bindparam, delete, insert, select, text, tuple_, update
+from sqlalchemy import inspect as sa_inspect
+
+from app.constant.biz_enums import SnapshotDiffModeEnum
+from app.extension import db
+
+# 不参与 upsert 比较/写入的列: 主键与时间戳由数据库维护
+_MANAGED_COLUMNS = {'id', 'created_at', 'updated_at'}
+
+# 行摘要列：由 upsert 根据其余写入列计算
+ROW_HASH_COLUMN = 'row_hash'
+
+
+@dataclass
+class UpsertResult:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+
+    @property
+    def written(self) -> int:
+        return self.inserted + self.updated
+
+    def merge(self, other: 'UpsertResult') -> 'UpsertResult':
+        """累加另一批的计数 (分块写入时汇总)"""
+        self.inserted += other.inserted
+        self.updated += other.updated
+        self.unchanged += other.unchanged
+        self.deleted += other.deleted
+        return self
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> 'UpsertResult':
+        """由 to_dict() 的结果还原，None 视为空结果"""
+        if not data:
+            return cls()
+        return cls(**{k: data.get(k, 0) for k in ('inserted', 'updated', 'unchanged', 'deleted')})
+
+
+@dataclass
+class RecordBatch:
+    """
+    列式记录批：取代逐行实例化 ORM 对象，列名与模型字段一致。
+    - 浮点列为 float64 数组，NaN 表示 NULL，写入时按模型列精度整列量化；
+    - 其余列 (ID、日期、字符串、整数) 为等长数组，整列同值时可直接给标量。
+    """
+    size: int
+    columns: Dict[str, Any]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def column(self, name: str) -> np.ndarray:
+        """取一列，标量展开为等长数组"""
+        values = self.columns[name]
+        if isinstance(values, np.ndarray):
+            return values
+        return np.full(self.size, values, dtype=object)
+
+    def take(self, order: np.ndarray) -> 'RecordBatch':
+        """按下标重排/筛选行"""
+        return RecordBatch(len(order), {
+            name: values[order] if isinstance(values, np.ndarray) else values
+            for name, values in self.columns.items()
+        })
+
+    @classmethod
+    def concat(cls, batches: Sequence['RecordBatch']) -> 'RecordBatch':
+        """按行拼接，各批列集合须一致"""
+        batches = [b for b in batches if len(b)]
+        if not batches:
+            return cls(0, {})
+        if len(batches) == 1:
+            return batches[0]
+        names = list(batches[0].columns)
+        return cls(sum(len(b) for b in batches), {
+            name: np.concatenate([b.column(name) for b in batches]) for name in names
+        })
+
+
+class BulkUpsertMapper:
+
+    DEFAULT_BATCH_SIZE = 500
+
+    @classmethod
+    def upsert(
+            cls,
+            model,
+            records: Union[Iterable[Any], RecordBatch],
+            constraint_name: Optional[str] = None,
+            prune_scope: Optional[Sequence] = None,
+            batch_size: int = DEFAULT_BATCH_SIZE,
+            diff_mode: Optional[str] = None
+    ) -> UpsertResult:
+        """
+        按唯一约束批量 upsert，不提交事务（由调用方 commit/rollback）。
+
+        :param model: ORM 模型类，如 HoldingSnapshot
+        :param records: ORM 实例或列名->值的 dict，或列式的 RecordBatch
+        :param constraint_name: 冲突判定使用的唯一约束名，模型只有一个唯一约束时可省略
+        :param prune_scope: 可选的过滤条件列表；范围内但不在 records 中的旧行会被删除，
+                            与原 "先删后插" 语义保持一致
+        :param batch_size: executemany 路径每批行数
+        :param diff_mode: 变更判定方式，见 SnapshotDiffModeEnum；为空时有 row_hash 列则用 HASH，否则用 VALUE
+        """
+        table = model.__table__
+        key_cols = cls._conflict_columns(table, constraint_name)
+        value_cols = [c.name for c in table.columns if c.name not in _MANAGED_COLUMNS and c.name not in key_cols]
+
+        has_hash = ROW_HASH_COLUMN in table.c
+        if diff_mode is None:
+            diff_mode = SnapshotDiffModeEnum.HASH if has_hash else SnapshotDiffModeEnum.VALUE
+        if diff_mode == SnapshotDiffModeEnum.HASH and not has_hash:
+            raise ValueError(f"{table.name} has no {ROW_HASH_COLUMN} column for hash diff")
+        compare_cols = [ROW_HASH_COLUMN] if diff_mode == SnapshotDiffModeEnum.HASH else value_cols
+
+        hashed_cols = [c for c in value_cols if c != ROW_HASH_COLUMN]
+        if isinstance(records, RecordBatch):
+            rows = cls._batch_rows(table, records, key_cols + hashed_cols)
+        else:
+            rows = [cls._to_row(table, record, key_cols + hashed_cols) for record in records]
+        if has_hash:
+            for row in rows:
+                row[ROW_HASH_COLUMN] = cls._row_hash(row, hashed_cols)
+        rows = cls._dedupe(rows, key_cols)
+        if not rows and not prune_scope:
+            return UpsertResult()
+
+        if db.session.get_bind().dialect.name == 'postgresql':
+            result = cls._upsert_copy(table, rows, key_cols, value_cols, compare_cols, prune_scope)
+        else:
+            result = cls._upsert_executemany(table, rows, key_cols, value_cols, compare_cols, prune_scope, batch_size)
+
+        logger.info(f"Upsert {table.name}: {result.to_dict()}")
+        return result
+
+    # ------------------------------------------------------------------
+    # 行准备
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _conflict_columns(table, constraint_name: Optional[str]) -> List[str]:
+        uniques = [c for c in table.constraints if isinstance(c, UniqueConstraint)]
+        if constraint_name:
+            uniques = [c for c in uniques if c.name == constraint_name]
+        if len(uniques) != 1:
+            raise ValueError(f"Cannot resolve unique constraint for {table.name}: {constraint_name}")
+        return [c.name for c in uniques[0].columns]
+
+    @staticmethod
+    def _normalize(column, value):
+        """与数据库存储精度对齐，保证比较结果与 ON CONFLICT 路径一致"""
+        if value is None:
+            return None
+        if isinstance(column.type, Numeric) and column.type.scale is not None and not isinstance(value, bool):
+            if not isinstance(value, Decimal):
+                value = Decimal(str(value))
+            return value.quantize(Decimal(1).scaleb(-column.type.scale))
+        return value
+
+    @classmethod
+    def _to_row(cls, table, record, columns: List[str]) -> Dict[str, Any]:
+        if isinstance(record, dict):
+            source = record
+        else:
+            source = sa_inspect(record).dict
+        row = {}
+        for name in columns:
+            column = table.c[name]
+            value = source.get(name)
+            if value is None and name not in source and column.default is not None and column.default.is_scalar:
+                value = column.default.arg
+            row[name] = cls._normalize(column, value)
+        return row
+
+    @classmethod
+    def _batch_rows(cls, table, batch: RecordBatch, columns: List[str]) -> List[Dict[str, Any]]:
+        """列式批 -> 行 dict：定点数列整列格式化到列精度，其余列逐值归一化"""
+        values_by_col = []
+        for name in columns:
+            column = table.c[name]
+            values = batch.columns.get(name)
+            if values is None and name not in batch.columns:
+                if column.default is not None and column.default.is_scalar:
+                    values = column.default.arg
+            if not isinstance(values, np.ndarray):
+                values_by_col.append([cls._normalize(column, values)] * len(batch))
+            elif isinstance(column.type, Numeric) and column.type.scale is not None and values.dtype.kind == 'f':
+                values_by_col.append(cls._quantize_column(values, column.type.scale))
+            else:
+                values_by_col.append([cls._normalize(column, v) for v in values.tolist()])
+        return [dict(zip(columns, row_values)) for row_values in zip(*values_by_col)]
+
+    @staticmethod
+    def _quantize_column(values: np.ndarray, scale: int) -> List[Optional[Decimal]]:
+        """浮点列整列按 scale 位小数格式化 (与 f"{x:.{scale}f}" 一致)，NaN 为 NULL"""
+        text_values = np.char.mod(f"%.{scale}f", values).tolist()
+        missing = np.isnan(values).tolist()
+        return [None if na else Decimal(t) for t, na in zip(text_values, missing)]
+
+    @staticmethod
+    def _row_hash(row: Dict[str, Any], columns: List[str]) -> str:
+        """按列顺序拼接归一化后的值取 MD5；NULL 与空串区分"""
+        payload = '\x1f'.join('\\N' if row[c] is None else str(row[c]) for c in columns)
+        return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _dedupe(rows: List[Dict[str, Any]], key_cols: List[str]) -> List[Dict[str, Any]]:
+        """同一批内重复的键以最后一条为准 (ON CONFLICT 不允许同一语句内重复键)"""
+        by_key = {}
+        for row in rows:
+            by_key[tuple(row[c] for c in key_cols)] = row
+        return list(by_key.values())
+
+    # ------------------------------------------------------------------
+    # PostgreSQL: COPY + INSERT ... ON CONFLICT
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def _upsert_copy(cls, table, rows, key_cols, value_cols, compare_cols, prune_scope) -> UpsertResult:
+        columns = key_cols + value_cols
+        tmp_name = f"tmp_upsert_{table.name}_{uuid.uuid4().hex[:8]}"
+        col_list = ', '.join(columns)
+        session = db.session
+
+        session.execute(text(
+            f"CREATE TEMP TABLE {tmp_name} AS SELECT {col_list} FROM {table.name} WITH NO DATA"
+        ))
+        try:
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            for row in rows:
+                writer.writerow([cls._copy_value(row[c]) for c in columns])
+            buf.seek(0)
+            cursor = session.connection().connection.cursor()
+            try:
+                cursor.copy_expert(f"COPY {tmp_name} ({col_list}) FROM STDIN WITH (FORMAT csv)", buf)
+            finally:
+                cursor.close()
+
+            set_clause = ', '.join(f"{c} = EXCLUDED.{c}" for c in value_cols)
+            target_values = ', '.join(f"{table.name}.{c}" for c in compare_cols)
+            excluded_values = ', '.join(f"EXCLUDED.{c}" for c in compare_cols)
+            counts = session.execute(text(f"""
+                WITH upserted AS (
+                    INSERT INTO {table.name} ({col_list}, created_at, updated_at)
+                    SELECT {col_list}, now(), now() FROM {tmp_name}
+                    ON CONFLICT ({', '.join(key_cols)}) DO UPDATE
+                    SET {set_clause}, updated_at = now()
+                    WHERE ({target_values}) IS DISTINCT FROM ({excluded_values})
+                    RETURNING (xmax = 0) AS is_insert
+                )
+                SELECT count(*) FILTER (WHERE is_insert), count(*) FILTER (WHERE NOT is_insert) FROM upserted
+            """)).one()
+            result = UpsertResult(inserted=counts[0], updated=counts[1])
+            result.unchanged = len(rows) - result.inserted - result.updated
+
+            if prune_scope:
+                match = ' AND '.join(f"t.{c} = {table.name}.{c}" for c in key_cols)
+                stmt = delete(table).where(*prune_scope).where(
+                    text(f"NOT EXISTS (SELECT 1 FROM {tmp_name} t WHERE {match})")
+                )
+                result.deleted = session.execute(stmt).rowcount
+        finally:
+            session.execute(text(f"DROP TABLE IF EXISTS {tmp_name}"))
+        return result
+
+    @staticmethod
+    def _copy_value(value):
+        if value is None:
+            return None
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+    # ------------------------------------------------------------------
+    # 通用回退: 分批 executemany
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def _upsert_executemany(cls, table, rows, key_cols, value_cols, compare_cols, prune_scope,
+                            batch_size) -> UpsertResult:
+        session = db.session
+        result = UpsertResult()
+        key_exprs = [table.c[c] for c in key_cols]
+        update_stmt = update(table).where(table.c.id == bindparam('b_id')).values(
+            {c: bindparam(f"b_{c}") for c in value_cols}
+        )
+
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            keys = [tuple(r[c] for c in key_cols) for r in batch]
+            existing = {
+                tuple(rec[:len(key_cols)]): rec
+                for rec in session.execute(
+                    select(*key_exprs, table.c.id, *[table.c[c] for c in compare_cols])
+                    .where(tuple_(*key_exprs).in_(keys))
+                ).all()
+            }
+
+            to_insert, to_update = [], []
+            for key, row in zip(keys, batch):
+                current = existing.get(key)
+                if current is None:
+                    to_insert.append(row)
+                    continue
+                current_values = current[len(key_cols) + 1:]
+                if cls._row_changed(table, compare_cols, current_values, row):
+                    params = {f"b_{c}": row[c] for c in value_cols}
+                    params['b_id'] = current[len(key_cols)]
+                    to_update.append(params)
+                else:
+                    result.unchanged += 1
+
+            if to_insert:
+                session.execute(insert(table), to_insert)
+            if to_update:
+                session.execute(update_stmt, to_update)
+            result.inserted += len(to_insert)
+            result.updated += len(to_update)
+
+        if prune_scope:
+            result.deleted = cls._prune(table, rows, key_cols, prune_scope)
+        return result
+
+    @classmethod
+    def _row_changed(cls, table, value_cols: List[str], current_values: Tuple, row: Dict[str, Any]) -> bool:
+        for name, old in zip(value_cols, current_values):
+            if cls._normalize(table.c[name], old) != row[name]:
+                return True
+        return False
+
+    @staticmethod
+    def _prune(table, rows, key_cols, prune_scope) -> int:
+        """删除范围内不再产生的旧行"""
+        key_exprs = [table.c[c] for c in key_cols]
+        wanted = {tuple(r[c] for c in key_cols) for r in rows}
+        stale_ids = [
+            rec[-1] for rec in db.session.execute(select(*key_exprs, table.c.id).where(*prune_scope)).all()
+            if tuple(rec[:-1]) not in wanted
+        ]
+        if not stale_ids:
+            return 0
+        return db.session.execute(delete(table).where(table.c.id.in_(stale_ids))).rowcount
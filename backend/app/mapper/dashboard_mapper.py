@@ -34,3 +34,19 @@ class DashboardMapper:
             {"user_id": user_id, "snapshot_date": snapshot_date, "window_key": window_key},
         ).mappings().all()
         return [dict(row) for row in rows]
+
+    @classmethod
+    def get_holdings_position(cls,
+                              user_id: int,
+                              snapshot_date: str,
+                              prev_date: str,
+                              ) -> List[dict]:
+        """
+        持仓快照当日的仓位占比 / 组合贡献，字段名同 SQL 列名
+        """
+        sql = text(cls._load_sql("get_holdings_position"))
+        rows = db.session.execute(
+            sql,
+            {"user_id": user_id, "snapshot_date": snapshot_date, "prev_date": prev_date},
+        ).mappings().all()
+        return [dict(row) for row in rows]
@@ -0,0 +1,90 @@
+"""
+持仓分析快照的集合式 SQL 更新
+"""
+from datetime import date
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.extension import db
+
+_SQL_DIR = Path(__file__).with_suffix('').parent / "sql"
+
+# 仅重算缺失值时的范围条件
+_MISSING_SCOPE = ("(holding_analytics_snapshot.has_position_ratio IS NULL "
+                  "OR holding_analytics_snapshot.has_portfolio_contribution IS NULL)")
+_DATE_SCOPE = "holding_analytics_snapshot.snapshot_date BETWEEN :start_date AND :end_date"
+
+# 每条语句携带的交易日映射条数 (仅非 PostgreSQL 的分块回退)
+CALENDAR_CHUNK_SIZE = 400
+
+# PostgreSQL：交易日映射作为两个数组参数展开，任意日期范围一条语句
+_UNNEST_CALENDAR = ("SELECT * FROM unnest(CAST(:trade_days AS date[]), CAST(:prev_days AS date[])) "
+                    "AS cal_src(trade_date, prev_date)")
+
+
+class HoldingAnalyticsMapper:
+
+    @staticmethod
+    def _load_sql(name: str) -> str:
+        return (_SQL_DIR / f"{name}.sql").read_text(encoding="utf-8")
+
+    @classmethod
+    def update_position_ratios(
+            cls,
+            user_id: int,
+            prev_days: List[Tuple[date, date]],
+            start_date: Optional[date] = None,
+            end_date: Optional[date] = None
+    ) -> int:
+        """
+        集合式 UPDATE ... FROM 写入 has_position_ratio / has_portfolio_contribution，不提交事务。
+
+        :param prev_days: [(交易日, 前一交易日)]，覆盖待更新的快照日期
+        :param start_date: 与 end_date 同时给出时按日期范围更新，否则只更新缺失值的行
+        :return: 更新的行数
+        """
+        if start_date and end_date:
+            scope = _DATE_SCOPE
+            base_params = {"user_id": user_id, "start_date": start_date, "end_date": end_date}
+        else:
+            scope = _MISSING_SCOPE
+            base_params = {"user_id": user_id}
+
+        if db.session.get_bind().dialect.name == 'postgresql':
+            sql = cls._load_sql("update_position_ratios").format(calendar_values=_UNNEST_CALENDAR, scope=scope)
+            params = dict(base_params,
+                          trade_days=[trade_date for trade_date, _ in prev_days],
+                          prev_days=[prev_date for _, prev_date in prev_days])
+            return db.session.execute(text(sql), params).rowcount
+
+        if not prev_days:
+            sql = cls._load_sql("update_position_ratios").format(
+                calendar_values="SELECT NULL AS trade_date, NULL AS prev_date WHERE 1 = 0", scope=scope)
+            return db.session.execute(text(sql), base_params).rowcount
+
+        # 其他方言 (SQLite) 回退：按交易日分块 (复合 SELECT 上限 500)，每块只更新 [本块首日, 下块首日) 的行
+        updated = 0
+        for offset in range(0, len(prev_days), CALENDAR_CHUNK_SIZE):
+            chunk = prev_days[offset:offset + CALENDAR_CHUNK_SIZE]
+            params = dict(base_params)
+            rows = []
+            for i, (trade_date, prev_date) in enumerate(chunk):
+                # 派生表而非 WITH：sqlite3 驱动对 WITH 开头的语句不返回 rowcount
+                rows.append(f"SELECT :d{i} AS trade_date, :p{i} AS prev_date")
+                params[f"d{i}"] = trade_date
+                params[f"p{i}"] = prev_date
+
+            chunk_scope = [scope]
+            if offset > 0:
+                chunk_scope.append("holding_analytics_snapshot.snapshot_date >= :chunk_start")
+                params["chunk_start"] = chunk[0][0]
+            if offset + CALENDAR_CHUNK_SIZE < len(prev_days):
+                chunk_scope.append("holding_analytics_snapshot.snapshot_date < :chunk_end")
+                params["chunk_end"] = prev_days[offset + CALENDAR_CHUNK_SIZE][0]
+
+            sql = cls._load_sql("update_position_ratios").format(
+                calendar_values=" UNION ALL ".join(rows), scope=" AND ".join(chunk_scope))
+            updated += db.session.execute(text(sql), params).rowcount
+        return updated
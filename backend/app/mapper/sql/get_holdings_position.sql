@@ -0,0 +1,25 @@
+-- 持仓在指定日期的仓位占比 / 组合贡献 (口径同 update_position_ratios.sql)，ON_READ 窗口读取时使用
+SELECT h.id AS ho_id,
+       h.ho_code,
+       h.ho_short_name,
+       hs.snapshot_date,
+       CASE
+           WHEN ias.ias_market_value <> 0
+               THEN hs.hos_market_value * 1.0 / ias.ias_market_value
+           ELSE 0 END AS has_position_ratio,
+       CASE
+           WHEN prev.ias_market_value <> 0
+               THEN hs.hos_daily_pnl * 1.0 / prev.ias_market_value
+           ELSE 0 END AS has_portfolio_contribution
+FROM holding_snapshot hs
+         INNER JOIN holding h
+                    ON h.id = hs.ho_id
+         LEFT JOIN invested_asset_snapshot ias
+                   ON ias.user_id = hs.user_id
+                       AND ias.snapshot_date = hs.snapshot_date
+         LEFT JOIN invested_asset_snapshot prev
+                   ON prev.user_id = hs.user_id
+                       AND prev.snapshot_date = :prev_date
+WHERE hs.user_id = :user_id
+  AND hs.snapshot_date = :snapshot_date
+ORDER BY has_position_ratio DESC;
@@ -0,0 +1,25 @@
+-- 仓位占比 / 组合贡献：一条 UPDATE ... FROM 完成
+-- cal: 目标日期 -> 前一交易日 (由交易日历生成，占位符由 mapper 填充)
+UPDATE holding_analytics_snapshot
+SET has_position_ratio         = CASE
+                                     WHEN ias.ias_market_value <> 0
+                                         THEN hs.hos_market_value * 1.0 / ias.ias_market_value
+                                     ELSE 0 END,
+    has_portfolio_contribution = CASE
+                                     WHEN prev.ias_market_value <> 0
+                                         THEN hs.hos_daily_pnl * 1.0 / prev.ias_market_value
+                                     ELSE 0 END
+FROM holding_snapshot hs
+         LEFT JOIN invested_asset_snapshot ias
+                   ON ias.user_id = hs.user_id
+                       AND ias.snapshot_date = hs.snapshot_date
+         LEFT JOIN ({calendar_values}) cal
+                   ON cal.trade_date = hs.snapshot_date
+         LEFT JOIN invested_asset_snapshot prev
+                   ON prev.user_id = hs.user_id
+                       AND prev.snapshot_date = cal.prev_date
+WHERE hs.user_id = holding_analytics_snapshot.user_id
+  AND hs.ho_id = holding_analytics_snapshot.ho_id
+  AND hs.snapshot_date = holding_analytics_snapshot.snapshot_date
+  AND holding_analytics_snapshot.user_id = :user_id
+  AND {scope};
@@ -404,6 +404,11 @@ class HoldingSnapshot(TimestampMixin, BaseModel):
     是否清仓日
     """
 
+    row_hash = db.Column(db.String(32))
+    """
+    快照生成列的 MD5 摘要，批量 upsert 据此只重写有变化的行
+    """
+
     __table_args__ = (
         db.Index('idx_hs_user_date', 'user_id', 'ho_id', 'snapshot_date'),
         # 确保同一用户、同一持仓、同一天只有一条快照
@@ -432,6 +437,10 @@ class AnalyticsWindow(BaseModel):
     """
     年化因子
     """
+    materialize_policy = db.Column(db.String(20), nullable=False, default='ALL_DATES', server_default='ALL_DATES')
+    """
+    物化策略，见 AnalyticsMaterializeEnum: 'ALL_DATES' | 'LATEST' | 'ON_READ'
+    """
     description = db.Column(db.String(255))
 
 
@@ -572,6 +581,11 @@ class HoldingAnalyticsSnapshot(TimestampMixin, BaseModel):
     或者近似：该持仓平均权重 * 该持仓收益率
     注意：计算此字段需要读取 InvestedAssetSnapshot 的数据。
     """
+    row_hash = db.Column(db.String(32))
+    """
+    快照生成列的 MD5 摘要，批量 upsert 据此只重写有变化的行
+    """
+
     __table_args__ = (
         db.UniqueConstraint('user_id', 'ho_id', 'snapshot_date', 'window_key', name='uq_user_ho_date_window'),
         db.Index('idx_has_user_window_date', 'user_id', 'window_key', 'snapshot_date'),
@@ -658,9 +672,53 @@ class InvestedAssetSnapshot(TimestampMixin, BaseModel):
     历史累计收益率 (Simple Return = 累计收益 / 总成本)
     """
 
+    row_hash = db.Column(db.String(32))
+    """
+    快照生成列的 MD5 摘要，批量 upsert 据此只重写有变化的行
+    """
+
     __table_args__ = (
         db.UniqueConstraint('user_id', 'snapshot_date', name='uq_invested_asset_snapshot_user_date'),
-        db.Index('idx_ias_user_date', 'user_id', 'snapshot_date'),
+        # 覆盖索引：基准指标按用户读取 (日期, 日收益) 序列时走 index-only scan
+        db.Index('idx_ias_user_date_return', 'user_id', 'snapshot_date', postgresql_include=['ias_daily_pnl_ratio']),
+    )
+
+
+class InvestedAssetIndex(TimestampMixin, BaseModel):
+    """
+    投资组合单位净值指数 (每个 用户 x 快照日期 一行，与 InvestedAssetSnapshot 同步生成)
+    任意区间的时间加权收益 = 期末单位净值 / 期初前一行单位净值 - 1，无需逐日连乘；
+    区间外部现金流 / 现金分红同理由累计列相减得到。
+    """
+    __tablename__ = 'invested_asset_index'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user_setting.id'), nullable=False)
+    snapshot_date = db.Column(db.Date, nullable=False)
+
+    unit_value = db.Column(db.Float(precision=53), nullable=False)
+    """
+    单位净值：首个快照之前为 1，逐日乘以 (1 + ias_daily_pnl_ratio)
+    """
+    peak_unit_value = db.Column(db.Float(precision=53), nullable=False)
+    """
+    截至当日的历史最高单位净值，当日回撤 = unit_value / peak_unit_value - 1
+    """
+    peak_date = db.Column(db.Date, nullable=False)
+    """
+    历史最高单位净值最后一次出现的日期
+    """
+    cumulative_net_flow = db.Column(db.Numeric(20, 4), nullable=False)
+    """
+    历史累计外部现金流 (ias_net_external_cash_flow 之和)
+    """
+    cumulative_cash_dividend = db.Column(db.Numeric(20, 4), nullable=False)
+    """
+    历史累计现金分红 (ias_daily_cash_dividend 之和)
+    """
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'snapshot_date', name='uq_invested_asset_index_user_date'),
     )
 
 
@@ -721,12 +779,93 @@ class InvestedAssetAnalyticsSnapshot(TimestampMixin, BaseModel):
     beta = db.Column(db.Numeric(18, 6))
     alpha = db.Column(db.Numeric(18, 6))
 
+    row_hash = db.Column(db.String(32))
+    """
+    快照生成列的 MD5 摘要，批量 upsert 据此只重写有变化的行
+    """
+
     __table_args__ = (
         db.UniqueConstraint('user_id', 'snapshot_date', 'window_key', name='uq_invested_asset_analytics_user_date_window'),
         db.Index('idx_iaas_user_window_date', 'user_id', 'window_key', 'snapshot_date'),
     )
 
 
+class SnapshotDirtyRange(TimestampMixin, BaseModel):
+    """
+    快照脏数据水位线
+    交易新增/修改/删除/导入后，记录每个 (用户, 持仓) 最早需要重算的日期，
+    增量流水线只从该日期起重算各层快照。
+    """
+    __tablename__ = 'snapshot_dirty_range'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user_setting.id'), nullable=False)
+    ho_id = db.Column(db.Integer, db.ForeignKey('holding.id'), nullable=False)
+    dirty_from = db.Column(db.Date, nullable=False)
+    """
+    最早受影响的日期 (包含)，多次标记取最小值
+    """
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'ho_id', name='uq_snapshot_dirty_range_user_ho'),
+    )
+
+
+class HoldingAnalyticsState(TimestampMixin, BaseModel):
+    """
+    持仓分析的滚动累加状态 (每个 用户 x 持仓 x 窗口 一行)
+    每日增量时把新的一天 push 进状态即可得到扩张窗口 (ALL / CUR) 的指标，无需加载全部历史；
+    滚动窗口只使用 last_date / row_count / window_start_date / last_irr。
+    累加列为双精度原值，不做定点量化。
+    """
+    __tablename__ = 'holding_analytics_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user_setting.id'), nullable=False)
+    ho_id = db.Column(db.Integer, db.ForeignKey('holding.id'), nullable=False)
+    window_key = db.Column(db.String(32), nullable=False)
+    last_date = db.Column(db.Date, nullable=False)
+    """
+    已累加的最后一个快照日期
+    """
+    window_start_date = db.Column(db.Date)
+    cycle = db.Column(db.Integer)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+
+    log_sum = db.Column(db.Float(precision=53))
+    zero_count = db.Column(db.Integer)
+    pnl_sum = db.Column(db.Float(precision=53))
+    cash_dividend_sum = db.Column(db.Float(precision=53))
+    reinvest_dividend_sum = db.Column(db.Float(precision=53))
+    win_count = db.Column(db.Integer)
+
+    ret_mean = db.Column(db.Float(precision=53))
+    ret_m2 = db.Column(db.Float(precision=53))
+    neg_count = db.Column(db.Integer)
+    neg_mean = db.Column(db.Float(precision=53))
+    neg_m2 = db.Column(db.Float(precision=53))
+
+    nav = db.Column(db.Float(precision=53))
+    peak_nav = db.Column(db.Float(precision=53))
+    peak_date = db.Column(db.Date)
+    trough_nav = db.Column(db.Float(precision=53))
+    max_runup = db.Column(db.Float(precision=53))
+    mdd = db.Column(db.Float(precision=53))
+    mdd_start = db.Column(db.Date)
+    mdd_end = db.Column(db.Date)
+    mdd_peak_nav = db.Column(db.Float(precision=53))
+    recovery_date = db.Column(db.Date)
+
+    last_irr = db.Column(db.Float(precision=53))
+    """
+    上一次的 XIRR 解，作为下一次求解的初值
+    """
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'ho_id', 'window_key', name='uq_holding_analytics_state_user_ho_window'),
+    )
+
+
 class Benchmark(TimestampMixin, BaseModel):
     __tablename__ = 'benchmark'
     id = db.Column(db.Integer, primary_key=True)
@@ -34,13 +34,13 @@ def remake_all():
         end_date=end_date
     )
 
-    if snapshots:
-        # 删除旧数据
-        db.session.query(HoldingAnalyticsSnapshot).filter(
-            HoldingAnalyticsSnapshot.user_id == g.user.id
-        ).delete(synchronize_session=False)
-        db.session.bulk_save_objects(snapshots)
-        db.session.commit()
+    HoldingAnalyticsSnapshotService.save_analytics(
+        user_id=g.user.id,
+        snapshots=snapshots,
+        prune_scope=[HoldingAnalyticsSnapshot.user_id == g.user.id],
+        invalidate_from=start_date
+    )
+    db.session.commit()
 
     # 更新仓位占比
     HoldingAnalyticsSnapshotService.update_position_ratios_and_contributions(
@@ -3,6 +3,7 @@ from datetime import date
 from flask import Blueprint, request, g
 
 from app.calendars.trade_calendar import trade_calendar
+from app.constant.biz_enums import SnapshotEngineEnum
 from app.framework.auth import auth_required
 from app.framework.res import Res
 from app.models import db, HoldingSnapshot, Holding, Trade
@@ -94,7 +95,10 @@ def generate_all_snapshots():
     data = HoldingSnapshotService.generate_snapshots(
         user_id=g.user.id,
         start_date=start_date,
-        end_date=end_date
+        end_date=end_date,
+        engine=request.args.get('engine', SnapshotEngineEnum.DECIMAL.value),
+        chunk_by=request.args.get('chunk_by'),
+        chunk_size=request.args.get('chunk_size', type=int)
     )
     return Res.success(data)
 
@@ -1,11 +1,14 @@
 from datetime import date
-from flask import Blueprint, g
+from flask import Blueprint, g, request
 
 from app.calendars.trade_calendar import trade_calendar
+from app.constant.biz_enums import ErrorMessageEnum
 from app.framework.auth import auth_required
+from app.framework.exceptions import BizException
 from app.framework.res import Res
 from app.models import db, InvestedAssetSnapshot, Trade
 from app.service.invested_asset_analytics_snapshot_service import InvestedAssetAnalyticsSnapshotService
+from app.utils.date_util import str_to_date
 
 invested_asset_analytics_snapshot_bp = Blueprint('invested_asset_analytics_snapshot', __name__, url_prefix='/invested_asset_analytics_snapshot')
 
@@ -33,3 +36,17 @@ def remake_all():
         end_date=end_date
     )
     return Res.success(data)
+
+
+@invested_asset_analytics_snapshot_bp.route('/custom_range', methods=['POST'])
+@auth_required
+def custom_range():
+    """任意区间的组合分析指标 (即时计算，不落库)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        start_date = str_to_date(data['start_date'])
+        end_date = str_to_date(data['end_date'])
+    except (KeyError, TypeError, ValueError):
+        raise BizException(msg=ErrorMessageEnum.MISSING_FIELD.view)
+
+    return Res.success(InvestedAssetAnalyticsSnapshotService.get_custom_range_metrics(g.user.id, start_date, end_date))
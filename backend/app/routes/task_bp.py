@@ -100,6 +100,33 @@ def async_redo_all_snapshot_job():
     })
 
 
+@task_log_bp.route('/redo_dirty_snapshot_job', methods=['GET'])
+@auth_required
+def async_redo_dirty_snapshot_job():
+    """
+    增量重算快照：只从交易变更记录的脏数据水位线开始
+    Creates an AsyncTaskLog record and lets the consumer execute it.
+    """
+    user_id = g.user.id
+
+    task_log = create_task(
+        user_id=user_id,
+        task_name="Redo dirty snapshots",
+        module_path="app.service.task_service",
+        class_name="TaskService",
+        method_name="redo_dirty_snapshot",
+        args=[user_id],
+        max_retries=1,
+        deduplication_strategy=DeduplicationStrategy.BUSINESS_KEY,
+        business_key=f"redo_dirty_snapshots:user_{user_id}"
+    )
+
+    return Res.success({
+        "task_id": task_log.id,
+        "status": task_log.status
+    })
+
+
 @task_log_bp.route('/redo_yesterday_snapshot_job', methods=['GET'])
 @auth_required
 def async_redo_yesterday_snapshot_job():
@@ -236,8 +263,10 @@ def async_calculate_all():
     Request body (optional):
         start_date: Start date (YYYY-MM-DD format), defaults to earliest trade date
         end_date: End date (YYYY-MM-DD format), defaults to previous trade day
+        mode: FULL (default) or DIRTY, see SnapshotPipelineModeEnum
     """
     from app import create_app
+    from app.constant.biz_enums import SnapshotPipelineModeEnum
     from app.service.task_service import TaskService
 
     user_id = g.user.id
@@ -245,6 +274,11 @@ def async_calculate_all():
 
     start_date_str = data.get('start_date')
     end_date_str = data.get('end_date')
+    mode = data.get('mode') or SnapshotPipelineModeEnum.FULL.value
+    if mode not in {m.value for m in SnapshotPipelineModeEnum}:
+        from app.constant.biz_enums import ErrorMessageEnum
+        from app.framework.exceptions import BizException
+        raise BizException(msg=ErrorMessageEnum.INVALID_PARAM.view)
 
     start_date = None
     end_date = None
@@ -265,11 +299,12 @@ def async_calculate_all():
             from app.framework.exceptions import BizException
             raise BizException(msg=ErrorMessageEnum.INVALID_PARAM.view)
 
-    def run_in_thread(app, uid, s_date, e_date):
+    def run_in_thread(app, uid, s_date, e_date, run_mode):
         """Execute calculate_all in a separate thread with Flask app context."""
         with app.app_context():
             try:
-                task_log_id = TaskService.calculate_all(user_id=uid, start_date=s_date, end_date=e_date)
+                task_log_id = TaskService.calculate_all(user_id=uid, start_date=s_date, end_date=e_date,
+                                                        mode=run_mode)
                 logger.info(f"Background task calculate_all completed for user {uid}, task_id={task_log_id}")
             except Exception as e:
                 logger.exception(f"Background task calculate_all failed for user {uid}: {str(e)}")
@@ -280,7 +315,7 @@ def async_calculate_all():
     # Start the background thread
     thread = threading.Thread(
         target=run_in_thread,
-        args=(app, user_id, start_date, end_date),
+        args=(app, user_id, start_date, end_date, mode),
         daemon=True
     )
     thread.start()
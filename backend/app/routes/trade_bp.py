@@ -16,7 +16,7 @@ from app.constant.biz_enums import ErrorMessageEnum
 from app.framework.auth import auth_required
 from app.framework.exceptions import BizException
 from app.framework.res import Res
-from app.models import db, Trade, Holding, UserHolding
+from app.models import Trade, Holding, UserHolding
 from app.schemas_marshall import TradeSchema, marshal_pagination
 from app.service.trade_service import TradeService
 from app.utils.user_util import get_or_raise
@@ -99,12 +99,8 @@ def update_tr():
     id = data.get('id')
     t = get_or_raise(Trade, id)
 
-    updated_trade = TradeSchema().load(data, instance=t, partial=True)
-
-    db.session.add(updated_trade)
-    db.session.flush()
-    TradeService.recalculate_holding_trades(updated_trade.ho_id, g.user.id)
-    db.session.commit()
+    update_data = TradeSchema(load_instance=False).load(data, partial=True)
+    TradeService.update_trade_record(t.id, update_data)
     return Res.success()
 
 
@@ -114,13 +110,7 @@ def del_tr():
     data = request.get_json()
     id = data.get('id')
     t = get_or_raise(Trade, id)
-    ho_id = t.ho_id
-
-    db.session.delete(t)
-    db.session.flush()
-    TradeService.recalculate_holding_trades(ho_id, g.user.id)
-
-    db.session.commit()
+    TradeService.delete_trade(t)
     return Res.success()
 
 
@@ -1,15 +1,22 @@
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from operator import attrgetter
 from typing import Optional, Dict, Tuple, List
 
 import akshare as ak
 import numpy as np
 import pandas as pd
 from loguru import logger
-from sqlalchemy import select, func, and_
+from sqlalchemy import Float, select, func, and_, update, bindparam, cast
 from sqlalchemy.exc import SQLAlchemyError
 
+from app.engine.array_cache import ArrayCache
+from app.engine.benchmark_metrics import BenchmarkSeries, benchmark_window_metrics
 from app.extension import db
-from app.models import Benchmark, BenchmarkHistory, InvestedAssetAnalyticsSnapshot, InvestedAssetSnapshot
+from app.models import AnalyticsWindow, Benchmark, BenchmarkHistory, InvestedAssetAnalyticsSnapshot, InvestedAssetSnapshot
+
+# 批量更新写入的基准指标列
+_BENCHMARK_METRIC_COLUMNS = ('benchmark_cumulative_return', 'excess_return', 'beta', 'alpha')
 
 
 class BenchmarkService:
@@ -20,6 +27,12 @@ class BenchmarkService:
 
     DEFAULT_BENCHMARK_CODE = '000300.SH'
     DEFAULT_BENCHMARK_NAME = 'CSI 300'
+    # 进程内缓存的基准序列个数
+    SERIES_CACHE_SIZE = 16
+
+    # 进程内缓存：bm_code -> BenchmarkSeries，以 (行数, 最后日期) 为版本；
+    # 其他进程 (如另一个 worker 中的定时同步) 写入新行后版本变化即重新加载，本进程同步时直接失效
+    _series_cache = ArrayCache(SERIES_CACHE_SIZE)
 
     @staticmethod
     def ensure_benchmark_exists(code: str = None, name: str = None) -> Benchmark:
@@ -112,6 +125,7 @@ class BenchmarkService:
             if new_records:
                 db.session.bulk_save_objects(new_records)
                 db.session.commit()
+                cls.invalidate_benchmark_series(bm_code)
                 logger.info(f"Successfully added {len(new_records)} records for {bm_code}")
 
         except Exception as e:
@@ -171,8 +185,34 @@ class BenchmarkService:
         logger.exception(f"All data sources failed for benchmark: {code}")
         return pd.DataFrame()
 
+    @classmethod
+    def get_benchmark_series(cls, bm_code: str = None) -> BenchmarkSeries:
+        """
+        基准的完整日收益序列 (进程内缓存，版本不变时不再加载整段历史)
+        """
+        target_code = bm_code or cls.DEFAULT_BENCHMARK_CODE
+        return cls._series_cache.get(
+            target_code,
+            lambda: cls._load_benchmark_series(target_code),
+            version=cls._series_version(target_code)
+        )
+
     @staticmethod
-    def get_benchmark_returns_map(start_date: date, end_date: date, bm_code: str = None) -> Dict[date, float]:
+    def _series_version(bm_code: str):
+        """基准历史的版本标识 (行数 + 最后日期)，只读聚合"""
+        return tuple(db.session.execute(
+            select(func.count(BenchmarkHistory.id), func.max(BenchmarkHistory.bmh_date))
+            .join(Benchmark, Benchmark.id == BenchmarkHistory.bm_id)
+            .where(Benchmark.bm_code == bm_code)
+        ).one())
+
+    @classmethod
+    def invalidate_benchmark_series(cls, bm_code: str = None):
+        """使某个基准 (为空时全部) 的缓存序列失效，下次读取时重新加载"""
+        cls._series_cache.invalidate(bm_code)
+
+    @classmethod
+    def get_benchmark_returns_map(cls, start_date: date, end_date: date, bm_code: str = None) -> Dict[date, float]:
         """
         获取指定时间段的基准收益率字典。
         用于 HoldingAnalyticsSnapshot 计算 Alpha/Beta。
@@ -180,44 +220,16 @@ class BenchmarkService:
         Returns:
             { date(2023-01-01): 0.012, date(2023-01-02): -0.005, ... }
         """
-        target_code = bm_code or BenchmarkService.DEFAULT_BENCHMARK_CODE
-
-        stmt = (
-            select(BenchmarkHistory.bmh_date, BenchmarkHistory.benchmark_return_daily)
-            .join(Benchmark, Benchmark.id == BenchmarkHistory.bm_id)
-            .where(
-                Benchmark.bm_code == target_code,
-                BenchmarkHistory.bmh_date >= start_date,
-                BenchmarkHistory.bmh_date <= end_date
-            )
-        )
-
-        results = db.session.execute(stmt).all()
-
-        # 转换为字典，方便快速查找
-        def safe_float(val):
-            try:
-                return float(val) if val is not None else 0.0
-            except ValueError:
-                return 0.0
+        days, returns = cls.get_benchmark_series(bm_code).slice(*cls._day_ordinals(start_date, end_date))
+        return dict(zip(days.astype('datetime64[D]').tolist(), returns.tolist()))
 
-        return {row[0]: safe_float(row[1]) for row in results}
-
-    @staticmethod
-    def get_benchmark_cumulative_return(start_date: date, end_date: date, bm_code: str = None) -> float:
+    @classmethod
+    def get_benchmark_cumulative_return(cls, start_date: date, end_date: date, bm_code: str = None) -> float:
         """
         计算区间内的基准累计收益率
-        逻辑：(1+r1)*(1+r2)*... - 1
+        逻辑：(1+r1)*(1+r2)*... - 1，由缓存序列的乘积前缀直接求出
         """
-        returns_map = BenchmarkService.get_benchmark_returns_map(start_date, end_date, bm_code)
-        if not returns_map:
-            return 0.0
-
-        cumulative = 1.0
-        for r in returns_map.values():
-            cumulative *= (1 + r)
-
-        return cumulative - 1
+        return cls.get_benchmark_series(bm_code).cumulative_return(*cls._day_ordinals(start_date, end_date))
 
     @classmethod
     def calculate_and_update_benchmark_metrics(
@@ -234,45 +246,41 @@ class BenchmarkService:
             snapshot_date: 快照日期
             window_key: 窗口键（如 'R21', 'R252', 'ALL' 等）
             bm_code: 基准代码，默认为 DEFAULT_BENCHMARK_CODE
-            user_id: 用户ID，为空时更新所有匹配的快照
+            user_id: 用户ID，为空时按用户分别计算所有匹配的快照 (委托给 batch_update_benchmark_metrics)
 
         Returns:
-            包含计算结果的字典
+            包含计算结果的字典；user_id 为空时为批量更新的统计信息
         """
+        if user_id is None:
+            return cls.batch_update_benchmark_metrics(snapshot_date, snapshot_date, [window_key], bm_code)
+
         try:
             # 1. 获取窗口的开始日期
-            start_date = cls._get_window_start_date(snapshot_date, window_key)
+            start_date = cls._get_window_start_date(snapshot_date, window_key, user_id)
             if not start_date:
                 logger.warning(f"Cannot determine start date for window {window_key} on {snapshot_date}")
                 return {}
 
-            # 2. 获取基准收益率数据
-            benchmark_returns = cls.get_benchmark_returns_map(start_date, snapshot_date, bm_code)
-            if not benchmark_returns:
-                logger.warning(f"No benchmark returns found for period {start_date} to {snapshot_date}")
-                return {}
-
-            # 3. 获取投资组合收益率数据
-            portfolio_returns = cls._get_portfolio_returns(start_date, snapshot_date)
-            if not portfolio_returns:
+            # 2. 基准与该用户组合的收益率序列 (日期序数 + 日收益)
+            benchmark = cls.get_benchmark_series(bm_code)
+            port_days, port_returns = cls._get_portfolio_returns(user_id, start_date, snapshot_date)
+            if not len(port_days):
                 logger.warning(f"No portfolio returns found for period {start_date} to {snapshot_date}")
                 return {}
 
-            # 4. 对齐日期（确保两个序列有相同的日期）
-            aligned_benchmark, aligned_portfolio = cls._align_returns_series(
-                benchmark_returns, portfolio_returns
-            )
-
-            if len(aligned_benchmark) < 2:  # 至少需要2个数据点计算Beta/Alpha
-                logger.warning(f"Insufficient data points for regression: {len(aligned_benchmark)}")
+            # 3. 对齐并计算 (与批量更新同一引擎)
+            bounds = np.array([start_date, snapshot_date], dtype='datetime64[D]').astype(np.int64)
+            result = benchmark_window_metrics(port_days, port_returns, benchmark.days, benchmark.returns,
+                                              bounds[:1], bounds[1:])
+            if result['count'][0] < 2:  # 至少需要2个数据点计算Beta/Alpha
+                logger.warning(f"Insufficient data points for regression: {result['count'][0]}")
                 return {}
+            metrics = {
+                key: float(result[key][0])
+                for key in _BENCHMARK_METRIC_COLUMNS + ('portfolio_cumulative_return',)
+            }
 
-            # 5. 计算各项指标
-            metrics = cls._calculate_benchmark_metrics(
-                aligned_benchmark, aligned_portfolio, start_date, snapshot_date
-            )
-
-            # 6. 更新数据库
+            # 4. 更新数据库
             cls._update_snapshot_metrics(snapshot_date, window_key, metrics, user_id=user_id)
 
             return metrics
@@ -282,17 +290,12 @@ class BenchmarkService:
             raise
 
     @staticmethod
-    def _get_window_start_date(snapshot_date: date, window_key: str) -> Optional[date]:
+    def _get_window_start_date(snapshot_date: date, window_key: str, user_id: int) -> Optional[date]:
         """
-        根据窗口键计算开始日期
-
-        注意：这里需要根据你的业务逻辑实现具体的窗口计算
-        假设你已经有了 AnalyticsWindow 表来定义窗口
+        根据窗口键计算开始日期：滚动窗口为快照日期前推 window_days 个自然日，
+        ALL 为该用户最早的投资快照日期，CUR 只含当天
         """
         try:
-            # 方法1：从 AnalyticsWindow 表查询
-            from app.models import AnalyticsWindow
-
             stmt = select(AnalyticsWindow).where(AnalyticsWindow.window_key == window_key)
             window = db.session.execute(stmt).scalar_one_or_none()
 
@@ -303,19 +306,17 @@ class BenchmarkService:
             if window.window_type == 'expanding':
                 # 扩展窗口：从有数据的第一天开始
                 if window_key == 'ALL':
-                    # 获取最早的投资快照日期
-                    stmt = select(func.min(InvestedAssetSnapshot.snapshot_date))
-                    earliest_date = db.session.execute(stmt).scalar()
-                    return earliest_date
+                    # 获取该用户最早的投资快照日期
+                    stmt = select(func.min(InvestedAssetSnapshot.snapshot_date)).where(
+                        InvestedAssetSnapshot.user_id == user_id
+                    )
+                    return db.session.execute(stmt).scalar()
                 elif window_key == 'CUR':
-                    # 当前周期：需要根据持仓周期计算
-                    # 这里需要根据你的业务逻辑实现
-                    return snapshot_date  # 临时返回，需要根据实际业务调整
+                    # 当前周期：组合层没有持仓周期，只含当天
+                    return snapshot_date
             elif window.window_type == 'rolling':
-                # 滚动窗口：根据天数计算
+                # 滚动窗口：根据天数计算 (自然日)
                 if window.window_days:
-                    # 计算交易日，这里简化处理，实际应该考虑交易日历
-                    from datetime import timedelta
                     return snapshot_date - timedelta(days=window.window_days)
 
             return None
@@ -325,49 +326,29 @@ class BenchmarkService:
             return None
 
     @staticmethod
-    def _get_portfolio_returns(start_date: date, end_date: date) -> Dict[date, float]:
+    def _get_portfolio_returns(user_id: int, start_date: date = None,
+                               end_date: date = None) -> Tuple[np.ndarray, np.ndarray]:
         """
-        获取投资组合的日收益率
+        获取单个用户投资组合的日收益率序列，按日期升序。
+        只读 (user_id, snapshot_date, ias_daily_pnl_ratio) 三列，由覆盖索引 idx_ias_user_date_return
+        完成 index-only scan；收益率在数据库端转为双精度，直接落为定型数组。
 
         Returns:
-            {date: daily_return, ...}
+            (日期序数 int64 数组, 日收益 float64 数组)
         """
-        try:
-            stmt = (
-                select(
-                    InvestedAssetSnapshot.snapshot_date,
-                    InvestedAssetSnapshot.ias_daily_pnl_ratio
-                )
-                .where(
-                    and_(
-                        InvestedAssetSnapshot.snapshot_date >= start_date,
-                        InvestedAssetSnapshot.snapshot_date <= end_date
-                    )
-                )
-                .order_by(InvestedAssetSnapshot.snapshot_date)
-            )
-
-            results = db.session.execute(stmt).all()
-
-            returns_map = {}
-            for row in results:
-                date_val = row.snapshot_date
-                return_val = row.ias_daily_pnl_ratio
-
-                # 确保返回值是浮点数
-                if return_val is not None:
-                    try:
-                        returns_map[date_val] = float(return_val)
-                    except (ValueError, TypeError):
-                        returns_map[date_val] = 0.0
-                else:
-                    returns_map[date_val] = 0.0
-
-            return returns_map
-
-        except Exception as e:
-            logger.exception(f"Error getting portfolio returns: {str(e)}")
-            return {}
+        stmt = select(
+            InvestedAssetSnapshot.snapshot_date,
+            cast(func.coalesce(InvestedAssetSnapshot.ias_daily_pnl_ratio, 0), Float(precision=53))
+        ).where(InvestedAssetSnapshot.user_id == user_id)
+        if start_date:
+            stmt = stmt.where(InvestedAssetSnapshot.snapshot_date >= start_date)
+        if end_date:
+            stmt = stmt.where(InvestedAssetSnapshot.snapshot_date <= end_date)
+
+        rows = db.session.execute(stmt.order_by(InvestedAssetSnapshot.snapshot_date)).all()
+        days = np.array([row[0] for row in rows], dtype='datetime64[D]').astype(np.int64)
+        returns = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+        return days, returns
 
     @staticmethod
     def _align_returns_series(
@@ -520,7 +501,8 @@ class BenchmarkService:
             user_id: int = None
     ) -> Dict[str, int]:
         """
-        批量更新基准指标
+        批量更新基准指标：基准序列只加载一次，每个用户的组合收益序列只加载一次，
+        所有 (日期, 窗口) 的指标由 benchmark_window_metrics 整列算出，最后一次批量 UPDATE 并提交。
 
         Args:
             start_date: 开始日期（可选）
@@ -530,73 +512,126 @@ class BenchmarkService:
             user_id: 用户ID（可选），为空时更新所有用户
 
         Returns:
-            更新统计信息
+            更新统计信息：total 目标快照行数、success 更新行数、skipped 数据不足跳过的行数、error 计算失败的行数
         """
         try:
-            # 1. 确定要更新的日期范围
-            if not start_date or not end_date:
-                # 获取所有需要更新的快照日期
-                stmt = select(
-                    InvestedAssetAnalyticsSnapshot.snapshot_date,
-                    InvestedAssetAnalyticsSnapshot.window_key
-                ).distinct()
-
-                if start_date:
-                    stmt = stmt.where(InvestedAssetAnalyticsSnapshot.snapshot_date >= start_date)
-                if end_date:
-                    stmt = stmt.where(InvestedAssetAnalyticsSnapshot.snapshot_date <= end_date)
-                if window_keys:
-                    stmt = stmt.where(InvestedAssetAnalyticsSnapshot.window_key.in_(window_keys))
-                if user_id is not None:
-                    stmt = stmt.where(InvestedAssetAnalyticsSnapshot.user_id == user_id)
-
-                results = db.session.execute(stmt).all()
-            else:
-                # 获取指定日期范围内的所有组合
-                stmt = select(
-                    InvestedAssetAnalyticsSnapshot.snapshot_date,
-                    InvestedAssetAnalyticsSnapshot.window_key
-                ).distinct().where(
-                    and_(
-                        InvestedAssetAnalyticsSnapshot.snapshot_date >= start_date,
-                        InvestedAssetAnalyticsSnapshot.snapshot_date <= end_date
-                    )
-                )
-
-                if window_keys:
-                    stmt = stmt.where(InvestedAssetAnalyticsSnapshot.window_key.in_(window_keys))
-                if user_id is not None:
-                    stmt = stmt.where(InvestedAssetAnalyticsSnapshot.user_id == user_id)
-
-                results = db.session.execute(stmt).all()
-
-            # 2. 批量计算和更新
-            success_count = 0
-            error_count = 0
-
-            for snapshot_date, window_key in results:
+            # 1. 需要更新的快照行 (按用户聚集)
+            stmt = select(
+                InvestedAssetAnalyticsSnapshot.id,
+                InvestedAssetAnalyticsSnapshot.user_id,
+                InvestedAssetAnalyticsSnapshot.snapshot_date,
+                InvestedAssetAnalyticsSnapshot.window_key
+            )
+            if start_date:
+                stmt = stmt.where(InvestedAssetAnalyticsSnapshot.snapshot_date >= start_date)
+            if end_date:
+                stmt = stmt.where(InvestedAssetAnalyticsSnapshot.snapshot_date <= end_date)
+            if window_keys:
+                stmt = stmt.where(InvestedAssetAnalyticsSnapshot.window_key.in_(window_keys))
+            if user_id is not None:
+                stmt = stmt.where(InvestedAssetAnalyticsSnapshot.user_id == user_id)
+            targets = db.session.execute(stmt.order_by(InvestedAssetAnalyticsSnapshot.user_id)).all()
+            if not targets:
+                return {'total': 0, 'success': 0, 'skipped': 0, 'error': 0}
+
+            # 2. 窗口配置与基准序列各加载一次
+            windows = {w.window_key: w for w in AnalyticsWindow.query.all()}
+            benchmark = cls.get_benchmark_series(bm_code)
+
+            # 3. 逐用户整列计算
+            updates, error_count = [], 0
+            for target_user_id, rows in groupby(targets, key=attrgetter('user_id')):
+                rows = list(rows)
                 try:
-                    cls.calculate_and_update_benchmark_metrics(
-                        snapshot_date, window_key, bm_code, user_id=user_id
-                    )
-                    success_count += 1
-
-                    # 每处理100条记录提交一次，避免事务过大
-                    if success_count % 100 == 0:
-                        logger.info(f"Processed {success_count} records...")
-
+                    updates.extend(cls._user_benchmark_updates(target_user_id, rows, windows,
+                                                                benchmark.days, benchmark.returns))
                 except Exception as e:
-                    error_count += 1
-                    logger.exception(f"Error processing {snapshot_date}, {window_key}: {str(e)}")
-
-            logger.info(f"Batch update completed: {success_count}成功, {error_count}失败")
+                    error_count += len(rows)
+                    logger.exception(f"Error computing benchmark metrics for user {target_user_id}: {str(e)}")
+
+            # 4. 一次批量更新
+            if updates:
+                table = InvestedAssetAnalyticsSnapshot.__table__
+                db.session.execute(
+                    update(table).where(table.c.id == bindparam('b_id')).values(
+                        {column: bindparam(f"b_{column}") for column in _BENCHMARK_METRIC_COLUMNS}
+                    ),
+                    updates
+                )
+            db.session.commit()
 
+            skipped = len(targets) - len(updates) - error_count
+            logger.info(f"Batch update completed: {len(updates)} updated, {skipped} skipped, {error_count} failed")
             return {
-                'total': success_count + error_count,
-                'success': success_count,
+                'total': len(targets),
+                'success': len(updates),
+                'skipped': skipped,
                 'error': error_count
             }
 
         except Exception as e:
+            db.session.rollback()
             logger.exception(f"Error in batch update: {str(e)}")
             raise
+
+    @classmethod
+    def _user_benchmark_updates(cls, user_id: int, rows: List, windows: Dict[str, AnalyticsWindow],
+                                bm_days: np.ndarray, bm_returns: np.ndarray) -> List[Dict]:
+        """
+        一个用户所有目标快照行的基准指标 (executemany 参数)，用户的组合收益序列只读取一次。
+        窗口起点口径同 _get_window_start_date：
+        滚动窗口为快照日期前推 window_days 个自然日，ALL 为该用户最早的快照日期，CUR 只含当天 (不具备回归条件)。
+        对齐后不足 2 天的行跳过。
+        """
+        port_days, port_returns = cls._get_portfolio_returns(user_id)
+        if not len(port_days):
+            return []
+
+        # 1. 每行的窗口起止日期序数，无法确定起点的行为 -1
+        end_days = np.array([row.snapshot_date for row in rows], dtype='datetime64[D]').astype(np.int64)
+        start_days = np.full(len(rows), -1, dtype=np.int64)
+        for i, row in enumerate(rows):
+            window = windows.get(row.window_key)
+            if window is None:
+                continue
+            if window.window_type == 'rolling' and window.window_days:
+                start_days[i] = end_days[i] - window.window_days
+            elif window.window_type == 'expanding':
+                if row.window_key == 'ALL':
+                    start_days[i] = port_days[0]
+                elif row.window_key == 'CUR':
+                    start_days[i] = end_days[i]
+        valid = np.flatnonzero(start_days >= 0)
+        if not len(valid):
+            return []
+
+        # 2. 整列计算
+        metrics = benchmark_window_metrics(port_days, port_returns, bm_days, bm_returns,
+                                           start_days[valid], end_days[valid])
+        eligible = np.flatnonzero(metrics['count'] >= 2)
+        columns = {column: metrics[column][eligible].tolist() for column in _BENCHMARK_METRIC_COLUMNS}
+        ids = [rows[i].id for i in valid[eligible].tolist()]
+        return [
+            {'b_id': row_id, **{f"b_{column}": columns[column][k] for column in _BENCHMARK_METRIC_COLUMNS}}
+            for k, row_id in enumerate(ids)
+        ]
+
+    @classmethod
+    def _load_benchmark_series(cls, bm_code: str = None) -> BenchmarkSeries:
+        """从数据库加载基准的日收益序列，按日期升序，同一日期只保留一行"""
+        target_code = bm_code or cls.DEFAULT_BENCHMARK_CODE
+        rows = db.session.execute(
+            select(BenchmarkHistory.bmh_date, BenchmarkHistory.benchmark_return_daily)
+            .join(Benchmark, Benchmark.id == BenchmarkHistory.bm_id)
+            .where(Benchmark.bm_code == target_code)
+            .order_by(BenchmarkHistory.bmh_date)
+        ).all()
+        days = np.array([row[0] for row in rows], dtype='datetime64[D]').astype(np.int64)
+        returns = np.array([float(row[1] or 0) for row in rows], dtype=np.float64)
+        days, first = np.unique(days, return_index=True)
+        return BenchmarkSeries(days, returns[first])
+
+    @staticmethod
+    def _day_ordinals(*dates: date) -> List[int]:
+        """date -> 日期序数 (与 BenchmarkSeries.days 同一口径)"""
+        return np.array(dates, dtype='datetime64[D]').astype(np.int64).tolist()
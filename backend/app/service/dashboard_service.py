@@ -5,14 +5,17 @@ from loguru import logger
 from sqlalchemy import desc, func
 
 from app.cache import cache
-from app.constant.biz_enums import AnalyticsWindowEnum
+from app.calendars.trade_calendar import trade_calendar
+from app.constant.biz_enums import AnalyticsMaterializeEnum, AnalyticsWindowEnum
 from app.extension import db
 from app.mapper.dashboard_mapper import DashboardMapper
 from app.models import (
     InvestedAssetSnapshot, InvestedAssetAnalyticsSnapshot,
-    AlertHistory, HoldingAnalyticsSnapshot
+    AlertHistory, HoldingAnalyticsSnapshot, AnalyticsWindow, HoldingSnapshot
 )
 from app.schemas_marshall import AlertHistorySchema
+from app.service.holding_analytics_snapshot_service import HoldingAnalyticsSnapshotService
+from app.service.invested_asset_analytics_snapshot_service import InvestedAssetAnalyticsSnapshotService
 from app.utils.date_util import date_to_str
 
 
@@ -55,14 +58,20 @@ class DashboardService:
         latest_date_query = db.session.query(func.max(InvestedAssetAnalyticsSnapshot.snapshot_date))
         latest_date = latest_date_query.scalar()
 
-        if not latest_date:
+        on_read_window = cls._on_read_window(window_key)
+        if on_read_window:
+            # ON_READ 窗口不落库，即时计算
+            analytics = InvestedAssetAnalyticsSnapshotService.compute_on_read(user_id, on_read_window, end_date.date())
+            if analytics and analytics.snapshot_date < start_date.date():
+                analytics = None
+        elif not latest_date:
             return {}
-
-        analytics = InvestedAssetAnalyticsSnapshot.query.filter(
-            InvestedAssetAnalyticsSnapshot.user_id == user_id,
-            InvestedAssetAnalyticsSnapshot.snapshot_date.between(start_date, end_date),
-            InvestedAssetAnalyticsSnapshot.window_key == window_key
-        ).order_by(InvestedAssetAnalyticsSnapshot.snapshot_date.desc()).first()
+        else:
+            analytics = InvestedAssetAnalyticsSnapshot.query.filter(
+                InvestedAssetAnalyticsSnapshot.user_id == user_id,
+                InvestedAssetAnalyticsSnapshot.snapshot_date.between(start_date, end_date),
+                InvestedAssetAnalyticsSnapshot.window_key == window_key
+            ).order_by(InvestedAssetAnalyticsSnapshot.snapshot_date.desc()).first()
 
         if not analytics:
             return {}
@@ -112,6 +121,10 @@ class DashboardService:
         """
         获取最新持仓分布
         """
+        on_read_window = cls._on_read_window(window_key)
+        if on_read_window:
+            return cls._holdings_allocation_on_read(user_id, on_read_window)
+
         # 1. 找到用户的最新的快照日期
         latest_date = db.session.query(
             func.max(HoldingAnalyticsSnapshot.snapshot_date)
@@ -141,6 +154,45 @@ class DashboardService:
 
         return holding_ana_snaps
 
+    @classmethod
+    def _holdings_allocation_on_read(cls, user_id: int, window: AnalyticsWindow) -> List[Dict]:
+        """ON_READ 窗口的持仓分布：区间盈亏即时计算，仓位占比 / 组合贡献直接由快照关联得出"""
+        # 1. 用户最新的持仓快照日期
+        latest_date = db.session.query(func.max(HoldingSnapshot.snapshot_date)).filter(
+            HoldingSnapshot.user_id == user_id
+        ).scalar()
+        if not latest_date:
+            return []
+
+        # 2. 各持仓窗口内的累计盈亏 (即时计算)
+        batch = HoldingAnalyticsSnapshotService.compute_on_read(user_id, window, latest_date)
+        pnl_by_holding = dict(zip(batch.column('ho_id').tolist(), batch.column('has_cumulative_pnl').tolist())) \
+            if len(batch) else {}
+
+        # 3. 仓位占比 / 组合贡献
+        prev_date = trade_calendar.prev_trade_day(latest_date)
+        rows = DashboardMapper.get_holdings_position(
+            user_id, date_to_str(latest_date), date_to_str(prev_date) if prev_date else None
+        )
+
+        # 4. 组合同期盈亏 -> 盈亏占比
+        iaas = InvestedAssetAnalyticsSnapshotService.compute_on_read(user_id, window, latest_date)
+        total_pnl = float(iaas.period_pnl) if iaas and iaas.period_pnl else 0
+        for item in rows:
+            pnl = pnl_by_holding.get(item.pop('ho_id'))
+            item['window_key'] = window.window_key
+            item['has_cumulative_pnl'] = pnl
+            item['pnl_contribution_ratio'] = pnl / total_pnl if pnl is not None and total_pnl != 0 else 0
+        return rows
+
+    @staticmethod
+    def _on_read_window(window_key: str):
+        """window_key 对应的窗口为 ON_READ 策略时返回该窗口，否则为 None"""
+        window = AnalyticsWindow.query.filter_by(window_key=window_key).first()
+        if window and window.materialize_policy == AnalyticsMaterializeEnum.ON_READ:
+            return window
+        return None
+
     @classmethod
     def get_recent_alert_signals(cls, user_id: int, limit: int = 5) -> List[Dict]:
         """
@@ -181,11 +233,17 @@ class DashboardService:
 
         # 2. 获取 'ALL' 窗口的分析数据 (用于成立以来的 TWRR 和 IRR)
         # 注意：必须匹配最新快照的日期，确保数据同步
-        analytics_all = InvestedAssetAnalyticsSnapshot.query.filter_by(
-            user_id=user_id,
-            snapshot_date=latest_snapshot.snapshot_date,
-            window_key=AnalyticsWindowEnum.ALL.value
-        ).first()
+        on_read_window = cls._on_read_window(AnalyticsWindowEnum.ALL.value)
+        if on_read_window:
+            analytics_all = InvestedAssetAnalyticsSnapshotService.compute_on_read(
+                user_id, on_read_window, latest_snapshot.snapshot_date
+            )
+        else:
+            analytics_all = InvestedAssetAnalyticsSnapshot.query.filter_by(
+                user_id=user_id,
+                snapshot_date=latest_snapshot.snapshot_date,
+                window_key=AnalyticsWindowEnum.ALL.value
+            ).first()
 
         return {
             'total_mv': float(latest_snapshot.ias_market_value),
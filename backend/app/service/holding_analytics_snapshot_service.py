@@ -1,31 +1,59 @@
 # app/service/holding_analytics_snapshot_service.py
 import time
-from collections import defaultdict
-from datetime import date, timedelta
-from decimal import Decimal
-from typing import List, Dict, Optional
+from datetime import date
+from typing import List, Dict, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 from flask import g
 from loguru import logger
-from scipy import optimize
-from sqlalchemy import or_
+from sqlalchemy import Float, cast, func, or_
 
 from app.calendars.trade_calendar import trade_calendar
+from app.constant.biz_enums import AnalyticsMaterializeEnum
+from app.engine.analytics_state import ExpandingState
+from app.engine.array_cache import ArrayCache
+from app.engine.drawdown import drawdown_stats
+from app.engine.rolling_metrics import RollingMetricsEngine, expanding_starts, rolling_starts, segment_starts
+from app.engine.xirr import xirr_windows
 from app.extension import db
 from app.framework.async_task_manager import create_task
+from app.mapper.bulk_upsert_mapper import BulkUpsertMapper, RecordBatch, UpsertResult
+from app.mapper.holding_analytics_mapper import HoldingAnalyticsMapper
 from app.models import (
-    Holding, HoldingSnapshot, AnalyticsWindow, HoldingAnalyticsSnapshot, InvestedAssetSnapshot, UserSetting, UserHolding
+    Holding, HoldingSnapshot, AnalyticsWindow, HoldingAnalyticsSnapshot, HoldingAnalyticsState, UserSetting,
+    UserHolding
 )
+from app.utils.date_util import str_to_date
 
-ZERO = Decimal('0')
 
 # 配置化常量
 TRADING_DAYS_PER_YEAR = 252
 MIN_ANNUALIZATION_DAYS = 30
 EPSILON = 1e-6
 DEFAULT_RISK_FREE_RATE = 0.02
+# ON_READ 窗口读取缓存的用户数上限
+ON_READ_CACHE_SIZE = 64
+
+# 窗口在当前配置下不产出数据
+_NO_WINDOW = object()
+
+# 原始指标中的日期列 (其余为数值列)
+_RAW_DATE_KEYS = ('mdd_start', 'mdd_end', 'recovery_date')
+
+# 分析所需的数值列 (DataFrame 列名, 快照字段)，加载时在数据库端转为双精度
+_FLOAT_COLUMNS = [
+    ('daily_pnl_ratio', HoldingSnapshot.hos_daily_pnl_ratio),
+    ('daily_pnl', HoldingSnapshot.hos_daily_pnl),
+    ('shares', HoldingSnapshot.holding_shares),
+    ('daily_cash_dividend', HoldingSnapshot.hos_daily_cash_dividend),
+    ('daily_reinvest_dividend', HoldingSnapshot.hos_daily_reinvest_dividend),
+    ('net_external_cash_flow', HoldingSnapshot.hos_net_external_cash_flow),
+    ('mv', HoldingSnapshot.hos_market_value),
+]
+
+# (user_id, 持仓ID元组) -> {ho_id: 基础快照 DataFrame}，ON_READ 窗口读取时使用
+_frames_cache = ArrayCache(ON_READ_CACHE_SIZE)
 
 
 class HoldingAnalyticsSnapshotService:
@@ -37,7 +65,7 @@ class HoldingAnalyticsSnapshotService:
             start_date: date,
             end_date: date,
             ho_ids: Optional[List[int]] = None
-    ) -> Optional[List[HoldingAnalyticsSnapshot]]:
+    ) -> RecordBatch:
         """
         统一的分析快照生成入口。
 
@@ -45,33 +73,24 @@ class HoldingAnalyticsSnapshotService:
         :param start_date: 目标开始日期 (包含)
         :param end_date: 目标结束日期 (包含)
         :param ho_ids: 指定的持仓ID列表，为空则处理该用户所有持仓
-        :return: 生成的快照列表
+        :return: 列式快照批，可直接交给 BulkUpsertMapper.upsert
         """
         logger.info(f"Starting analytics generation: {start_date} to {end_date} for user {user_id}")
         start_time = time.time()
 
-        # 1. 获取分析窗口配置 (全局共享)
-        windows = AnalyticsWindow.query.all()
-        if not windows:
-            logger.warning("No AnalyticsWindow defined. Aborting.")
-            return []
-
-        # 2. 获取用户的 risk_free_rate
-        user = UserSetting.query.get(user_id)
-        risk_free_rate = float(user.risk_free_rate) if user and user.risk_free_rate else DEFAULT_RISK_FREE_RATE
-
-        # 3. 获取目标持仓 (通过 UserHolding 关联表)
-        query = Holding.query.join(UserHolding, UserHolding.ho_id == Holding.id).filter(UserHolding.user_id == user_id)
-        if ho_ids:
-            query = query.filter(Holding.id.in_(ho_ids))
-        holdings = query.all()
+        # 1-3. 分析窗口、risk_free_rate、目标持仓 (ON_READ 窗口读取时计算，不落库)
+        windows, risk_free_rate, holdings = cls._load_context(user_id, ho_ids)
+        windows = cls._materialized(windows)
+        if not windows or not holdings:
+            return RecordBatch(0, {})
 
-        if not holdings:
-            return []
+        batches = []
 
-        all_snapshots = []
+        # 4. 一次查询加载所有目标持仓的基础快照
+        # 需要加载 end_date 之前的所有数据，因为计算窗口需要历史数据
+        frames = cls._load_holdings_data(user_id, [h.id for h in holdings], end_date)
 
-        # 4. 逐个持仓处理
+        # 5. 逐个持仓处理
         for holding in holdings:
             try:
                 # 生成该持仓在指定时间段的快照对象
@@ -81,9 +100,10 @@ class HoldingAnalyticsSnapshotService:
                     windows=windows,
                     target_start=start_date,
                     target_end=end_date,
-                    risk_free_rate=risk_free_rate
+                    risk_free_rate=risk_free_rate,
+                    df=frames.get(holding.id)
                 )
-                all_snapshots.extend(snapshots)
+                batches.append(snapshots)
 
             except Exception as e:
                 err_msg = f"Error processing holding {holding.ho_code}: {str(e)}"
@@ -94,7 +114,8 @@ class HoldingAnalyticsSnapshotService:
                     user_id=user_id,
                     task_name=f"Fix Analytics: {holding.ho_code}",
                     module_path="app.service.holding_analytics_snapshot_service",
-                    method_name="generate_analytics",
+                    class_name="HoldingAnalyticsSnapshotService",
+                    method_name="regenerate_analytics",
                     kwargs={
                         "user_id": user_id,
                         "start_date": str(start_date),
@@ -104,13 +125,396 @@ class HoldingAnalyticsSnapshotService:
                     error_message=err_msg
                 )
 
+        all_snapshots = RecordBatch.concat(batches)
         logger.info(f"Generated {len(all_snapshots)} analytics snapshots in {round(time.time() - start_time, 2)}s")
         return all_snapshots
 
+    @classmethod
+    def generate_daily_analytics(cls, user_id: int, target_date: date) -> RecordBatch:
+        """
+        单日增量分析快照：基于 HoldingAnalyticsState 累加状态只追加 target_date 一天。
+        扩张窗口 (ALL / CUR) 把当天 push 进状态 (O(1))；滚动窗口只加载最近 window_days 行 (O(window))；
+        XIRR 以上一次的解为初值，扩张窗口只加载有现金流的行。
+        状态缺失或与前一快照日期不衔接的持仓，回退为全量历史计算并重新播种状态。
+        状态写入当前事务，由调用方提交。
+
+        :return: 列式快照批，可直接交给 BulkUpsertMapper.upsert
+        """
+        logger.info(f"Starting daily analytics for {target_date}, user {user_id}")
+        start_time = time.time()
+
+        windows, risk_free_rate, holdings = cls._load_context(user_id)
+        windows = cls._materialized(windows)
+        if not windows or not holdings:
+            return RecordBatch(0, {})
+        ho_ids = [h.id for h in holdings]
+
+        # 1. 累加状态、最近 N 行快照、扩张窗口的现金流行，各一次查询
+        states = {
+            (row.ho_id, row.window_key): row
+            for row in HoldingAnalyticsState.query.filter(
+                HoldingAnalyticsState.user_id == user_id,
+                HoldingAnalyticsState.ho_id.in_(ho_ids)
+            ).all()
+        }
+        tail_rows = max([w.window_days for w in windows if w.window_type == 'rolling' and w.window_days] + [2])
+        tails = cls._load_holdings_data(user_id, ho_ids, target_date, tail=tail_rows)
+        flow_frames = cls._load_holdings_data(user_id, ho_ids, target_date, flows_only=True)
+
+        # 2. 逐持仓追加；状态不可用的持仓走全量回退
+        batches, records, fallback = [], [], []
+        for holding in holdings:
+            df_tail = tails.get(holding.id)
+            if df_tail is None or df_tail.index[-1].date() != target_date:
+                continue
+            advanced = cls._advance_holding(
+                holding, user_id, windows, df_tail, flow_frames.get(holding.id), states, risk_free_rate
+            )
+            if advanced is None:
+                fallback.append(holding)
+                continue
+            batch, holding_states = advanced
+            batches.append(batch)
+            records.extend(holding_states)
+
+        if fallback:
+            logger.info(f"Seeding analytics state for {len(fallback)} holdings from full history")
+            frames = cls._load_holdings_data(user_id, [h.id for h in fallback], target_date)
+            for holding in fallback:
+                df = frames.get(holding.id)
+                batch = cls._process_single_holding(
+                    holding=holding,
+                    user_id=user_id,
+                    windows=windows,
+                    target_start=target_date,
+                    target_end=target_date,
+                    risk_free_rate=risk_free_rate,
+                    df=df
+                )
+                batches.append(batch)
+                records.extend(cls._seed_states(holding.id, user_id, windows, df, batch))
+
+        # 3. 状态写回
+        if records:
+            BulkUpsertMapper.upsert(HoldingAnalyticsState, records)
+
+        result = RecordBatch.concat(batches)
+        logger.info(f"Generated {len(result)} daily analytics snapshots "
+                    f"({len(fallback)} seeded) in {round(time.time() - start_time, 2)}s")
+        return result
+
+    @classmethod
+    def save_analytics(
+            cls,
+            user_id: int,
+            snapshots: RecordBatch,
+            prune_scope: list,
+            ho_ids: Optional[List[int]] = None,
+            invalidate_from: Optional[date] = None
+    ) -> Optional[UpsertResult]:
+        """
+        分析快照写库，不提交事务 (由调用方 commit)。
+        与 upsert 同一事务内：历史区间重算时使覆盖到的累加状态失效，并清理 LATEST / ON_READ 窗口的旧行。
+
+        :param snapshots: generate_analytics / generate_daily_analytics 的结果
+        :param prune_scope: 传给 BulkUpsertMapper.upsert 的清理范围
+        :param ho_ids: 本次计算的持仓ID列表，为空则为该用户所有持仓
+        :param invalidate_from: 历史区间重算的开始日期，覆盖到该日期及之后的累加状态失效，下次日增量时重新播种
+        :return: upsert 结果，本批为空时为 None
+        """
+        if invalidate_from:
+            cls._invalidate_states(user_id, ho_ids, invalidate_from)
+
+        result = None
+        if snapshots:
+            result = BulkUpsertMapper.upsert(HoldingAnalyticsSnapshot, snapshots, prune_scope=prune_scope)
+        cls._prune_lazy_windows(user_id, AnalyticsWindow.query.all(), ho_ids, snapshots)
+        return result
+
+    @classmethod
+    def regenerate_analytics(cls, user_id: int, start_date, end_date, ho_ids: Optional[List[int]] = None) -> Dict:
+        """
+        重新生成并保存指定区间的分析快照 (异步任务重试入口，日期可为 YYYY-MM-DD 字符串)。
+        """
+        start_date = str_to_date(start_date) if isinstance(start_date, str) else start_date
+        end_date = str_to_date(end_date) if isinstance(end_date, str) else end_date
+
+        snapshots = cls.generate_analytics(user_id, start_date, end_date, ho_ids)
+        prune_scope = [
+            HoldingAnalyticsSnapshot.user_id == user_id,
+            HoldingAnalyticsSnapshot.snapshot_date >= start_date,
+            HoldingAnalyticsSnapshot.snapshot_date <= end_date
+        ]
+        if ho_ids:
+            prune_scope.append(HoldingAnalyticsSnapshot.ho_id.in_(ho_ids))
+        result = cls.save_analytics(user_id, snapshots, prune_scope, ho_ids=ho_ids, invalidate_from=start_date)
+        db.session.commit()
+        return {"generated": len(snapshots), "upsert": result.to_dict() if result else None}
+
+    @classmethod
+    def compute_on_read(cls, user_id: int, window: AnalyticsWindow, as_of: date) -> RecordBatch:
+        """
+        ON_READ 窗口的读取：用户所有持仓在 as_of 当日的指标即时计算，不落库。
+        基础快照按用户缓存在进程内 LRU 中，以 (行数, 最后日期, 最后更新时间) 作为版本，快照重算后自动失效。
+
+        :return: 列式快照批 (字段同 HoldingAnalyticsSnapshot，不含仓位占比 / 组合贡献)
+        """
+        _, risk_free_rate, holdings = cls._load_context(user_id)
+        if not holdings:
+            return RecordBatch(0, {})
+        ho_ids = [h.id for h in holdings]
+
+        version = tuple(db.session.query(
+            func.count(HoldingSnapshot.id),
+            func.max(HoldingSnapshot.snapshot_date),
+            func.max(HoldingSnapshot.updated_at)
+        ).filter(HoldingSnapshot.user_id == user_id).one())
+        frames = _frames_cache.get(
+            (user_id, tuple(ho_ids)),
+            lambda: cls._load_holdings_data(user_id, ho_ids, date.max),
+            version=version
+        )
+
+        return RecordBatch.concat([
+            cls._process_single_holding(
+                holding=holding,
+                user_id=user_id,
+                windows=[window],
+                target_start=as_of,
+                target_end=as_of,
+                risk_free_rate=risk_free_rate,
+                df=frames[holding.id]
+            ) for holding in holdings if holding.id in frames
+        ])
+
     # ---------------------------------------------------------
     # Internal Logic Methods
     # ---------------------------------------------------------
 
+    @staticmethod
+    def _materialized(windows: List[AnalyticsWindow]) -> List[AnalyticsWindow]:
+        """需要落库的窗口 (ALL_DATES / LATEST)"""
+        return [w for w in windows if w.materialize_policy != AnalyticsMaterializeEnum.ON_READ]
+
+    @staticmethod
+    def _prune_lazy_windows(
+            user_id: int,
+            windows: List[AnalyticsWindow],
+            ho_ids: Optional[List[int]],
+            batch: RecordBatch
+    ):
+        """
+        LATEST 窗口每个持仓只保留本批中的最新一行，ON_READ 窗口的历史行全部删除 (策略调整后的遗留数据)。
+        ho_ids 为空时清理该用户所有持仓。
+        """
+        latest_keys = [w.window_key for w in windows if w.materialize_policy == AnalyticsMaterializeEnum.LATEST]
+        on_read_keys = [w.window_key for w in windows if w.materialize_policy == AnalyticsMaterializeEnum.ON_READ]
+        scope = [HoldingAnalyticsSnapshot.user_id == user_id]
+        if ho_ids:
+            scope.append(HoldingAnalyticsSnapshot.ho_id.in_(ho_ids))
+
+        if on_read_keys:
+            HoldingAnalyticsSnapshot.query.filter(
+                *scope, HoldingAnalyticsSnapshot.window_key.in_(on_read_keys)
+            ).delete(synchronize_session=False)
+
+        if not latest_keys or not batch:
+            return
+        # 持仓 -> 本批最新日期，同一日期的持仓合并为一条 DELETE
+        latest = np.isin(batch.column('window_key'), latest_keys)
+        latest_dates = {}
+        for ho_id, day in zip(batch.column('ho_id')[latest].tolist(), batch.column('snapshot_date')[latest].tolist()):
+            latest_dates[ho_id] = max(day, latest_dates.get(ho_id, day))
+        ho_ids_by_date = {}
+        for ho_id, day in latest_dates.items():
+            ho_ids_by_date.setdefault(day, []).append(ho_id)
+        for day, day_ho_ids in ho_ids_by_date.items():
+            HoldingAnalyticsSnapshot.query.filter(
+                HoldingAnalyticsSnapshot.user_id == user_id,
+                HoldingAnalyticsSnapshot.ho_id.in_(day_ho_ids),
+                HoldingAnalyticsSnapshot.window_key.in_(latest_keys),
+                HoldingAnalyticsSnapshot.snapshot_date < day
+            ).delete(synchronize_session=False)
+
+    @classmethod
+    def _load_context(cls, user_id: int, ho_ids: Optional[List[int]] = None
+                      ) -> Tuple[List[AnalyticsWindow], float, List[Holding]]:
+        """分析窗口配置 (全局共享)、用户的 risk_free_rate、目标持仓 (通过 UserHolding 关联表)"""
+        windows = AnalyticsWindow.query.all()
+        if not windows:
+            logger.warning("No AnalyticsWindow defined. Aborting.")
+            return [], DEFAULT_RISK_FREE_RATE, []
+
+        user = UserSetting.query.get(user_id)
+        risk_free_rate = float(user.risk_free_rate) if user and user.risk_free_rate else DEFAULT_RISK_FREE_RATE
+
+        query = Holding.query.join(UserHolding, UserHolding.ho_id == Holding.id).filter(UserHolding.user_id == user_id)
+        if ho_ids:
+            query = query.filter(Holding.id.in_(ho_ids))
+        return windows, risk_free_rate, query.all()
+
+    @staticmethod
+    def _invalidate_states(user_id: int, ho_ids: Optional[List[int]], start_date: date):
+        scope = [HoldingAnalyticsState.user_id == user_id, HoldingAnalyticsState.last_date >= start_date]
+        if ho_ids:
+            scope.append(HoldingAnalyticsState.ho_id.in_(ho_ids))
+        HoldingAnalyticsState.query.filter(*scope).delete(synchronize_session=False)
+
+    @classmethod
+    def _advance_holding(
+            cls,
+            holding: Holding,
+            user_id: int,
+            windows: List[AnalyticsWindow],
+            df_tail: pd.DataFrame,
+            flow_df: Optional[pd.DataFrame],
+            states: Dict[Tuple[int, str], HoldingAnalyticsState],
+            risk_free_rate: float
+    ) -> Optional[Tuple[RecordBatch, List[Dict]]]:
+        """
+        用累加状态追加 df_tail 的最后一行 (目标日期)。
+        :return: (单日快照批, 新状态记录)；任一扩张窗口的状态不可用时返回 None
+        """
+        target = df_tail.index[-1]
+        today = df_tail.iloc[-1]
+        prev_date = df_tail.index[-2].date() if len(df_tail) > 1 else None
+        last = len(df_tail) - 1
+
+        # 1. 扩张窗口：校验状态衔接后 push 当天
+        expanding = {}
+        for window in windows:
+            if window.window_type != 'expanding':
+                continue
+            row = states.get((holding.id, window.window_key))
+            if row is None:
+                if prev_date is not None:
+                    return None
+                state = ExpandingState()
+            elif row.last_date != prev_date:
+                return None
+            else:
+                state = ExpandingState.from_row(row)
+            if window.window_key == 'CUR':
+                cycle = int(today['cycle'])
+                if state.cycle is not None and cycle != state.cycle:
+                    # 新的持仓周期从当天开始；周期号回退时与全量切片口径不同，走回退
+                    if cycle < state.cycle:
+                        return None
+                    state = ExpandingState()
+                state.cycle = cycle
+            state.push(target.date(), today['daily_pnl_ratio'], today['daily_pnl'],
+                       today['daily_cash_dividend'], today['daily_reinvest_dividend'])
+            expanding[window.window_key] = state
+
+        # 2. 逐窗口计算当天的原始指标
+        engine = None
+        target_rows = np.array([last])
+        batches, records = [], []
+        for window in windows:
+            row = states.get((holding.id, window.window_key))
+            guess = np.array([np.nan if row is None or row.last_irr is None else row.last_irr])
+            if window.window_key in expanding:
+                state = expanding[window.window_key]
+                irr = cls._state_xirr(df_tail, flow_df, state, guess)
+                raw = {key: np.array([value], dtype=object if key in _RAW_DATE_KEYS else None)
+                       for key, value in state.metrics(window.annualization_factor, MIN_ANNUALIZATION_DAYS).items()}
+                raw['irr_ann'] = np.array([irr])
+                raw['irr_days'] = np.array([(target.date() - state.window_start_date).days])
+                state.last_irr = None if np.isnan(irr) else float(irr)
+                records.append(dict(user_id=user_id, ho_id=holding.id, window_key=window.window_key,
+                                    **state.to_dict()))
+            else:
+                starts = cls._window_starts(df_tail, window, target_rows)
+                if starts is _NO_WINDOW or starts is None:
+                    continue
+                if engine is None:
+                    engine = RollingMetricsEngine(
+                        returns=df_tail['daily_pnl_ratio'].to_numpy(),
+                        pnl=df_tail['daily_pnl'].to_numpy(),
+                        cash_dividend=df_tail['daily_cash_dividend'].to_numpy(),
+                        reinvest_dividend=df_tail['daily_reinvest_dividend'].to_numpy()
+                    )
+                raw = cls._window_metrics_single_pass(df_tail, engine, window, starts, target_rows, guess)
+                irr = raw['irr_ann'][0]
+                records.append(dict(
+                    user_id=user_id, ho_id=holding.id, window_key=window.window_key,
+                    last_date=target.date(), window_start_date=df_tail.index[starts[0]].date(),
+                    row_count=int(raw['count'][0]), last_irr=None if np.isnan(irr) else float(irr)
+                ))
+            columns = cls._format_columns(raw, risk_free_rate)
+            columns['snapshot_date'] = np.array([target.date()], dtype=object)
+            columns['window_key'] = window.window_key
+            batches.append(RecordBatch(1, columns))
+
+        result = RecordBatch.concat(batches)
+        result.columns['user_id'] = user_id
+        result.columns['ho_id'] = holding.id
+        return result, records
+
+    @classmethod
+    def _state_xirr(cls, df_tail: pd.DataFrame, flow_df: Optional[pd.DataFrame], state: ExpandingState,
+                    guess: np.ndarray) -> float:
+        """扩张窗口的 XIRR：窗口内有现金流的行 + 当天 (期末市值)，与全量批量求解同口径"""
+        target = df_tail.index[-1]
+        cash_flows = df_tail.iloc[[-1]]
+        if flow_df is not None and not flow_df.empty:
+            dates = flow_df.index.date
+            in_window = flow_df[(dates >= state.window_start_date) & (dates < target.date())]
+            cash_flows = pd.concat([in_window, cash_flows])
+        irr = cls._batch_xirr(
+            cash_flows, np.array([0]), np.array([len(cash_flows) - 1]), np.array([state.row_count]), guess
+        )
+        return float(irr[0])
+
+    @classmethod
+    def _seed_states(cls, ho_id: int, user_id: int, windows: List[AnalyticsWindow],
+                     df: Optional[pd.DataFrame], batch: RecordBatch) -> List[Dict]:
+        """由全量历史逐行累加出各窗口的状态，XIRR 初值取本次全量计算的结果"""
+        if df is None or df.empty or not len(batch):
+            return []
+        last = len(df) - 1
+        target = df.index[-1].date()
+        window_keys = batch.column('window_key')
+        irr_by_window = {
+            key: irr for key, irr, day in zip(
+                window_keys.tolist(), batch.column('irr_annualized').tolist(), batch.column('snapshot_date').tolist()
+            ) if day == target
+        }
+
+        records = []
+        for window in windows:
+            if window.window_key not in irr_by_window:
+                continue
+            irr = irr_by_window[window.window_key]
+            last_irr = None if irr is None or np.isnan(irr) else float(irr)
+            base = dict(user_id=user_id, ho_id=ho_id, window_key=window.window_key)
+
+            if window.window_type == 'expanding':
+                start = 0
+                state = ExpandingState()
+                if window.window_key == 'CUR':
+                    starts = segment_starts(df['cycle'].to_numpy(), np.array([last]))
+                    if starts is None:
+                        continue
+                    start = int(starts[0])
+                    state.cycle = int(df['cycle'].iloc[last])
+                window_df = df.iloc[start:]
+                for day, ret, pnl, cash, reinvest in zip(
+                        window_df.index.date, window_df['daily_pnl_ratio'].tolist(), window_df['daily_pnl'].tolist(),
+                        window_df['daily_cash_dividend'].tolist(), window_df['daily_reinvest_dividend'].tolist()):
+                    state.push(day, ret, pnl, cash, reinvest)
+                state.last_irr = last_irr
+                records.append(dict(base, **state.to_dict()))
+            else:
+                starts = cls._window_starts(df, window, np.array([last]))
+                if starts is _NO_WINDOW or starts is None:
+                    continue
+                records.append(dict(
+                    base, last_date=target, window_start_date=df.index[starts[0]].date(),
+                    row_count=last - int(starts[0]) + 1, last_irr=last_irr
+                ))
+        return records
+
     @classmethod
     def _process_single_holding(
             cls,
@@ -119,125 +523,239 @@ class HoldingAnalyticsSnapshotService:
             windows: List[AnalyticsWindow],
             target_start: date,
             target_end: date,
-            risk_free_rate: float = DEFAULT_RISK_FREE_RATE
-    ) -> List[HoldingAnalyticsSnapshot]:
+            risk_free_rate: float = DEFAULT_RISK_FREE_RATE,
+            df: Optional[pd.DataFrame] = None
+    ) -> RecordBatch:
         """
-        处理单个持仓：加载数据 -> 遍历日期 -> 计算指标 -> 生成对象
-        """
-        # 1. 加载该持仓的基础快照数据 (DataFrame)
-        # 需要加载 target_end 之前的所有数据，因为计算窗口需要历史数据
-        df = cls._load_holding_data(ho_id=holding.id, up_to_date=target_end)
-        if df.empty:
-            return []
+        处理单个持仓：加载数据 -> 单遍计算所有窗口、所有日期的指标 -> 列式快照批
+        LATEST 窗口只计算最后一个目标日期。
 
-        # 2. 筛选出需要生成快照的目标日期范围
-        mask = (df.index.date >= target_start) & (df.index.date <= target_end)
-        target_dates = df.loc[mask].index
+        :param df: 已批量加载的基础快照，为空时单独加载该持仓
+        """
+        # 1. 该持仓截至 target_end 的基础快照数据 (DataFrame)
+        if df is None:
+            df = cls._load_holdings_data(user_id, [holding.id], target_end).get(holding.id)
+        if df is None or df.empty:
+            return RecordBatch(0, {})
+
+        # 2. 筛选出需要生成快照的目标日期范围 (行号)
+        dates = df.index.date
+        target_rows = np.flatnonzero((dates >= target_start) & (dates <= target_end))
+        if not len(target_rows):
+            return RecordBatch(0, {})
+
+        # 3. 前缀数组只构建一次，所有窗口共用
+        engine = RollingMetricsEngine(
+            returns=df['daily_pnl_ratio'].to_numpy(),
+            pnl=df['daily_pnl'].to_numpy(),
+            cash_dividend=df['daily_cash_dividend'].to_numpy(),
+            reinvest_dividend=df['daily_reinvest_dividend'].to_numpy()
+        )
 
-        if target_dates.empty:
-            return []
+        # 4. 逐窗口计算原始指标列，再整列派生比率 -> 每个窗口一个列式批
+        batches, row_pos, window_pos = [], [], []
+        for order, window in enumerate(windows):
+            positions = np.arange(len(target_rows))
+            if window.materialize_policy == AnalyticsMaterializeEnum.LATEST:
+                positions = positions[-1:]
+            window_rows = target_rows[positions]
+            starts = cls._window_starts(df, window, window_rows)
+            if starts is _NO_WINDOW:
+                continue
+            if starts is None:
+                raw, rows = cls._window_metrics_by_slice(df, window, window_rows)
+            else:
+                raw = cls._window_metrics_single_pass(df, engine, window, starts, window_rows)
+                rows = np.arange(len(window_rows))
+            if not len(rows):
+                continue
+            columns = cls._format_columns(raw, risk_free_rate)
+            columns['snapshot_date'] = dates[window_rows[rows]]
+            columns['window_key'] = window.window_key
+            batches.append(RecordBatch(len(rows), columns))
+            row_pos.append(positions[rows])
+            window_pos.append(np.full(len(rows), order))
+
+        if not batches:
+            return RecordBatch(0, {})
+
+        # 5. 日期优先、与窗口配置顺序一致
+        order = np.lexsort((np.concatenate(window_pos), np.concatenate(row_pos)))
+        result = RecordBatch.concat(batches).take(order)
+        result.columns['user_id'] = user_id
+        result.columns['ho_id'] = holding.id
+        return result
 
-        results = []
+    @staticmethod
+    def _window_starts(df: pd.DataFrame, window: AnalyticsWindow, target_rows: np.ndarray):
+        """
+        每个目标行的窗口起点 (行号)，与 _get_window_slice 的切片规则一致。
+        返回 _NO_WINDOW 表示该窗口不产出数据；None 表示需要回退到逐日切片。
+        """
+        if window.window_type == 'rolling':
+            if not window.window_days:
+                return _NO_WINDOW
+            return rolling_starts(target_rows, window.window_days)
 
-        # 3. 遍历目标日期
-        for current_ts in target_dates:
-            current_date_obj = current_ts.date()
+        elif window.window_type == 'expanding':
+            if window.window_key == 'CUR':
+                return segment_starts(df['cycle'].to_numpy(), target_rows)
+            return expanding_starts(target_rows)
 
-            # 截止到当前日期的数据切片
-            df_upto_now = df.loc[:current_ts]
-            current_cycle = df_upto_now.iloc[-1]['cycle']
+        return _NO_WINDOW
 
-            # 4. 遍历窗口配置
-            for window in windows:
-                # 获取计算所需的窗口数据
-                df_window = cls._get_window_slice(df_upto_now, window, current_cycle)
+    @classmethod
+    def _window_metrics_single_pass(
+            cls,
+            df: pd.DataFrame,
+            engine: RollingMetricsEngine,
+            window: AnalyticsWindow,
+            starts: np.ndarray,
+            target_rows: np.ndarray,
+            irr_guess: Optional[np.ndarray] = None
+    ) -> Dict[str, np.ndarray]:
+        """一个窗口在所有目标日期上的原始指标列，由引擎一次算出"""
+        cols = engine.compute(starts, target_rows, window.annualization_factor, MIN_ANNUALIZATION_DAYS)
+        dates = df.index.date
+        recovery = cols['mdd_recovery']
+        raw = {
+            'count': cols['count'],
+            'twrr_cum': cols['twrr_cum'],
+            'twrr_ann': cols['twrr_ann'],
+            'irr_ann': cls._batch_xirr(df, starts, target_rows, cols['count'], irr_guess),
+            'irr_days': (df.index[target_rows] - df.index[starts]).days.to_numpy(),
+            'cum_pnl': cols['cum_pnl'],
+            'total_cash_div': cols['total_cash_div'],
+            'total_reinvest_div': cols['total_reinvest_div'],
+            'volatility': cols['volatility'],
+            'downside_std': cols['downside_risk'],
+            'mdd': cols['mdd'],
+            'mdd_start': dates[cols['mdd_peak']],
+            'mdd_end': dates[cols['mdd_trough']],
+            'recovery_date': np.where(recovery >= 0, dates[np.maximum(recovery, 0)], None),
+            'max_runup': cols['max_runup'],
+            'win_rate': cols['win_rate'],
+        }
 
-                # 数据不足则跳过
-                if df_window is None or df_window.empty:
-                    continue
+        # 窗口内有日收益 <= -100% 的行：净值归零 / 变号，回撤与修复日按切片重算 (与 CUR 周期不连续时的回退一致)
+        for i in np.flatnonzero(engine.nonpositive_windows(starts, target_rows)).tolist():
+            record = cls._calculate_metrics(df.iloc[starts[i]:target_rows[i] + 1], window.annualization_factor)
+            for key, value in record.items():
+                raw[key][i] = value
+        return raw
 
-                # 计算指标
-                metrics = cls._calculate_metrics(df_window, window.annualization_factor, risk_free_rate)
-
-                # 组装对象
-                snapshot = HoldingAnalyticsSnapshot()
-                snapshot.user_id = user_id
-                snapshot.ho_id = holding.id
-                snapshot.snapshot_date = current_date_obj
-                snapshot.window_key = window.window_key
-
-                # 映射指标
-                snapshot.twrr_cumulative = metrics.get('twrr_cum')
-                snapshot.twrr_annualized = metrics.get('twrr_ann')
-                snapshot.irr_cumulative = metrics.get('irr_cum')
-                snapshot.irr_annualized = metrics.get('irr_ann')
-                snapshot.has_cumulative_pnl = metrics.get('cum_pnl')
-                snapshot.has_cash_dividend = metrics.get('total_cash_div')
-                snapshot.has_reinvest_dividend = metrics.get('total_reinvest_div')
-                snapshot.has_total_dividend = (snapshot.has_cash_dividend or ZERO) + (snapshot.has_reinvest_dividend or ZERO)
-                snapshot.has_return_volatility = metrics.get('volatility')
-                snapshot.has_sharpe_ratio = metrics.get('sharpe')
-                snapshot.has_max_drawdown = metrics.get('mdd')
-                snapshot.has_max_drawdown_start_date = metrics.get('mdd_start')
-                snapshot.has_max_drawdown_end_date = metrics.get('mdd_end')
-                snapshot.has_max_drawdown_recovery_date = metrics.get('mdd_recovery_date')
-                snapshot.has_max_drawdown_days = metrics.get('mdd_days')
-                snapshot.has_max_runup = metrics.get('max_runup')
-                snapshot.has_win_rate = metrics.get('win_rate')
-                snapshot.has_calmar_ratio = metrics.get('calmar')
-                snapshot.has_sortino_ratio = metrics.get('sortino')
-                snapshot.has_downside_risk = metrics.get('downside_risk')
-
-                results.append(snapshot)
-
-        return results
+    @staticmethod
+    def _batch_xirr(df: pd.DataFrame, starts: np.ndarray, ends: np.ndarray, counts: np.ndarray,
+                    guess: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        一个窗口所有目标日期的 XIRR 一次求解，口径同 _calculate_xirr，不足年化天数的行为 NaN
+        :param guess: 每个目标日期的 Newton 初值 (如累加状态中上一次的解)
+        """
+        irr = np.full(len(ends), np.nan)
+        eligible = np.flatnonzero(counts >= MIN_ANNUALIZATION_DAYS)
+        if not len(eligible):
+            return irr
+        irr[eligible] = xirr_windows(
+            day_ordinals=df.index.to_numpy(dtype='datetime64[D]').astype(np.int64),
+            flows=(df['net_external_cash_flow'] + df['daily_cash_dividend']).to_numpy(dtype=np.float64),
+            terminal_values=df['mv'].to_numpy(dtype=np.float64),
+            starts=starts[eligible],
+            ends=ends[eligible],
+            days_per_year=365.0,
+            min_days=MIN_ANNUALIZATION_DAYS,
+            flow_epsilon=EPSILON,
+            guess=None if guess is None else np.asarray(guess, dtype=np.float64)[eligible]
+        )
+        return irr
 
     @classmethod
-    def _load_holding_data(cls, ho_id: int, up_to_date: date) -> pd.DataFrame:
+    def _window_metrics_by_slice(
+            cls,
+            df: pd.DataFrame,
+            window: AnalyticsWindow,
+            target_rows: np.ndarray
+    ) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
         """
-        加载持仓基础快照并转为 DataFrame 以便计算
+        回退路径：逐个目标日期切片后完整计算 (窗口不连续时使用)
+        :return: (原始指标列, 有数据的目标行在 target_rows 中的位置)
         """
-        query = db.session.query(
-            HoldingSnapshot.snapshot_date,
-            HoldingSnapshot.hos_daily_pnl_ratio,
-            HoldingSnapshot.hos_daily_pnl,
-            HoldingSnapshot.holding_shares,
-            HoldingSnapshot.hos_daily_cash_dividend,
-            HoldingSnapshot.hos_daily_reinvest_dividend,
-            HoldingSnapshot.tr_cycle,
-            HoldingSnapshot.hos_net_external_cash_flow,
-            HoldingSnapshot.hos_market_value,
-        ).filter(
-            HoldingSnapshot.ho_id == ho_id,
-            HoldingSnapshot.snapshot_date <= up_to_date
-        ).order_by(HoldingSnapshot.snapshot_date)
+        records, rows = [], []
+        for i, row in enumerate(target_rows.tolist()):
+            df_upto_now = df.iloc[:row + 1]
+            df_window = cls._get_window_slice(df_upto_now, window, df_upto_now.iloc[-1]['cycle'])
+            if df_window is None or df_window.empty:
+                continue
+            records.append(cls._calculate_metrics(df_window, window.annualization_factor))
+            rows.append(i)
+        if not records:
+            return {}, np.array([], dtype=np.int64)
+        raw = {
+            key: np.array([r[key] for r in records], dtype=object if key in _RAW_DATE_KEYS else None)
+            for key in records[0]
+        }
+        return raw, np.array(rows, dtype=np.int64)
 
-        raw_data = query.all()
-        if not raw_data:
-            return pd.DataFrame()
+    @classmethod
+    def _load_holdings_data(cls, user_id: int, ho_ids: List[int], up_to_date: date,
+                            tail: Optional[int] = None, flows_only: bool = False) -> Dict[int, pd.DataFrame]:
+        """
+        一次查询加载多个持仓的基础快照，按持仓切分为 DataFrame (以日期为索引)。
+        数值列在数据库端 COALESCE + CAST 为双精度，结果直接落为 float64 列，
+        不再逐行构造 dict、也不再对 Decimal 对象列做 pd.to_numeric。
+
+        :param tail: 每个持仓只取截至 up_to_date 的最近 tail 行 (日增量的滚动窗口)
+        :param flows_only: 只取有外部现金流或现金分红的行 (日增量的扩张窗口 XIRR)
+        """
+        if not ho_ids:
+            return {}
 
-        # 转换为 DataFrame
         columns = [
-            'date', 'daily_pnl_ratio', 'daily_pnl', 'shares',
-            'daily_cash_dividend', 'daily_reinvest_dividend',
-            'cycle', 'net_external_cash_flow', 'mv'
+            HoldingSnapshot.ho_id,
+            HoldingSnapshot.snapshot_date,
+            *[cast(func.coalesce(column, 0), Float(precision=53)).label(name) for name, column in _FLOAT_COLUMNS],
+            func.coalesce(HoldingSnapshot.tr_cycle, 0).label('cycle'),
         ]
-        df = pd.DataFrame([dict(zip(columns, row)) for row in raw_data])
-
-        # 类型转换
-        cols_to_float = [
-            'daily_pnl_ratio', 'daily_pnl', 'shares',
-            'daily_cash_dividend', 'daily_reinvest_dividend',
-            'net_external_cash_flow', 'mv'
+        filters = [
+            HoldingSnapshot.user_id == user_id,
+            HoldingSnapshot.ho_id.in_(ho_ids),
+            HoldingSnapshot.snapshot_date <= up_to_date
         ]
-        for col in cols_to_float:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
+        if flows_only:
+            filters.append(func.abs(
+                func.coalesce(HoldingSnapshot.hos_net_external_cash_flow, 0)
+                + func.coalesce(HoldingSnapshot.hos_daily_cash_dividend, 0)
+            ) > EPSILON)
+
+        if tail:
+            row_no = func.row_number().over(
+                partition_by=HoldingSnapshot.ho_id, order_by=HoldingSnapshot.snapshot_date.desc()
+            ).label('row_no')
+            sub = db.session.query(*columns, row_no).filter(*filters).subquery()
+            query = db.session.query(*[c for c in sub.c if c.name != 'row_no']) \
+                .filter(sub.c.row_no <= tail).order_by(sub.c.ho_id, sub.c.snapshot_date)
+        else:
+            query = db.session.query(*columns).filter(*filters) \
+                .order_by(HoldingSnapshot.ho_id, HoldingSnapshot.snapshot_date)
 
-        df['cycle'] = df['cycle'].fillna(0).astype(int)
-        df['date'] = pd.to_datetime(df['date'])
-        df.set_index('date', inplace=True)
+        raw_data = query.all()
+        if not raw_data:
+            return {}
 
-        return df
+        columns = ['ho_id', 'date'] + [name for name, _ in _FLOAT_COLUMNS] + ['cycle']
+        frame = pd.DataFrame.from_records(raw_data, columns=columns, coerce_float=True)
+        dtypes = {name: np.float64 for name, _ in _FLOAT_COLUMNS}
+        dtypes['cycle'] = np.int64
+        frame = frame.astype(dtypes)
+        frame['date'] = pd.to_datetime(frame['date'])
+
+        # 按 ho_id 有序，相邻区段即为各持仓的连续序列
+        ho_col = frame['ho_id'].to_numpy()
+        bounds = np.r_[0, np.flatnonzero(ho_col[1:] != ho_col[:-1]) + 1, len(frame)]
+        frame = frame.drop(columns='ho_id').set_index('date')
+        return {
+            int(ho_col[lo]): frame.iloc[lo:hi]
+            for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist())
+        }
 
     @staticmethod
     def _get_window_slice(df: pd.DataFrame, window: AnalyticsWindow, current_cycle_id: int) -> Optional[pd.DataFrame]:
@@ -260,227 +778,133 @@ class HoldingAnalyticsSnapshotService:
         return None
 
     @classmethod
-    def _calculate_metrics(cls, df: pd.DataFrame, annual_factor: int = 252, risk_free_rate: float = DEFAULT_RISK_FREE_RATE) -> Dict:
+    def _calculate_metrics(cls, df: pd.DataFrame, annual_factor: int = 252) -> Dict:
         """
-        核心指标计算
+        核心指标计算 (单个窗口切片，逐日切片的回退路径与校验基准)
+        返回与单遍引擎相同口径的原始指标，缺失值为 NaN / None
         """
         daily_pnl_ratio_list = df['daily_pnl_ratio']
-        pnls = df['daily_pnl']
-        daily_cash_dividend = df['daily_cash_dividend']
-        daily_reinvest_dividend = df['daily_reinvest_dividend']
 
         n = len(daily_pnl_ratio_list)
         if n == 0:
             return {}
 
-        # 1. TWRR Cumulative
+        # 1. TWRR
         twrr_cum = (1 + daily_pnl_ratio_list).prod() - 1
-
-        # 2. Annualized TWRR
-        twrr_ann = None
+        twrr_ann = np.nan
         if n >= MIN_ANNUALIZATION_DAYS:
             twrr_ann = (1 + twrr_cum) ** (annual_factor / n) - 1
 
-        # 3. PnL & Dividends
-        cum_pnl = pnls.sum()
-        total_cash_div = daily_cash_dividend.sum()
-        total_reinvest_div = daily_reinvest_dividend.sum()
-
-        # 4. IRR (XIRR)
+        # 2. IRR (XIRR)
         irr_ann = None
-        irr_cum = None
         if n >= MIN_ANNUALIZATION_DAYS:
             try:
                 irr_ann = cls._calculate_xirr(df)
-                if irr_ann is not None:
-                    days_diff = (df.index[-1] - df.index[0]).days
-                    if days_diff > 0:
-                        irr_cum = Decimal(f"{((1 + irr_ann) ** (days_diff / 365.0) - 1):.6f}")
-                    else:
-                        irr_cum = ZERO
             except Exception:
                 pass
 
-        # 5. Volatility
-        volatility = ZERO
-        if n > 1:
-            volatility = Decimal(f"{daily_pnl_ratio_list.std(ddof=1) * np.sqrt(annual_factor):.6f}")
-
-        # 6. Sharpe
-        sharpe = ZERO
-        if volatility > EPSILON and twrr_ann is not None:
-            sharpe = Decimal(f"{(float(twrr_ann) - risk_free_rate) / float(volatility):.4f}")
+        # 3. MDD & Dates, Recovery, Runup (一次数组内核)
+        dd = drawdown_stats(daily_pnl_ratio_list.to_numpy())
+        dates = df.index.date
 
-        # 7. Downside Risk & Sortino
         neg_returns = daily_pnl_ratio_list[daily_pnl_ratio_list < 0]
-        downside_std = ZERO
-        if len(neg_returns) > 1:
-            downside_std = Decimal(f"{neg_returns.std(ddof=1) * np.sqrt(annual_factor):.6f}")
-
-        sortino = ZERO
-        if downside_std > EPSILON and twrr_ann is not None:
-            sortino = Decimal(f"{(float(twrr_ann) - risk_free_rate) / float(downside_std):.4f}")
-
-        # 8. MDD & Dates
-        nav_series = (1 + daily_pnl_ratio_list).cumprod()
-        running_max = nav_series.cummax()
-        drawdown_series = (nav_series - running_max) / running_max
-        mdd = drawdown_series.min()
-
-        mdd_end_ts = drawdown_series.idxmin()
-        mdd_end_date = mdd_end_ts.date()
-
-        # MDD Start
-        subset_before_trough = running_max.loc[:mdd_end_ts]
-        if not subset_before_trough.empty:
-            peak_val = subset_before_trough.iloc[-1]
-            peak_candidates = subset_before_trough[subset_before_trough == peak_val]
-            mdd_start_ts = peak_candidates.index[-1]
-            mdd_start_date = mdd_start_ts.date()
-        else:
-            mdd_start_date = df.index[0].date()
-            peak_val = nav_series.iloc[0]
-
-        # MDD Days
-        try:
-            mdd_days = trade_calendar.count_trade_days_between(mdd_start_date, mdd_end_date, inclusive=False)
-        except Exception:
-            mdd_days = (mdd_end_date - mdd_start_date).days
-
-        # Recovery Date
-        recovery_date = cls._calc_recovery_date(nav_series, mdd_end_date, peak_val)
-
-        # Max Runup
-        max_runup = cls._calc_max_runup(nav_series)
-
-        # 9. Calmar
-        calmar = ZERO
-        if mdd < 0 and twrr_ann is not None:
-            calmar = Decimal(f"{float(twrr_ann) / abs(float(mdd)):.4f}")
-
-        # 10. Win Rate
-        win_rate = Decimal((daily_pnl_ratio_list > 0).sum() / n)
-
         return {
-            'twrr_cum': Decimal(f"{twrr_cum:.6f}"),
-            'twrr_ann': Decimal(f"{twrr_ann:.6f}") if twrr_ann is not None else None,
-            'irr_ann': Decimal(f"{irr_ann:.6f}") if irr_ann is not None else None,
-            'irr_cum': irr_cum,
-            'cum_pnl': Decimal(f"{cum_pnl:.4f}"),
-            'total_cash_div': Decimal(f"{total_cash_div:.4f}"),
-            'total_reinvest_div': Decimal(f"{total_reinvest_div:.4f}"),
-            'volatility': volatility,
-            'sharpe': sharpe,
-            'sortino': sortino,
-            'downside_risk': downside_std,
-            'mdd': Decimal(f"{mdd:.6f}"),
-            'mdd_start': mdd_start_date,
-            'mdd_end': mdd_end_date,
-            'mdd_days': int(mdd_days),
-            'calmar': calmar,
-            'win_rate': win_rate,
-            'mdd_recovery_date': recovery_date,
-            'max_runup': max_runup,
+            'count': n,
+            'twrr_cum': twrr_cum,
+            'twrr_ann': twrr_ann,
+            'irr_ann': np.nan if irr_ann is None else irr_ann,
+            'irr_days': (df.index[-1] - df.index[0]).days,
+            'cum_pnl': df['daily_pnl'].sum(),
+            'total_cash_div': df['daily_cash_dividend'].sum(),
+            'total_reinvest_div': df['daily_reinvest_dividend'].sum(),
+            'volatility': daily_pnl_ratio_list.std(ddof=1) * np.sqrt(annual_factor) if n > 1 else np.nan,
+            'downside_std': neg_returns.std(ddof=1) * np.sqrt(annual_factor) if len(neg_returns) > 1 else np.nan,
+            'mdd': dd.max_drawdown,
+            'mdd_start': dates[dd.peak] if dd.peak >= 0 else None,
+            'mdd_end': dates[dd.trough] if dd.trough >= 0 else None,
+            'recovery_date': dates[dd.recovery] if dd.recovery >= 0 else None,
+            'max_runup': dd.max_runup,
+            'win_rate': (daily_pnl_ratio_list > 0).sum() / n,
         }
 
-    # ---------------------------------------------------------
-    # Utility Methods (XIRR, Recovery, Runup)
-    # ---------------------------------------------------------
-
-    @staticmethod
-    def _calculate_xirr(df: pd.DataFrame) -> Optional[float]:
+    @classmethod
+    def _format_columns(cls, raw: Dict[str, np.ndarray], risk_free_rate: float) -> Dict[str, np.ndarray]:
         """
-        计算 XIRR (Newton/Bisection fallback)
+        原始指标列 -> HoldingAnalyticsSnapshot 字段列，并整列派生夏普/索提诺/卡玛等比率。
+        单遍引擎与逐日切片两条路径共用；量化在写入时按列精度完成。
         """
-        df = df.copy()
-        df['flow'] = df['net_external_cash_flow'] + df['daily_cash_dividend']
-
-        # 过滤微小现金流
-        flows = df[df['flow'].abs() > EPSILON].copy()
-        dates = list(flows.index)
-        amounts = list(flows['flow'])
-
-        # 加入期末市值
-        last_date = df.index[-1]
-        last_mv = df.iloc[-1]['mv']
-
-        if dates and dates[-1] == last_date:
-            amounts[-1] += last_mv
-        else:
-            dates.append(last_date)
-            amounts.append(last_mv)
-
-        if len(dates) < 2:
-            return None
-
-        # 检查现金流方向
-        pos = sum(1 for a in amounts if a > 0)
-        neg = sum(1 for a in amounts if a < 0)
-        if pos == 0 or neg == 0:
-            return None
-
-        if (dates[-1] - dates[0]).days < MIN_ANNUALIZATION_DAYS:
-            return None
-
-        def xnpv(rate, dates, amounts):
-            if rate <= -1.0:
-                return float('inf')
-            d0 = dates[0]
-            return sum(a / ((1.0 + rate) ** ((d - d0).days / 365.0)) for d, a in zip(dates, amounts))
-
-        # Initial Guess
-        total_in = sum(a for a in amounts if a < 0)
-        total_out = sum(a for a in amounts if a > 0)
-        guess = 0.1
-        if total_in != 0:
-            years = (dates[-1] - dates[0]).days / 365.0
-            if years > 0:
-                guess = ((total_out + total_in) / abs(total_in)) / years
-                guess = max(-0.99, min(10.0, guess))
-
-        try:
-            result = optimize.newton(lambda r: xnpv(r, dates, amounts), guess, tol=1e-6, maxiter=200, disp=False)
-            if not np.isfinite(result):
-                raise RuntimeError("Non-finite")
-            return result
-        except (RuntimeError, ValueError):
-            # Fallback: Bisection
-            try:
-                a, b = -0.99, 10.0
-                fa, fb = xnpv(a, dates, amounts), xnpv(b, dates, amounts)
-                if fa * fb > 0:
-                    return None
-                root, _ = optimize.bisect(lambda r: xnpv(r, dates, amounts), a, b, xtol=1e-6, maxiter=500, disp=False)
-                return root
-            except Exception:
-                return None
+        twrr_ann = raw['twrr_ann'].astype(np.float64)
+        irr_ann = raw['irr_ann'].astype(np.float64)
+        mdd = raw['mdd'].astype(np.float64)
+        has_twrr_ann = ~np.isnan(twrr_ann)
+
+        # 1. IRR Cumulative
+        irr_days = raw['irr_days'].astype(np.float64)
+        with np.errstate(invalid='ignore', over='ignore'):
+            irr_cum = np.where(irr_days > 0, np.power(1 + irr_ann, irr_days / 365.0) - 1, 0.0)
+        irr_cum = np.where(np.isnan(irr_ann), np.nan, irr_cum)
+
+        # 2. Volatility & Sharpe (缺失记为 0；比率按入库精度的波动率计算)
+        volatility = np.round(np.nan_to_num(raw['volatility'].astype(np.float64), nan=0.0), 6)
+        excess = twrr_ann - risk_free_rate
+        sharpe = np.divide(excess, volatility, out=np.zeros_like(excess),
+                           where=(volatility > EPSILON) & has_twrr_ann)
+
+        # 3. Downside Risk & Sortino
+        downside_std = np.round(np.nan_to_num(raw['downside_std'].astype(np.float64), nan=0.0), 6)
+        sortino = np.divide(excess, downside_std, out=np.zeros_like(excess),
+                            where=(downside_std > EPSILON) & has_twrr_ann)
+
+        # 4. Calmar
+        calmar = np.divide(twrr_ann, np.abs(mdd), out=np.zeros_like(twrr_ann), where=(mdd < 0) & has_twrr_ann)
+
+        cash_div = raw['total_cash_div'].astype(np.float64)
+        reinvest_div = raw['total_reinvest_div'].astype(np.float64)
+        return {
+            'twrr_cumulative': raw['twrr_cum'].astype(np.float64),
+            'twrr_annualized': twrr_ann,
+            'irr_cumulative': irr_cum,
+            'irr_annualized': irr_ann,
+            'has_cumulative_pnl': raw['cum_pnl'].astype(np.float64),
+            'has_cash_dividend': cash_div,
+            'has_reinvest_dividend': reinvest_div,
+            'has_total_dividend': np.round(cash_div, 4) + np.round(reinvest_div, 4),
+            'has_return_volatility': volatility,
+            'has_sharpe_ratio': sharpe,
+            'has_max_drawdown': mdd,
+            'has_max_drawdown_start_date': raw['mdd_start'],
+            'has_max_drawdown_end_date': raw['mdd_end'],
+            'has_max_drawdown_recovery_date': raw['recovery_date'],
+            'has_max_drawdown_days': cls._count_drawdown_days(raw['mdd_start'], raw['mdd_end']),
+            'has_max_runup': np.nan_to_num(raw['max_runup'].astype(np.float64), nan=0.0),
+            'has_win_rate': raw['win_rate'].astype(np.float64),
+            'has_calmar_ratio': calmar,
+            'has_sortino_ratio': sortino,
+            'has_downside_risk': downside_std,
+        }
 
     @staticmethod
-    def _calc_recovery_date(nav_series: pd.Series, mdd_end_date: date, peak_val: float) -> Optional[date]:
-        if mdd_end_date is None:
-            return None
+    def _count_drawdown_days(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """峰值到谷底之间的交易日数 (不含首尾)，日历不可用时退回自然日"""
         try:
-            after_trough = nav_series.loc[pd.Timestamp(mdd_end_date) + timedelta(days=1):]
-            if after_trough.empty:
-                return None
+            return trade_calendar.count_trade_days_between_many(starts, ends, inclusive=False)
+        except Exception:
+            return np.array([(end - start).days for start, end in zip(starts, ends)], dtype=np.int64)
 
-            recovery_mask = after_trough >= peak_val
-            if not recovery_mask.any():
-                return None
+    # ---------------------------------------------------------
+    # Utility Methods (XIRR)
+    # ---------------------------------------------------------
 
-            return recovery_mask.idxmax().date()
-        except Exception:
+    @classmethod
+    def _calculate_xirr(cls, df: pd.DataFrame) -> Optional[float]:
+        """
+        计算单个切片的 XIRR (Newton/Bisection fallback)，即整段切片作为一个窗口的批量求解
+        """
+        if df.empty:
             return None
-
-    @staticmethod
-    def _calc_max_runup(nav_series: pd.Series) -> Decimal:
-        if nav_series.empty:
-            return ZERO
-        running_min = nav_series.cummin().replace(0, np.nan)
-        runup_series = (nav_series / running_min) - 1
-        if runup_series.isnull().all():
-            return ZERO
-        return Decimal(f"{runup_series.max():.6f}")
+        end = np.array([len(df) - 1])
+        irr = cls._batch_xirr(df, np.zeros(1, dtype=np.int64), end, np.array([MIN_ANNUALIZATION_DAYS]))
+        return None if np.isnan(irr[0]) else float(irr[0])
 
     # ---------------------------------------------------------
     # Portfolio Level Aggregation
@@ -490,6 +914,7 @@ class HoldingAnalyticsSnapshotService:
     def update_position_ratios_and_contributions(cls, user_id: int, start_date: date = None, end_date: date = None):
         """
         更新仓位占比和组合贡献，需要先计算ias。
+        在数据库中以一条 UPDATE ... FROM 完成 (按用户、持仓、日期关联持仓快照与当日/前一交易日组合快照)。
 
         :param user_id: 用户ID (必填)
         :param start_date: 开始日期 (可选，如果不传则自动查找 has_position_ratio IS NULL 的记录)
@@ -498,100 +923,40 @@ class HoldingAnalyticsSnapshotService:
         logger.info(f"Updating position ratios/contributions for user {user_id}")
         start_time = time.time()
 
-        # 获取需要更新字段的列表
-        query = HoldingAnalyticsSnapshot.query.filter(
-            HoldingAnalyticsSnapshot.user_id == user_id
-        )
-
+        # 1. 确定日期范围；未传入日期时取缺失值记录的范围
         if start_date and end_date:
-            # 如果传入了日期范围，按范围处理
-            query = query.filter(
-                HoldingAnalyticsSnapshot.snapshot_date >= start_date,
-                HoldingAnalyticsSnapshot.snapshot_date <= end_date
-            )
+            min_date, max_date = start_date, end_date
         else:
-            # 如果未传入日期，自动查找 has_position_ratio IS NULL 的记录
-            query = query.filter(
+            min_date, max_date = db.session.query(
+                func.min(HoldingAnalyticsSnapshot.snapshot_date),
+                func.max(HoldingAnalyticsSnapshot.snapshot_date)
+            ).filter(
+                HoldingAnalyticsSnapshot.user_id == user_id,
                 or_(
                     HoldingAnalyticsSnapshot.has_position_ratio.is_(None),
                     HoldingAnalyticsSnapshot.has_portfolio_contribution.is_(None)
                 )
+            ).one()
+            if min_date is None:
+                logger.info("Nothing to update in position ratios/contributions.")
+                return {"updated": 0}
+
+        # 2. 交易日 -> 前一交易日 映射 (一次 searchsorted)
+        trade_days = trade_calendar.trade_days_between(min_date, max_date)
+        prev_days = trade_calendar.offset_trade_days(trade_days, -1)
+        valid = ~np.isnat(prev_days)
+        prev_map = list(zip(trade_days[valid].tolist(), prev_days[valid].tolist()))
+
+        # 3. 集合式更新
+        try:
+            updated_count = HoldingAnalyticsMapper.update_position_ratios(
+                user_id, prev_map, start_date=start_date, end_date=end_date
             )
-
-        to_update_has_list = query.order_by(HoldingAnalyticsSnapshot.snapshot_date).all()
-        if not to_update_has_list:
-            logger.info("Nothing to update in position ratios/contributions.")
-            return {"updated": 0}
-
-        # 1. 构建需要更新的 HoldingAnalyticsSnapshot 日期映射
-        has_to_update_map = defaultdict(list)
-        for has in to_update_has_list:
-            has_to_update_map[has.snapshot_date].append(has)
-
-        # 2. 获取日期范围并批量查询
-        min_date = min(has_to_update_map.keys())
-        max_date = max(has_to_update_map.keys())
-
-        # 3. 获取所有需要的持仓快照
-        holding_snapshots = HoldingSnapshot.query.filter(
-            HoldingSnapshot.snapshot_date.between(min_date, max_date),
-            HoldingSnapshot.user_id == user_id
-        ).all()
-
-        holding_data_map = defaultdict(dict)
-        for snap in holding_snapshots:
-            holding_data_map[snap.snapshot_date][snap.ho_id] = snap
-
-        # 获取所有需要的投资组合快照 (往前倒一天)
-        ias_list = InvestedAssetSnapshot.query.filter(
-            InvestedAssetSnapshot.snapshot_date.between(trade_calendar.prev_trade_day(min_date), max_date),
-            InvestedAssetSnapshot.user_id == user_id
-        ).all()
-
-        ias_date_map = {ias.snapshot_date: ias for ias in ias_list}
-
-        updated_count = 0
-        records_to_commit = []
-        # 遍历并计算更新
-        for target_date, has_records in has_to_update_map.items():
-            # 获取当日和前一日的组合快照
-            ias_today = ias_date_map.get(target_date)
-            ias_prev = ias_date_map.get(trade_calendar.prev_trade_day(target_date))
-
-            # 获取当日的持仓快照
-            holding_snaps_for_date = holding_data_map.get(target_date, {})
-
-            for has in has_records:
-                holding_data = holding_snaps_for_date.get(has.ho_id)
-                if not holding_data:
-                    logger.debug(f"Skipping HAS id={has.id}: No HoldingSnapshot data found.")
-                    continue
-
-                # 计算 has_portfolio_contribution
-                prev_mv = ias_prev.ias_market_value if ias_prev else ZERO
-                if prev_mv and prev_mv != ZERO:
-                    has.has_portfolio_contribution = holding_data.hos_daily_pnl / prev_mv
-                else:
-                    has.has_portfolio_contribution = ZERO
-
-                # 计算 has_position_ratio
-                if ias_today and ias_today.ias_market_value and ias_today.ias_market_value != ZERO:
-                    has.has_position_ratio = holding_data.hos_market_value / ias_today.ias_market_value
-                else:
-                    has.has_position_ratio = ZERO
-
-                records_to_commit.append(has)
-                updated_count += 1
-
-        if records_to_commit:
-            try:
-                db.session.bulk_save_objects(records_to_commit)
-                db.session.commit()
-                logger.info(f"Successfully updated {updated_count} HoldingAnalyticsSnapshot records.")
-            except Exception as e:
-                db.session.rollback()
-                logger.exception(f"Error committing updates for HoldingAnalyticsSnapshot: {e}")
-                raise
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f"Error committing updates for HoldingAnalyticsSnapshot: {e}")
+            raise
 
         duration = round(time.time() - start_time, 2)
         logger.info(f"Finished update_position_ratios_and_contributions in {duration}s. Updated {updated_count} records.")
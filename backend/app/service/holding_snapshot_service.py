@@ -1,17 +1,31 @@
 # app/service/holding_snapshot_service.py
+import multiprocessing
+import os
 import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass
 from datetime import date, timedelta
 from decimal import Decimal
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
+from flask import current_app, has_app_context
 from loguru import logger
+from sqlalchemy import and_, func
 
 from app.calendars.trade_calendar import TradeCalendar
-from app.constant.biz_enums import TradeTypeEnum, DividendTypeEnum, HoldingStatusEnum
+from app.constant.biz_enums import (
+    TradeTypeEnum, DividendTypeEnum, HoldingStatusEnum, SnapshotEngineEnum, SnapshotChunkModeEnum, ErrorMessageEnum
+)
+from app.engine.fixed_point import FixedPointOverflow, assert_fixed_matches, to_decimals
+from app.engine.nav_series import NavPoint, NavSeries
+from app.engine.position_replay import (
+    AMOUNT_COLUMNS, InitialPosition, OversellError, ReplayColumns, ReplayJob, TradeArrays, run_replay_job
+)
 from app.framework.async_task_manager import create_task
-from app.framework.exceptions import AsyncTaskException
+from app.framework.exceptions import AsyncTaskException, BizException
+from app.mapper.bulk_upsert_mapper import BulkUpsertMapper, UpsertResult
 from app.models import db, HoldingSnapshot, Holding, FundNavHistory, Trade, UserHolding
 from app.utils.date_util import date_to_str
 
@@ -50,13 +64,22 @@ class PositionState:
 
 class HoldingSnapshotService:
 
+    # 流式模式默认块大小：按持仓为持仓个数，按日期为交易日个数
+    DEFAULT_HOLDING_CHUNK_SIZE = 20
+    DEFAULT_DATE_CHUNK_SIZE = 250
+
     @classmethod
     def generate_snapshots(
             cls,
             user_id: int,
             start_date: date,
             end_date: date,
-            ids: Optional[List[str]] = None
+            ids: Optional[List[str]] = None,
+            engine: str = SnapshotEngineEnum.DECIMAL.value,
+            parallel: bool = False,
+            workers: Optional[int] = None,
+            chunk_by: Optional[str] = None,
+            chunk_size: Optional[int] = None
     ) -> dict:
         """
         统一快照生成入口。
@@ -65,7 +88,18 @@ class HoldingSnapshotService:
         :param start_date: 目标开始日期 (包含)
         :param end_date: 目标结束日期 (包含)
         :param ids: 指定的持仓ID列表，为空则处理所有
+        :param engine: 计算引擎，DECIMAL (逐日 Decimal 基准实现)、VECTOR (NumPy 向量化重放)、
+                       FIXED (定点整数重放) 或 VERIFY (Decimal 与定点整数对照校验)，见 SnapshotEngineEnum
+        :param parallel: 是否将持仓分发到进程池并行计算 (VECTOR / FIXED 引擎，子进程只接收纯数据；VERIFY 不并行)
+        :param workers: 并行进程数，为空时取配置 SNAPSHOT_WORKERS，再为空则取 CPU 核数
+        :param chunk_by: 流式模式，见 SnapshotChunkModeEnum；为空时一次性计算后整体入库
+        :param chunk_size: 每块的持仓数 (HOLDING) 或交易日数 (DATE)
         """
+        if engine not in {e.value for e in SnapshotEngineEnum}:
+            raise BizException(msg=ErrorMessageEnum.INVALID_PARAM.view)
+        if chunk_by and chunk_by not in {m.value for m in SnapshotChunkModeEnum}:
+            raise BizException(msg=ErrorMessageEnum.INVALID_PARAM.view)
+
         logger.info(f"Starting snapshot generation: {start_date} to {end_date} for user {user_id}")
         start_time = time.time()
 
@@ -76,12 +110,10 @@ class HoldingSnapshotService:
         holdings = query.all()
 
         if not holdings:
-            return {"total_generated": 0, "errors": [], "duration": 0}
+            return {"total_generated": 0, "errors": [], "failed_ids": [], "duration": 0}
 
-        # 2. 预加载全局数据 (优化：减少DB往返)
+        # 2. 获取所有相关交易 (必须过滤 user_id，避免多用户数据混淆)
         ho_ids = [h.id for h in holdings]
-
-        # 2.1 获取所有相关交易 (必须过滤 user_id，避免多用户数据混淆)
         all_trades = Trade.query.filter(
             Trade.ho_id.in_(ho_ids),
             Trade.user_id == user_id
@@ -90,28 +122,88 @@ class HoldingSnapshotService:
         for t in all_trades:
             trades_by_ho[t.ho_id].append(t)
 
-        # 2.2 获取区间内的所有净值
-        # 注意：需要从每个持仓的最早交易日期开始加载净值，而不是只从start_date
-        # 因为回溯计算需要历史净值
-        all_navs = FundNavHistory.query.filter(
-            FundNavHistory.ho_id.in_(ho_ids),
-            FundNavHistory.nav_date <= end_date
-        ).all()
-        nav_map = defaultdict(dict)
-        for nav in all_navs:
-            nav_map[nav.ho_id][date_to_str(nav.nav_date)] = nav
-
-        # 2.3 获取 start_date - 1 天的快照 (用于状态热启动)
-        prev_day = trade_calendar.prev_trade_day(start_date)
-        existing_snaps = HoldingSnapshot.query.filter(
-            HoldingSnapshot.ho_id.in_(ho_ids),
-            HoldingSnapshot.snapshot_date == prev_day
-        ).all()
-        prev_snap_map = {s.ho_id: s for s in existing_snaps}
+        # 3. 按块计算并入库；每块结束即释放快照对象，内存峰值只取决于块大小
+        errors = []
+        failed_ho_ids = set()
+        total_generated = 0
+        upsert_result = UpsertResult()
+        chunks = 0
+
+        if chunk_by == SnapshotChunkModeEnum.DATE:
+            # 按日期分块：上一块每个持仓的最后一条快照作为下一块的检查点
+            checkpoints = cls._load_checkpoints(user_id, ho_ids, start_date)
+            for block_start, block_end in cls._date_blocks(start_date, end_date, chunk_size):
+                active = [h for h in holdings if h.id not in failed_ho_ids]
+                if not active:
+                    break
+                generated, result, last_snaps = cls._generate_block(
+                    user_id, active, block_start, block_end, trades_by_ho, checkpoints,
+                    engine, parallel, workers, errors, failed_ho_ids
+                )
+                checkpoints.update(last_snaps)
+                total_generated += generated
+                upsert_result.merge(result)
+                chunks += 1
+        else:
+            size = (chunk_size or cls.DEFAULT_HOLDING_CHUNK_SIZE) if chunk_by == SnapshotChunkModeEnum.HOLDING \
+                else len(holdings)
+            for i in range(0, len(holdings), size):
+                block = holdings[i:i + size]
+                checkpoints = cls._load_checkpoints(user_id, [h.id for h in block], start_date)
+                generated, result, _ = cls._generate_block(
+                    user_id, block, start_date, end_date, trades_by_ho, checkpoints,
+                    engine, parallel, workers, errors, failed_ho_ids
+                )
+                total_generated += generated
+                upsert_result.merge(result)
+                chunks += 1
+
+        duration = round(time.time() - start_time, 2)
+        return {
+            "total_generated": total_generated,
+            "errors": errors,
+            "failed_ids": sorted(failed_ho_ids),
+            "duration": duration,
+            "upsert": upsert_result.to_dict() if total_generated else None,
+            "chunks": chunks
+        }
+
+    @classmethod
+    def _generate_block(
+            cls,
+            user_id: int,
+            holdings: List[Holding],
+            start_date: date,
+            end_date: date,
+            trades_by_ho: Dict[int, List[Trade]],
+            checkpoints: Dict[int, HoldingSnapshot],
+            engine: str,
+            parallel: bool,
+            workers: Optional[int],
+            errors: List[str],
+            failed_ho_ids: set
+    ) -> Tuple[int, UpsertResult, Dict[int, HoldingSnapshot]]:
+        """
+        计算一批持仓在 [start_date, end_date] 内的快照并入库。
+        返回 (生成条数, upsert 结果, {ho_id: 该块最后一条快照})。
+        """
+        ho_ids = [h.id for h in holdings]
 
-        # 3. 核心计算循环
+        # 1. 获取区间内的净值 (列式)
+        # 回溯期只应用交易、不读取净值，因此净值下界就是 start_date
+        nav_map = cls._load_nav_series(ho_ids, start_date, end_date)
+
+        # 2. 核心计算循环
+        calculate = {
+            SnapshotEngineEnum.DECIMAL: cls._calculate_range,
+            SnapshotEngineEnum.VECTOR: cls._calculate_range_vectorized,
+            SnapshotEngineEnum.FIXED: cls._calculate_range_fixed,
+            SnapshotEngineEnum.VERIFY: cls._calculate_range_verified,
+        }[SnapshotEngineEnum(engine)]
+        parallel = parallel and engine != SnapshotEngineEnum.VERIFY
         snapshots_to_save = []
-        errors = []
+        last_snaps = {}
+        pending_jobs = {}
 
         for holding in holdings:
             try:
@@ -120,56 +212,233 @@ class HoldingSnapshotService:
                 if holding_status == HoldingStatusEnum.NOT_HELD and not trades_by_ho[holding.id]:
                     continue
 
-                new_snaps = cls._calculate_range(
+                navs = nav_map.get(holding.id) or NavSeries.empty()
+                if parallel:
+                    # 只准备纯数据任务，稍后统一分发
+                    job, sorted_trades = cls._build_replay_job(
+                        holding.id, start_date, end_date, trades_by_ho[holding.id], navs, checkpoints.get(holding.id),
+                        fixed=engine == SnapshotEngineEnum.FIXED
+                    )
+                    if job is not None:
+                        pending_jobs[holding.id] = (holding, job, sorted_trades, navs)
+                    continue
+
+                new_snaps = calculate(
                     holding=holding,
                     user_id=user_id,
                     target_start=start_date,
                     target_end=end_date,
                     trades=trades_by_ho[holding.id],
-                    navs=nav_map[holding.id],
-                    prev_snapshot=prev_snap_map.get(holding.id)
+                    navs=navs,
+                    prev_snapshot=checkpoints.get(holding.id)
                 )
                 snapshots_to_save.extend(new_snaps)
+                if new_snaps:
+                    last_snaps[holding.id] = new_snaps[-1]
 
-            except AsyncTaskException as e:
-                logger.exception()
-                errors.append(e.async_task_log.error_message)
             except Exception as e:
-                err_msg = f"Error processing holding {holding.ho_code}: {str(e)}"
-                logger.exception(err_msg)
-                errors.append(err_msg)
-                # 记录异步任务以便重试
-                create_task(
-                    user_id=user_id,
-                    task_name=f"Fix Snapshot: {holding.ho_code}",
-                    module_path="app.service.holding_snapshot_service",
-                    method_name="generate_snapshots",
-                    kwargs={"ids": [holding.id], "start_date": str(start_date), "end_date": str(end_date)},
-                    error_message=err_msg
-                )
-
-        # 4. 数据库持久化
-        total_generated = 0
-        if snapshots_to_save:
-            try:
-                # 删除目标区间内的旧数据 (幂等性)
-                db.session.query(HoldingSnapshot).filter(
-                    HoldingSnapshot.ho_id.in_(ho_ids),
+                failed_ho_ids.add(holding.id)
+                cls._handle_holding_error(e, holding, user_id, start_date, end_date, engine, errors)
+
+        # 2.1 并行模式：进程池计算，结果合并后统一入库
+        if pending_jobs:
+            results = cls._run_jobs_in_pool([job for _, job, _, _ in pending_jobs.values()], workers)
+            for ho_id, (holding, job, sorted_trades, navs) in pending_jobs.items():
+                try:
+                    outcome = results[ho_id]
+                    if isinstance(outcome, OversellError):
+                        raise AsyncTaskException(cls._create_oversell_task(
+                            user_id, holding.ho_code, sorted_trades[outcome.trade_index], outcome.shares_available
+                        ))
+                    if isinstance(outcome, FixedPointOverflow):
+                        logger.warning(f"{holding.ho_code}: {outcome}, falling back to Decimal engine")
+                        new_snaps = cls._calculate_range(
+                            holding=holding, user_id=user_id, target_start=start_date, target_end=end_date,
+                            trades=sorted_trades, navs=navs, prev_snapshot=checkpoints.get(ho_id)
+                        )
+                    elif isinstance(outcome, Exception):
+                        raise outcome
+                    else:
+                        new_snaps = cls._replay_to_snapshots(outcome, ho_id, user_id, navs)
+                    snapshots_to_save.extend(new_snaps)
+                    if new_snaps:
+                        last_snaps[ho_id] = new_snaps[-1]
+                except Exception as e:
+                    failed_ho_ids.add(ho_id)
+                    cls._handle_holding_error(e, holding, user_id, start_date, end_date, engine, errors)
+
+        # 3. 数据库持久化
+        if not snapshots_to_save:
+            return 0, UpsertResult(), last_snaps
+        # 计算失败的持仓不参与清理：旧快照整体保留，直到水位线重放时重新生成 (不会出现新旧数据中间夹着空档)
+        saved_ho_ids = [ho_id for ho_id in ho_ids if ho_id not in failed_ho_ids]
+        try:
+            # 按唯一约束 upsert，目标区间内不再产生的旧数据一并清理 (幂等性)
+            upsert_result = BulkUpsertMapper.upsert(
+                HoldingSnapshot,
+                snapshots_to_save,
+                prune_scope=[
+                    HoldingSnapshot.user_id == user_id,
+                    HoldingSnapshot.ho_id.in_(saved_ho_ids),
                     HoldingSnapshot.snapshot_date >= start_date,
                     HoldingSnapshot.snapshot_date <= end_date
-                ).delete(synchronize_session=False)
+                ]
+            )
+            db.session.commit()
+            logger.info(f"Successfully saved {len(snapshots_to_save)} snapshots ({start_date} to {end_date}).")
+            return len(snapshots_to_save), upsert_result, last_snaps
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f"Database commit failed: {e}")
+            errors.append(f"DB Commit Error: {str(e)}")
+            # 未入库的块不能作为后续块的检查点
+            failed_ho_ids.update(ho_ids)
+            return 0, UpsertResult(), {}
 
-                db.session.bulk_save_objects(snapshots_to_save)
-                db.session.commit()
-                total_generated = len(snapshots_to_save)
-                logger.info(f"Successfully saved {total_generated} snapshots.")
-            except Exception as e:
-                db.session.rollback()
-                logger.exception(f"Database commit failed: {e}")
-                errors.append(f"DB Commit Error: {str(e)}")
+    @classmethod
+    def _date_blocks(cls, start_date: date, end_date: date, chunk_size: Optional[int]) -> List[Tuple[date, date]]:
+        """将 [start_date, end_date] 按交易日个数切分为首尾相接的日期块"""
+        size = chunk_size or cls.DEFAULT_DATE_CHUNK_SIZE
+        days = trade_calendar.trade_days_between(start_date, end_date).tolist()
+        if len(days) <= size:
+            return [(start_date, end_date)]
+        blocks = []
+        block_start = start_date
+        for i in range(size - 1, len(days) - 1, size):
+            blocks.append((block_start, days[i]))
+            block_start = days[i + 1]
+        blocks.append((block_start, end_date))
+        return blocks
 
-        duration = round(time.time() - start_time, 2)
-        return {"total_generated": total_generated, "errors": errors, "duration": duration}
+    @staticmethod
+    def _load_nav_series(ho_ids: List[int], start_date: date, end_date: date) -> Dict[int, NavSeries]:
+        """
+        只查询 ho_id / nav_date / nav_per_unit 三列，返回 {ho_id: NavSeries}。
+        不实例化 FundNavHistory ORM 对象。
+        """
+        rows = db.session.query(
+            FundNavHistory.ho_id, FundNavHistory.nav_date, FundNavHistory.nav_per_unit
+        ).filter(
+            FundNavHistory.ho_id.in_(ho_ids),
+            FundNavHistory.nav_date >= start_date,
+            FundNavHistory.nav_date <= end_date,
+            FundNavHistory.nav_per_unit.isnot(None)
+        ).order_by(FundNavHistory.ho_id, FundNavHistory.nav_date).all()
+
+        count = len(rows)
+        ho_col = np.fromiter((r[0] for r in rows), dtype=np.int64, count=count)
+        ordinals = np.fromiter((r[1].toordinal() for r in rows), dtype=np.int32, count=count)
+        values = np.fromiter((float(r[2]) for r in rows), dtype=np.float64, count=count)
+        return NavSeries.split_by_holding(ho_col, ordinals, values)
+
+    @staticmethod
+    def _load_checkpoints(user_id: int, ho_ids: List[int], start_date: date) -> Dict[int, HoldingSnapshot]:
+        """
+        获取每个持仓在 start_date 之前最近的一条有效快照。
+        前一交易日的快照可能因缺少净值而不存在，此时退回到更早的检查点，
+        而不是从第一笔交易开始全量回放。
+        """
+        latest = db.session.query(
+            HoldingSnapshot.ho_id,
+            func.max(HoldingSnapshot.snapshot_date).label('checkpoint_date')
+        ).filter(
+            HoldingSnapshot.user_id == user_id,
+            HoldingSnapshot.ho_id.in_(ho_ids),
+            HoldingSnapshot.snapshot_date < start_date,
+            HoldingSnapshot.holding_shares.isnot(None),
+            HoldingSnapshot.hos_market_value.isnot(None)
+        ).group_by(HoldingSnapshot.ho_id).subquery()
+
+        checkpoints = HoldingSnapshot.query.join(
+            latest,
+            and_(
+                HoldingSnapshot.ho_id == latest.c.ho_id,
+                HoldingSnapshot.snapshot_date == latest.c.checkpoint_date
+            )
+        ).filter(HoldingSnapshot.user_id == user_id).all()
+        return {s.ho_id: s for s in checkpoints}
+
+    @staticmethod
+    def _resume_cursor(prev_snapshot: HoldingSnapshot, target_start: date) -> date:
+        """检查点的下一个交易日，不晚于 target_start"""
+        cursor = trade_calendar.next_trade_day(prev_snapshot.snapshot_date)
+        return min(cursor, target_start) if cursor else target_start
+
+    @staticmethod
+    def _handle_holding_error(
+            e: Exception,
+            holding: Holding,
+            user_id: int,
+            start_date: date,
+            end_date: date,
+            engine: str,
+            errors: List[str]
+    ):
+        """单个持仓计算失败：记录错误，非数据问题时创建重试任务"""
+        if isinstance(e, AsyncTaskException):
+            logger.exception(e.async_task_log.error_message)
+            errors.append(e.async_task_log.error_message)
+            return
+
+        err_msg = f"Error processing holding {holding.ho_code}: {str(e)}"
+        logger.exception(err_msg)
+        errors.append(err_msg)
+        # 记录异步任务以便重试
+        create_task(
+            user_id=user_id,
+            task_name=f"Fix Snapshot: {holding.ho_code}",
+            module_path="app.service.holding_snapshot_service",
+            method_name="generate_snapshots",
+            kwargs={"ids": [holding.id], "start_date": str(start_date), "end_date": str(end_date),
+                    "engine": engine},
+            error_message=err_msg
+        )
+
+    @staticmethod
+    def _resolve_workers(workers: Optional[int]) -> int:
+        if not workers and has_app_context():
+            workers = current_app.config.get('SNAPSHOT_WORKERS')
+        return max(1, int(workers or os.cpu_count() or 1))
+
+    @classmethod
+    def _run_jobs_in_pool(cls, jobs: List[ReplayJob], workers: Optional[int] = None) -> Dict[int, object]:
+        """
+        将重放任务分发到进程池。
+        返回 {ho_id: ReplayColumns 或 异常}，单个任务失败不影响其他持仓。
+        """
+        max_workers = min(cls._resolve_workers(workers), len(jobs))
+        results = {}
+        if max_workers <= 1:
+            for job in jobs:
+                try:
+                    results[job.ho_id] = run_replay_job(job)
+                except Exception as e:
+                    results[job.ho_id] = e
+            return results
+
+        # spawn: 子进程不继承父进程的数据库连接与调度线程
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(run_replay_job, job): job.ho_id for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    results[futures[future]] = e
+        logger.info(f"Replayed {len(jobs)} holdings with {max_workers} worker processes")
+        return results
+
+    @staticmethod
+    def _trade_day_grid(calc_cursor: date, target_end: date) -> List[date]:
+        """
+        计算起点 (含) 至 target_end 的交易日网格。
+        起点本身即使不是交易日也保留，以便应用当天的交易。
+        """
+        if not calc_cursor or calc_cursor > target_end:
+            return []
+        days = trade_calendar.trade_days_between(calc_cursor, target_end).tolist()
+        if not days or days[0] != calc_cursor:
+            days.insert(0, calc_cursor)
+        return days
 
     @classmethod
     def _calculate_range(
@@ -179,17 +448,17 @@ class HoldingSnapshotService:
             target_start: date,
             target_end: date,
             trades: List[Trade],
-            navs: dict,
+            navs: NavSeries,
             prev_snapshot: Optional[HoldingSnapshot]
     ) -> List[HoldingSnapshot]:
         """
         核心计算逻辑：生成指定时间段的快照。
         自动处理状态初始化（从prev_snapshot或从零开始）。
         """
-        # 1. 确定计算的起始点
+        # 1. 确定计算的起始点 (检查点之后的交易在回溯期内补齐)
         if prev_snapshot:
             current_state = PositionState.from_snapshot(prev_snapshot)
-            calc_cursor = target_start
+            calc_cursor = cls._resume_cursor(prev_snapshot, target_start)
         else:
             current_state = PositionState()
             if not trades:
@@ -203,57 +472,230 @@ class HoldingSnapshotService:
             trades_by_date[date_to_str(t.tr_date)].append(t)
 
         results = []
+        # 持仓周期：截至当日最后一笔入账交易的周期 (含回溯期)，此前沿用检查点
+        cycle = prev_snapshot.tr_cycle if prev_snapshot else None
+        # 检查点之后、目标区间之前的流量，计入第一个目标日 (日盈亏相对检查点市值)
+        carried = None
 
-        # 3. 逐日遍历
-        safety_counter = 0
-        max_days = (target_end - calc_cursor).days + 1 + 30
-
-        while calc_cursor <= target_end:
-            safety_counter += 1
-            if safety_counter > max_days + 100:
-                logger.warning(f"Loop safety limit reached for {holding.ho_code}")
-                break
-
+        # 3. 逐日遍历 (交易日网格一次性取出)
+        for calc_cursor in cls._trade_day_grid(calc_cursor, target_end):
             date_str = date_to_str(calc_cursor)
 
-            nav_today = navs.get(date_str)
+            nav_today = navs.get(calc_cursor)
             trades_today = trades_by_date.get(date_str, [])
 
             # 优化：如果在回溯期，且当天没交易，直接跳过
             if calc_cursor < target_start and not trades_today:
-                calc_cursor = trade_calendar.next_trade_day(calc_cursor)
                 continue
 
             # 如果在目标期，必须有净值才能生成快照
             if calc_cursor >= target_start and not nav_today:
                 if trades_today:
                     logger.warning(f"Missing NAV for {holding.ho_code} on {date_str} with trades. Skipping snapshot.")
-                calc_cursor = trade_calendar.next_trade_day(calc_cursor)
                 continue
 
             # 应用交易 (更新 State)
             current_state, flows = cls._apply_trades(
                 current_state, trades_today, user_id, holding.ho_code
             )
+            if trades_today:
+                cycle = trades_today[-1].tr_cycle
+
+            # 回溯期：只推进状态
+            if calc_cursor < target_start:
+                if prev_snapshot:
+                    carried = cls._merge_flows(carried, flows)
+                continue
+            if carried:
+                flows, carried = cls._merge_flows(carried, flows), None
 
             # 生成快照 (仅在目标区间内)
-            if calc_cursor >= target_start:
-                cycle = trades_today[-1].tr_cycle if trades_today else (results[-1].tr_cycle if results else None)
+            snap = cls._create_snapshot_entity(
+                state=current_state,
+                holding=holding,
+                nav_today=nav_today,
+                flows=flows,
+                prev_snapshot=results[-1] if results else prev_snapshot,
+                user_id=user_id
+            )
+            snap.tr_cycle = cycle
+            results.append(snap)
 
-                snap = cls._create_snapshot_entity(
-                    state=current_state,
-                    holding=holding,
-                    nav_today=nav_today,
-                    flows=flows,
-                    prev_snapshot=results[-1] if results else prev_snapshot,
-                    user_id=user_id
-                )
-                snap.tr_cycle = cycle
-                results.append(snap)
+        return results
 
-            calc_cursor = trade_calendar.next_trade_day(calc_cursor)
+    @classmethod
+    def _calculate_range_vectorized(
+            cls,
+            holding: Holding,
+            user_id: int,
+            target_start: date,
+            target_end: date,
+            trades: List[Trade],
+            navs: NavSeries,
+            prev_snapshot: Optional[HoldingSnapshot],
+            fixed: bool = False
+    ) -> List[HoldingSnapshot]:
+        """
+        向量化计算逻辑：与 _calculate_range 输出相同的快照，
+        状态推进由 app.engine.position_replay 在整个日期网格上以数组运算完成。
+        fixed 为 True 时使用定点整数重放。
+        """
+        job, sorted_trades = cls._build_replay_job(
+            holding.id, target_start, target_end, trades, navs, prev_snapshot, fixed=fixed
+        )
+        if job is None:
+            return []
+        try:
+            replayed = run_replay_job(job)
+        except OversellError as e:
+            raise AsyncTaskException(cls._create_oversell_task(
+                user_id, holding.ho_code, sorted_trades[e.trade_index], e.shares_available
+            ))
+        return cls._replay_to_snapshots(replayed, holding.id, user_id, navs)
 
-        return results
+    @classmethod
+    def _calculate_range_fixed(
+            cls,
+            holding: Holding,
+            user_id: int,
+            target_start: date,
+            target_end: date,
+            trades: List[Trade],
+            navs: NavSeries,
+            prev_snapshot: Optional[HoldingSnapshot]
+    ) -> List[HoldingSnapshot]:
+        """
+        定点整数计算逻辑：金额以 10^4 倍的 int64 精确累计，输出即为 4 位小数。
+        数值超出 int64 安全范围时回退到 Decimal 路径。
+        """
+        kwargs = dict(holding=holding, user_id=user_id, target_start=target_start, target_end=target_end,
+                      trades=trades, navs=navs, prev_snapshot=prev_snapshot)
+        try:
+            return cls._calculate_range_vectorized(**kwargs, fixed=True)
+        except FixedPointOverflow as e:
+            logger.warning(f"{holding.ho_code}: {e}, falling back to Decimal engine")
+            return cls._calculate_range(**kwargs)
+
+    @classmethod
+    def _calculate_range_verified(
+            cls,
+            holding: Holding,
+            user_id: int,
+            target_start: date,
+            target_end: date,
+            trades: List[Trade],
+            navs: NavSeries,
+            prev_snapshot: Optional[HoldingSnapshot]
+    ) -> List[HoldingSnapshot]:
+        """
+        校验模式：分别以 Decimal 与定点整数计算，逐列按列精度比较，
+        不一致时抛出 FixedPointMismatch；一致时返回 Decimal 结果。
+        """
+        kwargs = dict(holding=holding, user_id=user_id, target_start=target_start, target_end=target_end,
+                      trades=trades, navs=navs, prev_snapshot=prev_snapshot)
+        expected = cls._calculate_range(**kwargs)
+        actual = cls._calculate_range_fixed(**kwargs)
+        columns = HoldingSnapshot.__table__.c
+        assert_fixed_matches(
+            expected, actual,
+            scales={name: columns[name].type.scale for name in AMOUNT_COLUMNS},
+            label=f"holding {holding.ho_code}"
+        )
+        return expected
+
+    @classmethod
+    def _build_replay_job(
+            cls,
+            ho_id: int,
+            target_start: date,
+            target_end: date,
+            trades: List[Trade],
+            navs: NavSeries,
+            prev_snapshot: Optional[HoldingSnapshot],
+            fixed: bool = False
+    ) -> Tuple[Optional[ReplayJob], List[Trade]]:
+        """
+        将 ORM 输入转换为纯数据的重放任务。
+        返回 (job, 排序后的交易)；无需计算时 job 为 None。
+        """
+        # 1. 确定计算的起始点 (与 Decimal 路径一致)
+        if prev_snapshot:
+            initial = InitialPosition.from_snapshot(prev_snapshot)
+            calc_cursor = cls._resume_cursor(prev_snapshot, target_start)
+        else:
+            initial = None
+            if not trades:
+                return None, []
+            calc_cursor = trades[0].tr_date
+
+        # 2. 构建交易日网格与对齐的净值数组
+        days = np.array(cls._trade_day_grid(calc_cursor, target_end), dtype='datetime64[D]')
+        sorted_trades = sorted(trades, key=lambda x: x.tr_date)
+        job = ReplayJob(
+            ho_id=ho_id,
+            days=days,
+            navs=navs.values_on(days),
+            target_start=np.datetime64(target_start, 'D'),
+            trades=TradeArrays.from_trades(sorted_trades),
+            initial=initial,
+            fixed=fixed
+        )
+        return job, sorted_trades
+
+    @classmethod
+    def _replay_to_snapshots(cls, replayed: ReplayColumns, ho_id: int, user_id: int, navs: NavSeries) -> List[HoldingSnapshot]:
+        # 市场价格按净值列精度还原为 Decimal
+        market_prices = [navs.get(d).nav_per_unit for d in replayed.snapshot_dates()]
+        return cls._columns_to_snapshots(replayed, ho_id, user_id, market_prices)
+
+    @staticmethod
+    def _columns_to_snapshots(
+            replayed: ReplayColumns,
+            ho_id: int,
+            user_id: int,
+            market_prices: Optional[List[Decimal]] = None
+    ) -> List[HoldingSnapshot]:
+        """列式结果 -> HoldingSnapshot，金额列统一量化到 4 位小数 (定点 int64 列直接还原)"""
+        columns = {}
+        for name in AMOUNT_COLUMNS:
+            values = replayed.columns[name]
+            if values.dtype.kind == 'i':
+                columns[name] = to_decimals(values)
+            else:
+                columns[name] = [Decimal(f"{v:.4f}") for v in values.tolist()]
+        if market_prices is not None:
+            columns['market_price'] = market_prices
+
+        cycles = [None if np.isnan(c) else int(c) for c in replayed.tr_cycles.tolist()]
+        cleared = replayed.is_cleared.tolist()
+
+        snapshots = []
+        for i, snapshot_date in enumerate(replayed.snapshot_dates()):
+            snapshot = HoldingSnapshot()
+            snapshot.user_id = user_id
+            snapshot.ho_id = ho_id
+            snapshot.snapshot_date = snapshot_date
+            for name in AMOUNT_COLUMNS:
+                setattr(snapshot, name, columns[name][i])
+            snapshot.tr_cycle = cycles[i]
+            snapshot.is_cleared = cleared[i]
+            snapshots.append(snapshot)
+        return snapshots
+
+    @staticmethod
+    def _create_oversell_task(user_id: int, ho_code: Optional[str], trade: Trade, shares_available):
+        """超卖：记录异步任务以便数据修复后重新生成"""
+        return create_task(
+            user_id=user_id,
+            task_name=f"regenerate all holding snapshots for {ho_code or trade.ho_id} in _apply_trades",
+            module_path="app.service.holding_snapshot_service",
+            method_name="generate_snapshots",
+            kwargs={"ids": [trade.ho_id]},
+            error_message=(
+                f"Sell exceeds: Attempted to sell {trade.tr_shares} shares for holding {trade.ho_id} "
+                f"on {trade.tr_date}, but only {shares_available} shares are available."
+            )
+        )
 
     @staticmethod
     def _apply_trades(
@@ -282,18 +724,9 @@ class HoldingSnapshotService:
             elif trade.tr_type == TradeTypeEnum.SELL.value:
                 if state.shares <= ZERO:
                     # 数据质量问题：超卖
-                    async_task_log = create_task(
-                        user_id=user_id,
-                        task_name=f"regenerate all holding snapshots for {ho_code or trade.ho_id} in _apply_trades",
-                        module_path="app.service.holding_snapshot_service",
-                        method_name="generate_snapshots",
-                        kwargs={"ids": [trade.ho_id]},
-                        error_message=(
-                            f"Sell exceeds: Attempted to sell {trade.tr_shares} shares for holding {trade.ho_id} "
-                            f"on {trade.tr_date}, but only {state.shares} shares are available."
-                        )
+                    raise AsyncTaskException(
+                        HoldingSnapshotService._create_oversell_task(user_id, ho_code, trade, state.shares)
                     )
-                    raise AsyncTaskException(async_task_log)
 
                 avg_cost = state.hos_holding_cost / state.shares
                 cost_sold = avg_cost * trade.tr_shares
@@ -317,11 +750,18 @@ class HoldingSnapshotService:
 
         return state, flows
 
+    @staticmethod
+    def _merge_flows(base: Optional[dict], flows: dict) -> dict:
+        """逐项累加两段的当日流量"""
+        if base is None:
+            return dict(flows)
+        return {key: base[key] + value for key, value in flows.items()}
+
     @staticmethod
     def _create_snapshot_entity(
             state: PositionState,
             holding: Holding,
-            nav_today: FundNavHistory,
+            nav_today: NavPoint,
             flows: dict,
             prev_snapshot: Optional[HoldingSnapshot],
             user_id: int
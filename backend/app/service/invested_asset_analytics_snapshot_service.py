@@ -2,17 +2,24 @@
 from loguru import logger
 import time
 from datetime import date, timedelta
-from decimal import Decimal
 from typing import Dict, Optional, List
 
 import numpy as np
 import pandas as pd
-from scipy import optimize
+from sqlalchemy import and_, or_
 
 from app.calendars.trade_calendar import trade_calendar
+from app.constant.biz_enums import AnalyticsMaterializeEnum, ErrorMessageEnum
+from app.engine.array_cache import ArrayCache
+from app.engine.drawdown import drawdown_stats
+from app.engine.rolling_metrics import RollingMetricsEngine, expanding_starts, rolling_starts
+from app.engine.xirr import xirr_windows
 from app.extension import db
 from app.framework.async_task_manager import create_task
+from app.framework.exceptions import BizException
+from app.mapper.bulk_upsert_mapper import BulkUpsertMapper, RecordBatch
 from app.models import InvestedAssetSnapshot, AnalyticsWindow, InvestedAssetAnalyticsSnapshot, UserSetting
+from app.utils.date_util import date_to_str
 
 
 # 常量配置
@@ -20,8 +27,34 @@ TRADING_DAYS_PER_YEAR = 252
 CALENDAR_DAYS_PER_YEAR = 365.25
 MIN_ANNUALIZATION_DAYS = 30
 EPSILON = 1e-6
-ZERO = Decimal('0')
 DEFAULT_RISK_FREE_RATE = 0.02
+# 自定义区间查询缓存的用户数上限
+CUSTOM_RANGE_CACHE_SIZE = 64
+
+# 指标 -> InvestedAssetAnalyticsSnapshot 字段
+_METRIC_COLUMNS = {
+    'twrr_cum': 'twrr_cumulative',
+    'twrr_ann': 'twrr_annualized',
+    'irr_cum': 'irr_cumulative',
+    'irr_ann': 'irr_annualized',
+    'period_pnl': 'period_pnl',
+    'period_pnl_ratio': 'period_pnl_ratio',
+    'volatility': 'volatility',
+    'mdd': 'max_drawdown',
+    'mdd_start': 'max_drawdown_start_date',
+    'mdd_end': 'max_drawdown_end_date',
+    'mdd_recovery': 'max_drawdown_recovery_date',
+    'sharpe': 'sharpe_ratio',
+    'sortino': 'sortino_ratio',
+    'calmar': 'calmar_ratio',
+    'win_rate': 'win_rate',
+    'best_day': 'best_day_return',
+    'worst_day': 'worst_day_return',
+}
+_DATE_METRICS = ('mdd_start', 'mdd_end', 'mdd_recovery')
+
+# user_id -> (快照序列 DataFrame, RollingMetricsEngine)
+_series_cache = ArrayCache(CUSTOM_RANGE_CACHE_SIZE)
 
 
 class InvestedAssetAnalyticsSnapshotService:
@@ -38,15 +71,15 @@ class InvestedAssetAnalyticsSnapshotService:
         logger.info(f"Starting InvestedAssetAnalytics generation: {start_date} to {end_date} for user {user_id}")
         start_time = time.time()
 
-        # 1. 加载窗口配置
-        windows = AnalyticsWindow.query.all()
-        if not windows:
+        # 1. 加载窗口配置 (ON_READ 窗口读取时计算，不落库)
+        all_windows = AnalyticsWindow.query.all()
+        if not all_windows:
             logger.warning("No AnalyticsWindow defined.")
             return {"total_generated": 0, "errors": []}
+        windows = [w for w in all_windows if w.materialize_policy != AnalyticsMaterializeEnum.ON_READ]
 
         # 2. 获取用户的 risk_free_rate
-        user = UserSetting.query.get(user_id)
-        risk_free_rate = float(user.risk_free_rate) if user and user.risk_free_rate else DEFAULT_RISK_FREE_RATE
+        risk_free_rate = cls._risk_free_rate(user_id)
 
         # 3. 加载历史数据 (需要比 start_date 更早的数据用于计算滚动窗口)
         raw_df = cls._load_data(user_id, end_date)
@@ -63,16 +96,19 @@ class InvestedAssetAnalyticsSnapshotService:
 
         # 4. 数据库持久化
         total_generated = 0
+        upsert_result = None
         if result_snaps:
             try:
-                # 删除旧数据
-                db.session.query(InvestedAssetAnalyticsSnapshot).filter(
-                    InvestedAssetAnalyticsSnapshot.user_id == user_id,
-                    InvestedAssetAnalyticsSnapshot.snapshot_date >= start_date,
-                    InvestedAssetAnalyticsSnapshot.snapshot_date <= end_date
-                ).delete(synchronize_session=False)
-
-                db.session.bulk_save_objects(result_snaps)
+                upsert_result = BulkUpsertMapper.upsert(
+                    InvestedAssetAnalyticsSnapshot,
+                    result_snaps,
+                    prune_scope=[
+                        InvestedAssetAnalyticsSnapshot.user_id == user_id,
+                        InvestedAssetAnalyticsSnapshot.snapshot_date >= start_date,
+                        InvestedAssetAnalyticsSnapshot.snapshot_date <= end_date
+                    ]
+                )
+                cls._prune_lazy_windows(user_id, all_windows, max(result_snaps.column('snapshot_date')))
                 db.session.commit()
                 total_generated = len(result_snaps)
                 logger.info(f"Generated {total_generated} analytics snapshots.")
@@ -80,7 +116,121 @@ class InvestedAssetAnalyticsSnapshotService:
                 db.session.rollback()
                 logger.exception(f"DB Error: {e}")
 
-        return {"total_generated": total_generated, "duration": time.time() - start_time}
+        return {
+            "total_generated": total_generated,
+            "duration": time.time() - start_time,
+            "upsert": upsert_result.to_dict() if upsert_result else None
+        }
+
+    @classmethod
+    def get_custom_range_metrics(cls, user_id: int, start_date: date, end_date: date) -> Optional[Dict]:
+        """
+        任意 [start_date, end_date] 区间的分析指标，即时计算、不落库。
+        用户的快照序列与前缀数组缓存在进程内 LRU 中，以 (行数, 最后日期, 最后更新时间) 作为版本，
+        快照重算后自动失效；区间内无快照时返回 None。
+        """
+        if start_date > end_date:
+            raise BizException(msg=ErrorMessageEnum.INVALID_DATE_RANGE.view)
+
+        # 1. 取缓存 (版本变化时重新加载)
+        df, days, engine = _series_cache.get(
+            user_id,
+            lambda: cls._load_series(user_id),
+            version=cls._series_version(user_id)
+        )
+        if df.empty:
+            return None
+
+        # 2. 区间对应的行号 (序列按日期升序，二分定位)
+        start = int(days.searchsorted(np.datetime64(start_date, 'D'), side='left'))
+        end = int(days.searchsorted(np.datetime64(end_date, 'D'), side='right')) - 1
+        if start > end:
+            return None
+
+        # 3. 单窗口整列计算，口径与物化窗口一致
+        metrics = cls._window_metrics(df, engine, np.array([start]), np.array([end]), cls._risk_free_rate(user_id))
+
+        result = {
+            'start_date': date_to_str(df.index[start]),
+            'end_date': date_to_str(df.index[end]),
+            'days': end - start + 1,
+        }
+        for key, column in _METRIC_COLUMNS.items():
+            value = metrics[key][0]
+            if key in _DATE_METRICS:
+                result[column] = date_to_str(value) if value is not None else None
+            else:
+                result[column] = None if np.isnan(value) else float(value)
+        return result
+
+    @classmethod
+    def compute_on_read(cls, user_id: int, window: AnalyticsWindow,
+                        as_of: Optional[date] = None) -> Optional[InvestedAssetAnalyticsSnapshot]:
+        """
+        ON_READ 窗口的读取：基于自定义区间共用的数组缓存，即时算出 as_of (为空时取最新) 当日或之前最近一个快照日的指标。
+        返回未加入会话的 InvestedAssetAnalyticsSnapshot (不含基准指标)；无数据时为 None。
+        """
+        df, days, engine = _series_cache.get(
+            user_id,
+            lambda: cls._load_series(user_id),
+            version=cls._series_version(user_id)
+        )
+        if df.empty:
+            return None
+        row = len(days) - 1 if as_of is None else int(days.searchsorted(np.datetime64(as_of, 'D'), side='right')) - 1
+        if row < 0:
+            return None
+
+        rows = np.array([row])
+        starts = cls._window_starts(window, rows)
+        if starts is None:
+            return None
+        metrics = cls._window_metrics(df, engine, starts, rows, cls._risk_free_rate(user_id))
+        values = {}
+        for key, column in _METRIC_COLUMNS.items():
+            value = metrics[key][0]
+            values[column] = value if key in _DATE_METRICS or not np.isnan(value) else None
+        return InvestedAssetAnalyticsSnapshot(
+            user_id=user_id, snapshot_date=df.index[row].date(), window_key=window.window_key, **values
+        )
+
+    @staticmethod
+    def _prune_lazy_windows(user_id: int, windows: List[AnalyticsWindow], latest_date: date):
+        """LATEST 窗口只保留 latest_date 一行，ON_READ 窗口的历史行全部删除 (策略调整后的遗留数据)"""
+        latest_keys = [w.window_key for w in windows if w.materialize_policy == AnalyticsMaterializeEnum.LATEST]
+        on_read_keys = [w.window_key for w in windows if w.materialize_policy == AnalyticsMaterializeEnum.ON_READ]
+        if not latest_keys and not on_read_keys:
+            return
+        InvestedAssetAnalyticsSnapshot.query.filter(
+            InvestedAssetAnalyticsSnapshot.user_id == user_id,
+            or_(
+                and_(InvestedAssetAnalyticsSnapshot.window_key.in_(latest_keys),
+                     InvestedAssetAnalyticsSnapshot.snapshot_date < latest_date),
+                InvestedAssetAnalyticsSnapshot.window_key.in_(on_read_keys)
+            )
+        ).delete(synchronize_session=False)
+
+    @classmethod
+    def _load_series(cls, user_id: int):
+        """自定义区间缓存的加载函数：全量快照序列、按日的日期数组及前缀数组"""
+        df = cls._load_data(user_id, date.max)
+        if df.empty:
+            return df, None, None
+        return df, df.index.to_numpy(dtype='datetime64[D]'), cls._build_engine(df)
+
+    @staticmethod
+    def _series_version(user_id: int):
+        """用户快照序列的版本标识 (新增、删除、重算都会改变)"""
+        return tuple(db.session.query(
+            db.func.count(InvestedAssetSnapshot.id),
+            db.func.max(InvestedAssetSnapshot.snapshot_date),
+            db.func.max(InvestedAssetSnapshot.updated_at)
+        ).filter(InvestedAssetSnapshot.user_id == user_id).one())
+
+    @staticmethod
+    def _risk_free_rate(user_id: int) -> float:
+        user = UserSetting.query.get(user_id)
+        return float(user.risk_free_rate) if user and user.risk_free_rate else DEFAULT_RISK_FREE_RATE
 
     @classmethod
     def _load_data(cls, user_id: int, up_to_date: date) -> pd.DataFrame:
@@ -110,69 +260,132 @@ class InvestedAssetAnalyticsSnapshotService:
     @classmethod
     def _calculate_range(cls, df: pd.DataFrame, windows: List[AnalyticsWindow],
                          start_date: date, end_date: date, user_id: int,
-                         risk_free_rate: float = DEFAULT_RISK_FREE_RATE) -> List[InvestedAssetAnalyticsSnapshot]:
+                         risk_free_rate: float = DEFAULT_RISK_FREE_RATE) -> RecordBatch:
         """
-        核心计算逻辑：遍历日期和窗口，生成快照对象。
+        核心计算逻辑：前缀数组 / 回撤队列只构建一次，每个窗口在所有目标日期上的指标整列算出，
+        按 (日期, 窗口配置顺序) 写入列式快照批 (不实例化 ORM 对象)。
+        LATEST 窗口只计算最后一个目标日期。
         """
-        results = []
-
-        # 过滤出目标日期索引
-        target_dates = df.loc[start_date:end_date].index
-
-        for t_date in target_dates:
-            # 截止到当天的历史数据
-            df_hist = df.loc[:t_date]
-
-            for window in windows:
-                # 获取窗口切片
-                df_w = cls._get_window(df_hist, window)
-                if df_w.empty or len(df_w) < 1:
-                    continue
-
-                # 计算指标
-                metrics = cls._compute_metrics(df_w, risk_free_rate)
-
-                # 组装对象
-                snap = InvestedAssetAnalyticsSnapshot()
-                snap.user_id = user_id
-                snap.snapshot_date = t_date.date()
-                snap.window_key = window.window_key
-
-                snap.twrr_cumulative = metrics.get('twrr_cum')
-                snap.twrr_annualized = metrics.get('twrr_ann')
-                snap.irr_cumulative = metrics.get('irr_cum')
-                snap.irr_annualized = metrics.get('irr_ann')
-                snap.period_pnl = metrics.get('period_pnl')
-                snap.period_pnl_ratio = metrics.get('period_pnl_ratio')
-
-                snap.volatility = metrics.get('volatility')
-                snap.max_drawdown = metrics.get('mdd')
-                snap.max_drawdown_start_date = metrics.get('mdd_start')
-                snap.max_drawdown_end_date = metrics.get('mdd_end')
-                snap.max_drawdown_recovery_date = metrics.get('mdd_recovery')
-                snap.sharpe_ratio = metrics.get('sharpe')
-                snap.sortino_ratio = metrics.get('sortino')
-                snap.calmar_ratio = metrics.get('calmar')
-
-                snap.win_rate = metrics.get('win_rate')
-                snap.best_day_return = metrics.get('best_day')
-                snap.worst_day_return = metrics.get('worst_day')
-
-                results.append(snap)
-
-        return results
+        # 1. 目标日期 (行号)
+        target_rows = np.flatnonzero((df.index >= pd.Timestamp(start_date)) & (df.index <= pd.Timestamp(end_date)))
+        if not len(target_rows):
+            return RecordBatch(0, {})
+
+        # 2. 前缀数组只构建一次，所有窗口共用
+        engine = cls._build_engine(df)
+
+        # 3. 逐窗口整列计算
+        dates = df.index.date
+        batches, row_pos, window_pos = [], [], []
+        for order, window in enumerate(windows):
+            positions = np.arange(len(target_rows))
+            if window.materialize_policy == AnalyticsMaterializeEnum.LATEST:
+                positions = positions[-1:]
+            rows = target_rows[positions]
+            starts = cls._window_starts(window, rows)
+            if starts is None:
+                continue
+            metrics = cls._window_metrics(df, engine, starts, rows, risk_free_rate)
+            columns = {column: metrics[key] for key, column in _METRIC_COLUMNS.items()}
+            columns['snapshot_date'] = dates[rows]
+            columns['window_key'] = window.window_key
+            batches.append(RecordBatch(len(rows), columns))
+            row_pos.append(positions)
+            window_pos.append(np.full(len(rows), order))
+
+        if not batches:
+            return RecordBatch(0, {})
+
+        # 4. 日期优先、与窗口配置顺序一致
+        order = np.lexsort((np.concatenate(window_pos), np.concatenate(row_pos)))
+        result = RecordBatch.concat(batches).take(order)
+        result.columns['user_id'] = user_id
+        return result
+
+    @staticmethod
+    def _build_engine(df: pd.DataFrame) -> RollingMetricsEngine:
+        return RollingMetricsEngine(
+            returns=df['ret'].to_numpy(),
+            pnl=df['pnl'].to_numpy(),
+            cash_dividend=df['dividend'].to_numpy(),
+            reinvest_dividend=np.zeros(len(df))
+        )
 
     @staticmethod
-    def _get_window(df: pd.DataFrame, window: AnalyticsWindow) -> pd.DataFrame:
+    def _window_starts(window: AnalyticsWindow, rows: np.ndarray) -> Optional[np.ndarray]:
+        """每个目标行的窗口起点：滚动窗口为最近 window_days 行，扩张窗口为首行；窗口不产出数据时为 None"""
         if window.window_type == 'rolling':
-            return df.tail(window.window_days) if window.window_days else pd.DataFrame()
+            return rolling_starts(rows, window.window_days) if window.window_days else None
         elif window.window_type == 'expanding':
-            return df
-        return pd.DataFrame()
+            return expanding_starts(rows)
+        return None
+
+    @classmethod
+    def _window_metrics(cls, df: pd.DataFrame, engine: RollingMetricsEngine, starts: np.ndarray,
+                        ends: np.ndarray, risk_free_rate: float) -> Dict[str, np.ndarray]:
+        """一个窗口在所有目标日期上的指标列，口径与 _compute_metrics 一致"""
+        cols = engine.compute(starts, ends, TRADING_DAYS_PER_YEAR, MIN_ANNUALIZATION_DAYS)
+        dates = df.index.date
+
+        # 1. TWRR (不足年化天数的年化值为 NaN)
+        twrr_ann = cols['twrr_ann']
+        has_ann = ~np.isnan(twrr_ann) & (twrr_ann != 0)
+
+        # 2. 区间盈亏与收益率：本金 = 窗口首行的 T-1 日市值
+        mv, pnl, net_flow = (df[name].to_numpy(dtype=np.float64)[starts] for name in ('mv', 'pnl', 'net_flow'))
+        start_capital = mv - pnl - net_flow
+        start_capital = np.where(start_capital < 1.0, start_capital + net_flow, start_capital)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            period_pnl_ratio = np.where(start_capital > 1.0, cols['cum_pnl'] / start_capital, 0.0)
+
+        # 3. XIRR (批量求解) 及其区间累计值
+        irr_ann = cls._batch_xirr(df, starts, ends)
+        days = (df.index[ends] - df.index[starts]).days.to_numpy()
+        with np.errstate(invalid='ignore'):
+            irr_cum = np.where(days > 0, np.power(1 + irr_ann, days / CALENDAR_DAYS_PER_YEAR) - 1, np.nan)
+
+        # 4. 风险指标 (样本不足时为 0)
+        volatility = np.nan_to_num(cols['volatility'], nan=0.0)
+        downside_std = np.nan_to_num(cols['downside_risk'], nan=0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sharpe = np.where(has_ann & (volatility > EPSILON), (twrr_ann - risk_free_rate) / volatility, 0.0)
+            sortino = np.where(has_ann & (downside_std > EPSILON), (twrr_ann - risk_free_rate) / downside_std, 0.0)
+
+        # 5. 回撤 (无回撤时不记修复日)
+        mdd = cols['mdd']
+        drawdown = mdd < 0
+        recovery = cols['mdd_recovery']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            calmar = np.where(drawdown & has_ann, twrr_ann / np.abs(mdd), 0.0)
+
+        best_day, worst_day = engine.day_extremes(starts, ends)
+        return {
+            'twrr_cum': cols['twrr_cum'],
+            'twrr_ann': twrr_ann,
+            'irr_ann': irr_ann,
+            'irr_cum': irr_cum,
+            'period_pnl': cols['cum_pnl'],
+            'period_pnl_ratio': period_pnl_ratio,
+            'volatility': volatility,
+            'mdd': mdd,
+            'mdd_start': dates[cols['mdd_peak']],
+            'mdd_end': dates[cols['mdd_trough']],
+            'mdd_recovery': np.where(drawdown & (recovery >= 0), dates[np.maximum(recovery, 0)], None),
+            'sharpe': sharpe,
+            'sortino': sortino,
+            'calmar': calmar,
+            'win_rate': cols['win_rate'],
+            'best_day': best_day,
+            'worst_day': worst_day,
+        }
 
     @classmethod
-    def _compute_metrics(cls, df: pd.DataFrame, risk_free_rate: float = DEFAULT_RISK_FREE_RATE) -> Dict:
-        """计算所有指标"""
+    def _compute_metrics(cls, df: pd.DataFrame, risk_free_rate: float = DEFAULT_RISK_FREE_RATE,
+                         irr_ann: Optional[float] = None) -> Dict:
+        """
+        单个切片的全部指标 (浮点原值，缺失为 NaN / None)，_window_metrics 的逐窗口参照实现
+        :param irr_ann: 由 _batch_xirr 预先求出的年化 XIRR
+        """
         n = len(df)
         rets = df['ret']
         pnls = df['pnl']
@@ -191,51 +404,34 @@ class InvestedAssetAnalyticsSnapshotService:
         if start_capital < 1.0:
             start_capital += first_row['net_flow']
 
-        period_pnl_ratio = period_pnl / start_capital if start_capital > 1.0 else ZERO
+        period_pnl_ratio = period_pnl / start_capital if start_capital > 1.0 else 0.0
 
         # 3. IRR (XIRR)
-        irr_ann = None
         irr_cum = None
-        if n >= MIN_ANNUALIZATION_DAYS:
-            irr_ann = cls._calc_xirr(df)
-            if irr_ann is not None:
-                days = (df.index[-1] - df.index[0]).days
-                if days > 0:
-                    irr_cum = (1 + irr_ann) ** (days / CALENDAR_DAYS_PER_YEAR) - 1
+        if n < MIN_ANNUALIZATION_DAYS:
+            irr_ann = None
+        elif irr_ann is not None:
+            days = (df.index[-1] - df.index[0]).days
+            if days > 0:
+                irr_cum = (1 + irr_ann) ** (days / CALENDAR_DAYS_PER_YEAR) - 1
 
         # 4. Risk Metrics
-        volatility = rets.std(ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR) if n > 1 else ZERO
-        sharpe = (twrr_ann - risk_free_rate) / volatility if (volatility > EPSILON and twrr_ann) else ZERO
+        volatility = rets.std(ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR) if n > 1 else 0.0
+        sharpe = (twrr_ann - risk_free_rate) / volatility if (volatility > EPSILON and twrr_ann) else 0.0
 
         neg_rets = rets[rets < 0]
-        downside_std = neg_rets.std(ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR) if len(neg_rets) > 1 else ZERO
-        sortino = (twrr_ann - risk_free_rate) / downside_std if (downside_std > EPSILON and twrr_ann) else ZERO
-
-        # 5. MDD
-        nav = (1 + rets).cumprod()
-        running_max = nav.cummax()
-        dd = (nav - running_max) / running_max
-        mdd = dd.min()
-
-        mdd_end_ts = dd.idxmin()
-        mdd_end = mdd_end_ts.date()
-
-        # MDD Start
-        peak_val = running_max.loc[mdd_end_ts]
-        subset = running_max.loc[:mdd_end_ts]
-        mdd_start_ts = subset[subset == peak_val].index[-1]
-        mdd_start = mdd_start_ts.date()
-
-        # Recovery
-        mdd_recovery = None
-        if mdd < 0:
-            after_trough = nav.loc[mdd_end_ts:].iloc[1:]
-            if not after_trough.empty:
-                rec_mask = after_trough >= peak_val
-                if rec_mask.any():
-                    mdd_recovery = rec_mask.idxmax().date()
-
-        calmar = twrr_ann / abs(mdd) if (mdd < 0 and twrr_ann) else ZERO
+        downside_std = neg_rets.std(ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR) if len(neg_rets) > 1 else 0.0
+        sortino = (twrr_ann - risk_free_rate) / downside_std if (downside_std > EPSILON and twrr_ann) else 0.0
+
+        # 5. MDD (峰值 / 谷底 / 修复由数组内核一次求出，无回撤时不记修复日)
+        dd = drawdown_stats(rets.to_numpy())
+        dates = df.index.date
+        mdd = dd.max_drawdown
+        mdd_start = dates[dd.peak] if dd.peak >= 0 else None
+        mdd_end = dates[dd.trough] if dd.trough >= 0 else None
+        mdd_recovery = dates[dd.recovery] if (mdd < 0 and dd.recovery >= 0) else None
+
+        calmar = twrr_ann / abs(mdd) if (mdd < 0 and twrr_ann) else 0.0
 
         # 6. Distribution
         win_rate = (rets > 0).sum() / n
@@ -243,65 +439,51 @@ class InvestedAssetAnalyticsSnapshotService:
         worst_day = rets.min()
 
         return {
-            'twrr_cum': Decimal(f"{twrr_cum:.6f}"),
-            'twrr_ann': Decimal(f"{twrr_ann:.6f}") if twrr_ann is not None else None,
-            'irr_ann': Decimal(f"{irr_ann:.6f}") if irr_ann is not None else None,
-            'irr_cum': Decimal(f"{irr_cum:.6f}") if irr_cum is not None else None,
-            'period_pnl': Decimal(f"{period_pnl:.4f}"),
-            'period_pnl_ratio': Decimal(f"{period_pnl_ratio:.6f}"),
-            'volatility': Decimal(f"{volatility:.6f}"),
-            'mdd': Decimal(f"{mdd:.6f}"),
+            'twrr_cum': twrr_cum,
+            'twrr_ann': np.nan if twrr_ann is None else twrr_ann,
+            'irr_ann': np.nan if irr_ann is None else irr_ann,
+            'irr_cum': np.nan if irr_cum is None else irr_cum,
+            'period_pnl': period_pnl,
+            'period_pnl_ratio': period_pnl_ratio,
+            'volatility': volatility,
+            'mdd': mdd,
             'mdd_start': mdd_start,
             'mdd_end': mdd_end,
             'mdd_recovery': mdd_recovery,
-            'sharpe': Decimal(f"{sharpe:.4f}"),
-            'sortino': Decimal(f"{sortino:.4f}"),
-            'calmar': Decimal(f"{calmar:.4f}"),
-            'win_rate': Decimal(f"{win_rate:.4f}"),
-            'best_day': Decimal(f"{best_day:.6f}"),
-            'worst_day': Decimal(f"{worst_day:.6f}"),
+            'sharpe': sharpe,
+            'sortino': sortino,
+            'calmar': calmar,
+            'win_rate': win_rate,
+            'best_day': best_day,
+            'worst_day': worst_day,
         }
 
     @staticmethod
-    def _calc_xirr(df: pd.DataFrame) -> Optional[float]:
-        """优化后的 XIRR 计算"""
-        # 构造现金流：NetFlow + Dividend
-        flows = df['net_flow'] + df['dividend']
-        # 加上期末市值 (作为赎回)
-        last_date = df.index[-1]
-        last_mv = df.iloc[-1]['mv']
-
-        # 构建数组
-        dates = list(flows.index)
-        amounts = list(flows.values)
-
-        if dates[-1] == last_date:
-            amounts[-1] += last_mv
-        else:
-            dates.append(last_date)
-            amounts.append(last_mv)
-
-        # 过滤 0
-        mask = np.array(amounts) != 0
-        amounts = np.array(amounts)[mask]
-        dates = np.array(dates)[mask]
-
-        if len(amounts) < 2 or not (np.any(amounts > 0) and np.any(amounts < 0)):
-            return None
-
-        def xnpv(rate):
-            d0 = dates[0]
-            time_diffs = np.array([(d - d0).days for d in dates]) / CALENDAR_DAYS_PER_YEAR
-            return np.sum(amounts / np.power(1.0 + rate, time_diffs))
-
-        try:
-            f_low = xnpv(-0.99)
-            f_high = xnpv(10.0)
-
-            if np.sign(f_low) == np.sign(f_high):
-                return None
+    def _batch_xirr(df: pd.DataFrame, starts: np.ndarray, ends: np.ndarray,
+                    min_rows: int = MIN_ANNUALIZATION_DAYS) -> np.ndarray:
+        """
+        批量 XIRR：现金流 = NetFlow + Dividend，期末市值作为赎回；
+        只接受 [-0.99, 10] 区间内端点异号的根，窗口不足 min_rows 行的为 NaN
+        """
+        irr = np.full(len(ends), np.nan)
+        eligible = np.flatnonzero(ends - starts + 1 >= min_rows)
+        if not len(eligible):
+            return irr
+        irr[eligible] = xirr_windows(
+            day_ordinals=df.index.to_numpy(dtype='datetime64[D]').astype(np.int64),
+            flows=(df['net_flow'] + df['dividend']).to_numpy(dtype=np.float64),
+            terminal_values=df['mv'].to_numpy(dtype=np.float64),
+            starts=starts[eligible],
+            ends=ends[eligible],
+            days_per_year=CALENDAR_DAYS_PER_YEAR,
+            bracketed=True
+        )
+        return irr
 
-            root = optimize.brentq(xnpv, -0.99, 10.0)
-            return root
-        except Exception:
+    @classmethod
+    def _calc_xirr(cls, df: pd.DataFrame) -> Optional[float]:
+        """单个切片的 XIRR (整段切片作为一个窗口批量求解)"""
+        if df.empty:
             return None
+        irr = cls._batch_xirr(df, np.zeros(1, dtype=np.int64), np.array([len(df) - 1]), min_rows=1)
+        return None if np.isnan(irr[0]) else float(irr[0])
@@ -1,19 +1,48 @@
 # app/service/invested_asset_snapshot_service.py
 import time
 from dataclasses import dataclass
-from datetime import date, timedelta
+from datetime import date
 from decimal import Decimal
+from itertools import accumulate
+from typing import Dict, List, Optional
 
-import pandas as pd
+import numpy as np
 from loguru import logger
+from sqlalchemy import func
 
 from app.calendars.trade_calendar import trade_calendar
+from app.constant.biz_enums import SnapshotEngineEnum
+from app.engine import fixed_point as fp
 from app.extension import db
 from app.framework.async_task_manager import create_task
-from app.models import HoldingSnapshot, InvestedAssetSnapshot
+from app.mapper.bulk_upsert_mapper import BulkUpsertMapper, RecordBatch
+from app.models import HoldingSnapshot, InvestedAssetIndex, InvestedAssetSnapshot
 
 ZERO = Decimal('0')
 
+# 每日合计的字段 (聚合键, 持仓快照字段)
+_AGGREGATE_COLUMNS = [
+    ('mv', HoldingSnapshot.hos_market_value),
+    ('cost', HoldingSnapshot.hos_holding_cost),
+    ('unrealized_pnl', HoldingSnapshot.hos_unrealized_pnl),
+    ('net_flow', HoldingSnapshot.hos_net_external_cash_flow),
+    ('cash_div', HoldingSnapshot.hos_daily_cash_dividend),
+    ('reinvest_div', HoldingSnapshot.hos_daily_reinvest_dividend),
+    ('buy', HoldingSnapshot.hos_daily_buy_amount),
+    ('sell', HoldingSnapshot.hos_daily_sell_amount),
+]
+
+# 收益率列 Numeric(18,6) 的小数位数
+RATIO_DIGITS = 6
+RATIO_QUANTUM = Decimal(1).scaleb(-RATIO_DIGITS)
+# 逐日计算写入的全部数值列 (校验模式比较)
+_SNAPSHOT_COLUMNS = (
+    'ias_market_value', 'ias_holding_cost', 'ias_unrealized_pnl', 'ias_net_external_cash_flow',
+    'ias_daily_cash_dividend', 'ias_daily_reinvest_dividend', 'ias_daily_pnl', 'ias_daily_pnl_ratio',
+    'ias_total_pnl', 'ias_total_cash_dividend', 'ias_total_reinvest_dividend', 'ias_total_dividend',
+    'ias_total_buy_amount', 'ias_total_sell_amount', 'ias_total_realized_pnl', 'ias_total_pnl_ratio',
+)
+
 
 @dataclass
 class _AggregateState:
@@ -35,60 +64,30 @@ class InvestedAssetSnapshotService:
     """
 
     @classmethod
-    def generate_snapshots(cls, user_id: int, start_date: date, end_date: date):
+    def generate_snapshots(
+            cls,
+            user_id: int,
+            start_date: date,
+            end_date: date,
+            engine: str = SnapshotEngineEnum.DECIMAL.value
+    ):
         """
         统一入口：生成指定时间段的投资组合快照。
 
         :param user_id: 用户ID
         :param start_date: 目标开始日期 (包含)
         :param end_date: 目标结束日期 (包含)
+        :param engine: FIXED 使用定点整数累加，VERIFY 同时计算并与 Decimal 结果校验，其余为逐日 Decimal
         """
         logger.info(f"Starting InvestedAssetSnapshot generation: {start_date} to {end_date} for user {user_id}")
         start_time = time.time()
 
-        # 1. 预加载基础数据
-        # 获取区间内所有的 HoldingSnapshot
-        snapshots = HoldingSnapshot.query.filter(
-            HoldingSnapshot.user_id == user_id,
-            HoldingSnapshot.snapshot_date >= start_date,
-            HoldingSnapshot.snapshot_date <= end_date
-        ).order_by(HoldingSnapshot.snapshot_date).all()
-
-        if not snapshots:
+        # 1-2. 按日期聚合的持仓快照 (数据库端 GROUP BY，精确定点数求和)
+        daily_agg_dict = cls._load_daily_aggregates(user_id, start_date, end_date)
+        if not daily_agg_dict:
             logger.info("No holding snapshots found in range.")
             return {"total_generated": 0, "errors": []}
 
-        # 2. 转换为 DataFrame 进行高效聚合
-        data = [{
-            'date': s.snapshot_date,
-            'mv': float(s.hos_market_value or 0),
-            'cost': float(s.hos_holding_cost or 0),
-            'unrealized_pnl': float(s.hos_unrealized_pnl or 0),
-            'net_flow': float(s.hos_net_external_cash_flow or 0),
-            'cash_div': float(s.hos_daily_cash_dividend or 0),
-            'reinvest_div': float(s.hos_daily_reinvest_dividend or 0),
-            'buy': float(s.hos_daily_buy_amount or 0),
-            'sell': float(s.hos_daily_sell_amount or 0),
-        } for s in snapshots]
-
-        df = pd.DataFrame(data)
-        # 按日期聚合求和
-        daily_agg = df.groupby('date').sum().reset_index()
-        # 转换回 Decimal 以保证精度
-        daily_agg_dict = {
-            row['date']: {
-                'mv': Decimal(str(row['mv'])),
-                'cost': Decimal(str(row['cost'])),
-                'unrealized_pnl': Decimal(str(row['unrealized_pnl'])),
-                'net_flow': Decimal(str(row['net_flow'])),
-                'cash_div': Decimal(str(row['cash_div'])),
-                'reinvest_div': Decimal(str(row['reinvest_div'])),
-                'buy': Decimal(str(row['buy'])),
-                'sell': Decimal(str(row['sell'])),
-            }
-            for _, row in daily_agg.iterrows()
-        }
-
         # 3. 获取初始状态 (start_date - 1 天)
         prev_date = trade_calendar.prev_trade_day(start_date)
         prev_snap = InvestedAssetSnapshot.query.filter_by(
@@ -109,39 +108,51 @@ class InvestedAssetSnapshotService:
         else:
             state = _AggregateState()
 
-        # 4. 逐日计算
-        results = []
-        current_date = start_date
-        while current_date <= end_date:
-            if not trade_calendar.is_trade_day(current_date):
-                current_date += timedelta(days=1)
-                continue
-
-            # 获取当日聚合数据
-            day_data = daily_agg_dict.get(current_date)
-            if not day_data:
-                # 如果当天没有持仓快照，跳过当天
+        # 4. 逐日计算 (当天没有持仓快照则跳过)
+        days = []
+        for current_date in trade_calendar.iter_trade_days(start_date, end_date):
+            if current_date in daily_agg_dict:
+                days.append(current_date)
+            else:
                 logger.warning(f"No HoldingSnapshot found for user {user_id} on {current_date}, skipping InvestedAssetSnapshot")
-                current_date += timedelta(days=1)
-                continue
 
-            new_snap, state = cls._calculate_daily_snapshot(user_id, current_date, state, day_data)
-            results.append(new_snap)
-            current_date += timedelta(days=1)
+        if engine == SnapshotEngineEnum.FIXED:
+            results = cls._calculate_range_fixed(user_id, days, daily_agg_dict, state)
+        else:
+            results = cls._calculate_range(user_id, days, daily_agg_dict, state)
+            if engine == SnapshotEngineEnum.VERIFY:
+                columns = InvestedAssetSnapshot.__table__.c
+                fp.assert_fixed_matches(
+                    results, cls._calculate_range_fixed(user_id, days, daily_agg_dict, state),
+                    scales={name: columns[name].type.scale for name in _SNAPSHOT_COLUMNS},
+                    label=f"invested asset of user {user_id}"
+                )
 
         # 5. 批量入库
         total_generated = 0
         errors = []
+        upsert_result = None
         if results:
             try:
-                # 删除旧数据
-                db.session.query(InvestedAssetSnapshot).filter(
-                    InvestedAssetSnapshot.user_id == user_id,
-                    InvestedAssetSnapshot.snapshot_date >= start_date,
-                    InvestedAssetSnapshot.snapshot_date <= end_date
-                ).delete(synchronize_session=False)
-
-                db.session.bulk_save_objects(results)
+                upsert_result = BulkUpsertMapper.upsert(
+                    InvestedAssetSnapshot,
+                    results,
+                    prune_scope=[
+                        InvestedAssetSnapshot.user_id == user_id,
+                        InvestedAssetSnapshot.snapshot_date >= start_date,
+                        InvestedAssetSnapshot.snapshot_date <= end_date
+                    ]
+                )
+                # 单位净值指数与快照同一事务写入
+                BulkUpsertMapper.upsert(
+                    InvestedAssetIndex,
+                    cls._build_index(user_id, start_date, results),
+                    prune_scope=[
+                        InvestedAssetIndex.user_id == user_id,
+                        InvestedAssetIndex.snapshot_date >= start_date,
+                        InvestedAssetIndex.snapshot_date <= end_date
+                    ]
+                )
                 db.session.commit()
                 total_generated = len(results)
                 logger.info(f"Generated {total_generated} InvestedAssetSnapshots.")
@@ -152,10 +163,233 @@ class InvestedAssetSnapshotService:
                 create_task(
                     user_id, "Fix InvestedAsset Snapshots",
                     "app.service.invested_asset_snapshot_service", "generate_snapshots",
-                    {"user_id": user_id, "start_date": str(start_date), "end_date": str(end_date)}, str(e)
+                    {"user_id": user_id, "start_date": str(start_date), "end_date": str(end_date), "engine": engine},
+                    str(e)
                 )
 
-        return {"total_generated": total_generated, "errors": errors, "duration": time.time() - start_time}
+        return {
+            "total_generated": total_generated,
+            "errors": errors,
+            "duration": time.time() - start_time,
+            "upsert": upsert_result.to_dict() if upsert_result else None
+        }
+
+    @classmethod
+    def _calculate_range(
+            cls,
+            user_id: int,
+            days: List[date],
+            daily_agg_dict: Dict[date, dict],
+            state: _AggregateState
+    ) -> List[InvestedAssetSnapshot]:
+        """逐日 Decimal 计算 (基准实现)"""
+        results = []
+        for current_date in days:
+            new_snap, state = cls._calculate_daily_snapshot(user_id, current_date, state, daily_agg_dict[current_date])
+            results.append(new_snap)
+        return results
+
+    @classmethod
+    def _calculate_range_fixed(
+            cls,
+            user_id: int,
+            days: List[date],
+            daily_agg_dict: Dict[date, dict],
+            state: _AggregateState
+    ) -> List[InvestedAssetSnapshot]:
+        """
+        定点整数计算：与 _calculate_daily_snapshot 同口径，昨日状态的逐日传递改为
+        int64 (4 位小数) 数组上的 cumsum / 错位，收益率以 ROUND_HALF_EVEN 取到 6 位小数。
+        数值超出 int64 安全范围时回退到 Decimal 路径。
+        """
+        if not days:
+            return []
+        try:
+            columns = cls._carry_fixed(days, daily_agg_dict, state)
+        except fp.FixedPointOverflow as e:
+            logger.warning(f"InvestedAssetSnapshot for user {user_id}: {e}, falling back to Decimal engine")
+            return cls._calculate_range(user_id, days, daily_agg_dict, state)
+
+        values = {
+            name: fp.to_decimals(column, RATIO_DIGITS if name.endswith('_ratio') else fp.SCALE_DIGITS)
+            for name, column in columns.items()
+        }
+        results = []
+        for i, current_date in enumerate(days):
+            snap = InvestedAssetSnapshot()
+            snap.user_id = user_id
+            snap.snapshot_date = current_date
+            for name in _SNAPSHOT_COLUMNS:
+                setattr(snap, name, values[name][i])
+            results.append(snap)
+        return results
+
+    @staticmethod
+    def _carry_fixed(days: List[date], daily_agg_dict: Dict[date, dict], state: _AggregateState) -> Dict[str, np.ndarray]:
+        """逐日状态传递的数组版本，返回 {快照列名: 定点 int64 数组}"""
+        # 1. 当日基础数据与昨日状态换算为定点
+        day = {
+            name: fp.to_fixed(daily_agg_dict[d][name] for d in days)
+            for name, _ in _AGGREGATE_COLUMNS
+        }
+        (init_mv, init_total_pnl, init_cash_div, init_reinvest,
+         init_buy, init_sell, init_cost) = fp.to_fixed([
+            state.mv, state.total_pnl, state.total_cash_div, state.total_reinvest_div,
+            state.total_buy, state.total_sell, state.holding_cost
+        ]).tolist()
+
+        def carry(init_value: int, daily_values: np.ndarray) -> np.ndarray:
+            return init_value + np.cumsum(daily_values)
+
+        mv, cost, net_flow, cash_div, reinvest = (
+            day['mv'], day['cost'], day['net_flow'], day['cash_div'], day['reinvest_div']
+        )
+
+        # 2. 当日盈亏与收益率 (分母 = 昨日市值 + 今日净流入)
+        prev_mv = np.r_[init_mv, mv[:-1]]
+        daily_pnl = mv - prev_mv + net_flow + cash_div
+        denominator = prev_mv + np.where(net_flow < 0, -net_flow, 0)
+        daily_pnl_ratio = fp.scaled_div(daily_pnl, np.where(denominator > 0, denominator, 0), RATIO_DIGITS)
+
+        # 3. 累计数据与倒挤的已实现盈亏
+        total_pnl = carry(init_total_pnl, daily_pnl)
+        total_cash_div = carry(init_cash_div, cash_div)
+        total_reinvest = carry(init_reinvest, reinvest)
+        total_dividend = total_cash_div + total_reinvest
+        total_buy = carry(init_buy, day['buy'] + reinvest)
+        total_sell = carry(init_sell, day['sell'])
+
+        # 4. 累计收益率：净投入为负时使用当前 (或昨日) 持仓成本
+        net_invested = total_buy - total_sell
+        prev_cost = np.r_[init_cost, cost[:-1]]
+        cost_base = np.where(net_invested > 0, net_invested, np.where(cost > 0, cost, prev_cost))
+        total_pnl_ratio = fp.scaled_div(total_pnl, np.where(cost_base > 0, cost_base, 0), RATIO_DIGITS)
+
+        return {
+            'ias_market_value': mv,
+            'ias_holding_cost': cost,
+            'ias_unrealized_pnl': day['unrealized_pnl'],
+            'ias_net_external_cash_flow': net_flow,
+            'ias_daily_cash_dividend': cash_div,
+            'ias_daily_reinvest_dividend': reinvest,
+            'ias_daily_pnl': daily_pnl,
+            'ias_daily_pnl_ratio': daily_pnl_ratio,
+            'ias_total_pnl': total_pnl,
+            'ias_total_cash_dividend': total_cash_div,
+            'ias_total_reinvest_dividend': total_reinvest,
+            'ias_total_dividend': total_dividend,
+            'ias_total_buy_amount': total_buy,
+            'ias_total_sell_amount': total_sell,
+            'ias_total_realized_pnl': total_pnl - day['unrealized_pnl'] - total_dividend,
+            'ias_total_pnl_ratio': total_pnl_ratio,
+        }
+
+    @staticmethod
+    def _build_index(user_id: int, start_date: date, results: List[InvestedAssetSnapshot]) -> RecordBatch:
+        """
+        由本次生成的快照接续上一条指数行，得到单位净值 / 历史最高 / 累计现金流列。
+        上一条指数行之后、start_date 之前尚未编入指数的快照 (如指数表上线前的历史) 一并补齐。
+        收益率按入库精度 (6 位小数) 连乘，与分析服务读取的日收益率一致。
+        """
+        # 1. 接续点：上一条指数行 (没有则从 1 开始)
+        prev = InvestedAssetIndex.query.filter(
+            InvestedAssetIndex.user_id == user_id,
+            InvestedAssetIndex.snapshot_date < start_date
+        ).order_by(InvestedAssetIndex.snapshot_date.desc()).first()
+
+        gap_query = db.session.query(
+            InvestedAssetSnapshot.snapshot_date,
+            InvestedAssetSnapshot.ias_daily_pnl_ratio,
+            InvestedAssetSnapshot.ias_net_external_cash_flow,
+            InvestedAssetSnapshot.ias_daily_cash_dividend
+        ).filter(
+            InvestedAssetSnapshot.user_id == user_id,
+            InvestedAssetSnapshot.snapshot_date < start_date
+        )
+        if prev:
+            gap_query = gap_query.filter(InvestedAssetSnapshot.snapshot_date > prev.snapshot_date)
+        rows = gap_query.order_by(InvestedAssetSnapshot.snapshot_date).all()
+        rows += [
+            (r.snapshot_date, r.ias_daily_pnl_ratio, r.ias_net_external_cash_flow, r.ias_daily_cash_dividend)
+            for r in results
+        ]
+        if not rows:
+            return RecordBatch(0, {})
+
+        # 2. 单位净值与历史最高 (最高取最后一次出现)
+        dates = np.array([r[0] for r in rows], dtype=object)
+        ratios = np.array([float(Decimal(r[1] or 0).quantize(RATIO_QUANTUM)) for r in rows])
+        base = prev.unit_value if prev else 1.0
+        unit_value = base * np.cumprod(1.0 + ratios)
+        prev_peak = prev.peak_unit_value if prev else -np.inf
+        peak = np.maximum.accumulate(np.maximum(unit_value, prev_peak))
+        positions = np.arange(len(rows))
+        last_high = np.maximum.accumulate(np.where(unit_value >= peak, positions, -1))
+        peak_date = np.where(last_high >= 0, dates[np.maximum(last_high, 0)], prev.peak_date if prev else None)
+
+        # 3. 累计现金流 (定点数精确累加)
+        net_flow = accumulate((Decimal(r[2] or 0) for r in rows), initial=prev.cumulative_net_flow if prev else ZERO)
+        cash_div = accumulate((Decimal(r[3] or 0) for r in rows),
+                              initial=prev.cumulative_cash_dividend if prev else ZERO)
+
+        return RecordBatch(len(rows), {
+            'user_id': user_id,
+            'snapshot_date': dates,
+            'unit_value': unit_value,
+            'peak_unit_value': peak,
+            'peak_date': peak_date,
+            'cumulative_net_flow': np.array(list(net_flow)[1:], dtype=object),
+            'cumulative_cash_dividend': np.array(list(cash_div)[1:], dtype=object),
+        })
+
+    @staticmethod
+    def get_period_summary(user_id: int, start_date: date, end_date: date) -> Optional[dict]:
+        """
+        任意区间 [start_date, end_date] 的组合表现，只读取指数表的两行：
+        期末 (end_date 当天或之前最近一行) 与期初前一行 (start_date 之前最近一行，没有则视为起点)。
+
+        :return: {"twrr": 区间时间加权收益, "net_external_cash_flow": 区间外部现金流,
+                  "cash_dividend": 区间现金分红, "drawdown": 期末相对历史最高的回撤, "peak_date": 历史最高日期}，
+                 区间内没有数据时为 None
+        """
+        def latest_before(day: date, inclusive: bool) -> Optional[InvestedAssetIndex]:
+            bound = InvestedAssetIndex.snapshot_date <= day if inclusive else InvestedAssetIndex.snapshot_date < day
+            return InvestedAssetIndex.query.filter(
+                InvestedAssetIndex.user_id == user_id, bound
+            ).order_by(InvestedAssetIndex.snapshot_date.desc()).first()
+
+        end = latest_before(end_date, inclusive=True)
+        if end is None or end.snapshot_date < start_date:
+            return None
+        begin = latest_before(start_date, inclusive=False)
+
+        return {
+            "twrr": end.unit_value / (begin.unit_value if begin else 1.0) - 1.0,
+            "net_external_cash_flow": end.cumulative_net_flow - (begin.cumulative_net_flow if begin else ZERO),
+            "cash_dividend": end.cumulative_cash_dividend - (begin.cumulative_cash_dividend if begin else ZERO),
+            "drawdown": end.unit_value / end.peak_unit_value - 1.0,
+            "peak_date": end.peak_date,
+        }
+
+    @staticmethod
+    def _load_daily_aggregates(user_id: int, start_date: date, end_date: date) -> Dict[date, dict]:
+        """
+        一次 GROUP BY 查询得到区间内每日的持仓快照合计 {日期: {字段: Decimal}}，
+        求和在数据库端以定点数完成，不再经过 ORM 对象 / float / DataFrame。
+        """
+        rows = db.session.query(
+            HoldingSnapshot.snapshot_date,
+            *[func.coalesce(func.sum(column), 0).label(name) for name, column in _AGGREGATE_COLUMNS]
+        ).filter(
+            HoldingSnapshot.user_id == user_id,
+            HoldingSnapshot.snapshot_date >= start_date,
+            HoldingSnapshot.snapshot_date <= end_date
+        ).group_by(HoldingSnapshot.snapshot_date).all()
+
+        return {
+            row[0]: {name: Decimal(value) for (name, _), value in zip(_AGGREGATE_COLUMNS, row[1:])}
+            for row in rows
+        }
 
     @staticmethod
     def _calculate_daily_snapshot(
@@ -0,0 +1,67 @@
+# app/service/snapshot_dirty_range_service.py
+from datetime import date
+from typing import Dict, Iterable, Optional, Tuple
+
+from loguru import logger
+
+from app.models import db, SnapshotDirtyRange
+
+
+class SnapshotDirtyRangeService:
+    """
+    快照脏数据水位线。
+    交易变更时记录每个 (用户, 持仓) 最早受影响的日期，增量流水线据此只重算必要区间。
+    """
+
+    @classmethod
+    def mark_dirty(cls, user_id: int, ho_id: int, dirty_from: Optional[date]):
+        """
+        标记持仓自 dirty_from 起的快照失效，已有水位线时取较早的日期。
+        注意：不执行 commit，与交易变更在同一事务中提交。
+        """
+        if not user_id or not ho_id or not dirty_from:
+            return
+
+        # autoflush 保证同一事务内先前 add 的记录也能查到
+        record = SnapshotDirtyRange.query.filter_by(user_id=user_id, ho_id=ho_id).first()
+        if record is None:
+            db.session.add(SnapshotDirtyRange(user_id=user_id, ho_id=ho_id, dirty_from=dirty_from))
+        elif dirty_from < record.dirty_from:
+            record.dirty_from = dirty_from
+
+    @classmethod
+    def mark_trades_dirty(cls, trades: Iterable):
+        """按交易批量标记：每个 (用户, 持仓) 取最早的交易日期"""
+        earliest: Dict[Tuple[int, int], date] = {}
+        for t in trades:
+            if not t.tr_date:
+                continue
+            key = (t.user_id, t.ho_id)
+            if key not in earliest or t.tr_date < earliest[key]:
+                earliest[key] = t.tr_date
+        for (user_id, ho_id), dirty_from in earliest.items():
+            cls.mark_dirty(user_id, ho_id, dirty_from)
+
+    @classmethod
+    def get_watermarks(cls, user_id: int) -> Dict[int, Tuple[int, date]]:
+        """返回 {ho_id: (记录ID, dirty_from)}，值为读取时刻的快照，不随后续 commit 刷新"""
+        rows = db.session.query(
+            SnapshotDirtyRange.ho_id, SnapshotDirtyRange.id, SnapshotDirtyRange.dirty_from
+        ).filter(SnapshotDirtyRange.user_id == user_id).all()
+        return {ho_id: (record_id, dirty_from) for ho_id, record_id, dirty_from in rows}
+
+    @classmethod
+    def clear(cls, watermarks: Dict[int, Tuple[int, date]]) -> int:
+        """
+        清除已处理的水位线。
+        只删除水位线未被再次提前的记录：处理期间有更早的变更时保留，留给下一次增量重算。
+        """
+        cleared = 0
+        for record_id, dirty_from in watermarks.values():
+            cleared += SnapshotDirtyRange.query.filter(
+                SnapshotDirtyRange.id == record_id,
+                SnapshotDirtyRange.dirty_from >= dirty_from
+            ).delete(synchronize_session=False)
+        db.session.commit()
+        logger.info(f"Cleared {cleared} snapshot dirty ranges")
+        return cleared
@@ -1,25 +1,41 @@
 # app/services/job_service.py
+import json
+from collections import defaultdict
 from datetime import date
+from typing import Dict, Union
 
 from loguru import logger
 
 from app.calendars.trade_calendar import trade_calendar
-from app.constant.biz_enums import TaskStatusEnum
-from app.models import db, UserSetting, Trade, HoldingAnalyticsSnapshot, AsyncTaskLog
+from app.constant.biz_enums import TaskStatusEnum, SnapshotEngineEnum, SnapshotPipelineModeEnum
+from app.mapper.bulk_upsert_mapper import UpsertResult
+from app.models import (
+    db, UserSetting, Trade, AsyncTaskLog, HoldingSnapshot, HoldingAnalyticsSnapshot,
+    InvestedAssetSnapshot, InvestedAssetAnalyticsSnapshot
+)
 from app.service.holding_analytics_snapshot_service import HoldingAnalyticsSnapshotService
 from app.service.holding_snapshot_service import HoldingSnapshotService
 from app.service.invested_asset_analytics_snapshot_service import InvestedAssetAnalyticsSnapshotService
 from app.service.invested_asset_snapshot_service import InvestedAssetSnapshotService
 from app.service.benchmark_service import BenchmarkService
+from app.service.snapshot_dirty_range_service import SnapshotDirtyRangeService
 
 
 class TaskService:
 
     @classmethod
-    def redo_all_snapshot(cls, user_id: int, start_date: date = None, end_date: date = None):
+    def redo_all_snapshot(cls, user_id: int, start_date: date = None, end_date: date = None,
+                          engine: str = SnapshotEngineEnum.DECIMAL.value, parallel: bool = False,
+                          chunk_by: str = None):
         """
         重新执行所有的快照任务
+
+        :param engine: 持仓快照与投资资产快照的计算引擎，见 SnapshotEngineEnum
+        :param parallel: 持仓快照是否使用进程池并行计算
+        :param chunk_by: 持仓快照流式分块方式，见 SnapshotChunkModeEnum；长区间重建时控制内存峰值
+        :return: {"diff": {表名: 新增/更新/未变/删除行数}}，由任务日志记录
         """
+        diff = defaultdict(UpsertResult)
         if user_id:
             user_list = UserSetting.query.filter(UserSetting.id == user_id).all()
         else:
@@ -38,11 +54,15 @@ class TaskService:
                     end_date = trade_calendar.prev_trade_day(date.today())
 
                 # Holding Snapshot
-                HoldingSnapshotService.generate_snapshots(
+                result = HoldingSnapshotService.generate_snapshots(
                     user_id=user.id,
                     start_date=start_date,
-                    end_date=end_date
+                    end_date=end_date,
+                    engine=engine,
+                    parallel=parallel,
+                    chunk_by=chunk_by
                 )
+                cls._collect_diff(diff, HoldingSnapshot, result)
 
                 # Holding Analytics
                 snapshots = HoldingAnalyticsSnapshotService.generate_analytics(
@@ -50,27 +70,32 @@ class TaskService:
                     start_date=start_date,
                     end_date=end_date
                 )
-                if snapshots:
-                    # 删除旧数据
-                    db.session.query(HoldingAnalyticsSnapshot).filter(
-                        HoldingAnalyticsSnapshot.user_id == user.id
-                    ).delete(synchronize_session=False)
-                    db.session.bulk_save_objects(snapshots)
-                    db.session.commit()
+                # upsert 并清理该用户不再产生的旧数据
+                result = HoldingAnalyticsSnapshotService.save_analytics(
+                    user_id=user.id,
+                    snapshots=snapshots,
+                    prune_scope=[HoldingAnalyticsSnapshot.user_id == user.id],
+                    invalidate_from=start_date
+                )
+                cls._collect_diff(diff, HoldingAnalyticsSnapshot, result)
+                db.session.commit()
 
                 # Invested Asset Snapshot
-                InvestedAssetSnapshotService.generate_snapshots(
+                result = InvestedAssetSnapshotService.generate_snapshots(
                     user_id=user.id,
                     start_date=start_date,
-                    end_date=end_date
+                    end_date=end_date,
+                    engine=engine
                 )
+                cls._collect_diff(diff, InvestedAssetSnapshot, result)
 
                 # Invested Asset Analytics
-                InvestedAssetAnalyticsSnapshotService.generate_analytics(
+                result = InvestedAssetAnalyticsSnapshotService.generate_analytics(
                     user_id=user.id,
                     start_date=start_date,
                     end_date=end_date
                 )
+                cls._collect_diff(diff, InvestedAssetAnalyticsSnapshot, result)
 
                 # Update position ratios
                 HoldingAnalyticsSnapshotService.update_position_ratios_and_contributions(
@@ -83,48 +108,169 @@ class TaskService:
             db.session.rollback()
             logger.exception(f"执行快照任务失败: {str(e)}")
 
+        return {"diff": cls._diff_summary(diff)}
+
+    @classmethod
+    def redo_dirty_snapshot(cls, user_id: int, end_date: date = None,
+                            engine: str = SnapshotEngineEnum.DECIMAL.value) -> dict:
+        """
+        增量重算：只从交易变更记录的脏数据水位线起，依次重算
+        持仓快照 -> 持仓分析 -> 投资资产快照 -> 投资资产分析 -> 仓位占比。
+
+        只清除成功重算的持仓的水位线：持仓快照失败的持仓、超出 end_date 的水位线保留到下一次；
+        组合层快照报错时一条都不清除。
+
+        :return: {"holdings": 受影响持仓数, "start_date": 组合层重算起点, "failed_holdings": 保留水位线的持仓,
+                  "diff": 各表写入统计}
+        """
+        watermarks = SnapshotDirtyRangeService.get_watermarks(user_id)
+        if not watermarks:
+            logger.info(f"No dirty snapshot range for user {user_id}")
+            return {"holdings": 0, "start_date": None, "failed_holdings": [], "diff": {}}
+
+        end_date = end_date or trade_calendar.prev_trade_day(date.today())
+        # 同一水位线的持仓合并为一次调用
+        ho_ids_by_start = defaultdict(list)
+        for ho_id, (_, dirty_from) in watermarks.items():
+            ho_ids_by_start[dirty_from].append(ho_id)
+        # 组合层依赖所有持仓，从最早的水位线开始
+        portfolio_start = min(ho_ids_by_start)
+
+        diff = defaultdict(UpsertResult)
+        # 未成功重算的持仓，其水位线保留
+        pending = set()
+        try:
+            for dirty_from, ho_ids in sorted(ho_ids_by_start.items()):
+                if dirty_from > end_date:
+                    pending.update(ho_ids)
+                    continue
+                # Holding Snapshot
+                result = HoldingSnapshotService.generate_snapshots(
+                    user_id=user_id,
+                    start_date=dirty_from,
+                    end_date=end_date,
+                    ids=ho_ids,
+                    engine=engine
+                )
+                cls._collect_diff(diff, HoldingSnapshot, result)
+                pending.update(result.get('failed_ids', []))
+
+                # Holding Analytics
+                snapshots = HoldingAnalyticsSnapshotService.generate_analytics(
+                    user_id=user_id,
+                    start_date=dirty_from,
+                    end_date=end_date,
+                    ho_ids=ho_ids
+                )
+                result = HoldingAnalyticsSnapshotService.save_analytics(
+                    user_id=user_id,
+                    snapshots=snapshots,
+                    prune_scope=[
+                        HoldingAnalyticsSnapshot.user_id == user_id,
+                        HoldingAnalyticsSnapshot.ho_id.in_(ho_ids),
+                        HoldingAnalyticsSnapshot.snapshot_date >= dirty_from,
+                        HoldingAnalyticsSnapshot.snapshot_date <= end_date
+                    ],
+                    ho_ids=ho_ids,
+                    invalidate_from=dirty_from
+                )
+                cls._collect_diff(diff, HoldingAnalyticsSnapshot, result)
+                db.session.commit()
+
+            if portfolio_start <= end_date:
+                # Invested Asset Snapshot
+                result = InvestedAssetSnapshotService.generate_snapshots(
+                    user_id=user_id,
+                    start_date=portfolio_start,
+                    end_date=end_date,
+                    engine=engine
+                )
+                cls._collect_diff(diff, InvestedAssetSnapshot, result)
+                if result.get('errors'):
+                    # 组合层依赖所有持仓，写入失败时全部水位线保留
+                    pending.update(watermarks)
+
+                # Invested Asset Analytics
+                result = InvestedAssetAnalyticsSnapshotService.generate_analytics(
+                    user_id=user_id,
+                    start_date=portfolio_start,
+                    end_date=end_date
+                )
+                cls._collect_diff(diff, InvestedAssetAnalyticsSnapshot, result)
+
+                # Update position ratios
+                HoldingAnalyticsSnapshotService.update_position_ratios_and_contributions(
+                    user_id=user_id,
+                    start_date=portfolio_start,
+                    end_date=end_date
+                )
+
+            if pending:
+                logger.warning(f"Keeping dirty ranges of holdings {sorted(pending)} for user {user_id}")
+            SnapshotDirtyRangeService.clear({
+                ho_id: watermark for ho_id, watermark in watermarks.items() if ho_id not in pending
+            })
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f"执行增量快照任务失败: {str(e)}")
+            raise
+
+        return {
+            "holdings": len(watermarks),
+            "start_date": str(portfolio_start),
+            "failed_holdings": sorted(pending),
+            "diff": cls._diff_summary(diff)
+        }
+
     @classmethod
     def generate_yesterday_snapshot(cls, user_id: int):
         """
         增量执行快照任务
+
+        :return: {"diff": {表名: 新增/更新/未变/删除行数}}
         """
         prev_date = trade_calendar.prev_trade_day()
+        diff = defaultdict(UpsertResult)
         try:
             # Holding Snapshot
-            HoldingSnapshotService.generate_snapshots(
+            result = HoldingSnapshotService.generate_snapshots(
                 user_id=user_id,
                 start_date=prev_date,
                 end_date=prev_date
             )
+            cls._collect_diff(diff, HoldingSnapshot, result)
 
-            # Holding Analytics
-            snapshots = HoldingAnalyticsSnapshotService.generate_analytics(
+            # Holding Analytics (基于累加状态只追加一天)
+            snapshots = HoldingAnalyticsSnapshotService.generate_daily_analytics(
                 user_id=user_id,
-                start_date=prev_date,
-                end_date=prev_date
+                target_date=prev_date
             )
-            if snapshots:
-                from app.models import HoldingAnalyticsSnapshot
-                db.session.query(HoldingAnalyticsSnapshot).filter(
+            result = HoldingAnalyticsSnapshotService.save_analytics(
+                user_id=user_id,
+                snapshots=snapshots,
+                prune_scope=[
                     HoldingAnalyticsSnapshot.user_id == user_id,
                     HoldingAnalyticsSnapshot.snapshot_date == prev_date
-                ).delete(synchronize_session=False)
-                db.session.bulk_save_objects(snapshots)
-                db.session.commit()
+                ]
+            )
+            cls._collect_diff(diff, HoldingAnalyticsSnapshot, result)
+            db.session.commit()
 
             # Invested Asset Snapshot
-            InvestedAssetSnapshotService.generate_snapshots(
+            result = InvestedAssetSnapshotService.generate_snapshots(
                 user_id=user_id,
                 start_date=prev_date,
                 end_date=prev_date
             )
+            cls._collect_diff(diff, InvestedAssetSnapshot, result)
 
             # Invested Asset Analytics
-            InvestedAssetAnalyticsSnapshotService.generate_analytics(
+            result = InvestedAssetAnalyticsSnapshotService.generate_analytics(
                 user_id=user_id,
                 start_date=prev_date,
                 end_date=prev_date
             )
+            cls._collect_diff(diff, InvestedAssetAnalyticsSnapshot, result)
 
             # Update position ratios
             HoldingAnalyticsSnapshotService.update_position_ratios_and_contributions(
@@ -137,11 +283,27 @@ class TaskService:
             db.session.rollback()
             logger.exception(f"执行快照任务失败: {str(e)}")
 
+        return {"diff": cls._diff_summary(diff)}
+
+    @staticmethod
+    def _collect_diff(diff: Dict[str, UpsertResult], model, result: Union[UpsertResult, dict, None]):
+        """累加一次写入的变更统计；服务返回的 dict 取其中的 upsert 字段"""
+        if isinstance(result, dict):
+            result = UpsertResult.from_dict(result.get('upsert'))
+        if result is not None:
+            diff[model.__tablename__].merge(result)
+
+    @staticmethod
+    def _diff_summary(diff: Dict[str, UpsertResult]) -> Dict[str, dict]:
+        return {table: result.to_dict() for table, result in diff.items()}
+
     @classmethod
-    def calculate_all(cls, user_id: int, start_date: date = None, end_date: date = None) -> int:
+    def calculate_all(cls, user_id: int, start_date: date = None, end_date: date = None,
+                      mode: str = SnapshotPipelineModeEnum.FULL.value) -> int:
         """
         Execute all calculation tasks in sequence:
         1. redo_all_snapshot - regenerate all snapshots
+           (redo_dirty_snapshot when mode is DIRTY: only from each holding's dirty watermark)
         2. sync_benchmark_data - sync benchmark historical data
         3. batch_update_benchmark_metrics - update benchmark-related metrics
 
@@ -149,6 +311,7 @@ class TaskService:
             user_id: User ID
             start_date: Start date for calculations (optional, defaults to earliest trade date)
             end_date: End date for calculations (optional, defaults to previous trade day)
+            mode: SnapshotPipelineModeEnum, FULL or DIRTY
 
         Returns:
             task_id: The ID of the created AsyncTaskLog record
@@ -172,7 +335,8 @@ class TaskService:
             status=TaskStatusEnum.RUNNING.value,
             params={
                 "start_date": str(start_date) if start_date else None,
-                "end_date": str(end_date) if end_date else None
+                "end_date": str(end_date) if end_date else None,
+                "mode": mode
             },
             max_retries=1,
             retry_count=0,
@@ -185,9 +349,13 @@ class TaskService:
         try:
             logger.info(f"Starting calculate_all")
 
-            # Step 1: Redo all snapshots
-            cls.redo_all_snapshot(user_id, start_date, end_date)
-            logger.info(f"Completed redo_all_snapshot")
+            # Step 1: Redo snapshots
+            if mode == SnapshotPipelineModeEnum.DIRTY:
+                snapshot_result = cls.redo_dirty_snapshot(user_id, end_date)
+                logger.info(f"Completed redo_dirty_snapshot")
+            else:
+                snapshot_result = cls.redo_all_snapshot(user_id, start_date, end_date)
+                logger.info(f"Completed redo_all_snapshot")
 
             # Step 2: Sync benchmark data
             BenchmarkService.sync_benchmark_data()
@@ -199,7 +367,10 @@ class TaskService:
 
             # Update task log to SUCCESS
             task_log.status = TaskStatusEnum.SUCCESS.value
-            task_log.result_summary = f"Successfully completed: snapshots regenerated, benchmark data synced)"
+            task_log.result_summary = json.dumps({
+                "message": "Successfully completed: snapshots regenerated, benchmark data synced",
+                "diff": snapshot_result.get("diff")
+            })
             db.session.commit()
 
             logger.info(f"calculate_all completed successfully")
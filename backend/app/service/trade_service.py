@@ -17,6 +17,7 @@ from app.extension import openai_client
 from app.framework.exceptions import BizException
 from app.models import db, Holding, Trade, UserHolding
 from app.service.holding_service import HoldingService
+from app.service.snapshot_dirty_range_service import SnapshotDirtyRangeService
 from app.utils.common_util import is_not_blank
 from app.utils.date_util import str_to_date, date_to_str
 
@@ -174,8 +175,9 @@ class TradeService:
             # 需要 flush 获取 new_trade.id，保证重算时的排序稳定性
             db.session.flush()
 
-            # 3. 调用重算逻辑
+            # 3. 调用重算逻辑，并记录快照脏数据水位线
             cls.recalculate_holding_trades(new_trade.ho_id, new_trade.user_id)
+            SnapshotDirtyRangeService.mark_dirty(new_trade.user_id, new_trade.ho_id, new_trade.tr_date)
 
             # 4. 提交事务
             db.session.commit()
@@ -194,8 +196,9 @@ class TradeService:
             if not trade:
                 raise BizException(ErrorMessageEnum.DATA_NOT_FOUND.view)
 
-            # 记录旧的 ho_id，防止用户修改了关联的持仓（虽然一般不允许改 ho_id）
+            # 记录旧的 ho_id 与交易日期，防止用户修改了关联的持仓（虽然一般不允许改 ho_id）
             old_ho_id = trade.ho_id
+            old_tr_date = trade.tr_date
 
             # 使用 marshmallow load 后的数据更新对象
             # 假设 update_data 已经是处理好的字典或对象
@@ -205,8 +208,16 @@ class TradeService:
 
             db.session.flush()
 
-            # 重算
+            # 重算，并记录快照脏数据水位线 (新旧日期中较早者起失效)
             cls.recalculate_holding_trades(trade.ho_id, trade.user_id)
+            if old_ho_id != trade.ho_id:
+                cls.recalculate_holding_trades(old_ho_id, trade.user_id)
+                SnapshotDirtyRangeService.mark_dirty(trade.user_id, old_ho_id, old_tr_date)
+                SnapshotDirtyRangeService.mark_dirty(trade.user_id, trade.ho_id, trade.tr_date)
+            else:
+                SnapshotDirtyRangeService.mark_dirty(
+                    trade.user_id, trade.ho_id, min(d for d in (old_tr_date, trade.tr_date) if d)
+                )
 
             db.session.commit()
             return True
@@ -215,6 +226,26 @@ class TradeService:
             logger.exception(f"更新交易记录失败: {e}")
             raise e
 
+    @classmethod
+    def delete_trade(cls, trade: Trade):
+        """
+        删除单条交易记录并重算所属持仓，快照自该交易日期起失效
+        """
+        try:
+            ho_id, user_id = trade.ho_id, trade.user_id
+            SnapshotDirtyRangeService.mark_dirty(user_id, ho_id, trade.tr_date)
+
+            db.session.delete(trade)
+            db.session.flush()
+            cls.recalculate_holding_trades(ho_id, user_id)
+
+            db.session.commit()
+            return True
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f"删除交易记录失败: {e}")
+            raise e
+
     @classmethod
     def import_trade(cls, import_trades: List[Trade], user_id: str):
         """
@@ -315,6 +346,9 @@ class TradeService:
                         # 更新
                         pass
 
+                # 记录快照脏数据水位线：从本次导入最早的交易日期起
+                SnapshotDirtyRangeService.mark_dirty(user_id, holding.id, min(t.tr_date for t in new_trades))
+
                 # 6. 处理完一个基金的所有新交易后，根据最终份额更新持仓状态
                 # 使用一个小的阈值来判断是否为零，避免浮点精度问题
                 if current_shares < Decimal('0.0001'):
@@ -515,6 +549,7 @@ class TradeService:
 
                 # 记录受影响的持仓
                 affected_ho_ids.add(trade.ho_id)
+                SnapshotDirtyRangeService.mark_dirty(user_id, trade.ho_id, trade.tr_date)
 
                 # 删除交易
                 db.session.delete(trade)
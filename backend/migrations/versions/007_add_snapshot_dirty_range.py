@@ -0,0 +1,37 @@
+"""add snapshot_dirty_range table for incremental snapshot regeneration
+
+Revision ID: 007_snapshot_dirty_range
+Revises: 006_fix_has_unique
+Create Date: 2026-03-02
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '007_snapshot_dirty_range'
+down_revision: Union[str, Sequence[str], None] = '006_fix_has_unique'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create snapshot_dirty_range table."""
+    op.create_table(
+        'snapshot_dirty_range',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('user_setting.id'), nullable=False),
+        sa.Column('ho_id', sa.Integer, sa.ForeignKey('holding.id'), nullable=False),
+        sa.Column('dirty_from', sa.Date, nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('current_timestamp'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('current_timestamp'), onupdate=sa.text('current_timestamp'), nullable=False),
+        sa.UniqueConstraint('user_id', 'ho_id', name='uq_snapshot_dirty_range_user_ho')
+    )
+
+
+def downgrade() -> None:
+    """Drop snapshot_dirty_range table."""
+    op.drop_table('snapshot_dirty_range')
@@ -0,0 +1,37 @@
+"""add row_hash to snapshot tables for change-only writes
+
+Revision ID: 008_snapshot_row_hash
+Revises: 007_snapshot_dirty_range
+Create Date: 2026-03-04
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '008_snapshot_row_hash'
+down_revision: Union[str, Sequence[str], None] = '007_snapshot_dirty_range'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SNAPSHOT_TABLES = (
+    'holding_snapshot',
+    'holding_analytics_snapshot',
+    'invested_asset_snapshot',
+    'invested_asset_analytics_snapshot',
+)
+
+
+def upgrade() -> None:
+    """Add nullable row_hash; existing rows are hashed on their next regeneration."""
+    for table in SNAPSHOT_TABLES:
+        op.add_column(table, sa.Column('row_hash', sa.String(length=32), nullable=True))
+
+
+def downgrade() -> None:
+    """Drop row_hash."""
+    for table in SNAPSHOT_TABLES:
+        op.drop_column(table, 'row_hash')
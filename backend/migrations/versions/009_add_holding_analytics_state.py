@@ -0,0 +1,50 @@
+"""add holding_analytics_state table for incremental daily analytics
+
+Revision ID: 009_holding_analytics_state
+Revises: 008_snapshot_row_hash
+Create Date: 2026-03-06
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '009_holding_analytics_state'
+down_revision: Union[str, Sequence[str], None] = '008_snapshot_row_hash'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+FLOAT_COLUMNS = (
+    'log_sum', 'pnl_sum', 'cash_dividend_sum', 'reinvest_dividend_sum',
+    'ret_mean', 'ret_m2', 'neg_mean', 'neg_m2',
+    'nav', 'peak_nav', 'trough_nav', 'max_runup', 'mdd', 'mdd_peak_nav', 'last_irr',
+)
+INTEGER_COLUMNS = ('cycle', 'zero_count', 'win_count', 'neg_count')
+DATE_COLUMNS = ('window_start_date', 'peak_date', 'mdd_start', 'mdd_end', 'recovery_date')
+
+
+def upgrade() -> None:
+    """Create holding_analytics_state table; states are seeded on the next daily run."""
+    op.create_table(
+        'holding_analytics_state',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('user_setting.id'), nullable=False),
+        sa.Column('ho_id', sa.Integer, sa.ForeignKey('holding.id'), nullable=False),
+        sa.Column('window_key', sa.String(length=32), nullable=False),
+        sa.Column('last_date', sa.Date, nullable=False),
+        sa.Column('row_count', sa.Integer, nullable=False, server_default='0'),
+        *[sa.Column(name, sa.Date, nullable=True) for name in DATE_COLUMNS],
+        *[sa.Column(name, sa.Integer, nullable=True) for name in INTEGER_COLUMNS],
+        *[sa.Column(name, sa.Float(precision=53), nullable=True) for name in FLOAT_COLUMNS],
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('current_timestamp'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('current_timestamp'), onupdate=sa.text('current_timestamp'), nullable=False),
+        sa.UniqueConstraint('user_id', 'ho_id', 'window_key', name='uq_holding_analytics_state_user_ho_window')
+    )
+
+
+def downgrade() -> None:
+    """Drop holding_analytics_state table."""
+    op.drop_table('holding_analytics_state')
@@ -0,0 +1,41 @@
+"""add invested_asset_index table for range returns by lookup
+
+Revision ID: 010_invested_asset_index
+Revises: 009_holding_analytics_state
+Create Date: 2026-03-10
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '010_invested_asset_index'
+down_revision: Union[str, Sequence[str], None] = '009_holding_analytics_state'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create invested_asset_index table; rows are chained in on the next snapshot run."""
+    op.create_table(
+        'invested_asset_index',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('user_setting.id'), nullable=False),
+        sa.Column('snapshot_date', sa.Date, nullable=False),
+        sa.Column('unit_value', sa.Float(precision=53), nullable=False),
+        sa.Column('peak_unit_value', sa.Float(precision=53), nullable=False),
+        sa.Column('peak_date', sa.Date, nullable=False),
+        sa.Column('cumulative_net_flow', sa.Numeric(20, 4), nullable=False),
+        sa.Column('cumulative_cash_dividend', sa.Numeric(20, 4), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('current_timestamp'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('current_timestamp'), onupdate=sa.text('current_timestamp'), nullable=False),
+        sa.UniqueConstraint('user_id', 'snapshot_date', name='uq_invested_asset_index_user_date')
+    )
+
+
+def downgrade() -> None:
+    """Drop invested_asset_index table."""
+    op.drop_table('invested_asset_index')
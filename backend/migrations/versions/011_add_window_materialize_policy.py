@@ -0,0 +1,32 @@
+"""add materialize_policy column to analytics_window table
+
+Revision ID: 011_window_materialize_policy
+Revises: 010_invested_asset_index
+Create Date: 2026-03-14
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '011_window_materialize_policy'
+down_revision: Union[str, Sequence[str], None] = '010_invested_asset_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Add materialize_policy column; existing windows keep materializing every date."""
+    with op.batch_alter_table('analytics_window') as batch:
+        batch.add_column(
+            sa.Column('materialize_policy', sa.String(20), nullable=False, server_default='ALL_DATES')
+        )
+
+
+def downgrade() -> None:
+    """Remove materialize_policy column from analytics_window table."""
+    with op.batch_alter_table('analytics_window') as batch:
+        batch.drop_column('materialize_policy')
@@ -0,0 +1,32 @@
+"""replace idx_ias_user_date with a covering index including ias_daily_pnl_ratio
+
+Revision ID: 012_ias_user_date_return_index
+Revises: 011_window_materialize_policy
+Create Date: 2026-03-21
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '012_ias_user_date_return_index'
+down_revision: Union[str, Sequence[str], None] = '011_window_materialize_policy'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Per-user (date, daily return) reads become index-only scans."""
+    op.drop_index('idx_ias_user_date', table_name='invested_asset_snapshot', if_exists=True)
+    op.create_index(
+        'idx_ias_user_date_return', 'invested_asset_snapshot', ['user_id', 'snapshot_date'],
+        unique=False, postgresql_include=['ias_daily_pnl_ratio']
+    )
+
+
+def downgrade() -> None:
+    """Restore the plain (user_id, snapshot_date) index."""
+    op.drop_index('idx_ias_user_date_return', table_name='invested_asset_snapshot')
+    op.create_index('idx_ias_user_date', 'invested_asset_snapshot', ['user_id', 'snapshot_date'], unique=False)
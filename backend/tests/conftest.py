@@ -26,6 +26,7 @@ from app.models import (
     HoldingSnapshot, InvestedAssetSnapshot, InvestedAssetAnalyticsSnapshot,
     AlertRule, AlertHistory, FundNavHistory
 )
+from app.service.benchmark_service import BenchmarkService
 
 logger.info(f"Loaded test environment from: {env_test_path}")
 
@@ -73,6 +74,8 @@ def db(app):
         for table in reversed(_db.metadata.sorted_tables):
             _db.session.execute(table.delete())
         _db.session.commit()
+        # 表已清空，进程内缓存的基准序列一并失效
+        BenchmarkService.invalidate_benchmark_series()
         yield _db
         # 测试后回滚未提交的事务
         _db.session.rollback()
@@ -10,7 +10,7 @@ from unittest.mock import patch, MagicMock
 import pytest
 
 from app.constant.biz_enums import TradeTypeEnum
-from app.models import Trade, Holding
+from app.models import Trade, Holding, SnapshotDirtyRange
 from tests.conftest import create_trade
 
 
@@ -194,6 +194,18 @@ class TestUpdateTradeRoute:
         db.session.refresh(mock_trade)
         assert mock_trade.tr_shares == Decimal('2000')
 
+    def test_update_tr_marks_dirty_from_earlier_date(self, client, auth_headers, mock_trade):
+        """Moving a trade later keeps the snapshots from its old date dirty"""
+        response = client.post(
+            '/time/trade/update_tr',
+            json={'id': mock_trade.id, 'tr_date': '2024-01-22'},
+            headers=auth_headers
+        )
+
+        assert response.status_code == 200
+        watermark = SnapshotDirtyRange.query.filter_by(user_id=mock_trade.user_id, ho_id=mock_trade.ho_id).one()
+        assert watermark.dirty_from == date(2024, 1, 15)
+
     def test_update_tr_not_found(self, client, auth_headers):
         """Test trade update with non-existent ID"""
         response = client.post(
@@ -224,6 +236,16 @@ class TestDeleteTradeRoute:
         deleted = Trade.query.get(trade_id)
         assert deleted is None
 
+    def test_del_tr_marks_dirty(self, client, auth_headers, mock_trade):
+        """Deleting a trade marks the holding's snapshots dirty from the trade date"""
+        user_id, ho_id = mock_trade.user_id, mock_trade.ho_id
+
+        response = client.post('/time/trade/del_tr', json={'id': mock_trade.id}, headers=auth_headers)
+
+        assert response.status_code == 200
+        watermark = SnapshotDirtyRange.query.filter_by(user_id=user_id, ho_id=ho_id).one()
+        assert watermark.dirty_from == date(2024, 1, 15)
+
     def test_del_tr_not_found(self, client, auth_headers):
         """Test trade deletion with non-existent ID"""
         response = client.post(
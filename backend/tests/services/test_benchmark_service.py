@@ -0,0 +1,218 @@
+"""
+Tests for BenchmarkService benchmark-relative metrics
+"""
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.constant.sys_enums import GlobalYesOrNo
+from app.engine.benchmark_metrics import BenchmarkSeries, benchmark_window_metrics
+from app.models import (
+    AnalyticsWindow, Benchmark, BenchmarkHistory, InvestedAssetAnalyticsSnapshot, InvestedAssetSnapshot, UserSetting
+)
+from app.service.benchmark_service import BenchmarkService
+
+
+def _series(days, seed, drop=0.1):
+    """Business-day return series with random gaps"""
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range('2024-01-02', periods=days)
+    keep = rng.random(days) >= drop
+    return list(index[keep].date), rng.normal(0.0004, 0.011, days)[keep].round(6)
+
+
+def _ordinals(dates):
+    return np.array(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+def _reference(port, bm, start, end):
+    """Per-window reference: dict alignment + _calculate_benchmark_metrics"""
+    port_map = {d: r for d, r in zip(*port) if start <= d <= end}
+    bm_map = {d: r for d, r in zip(*bm) if start <= d <= end}
+    aligned_bm, aligned_port = BenchmarkService._align_returns_series(bm_map, port_map)
+    if len(aligned_bm) < 2:
+        return None
+    return BenchmarkService._calculate_benchmark_metrics(aligned_bm, aligned_port, start, end)
+
+
+class TestBenchmarkWindowMetrics:
+    """The prefix-sum engine must reproduce the per-window regression"""
+
+    def test_matches_per_window_reference(self):
+        port, bm = _series(200, seed=1), _series(220, seed=2)
+        rng = np.random.default_rng(3)
+        ends = [port[0][i] for i in rng.integers(0, len(port[0]), 60)]
+        starts = [end - timedelta(days=int(days)) for end, days in zip(ends, rng.integers(0, 150, 60))]
+
+        got = benchmark_window_metrics(_ordinals(port[0]), port[1], _ordinals(bm[0]), bm[1],
+                                       _ordinals(starts), _ordinals(ends))
+
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            expected = _reference(port, bm, start, end)
+            if expected is None:
+                assert got['count'][i] < 2
+                continue
+            for key in ('benchmark_cumulative_return', 'excess_return', 'beta', 'alpha'):
+                assert got[key][i] == pytest.approx(expected[key], rel=1e-9, abs=1e-12), key
+
+    def test_flat_benchmark_defaults(self):
+        days = np.arange(10, dtype=np.int64)
+        got = benchmark_window_metrics(days, np.full(10, 0.01), days, np.zeros(10), days[:1], days[-1:])
+        assert got['beta'][0] == 1.0
+        assert got['alpha'][0] == 0.0
+        assert got['excess_return'][0] == pytest.approx(1.01 ** 10 - 1)
+
+
+class TestBenchmarkSeries:
+    """Range slicing and prefix-product cumulative returns on a cached series"""
+
+    def test_range_queries_match_direct_product(self):
+        dates, returns = _series(120, seed=4)
+        series = BenchmarkSeries(_ordinals(dates), returns)
+        rng = np.random.default_rng(5)
+        for start, span in zip(rng.integers(-5, 130, 40), rng.integers(-3, 60, 40)):
+            start_day = _ordinals(dates[:1])[0] + int(start)
+            days, values = series.slice(start_day, start_day + int(span))
+            keep = (series.days >= start_day) & (series.days <= start_day + int(span))
+            assert days.tolist() == series.days[keep].tolist()
+            assert series.cumulative_return(start_day, start_day + int(span)) == pytest.approx(
+                np.prod(1 + returns[keep]) - 1, rel=1e-12, abs=1e-14
+            )
+
+    def test_arrays_are_read_only(self):
+        series = BenchmarkSeries(np.arange(3), np.zeros(3))
+        with pytest.raises(ValueError):
+            series.returns[0] = 1.0
+
+
+@pytest.fixture
+def two_user_series(db, mock_user):
+    """Benchmark + two users' portfolio snapshots (different histories) + analytics targets on the last 5 days"""
+    other = UserSetting(username='other', pwd_hash='x', email_address='other@example.com',
+                        is_locked=GlobalYesOrNo.NO)
+    benchmark = Benchmark(bm_code=BenchmarkService.DEFAULT_BENCHMARK_CODE, bm_name='CSI 300')
+    db.session.add_all([other, benchmark])
+    db.session.add_all([
+        AnalyticsWindow(window_key='R30', window_type='rolling', window_days=30),
+        AnalyticsWindow(window_key='ALL', window_type='expanding'),
+        AnalyticsWindow(window_key='CUR', window_type='expanding'),
+    ])
+    db.session.flush()
+
+    bm = _series(90, seed=10, drop=0.0)
+    db.session.add_all([
+        BenchmarkHistory(bm_id=benchmark.id, bmh_date=d, bmh_close_price=Decimal('1'),
+                         bmh_return=Decimal(str(r)), benchmark_return_daily=Decimal(str(r)))
+        for d, r in zip(*bm)
+    ])
+    series = {mock_user.id: _series(80, seed=11), other.id: _series(60, seed=12)}
+    for user_id, (dates, returns) in series.items():
+        db.session.add_all([
+            InvestedAssetSnapshot(
+                user_id=user_id, snapshot_date=d, ias_market_value=Decimal('0'), ias_holding_cost=Decimal('0'),
+                ias_unrealized_pnl=Decimal('0'), ias_total_realized_pnl=Decimal('0'),
+                ias_total_cash_dividend=Decimal('0'), ias_total_dividend=Decimal('0'),
+                ias_total_pnl=Decimal('0'), ias_daily_pnl_ratio=Decimal(str(r))
+            ) for d, r in zip(dates, returns)
+        ])
+        db.session.add_all([
+            InvestedAssetAnalyticsSnapshot(user_id=user_id, snapshot_date=d, window_key=key)
+            for d in dates[-5:] for key in ('R30', 'ALL', 'CUR')
+        ])
+    db.session.commit()
+    return bm, series
+
+
+class TestPortfolioReturns:
+    """Portfolio return series are read per user"""
+
+    def test_reads_only_own_rows(self, two_user_series, mock_user):
+        _, series = two_user_series
+        dates, returns = series[mock_user.id]
+
+        days, values = BenchmarkService._get_portfolio_returns(mock_user.id, dates[10], dates[-10])
+
+        assert days.dtype == np.int64 and values.dtype == np.float64
+        assert days.tolist() == _ordinals(dates[10:-9]).tolist()
+        assert values == pytest.approx(returns[10:-9])
+
+    def test_single_snapshot_uses_own_history(self, two_user_series, mock_user):
+        bm, series = two_user_series
+        dates, _ = series[mock_user.id]
+        end = dates[-1]
+
+        metrics = BenchmarkService.calculate_and_update_benchmark_metrics(end, 'ALL', user_id=mock_user.id)
+
+        expected = _reference(series[mock_user.id], bm, dates[0], end)
+        row = InvestedAssetAnalyticsSnapshot.query.filter_by(
+            user_id=mock_user.id, snapshot_date=end, window_key='ALL'
+        ).one()
+        for key in ('benchmark_cumulative_return', 'excess_return', 'beta', 'alpha'):
+            assert metrics[key] == pytest.approx(expected[key], rel=1e-9, abs=1e-12), key
+            assert float(getattr(row, key)) == pytest.approx(expected[key], abs=1e-6), key
+
+
+class TestBatchUpdateBenchmarkMetrics:
+    """Batch update loads each series once and writes every snapshot in one bulk update"""
+
+    def test_updates_each_user_from_own_series(self, two_user_series):
+        bm, series = two_user_series
+
+        result = BenchmarkService.batch_update_benchmark_metrics()
+
+        assert result == {'total': 30, 'success': 20, 'skipped': 10, 'error': 0}
+        for row in InvestedAssetAnalyticsSnapshot.query.all():
+            dates, _ = series[row.user_id]
+            if row.window_key == 'CUR':
+                assert row.beta is None
+                continue
+            start = dates[0] if row.window_key == 'ALL' else row.snapshot_date - timedelta(days=30)
+            expected = _reference(series[row.user_id], bm, start, row.snapshot_date)
+            for key in ('benchmark_cumulative_return', 'excess_return', 'beta', 'alpha'):
+                assert float(getattr(row, key)) == pytest.approx(expected[key], abs=1e-6), key
+
+
+class TestBenchmarkSeriesCache:
+    """Benchmark history is loaded once per bm_code and reloaded after a sync inserts rows"""
+
+    def test_range_helpers_reuse_cached_series(self, two_user_series):
+        bm, _ = two_user_series
+        dates, returns = bm
+        start, end = dates[20], dates[50]
+
+        returns_map = BenchmarkService.get_benchmark_returns_map(start, end)
+        with patch.object(BenchmarkService, '_load_benchmark_series', side_effect=AssertionError('reloaded')):
+            cumulative = BenchmarkService.get_benchmark_cumulative_return(start, end)
+
+        assert returns_map == pytest.approx(dict(zip(dates[20:51], returns[20:51])))
+        assert cumulative == pytest.approx(np.prod(1 + returns[20:51]) - 1)
+        assert BenchmarkService.get_benchmark_cumulative_return(end, start) == 0.0
+
+    def test_sync_invalidates_series(self, two_user_series):
+        bm, _ = two_user_series
+        dates = bm[0]
+        assert len(BenchmarkService.get_benchmark_series()) == len(dates)
+
+        new_day = dates[-1] + timedelta(days=1)
+        source = pd.DataFrame({'date': [dates[-1], new_day], 'close': [100.0, 101.0]})
+        with patch.object(BenchmarkService, '_fetch_data_from_source', return_value=source):
+            BenchmarkService.sync_benchmark_data()
+
+        assert BenchmarkService.get_benchmark_returns_map(new_day, new_day) == pytest.approx({new_day: 0.01})
+
+    def test_rows_written_elsewhere_reload_series(self, db, two_user_series):
+        """Rows inserted without invalidation (e.g. a sync in another worker) change the version"""
+        bm, _ = two_user_series
+        assert len(BenchmarkService.get_benchmark_series()) == len(bm[0])
+
+        benchmark = Benchmark.query.filter_by(bm_code=BenchmarkService.DEFAULT_BENCHMARK_CODE).one()
+        new_day = bm[0][-1] + timedelta(days=1)
+        db.session.add(BenchmarkHistory(bm_id=benchmark.id, bmh_date=new_day, bmh_close_price=Decimal('1'),
+                                        bmh_return=Decimal('0.02'), benchmark_return_daily=Decimal('0.02')))
+        db.session.commit()
+
+        assert BenchmarkService.get_benchmark_returns_map(new_day, new_day) == pytest.approx({new_day: 0.02})
@@ -0,0 +1,172 @@
+"""
+Tests for BulkUpsertMapper (executemany path, used by SQLite)
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from app.mapper.bulk_upsert_mapper import BulkUpsertMapper, RecordBatch, UpsertResult
+from app.models import HoldingSnapshot, HoldingAnalyticsSnapshot, FundNavHistory
+
+
+def _snapshot(user_id, ho_id, snapshot_date, shares):
+    return HoldingSnapshot(
+        user_id=user_id, ho_id=ho_id, snapshot_date=snapshot_date,
+        holding_shares=Decimal(shares), hos_market_value=Decimal(shares) * Decimal('1.5')
+    )
+
+
+class TestBulkUpsertMapper:
+    """Tests for BulkUpsertMapper.upsert"""
+
+    BASE = date(2024, 7, 1)
+
+    def _scope(self, user_id, ho_id):
+        return [
+            HoldingSnapshot.user_id == user_id,
+            HoldingSnapshot.ho_id == ho_id,
+            HoldingSnapshot.snapshot_date >= self.BASE,
+            HoldingSnapshot.snapshot_date <= self.BASE + timedelta(days=10)
+        ]
+
+    def test_insert_update_unchanged_counts(self, db, mock_user, mock_holding):
+        """Reports inserted / updated / unchanged rows"""
+        first = [_snapshot(mock_user.id, mock_holding.id, self.BASE + timedelta(days=i), '100') for i in range(3)]
+        result = BulkUpsertMapper.upsert(HoldingSnapshot, first)
+        db.session.commit()
+        assert (result.inserted, result.updated, result.unchanged) == (3, 0, 0)
+
+        second = [_snapshot(mock_user.id, mock_holding.id, self.BASE + timedelta(days=i), '100') for i in range(2)]
+        second.append(_snapshot(mock_user.id, mock_holding.id, self.BASE + timedelta(days=2), '120'))
+        second.append(_snapshot(mock_user.id, mock_holding.id, self.BASE + timedelta(days=3), '130'))
+        result = BulkUpsertMapper.upsert(HoldingSnapshot, second, batch_size=2)
+        db.session.commit()
+
+        assert (result.inserted, result.updated, result.unchanged) == (1, 1, 2)
+        rows = HoldingSnapshot.query.filter_by(user_id=mock_user.id).order_by(HoldingSnapshot.snapshot_date).all()
+        assert [r.holding_shares for r in rows] == [Decimal('100'), Decimal('100'), Decimal('120'), Decimal('130')]
+
+    def test_unchanged_after_quantization(self, db, mock_user, mock_holding):
+        """Values beyond the column scale compare equal to the stored value"""
+        snap = _snapshot(mock_user.id, mock_holding.id, self.BASE, '100')
+        snap.avg_cost = Decimal('1.23456789')
+        BulkUpsertMapper.upsert(HoldingSnapshot, [snap])
+        db.session.commit()
+
+        again = _snapshot(mock_user.id, mock_holding.id, self.BASE, '100')
+        again.avg_cost = Decimal('1.23455')
+        result = BulkUpsertMapper.upsert(HoldingSnapshot, [again])
+        assert result.unchanged == 1
+
+    def test_prune_scope_removes_stale_rows(self, db, mock_user, mock_holding):
+        """Rows inside the scope that are no longer produced are deleted"""
+        BulkUpsertMapper.upsert(
+            HoldingSnapshot,
+            [_snapshot(mock_user.id, mock_holding.id, self.BASE + timedelta(days=i), '100') for i in range(4)]
+        )
+        db.session.commit()
+
+        result = BulkUpsertMapper.upsert(
+            HoldingSnapshot,
+            [_snapshot(mock_user.id, mock_holding.id, self.BASE + timedelta(days=i), '100') for i in range(2)],
+            prune_scope=self._scope(mock_user.id, mock_holding.id)
+        )
+        db.session.commit()
+
+        assert result.deleted == 2
+        assert HoldingSnapshot.query.filter_by(user_id=mock_user.id).count() == 2
+
+    def test_ambiguous_constraint_raises(self, db):
+        """A named constraint must exist on the table"""
+        with pytest.raises(ValueError):
+            BulkUpsertMapper.upsert(HoldingAnalyticsSnapshot, [], constraint_name='not_a_constraint')
+
+    def test_hash_diff_skips_identical_rows(self, db, mock_user, mock_holding):
+        """Row hashes are stored and identical rows are not rewritten"""
+        BulkUpsertMapper.upsert(HoldingSnapshot, [_snapshot(mock_user.id, mock_holding.id, self.BASE, '100')])
+        db.session.commit()
+        stored = HoldingSnapshot.query.filter_by(user_id=mock_user.id).one()
+        assert len(stored.row_hash) == 32
+
+        same = BulkUpsertMapper.upsert(HoldingSnapshot, [_snapshot(mock_user.id, mock_holding.id, self.BASE, '100')])
+        changed = BulkUpsertMapper.upsert(HoldingSnapshot, [_snapshot(mock_user.id, mock_holding.id, self.BASE, '101')])
+        db.session.commit()
+
+        assert (same.unchanged, same.updated) == (1, 0)
+        assert (changed.unchanged, changed.updated) == (0, 1)
+
+    def test_hash_diff_backfills_missing_hash(self, db, mock_user, mock_holding):
+        """Rows written before row_hash existed are rewritten once, then compare equal"""
+        db.session.add(_snapshot(mock_user.id, mock_holding.id, self.BASE, '100'))
+        db.session.commit()
+
+        first = BulkUpsertMapper.upsert(HoldingSnapshot, [_snapshot(mock_user.id, mock_holding.id, self.BASE, '100')])
+        db.session.commit()
+        second = BulkUpsertMapper.upsert(HoldingSnapshot, [_snapshot(mock_user.id, mock_holding.id, self.BASE, '100')])
+
+        assert first.updated == 1
+        assert second.unchanged == 1
+
+    def test_value_diff_mode(self, db, mock_user, mock_holding):
+        """VALUE mode compares columns even when the table has a row hash"""
+        BulkUpsertMapper.upsert(HoldingSnapshot, [_snapshot(mock_user.id, mock_holding.id, self.BASE, '100')])
+        db.session.commit()
+
+        result = BulkUpsertMapper.upsert(
+            HoldingSnapshot, [_snapshot(mock_user.id, mock_holding.id, self.BASE, '100')], diff_mode='VALUE'
+        )
+        assert result.unchanged == 1
+
+    def test_hash_diff_requires_column(self, db):
+        """HASH mode is rejected for tables without row_hash"""
+        with pytest.raises(ValueError):
+            BulkUpsertMapper.upsert(FundNavHistory, [], diff_mode='HASH')
+
+    def test_record_batch_matches_orm_records(self, db, mock_user, mock_holding):
+        """A columnar batch quantizes column-wise and hashes like the equivalent ORM objects"""
+        batch = RecordBatch(2, {
+            'user_id': mock_user.id,
+            'ho_id': mock_holding.id,
+            'snapshot_date': np.array([self.BASE, self.BASE + timedelta(days=1)], dtype=object),
+            'window_key': np.array(['R20', 'ALL'], dtype=object),
+            'twrr_cumulative': np.array([0.0123456789, -0.5]),
+            'has_sharpe_ratio': np.array([1.23456, np.nan]),
+            'has_max_drawdown_days': np.array([3, 0]),
+        })
+        result = BulkUpsertMapper.upsert(HoldingAnalyticsSnapshot, batch)
+        db.session.commit()
+        assert result.inserted == 2
+
+        rows = HoldingAnalyticsSnapshot.query.order_by(HoldingAnalyticsSnapshot.snapshot_date).all()
+        assert [r.twrr_cumulative for r in rows] == [Decimal('0.012346'), Decimal('-0.500000')]
+        assert [r.has_sharpe_ratio for r in rows] == [Decimal('1.2346'), None]
+        assert [r.has_max_drawdown_days for r in rows] == [3, 0]
+
+        same = [
+            HoldingAnalyticsSnapshot(
+                user_id=mock_user.id, ho_id=mock_holding.id, snapshot_date=self.BASE, window_key='R20',
+                twrr_cumulative=Decimal('0.012346'), has_sharpe_ratio=Decimal('1.2346'), has_max_drawdown_days=3
+            )
+        ]
+        assert BulkUpsertMapper.upsert(HoldingAnalyticsSnapshot, same).unchanged == 1
+
+    def test_record_batch_concat_and_take(self):
+        """Scalar columns broadcast on concat; take reorders every column"""
+        a = RecordBatch(2, {'window_key': 'R20', 'value': np.array([1.0, 2.0])})
+        b = RecordBatch(1, {'window_key': 'ALL', 'value': np.array([3.0])})
+
+        merged = RecordBatch.concat([a, RecordBatch(0, {}), b]).take(np.array([2, 0]))
+
+        assert len(merged) == 2
+        assert merged.column('window_key').tolist() == ['ALL', 'R20']
+        assert merged.column('value').tolist() == [3.0, 1.0]
+
+    def test_result_merge(self):
+        """Chunk results add up and round-trip through to_dict"""
+        total = UpsertResult(inserted=1, unchanged=2)
+        total.merge(UpsertResult.from_dict({'inserted': 3, 'updated': 1, 'unchanged': 0, 'deleted': 4}))
+        total.merge(UpsertResult.from_dict(None))
+
+        assert total.to_dict() == {'inserted': 4, 'updated': 1, 'unchanged': 2, 'deleted': 4}
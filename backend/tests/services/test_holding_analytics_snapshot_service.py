@@ -0,0 +1,491 @@
+"""
+Tests for HoldingAnalyticsSnapshotService single-pass metrics
+"""
+from datetime import date
+from decimal import Decimal
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import optimize
+
+from app.constant.biz_enums import AnalyticsMaterializeEnum
+from app.engine.analytics_state import ExpandingState
+from app.engine.drawdown import drawdown_stats
+from app.engine.rolling_metrics import RollingMetricsEngine, rolling_starts
+from app.engine.xirr import xirr_windows
+from app.mapper import holding_analytics_mapper
+from app.mapper.bulk_upsert_mapper import BulkUpsertMapper
+from app.models import (
+    AnalyticsWindow, Holding, HoldingAnalyticsSnapshot, HoldingAnalyticsState, HoldingSnapshot, InvestedAssetSnapshot,
+    UserSetting
+)
+from app.service.dashboard_service import DashboardService
+from app.service.holding_analytics_snapshot_service import HoldingAnalyticsSnapshotService
+
+WINDOWS = [
+    SimpleNamespace(window_key='R20', window_type='rolling', window_days=20, annualization_factor=252),
+    SimpleNamespace(window_key='R60', window_type='rolling', window_days=60, annualization_factor=252),
+    SimpleNamespace(window_key='ALL', window_type='expanding', window_days=None, annualization_factor=252),
+    SimpleNamespace(window_key='CUR', window_type='expanding', window_days=None, annualization_factor=252),
+]
+
+
+def _holding_frame(n=160, seed=7, wipeout_at=None) -> pd.DataFrame:
+    """Synthetic holding series with flat stretches, two cycles and sparse cash flows"""
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.0005, 0.012, n).round(6)
+    returns[30:36] = 0.0
+    if wipeout_at is not None:
+        returns[wipeout_at] = -1.0
+    flows = np.zeros(n)
+    flows[0] = -10000.0
+    flows[[25, 70, 110]] = [-2000.0, 1500.0, -800.0]
+    mv = 10000.0 * np.cumprod(1 + returns)
+    df = pd.DataFrame({
+        'date': pd.bdate_range('2024-01-02', periods=n),
+        'daily_pnl_ratio': returns,
+        'daily_pnl': (returns * mv).round(4),
+        'shares': np.full(n, 1000.0),
+        'daily_cash_dividend': np.where(np.arange(n) % 40 == 5, 12.5, 0.0),
+        'daily_reinvest_dividend': np.where(np.arange(n) % 50 == 9, 8.0, 0.0),
+        'cycle': np.where(np.arange(n) < 90, 1, 2),
+        'net_external_cash_flow': flows,
+        'mv': mv,
+    })
+    return df.set_index('date')
+
+
+class TestSinglePassMetrics:
+    """The single-pass engine reproduces the per-date slice computation"""
+
+    @pytest.mark.parametrize('wipeout_at', [None, 70], ids=['regular', 'wipeout'])
+    @pytest.mark.parametrize('window', WINDOWS, ids=lambda w: w.window_key)
+    def test_matches_slice_path(self, window, wipeout_at):
+        """A -100% day zeroes the global NAV; windows containing it must still match the slice path"""
+        df = _holding_frame(wipeout_at=wipeout_at)
+        target_rows = np.arange(40, len(df))
+        engine = RollingMetricsEngine(
+            df['daily_pnl_ratio'].to_numpy(), df['daily_pnl'].to_numpy(),
+            df['daily_cash_dividend'].to_numpy(), df['daily_reinvest_dividend'].to_numpy()
+        )
+
+        starts = HoldingAnalyticsSnapshotService._window_starts(df, window, target_rows)
+        fast = HoldingAnalyticsSnapshotService._format_columns(
+            HoldingAnalyticsSnapshotService._window_metrics_single_pass(df, engine, window, starts, target_rows), 0.02
+        )
+        raw, rows = HoldingAnalyticsSnapshotService._window_metrics_by_slice(df, window, target_rows)
+        slow = HoldingAnalyticsSnapshotService._format_columns(raw, 0.02)
+
+        assert rows.tolist() == list(range(len(target_rows)))
+        assert fast.keys() == slow.keys()
+        for key, expected in slow.items():
+            got = fast[key]
+            if expected.dtype.kind == 'f':
+                np.testing.assert_allclose(got, expected, atol=2e-4, rtol=0, err_msg=key)
+            else:
+                assert got.tolist() == expected.tolist(), key
+
+    def test_cur_window_falls_back_when_cycles_repeat(self):
+        """Non-contiguous cycles cannot be expressed as a window start"""
+        df = _holding_frame()
+        df.iloc[100:105, df.columns.get_loc('cycle')] = 1
+        df.iloc[95:100, df.columns.get_loc('cycle')] = 2
+
+        assert HoldingAnalyticsSnapshotService._window_starts(df, WINDOWS[3], np.arange(len(df))) is None
+
+
+class TestRollingMetricsEngine:
+    """Tests for the drawdown queue against brute force"""
+
+    def test_drawdown_matches_brute_force(self):
+        rng = np.random.default_rng(3)
+        returns = rng.normal(0, 0.02, 300)
+        engine = RollingMetricsEngine(returns, returns, np.zeros(300), np.zeros(300))
+        ends = np.arange(300)
+        starts = rolling_starts(ends, 45)
+
+        cols = engine.compute(starts, ends, 252, 30)
+
+        for i, (s, e) in enumerate(zip(starts, ends)):
+            nav = np.cumprod(1 + returns[s:e + 1])
+            dd = nav / np.maximum.accumulate(nav) - 1
+            runup = nav / np.minimum.accumulate(nav) - 1
+            assert cols['mdd'][i] == pytest.approx(dd.min(), abs=1e-12)
+            assert cols['mdd_trough'][i] == s + int(np.argmin(dd))
+            assert cols['max_runup'][i] == pytest.approx(runup.max(), abs=1e-12)
+            assert cols['twrr_cum'][i] == pytest.approx(nav[-1] - 1, abs=1e-12)
+            assert cols['volatility'][i] == pytest.approx(np.std(returns[s:e + 1], ddof=1) * np.sqrt(252)
+                                                          if e > s else np.nan, nan_ok=True)
+
+
+class TestDrawdownStats:
+    """Tests for the single-pass drawdown / recovery / runup kernel"""
+
+    @pytest.mark.parametrize('seed', [1, 2, 3])
+    def test_matches_pandas(self, seed):
+        rng = np.random.default_rng(seed)
+        returns = pd.Series(rng.normal(0.0005, 0.015, 250), index=pd.bdate_range('2024-01-02', periods=250))
+        nav = (1 + returns).cumprod()
+        running_max = nav.cummax()
+        drawdown = (nav - running_max) / running_max
+        trough_ts = drawdown.idxmin()
+        peak_val = running_max.loc[trough_ts]
+        before = nav.loc[:trough_ts]
+        peak_ts = before[before == peak_val].index[-1]
+        after = nav.loc[trough_ts:].iloc[1:] >= peak_val
+
+        stats = drawdown_stats(returns.to_numpy())
+
+        assert stats.max_drawdown == pytest.approx(drawdown.min(), abs=1e-12)
+        assert returns.index[stats.trough] == trough_ts
+        assert returns.index[stats.peak] == peak_ts
+        assert stats.duration == stats.trough - stats.peak
+        assert stats.recovery == (returns.index.get_loc(after.idxmax()) if after.any() else -1)
+        assert stats.max_runup == pytest.approx((nav / nav.cummin() - 1).max(), abs=1e-12)
+
+    def test_edge_cases(self):
+        rising = drawdown_stats(np.array([0.01, 0.02, 0.0]))
+        assert (rising.max_drawdown, rising.peak, rising.trough, rising.recovery) == (0.0, 0, 0, 1)
+
+        # 谷底并列取第一次，峰值取谷底前最后一次创新高
+        stats = drawdown_stats(np.array([0.1, 0.0, -0.5, 0.0, 1.0]))
+        assert (stats.peak, stats.trough, stats.recovery, stats.duration) == (1, 2, 4, 1)
+        assert stats.max_drawdown == pytest.approx(-0.5)
+
+        empty = drawdown_stats(np.array([]))
+        assert empty.trough == -1 and np.isnan(empty.max_drawdown)
+
+
+class TestBatchXirr:
+    """The batched solver agrees with a scalar root finder on every window"""
+
+    @staticmethod
+    def _scalar_xirr(days, amounts, days_per_year):
+        def npv(rate):
+            return np.sum(amounts / np.power(1.0 + rate, (days - days[0]) / days_per_year))
+
+        if np.sign(npv(-0.99)) == np.sign(npv(10.0)):
+            return np.nan
+        return optimize.brentq(npv, -0.99, 10.0, xtol=1e-12)
+
+    def test_matches_scalar_solver(self):
+        rng = np.random.default_rng(11)
+        n = 400
+        day_ordinals = np.cumsum(rng.integers(1, 4, n))
+        flows = np.where(rng.random(n) < 0.08, rng.normal(0, 3000, n).round(2), 0.0)
+        flows[0] = -20000.0
+        mv = 20000.0 * np.cumprod(1 + rng.normal(0.0004, 0.01, n))
+        ends = np.arange(30, n)
+        starts = rolling_starts(ends, 120)
+
+        got = xirr_windows(day_ordinals, flows, mv, starts, ends, days_per_year=365.25, bracketed=True)
+
+        for i, (s, e) in enumerate(zip(starts, ends)):
+            keep = np.flatnonzero(flows[s:e] != 0) + s
+            days = np.r_[day_ordinals[keep], day_ordinals[e]].astype(float)
+            amounts = np.r_[flows[keep], mv[e] + flows[e]]
+            expected = self._scalar_xirr(days, amounts, 365.25)
+            assert got[i] == pytest.approx(expected, abs=1e-6, nan_ok=True)
+
+    def test_unsolvable_windows(self):
+        """Windows without both inflows and outflows, or shorter than min_days, have no rate"""
+        day_ordinals = np.arange(60)
+        flows = np.zeros(60)
+        flows[0] = -1000.0
+        mv = np.full(60, 1100.0)
+
+        got = xirr_windows(day_ordinals, flows, mv, np.array([1, 0, 0]), np.array([59, 20, 59]), min_days=30)
+
+        assert np.isnan(got[0])
+        assert np.isnan(got[1])
+        assert got[2] == pytest.approx(1.1 ** (365.0 / 59) - 1, abs=1e-6)
+
+
+class TestLoadHoldingsData:
+    """Tests for the single-query multi-holding loader"""
+
+    def test_splits_by_holding_and_filters_user(self, db, mock_user, mock_holding):
+        other_holding = Holding(ho_code='000002', ho_name='Other Fund', ho_type='FUND', currency='CNY')
+        other_user = UserSetting(username='other_user', is_locked=0)
+        db.session.add_all([other_holding, other_user])
+        db.session.flush()
+
+        def snap(user_id, ho_id, day, pnl_ratio, mv, cycle=1):
+            return HoldingSnapshot(
+                user_id=user_id, ho_id=ho_id, snapshot_date=date(2024, 3, day),
+                hos_daily_pnl_ratio=Decimal(pnl_ratio), hos_market_value=Decimal(mv), tr_cycle=cycle
+            )
+
+        db.session.add_all([
+            snap(mock_user.id, mock_holding.id, 2, '0.01', '1010'),
+            snap(mock_user.id, mock_holding.id, 1, '0', '1000'),
+            snap(mock_user.id, other_holding.id, 1, '0.02', '500', cycle=None),
+            snap(mock_user.id, mock_holding.id, 9, '0.03', '1040'),
+            snap(other_user.id, mock_holding.id, 1, '0.5', '1'),
+        ])
+        db.session.commit()
+
+        frames = HoldingAnalyticsSnapshotService._load_holdings_data(
+            mock_user.id, [mock_holding.id, other_holding.id], date(2024, 3, 5)
+        )
+
+        assert set(frames) == {mock_holding.id, other_holding.id}
+        first = frames[mock_holding.id]
+        assert list(first.index.date) == [date(2024, 3, 1), date(2024, 3, 2)]
+        assert first['daily_pnl_ratio'].tolist() == pytest.approx([0.0, 0.01])
+        assert first['mv'].tolist() == pytest.approx([1000.0, 1010.0])
+        assert first['daily_pnl'].dtype == np.float64
+        assert first['daily_pnl'].tolist() == [0.0, 0.0]
+        assert frames[other_holding.id]['cycle'].tolist() == [0]
+
+
+class TestUpdatePositionRatios:
+    """Tests for the set-based position ratio / contribution update"""
+
+    @staticmethod
+    def _seed(db, user_id, ho_id):
+        # 2024-03-01 (Fri) -> 2024-03-04 (Mon) 为连续交易日
+        days = [date(2024, 3, 1), date(2024, 3, 4)]
+        for day, mv, pnl, total in zip(days, ['400', '500'], ['0', '100'], ['1000', '2000']):
+            db.session.add(HoldingSnapshot(
+                user_id=user_id, ho_id=ho_id, snapshot_date=day,
+                hos_market_value=Decimal(mv), hos_daily_pnl=Decimal(pnl)
+            ))
+            db.session.add(InvestedAssetSnapshot(
+                user_id=user_id, snapshot_date=day, ias_market_value=Decimal(total),
+                ias_holding_cost=Decimal(total), ias_unrealized_pnl=Decimal('0'),
+                ias_total_realized_pnl=Decimal('0'), ias_total_cash_dividend=Decimal('0'),
+                ias_total_dividend=Decimal('0'), ias_total_pnl=Decimal('0')
+            ))
+            for window_key in ('ALL', 'R20'):
+                db.session.add(HoldingAnalyticsSnapshot(
+                    user_id=user_id, ho_id=ho_id, snapshot_date=day, window_key=window_key
+                ))
+        db.session.commit()
+
+    @staticmethod
+    def _values(user_id):
+        rows = HoldingAnalyticsSnapshot.query.filter_by(user_id=user_id, window_key='ALL') \
+            .order_by(HoldingAnalyticsSnapshot.snapshot_date).all()
+        return [(float(r.has_position_ratio), float(r.has_portfolio_contribution)) for r in rows]
+
+    @pytest.mark.parametrize('chunk_size', [400, 1])
+    def test_fills_missing_rows(self, db, mock_user, mock_holding, monkeypatch, chunk_size):
+        monkeypatch.setattr(holding_analytics_mapper, 'CALENDAR_CHUNK_SIZE', chunk_size)
+        self._seed(db, mock_user.id, mock_holding.id)
+
+        result = HoldingAnalyticsSnapshotService.update_position_ratios_and_contributions(mock_user.id)
+
+        assert result['updated'] == 4
+        # 贡献 = 当日盈亏 / 前一交易日组合市值；首日无前值为 0
+        assert self._values(mock_user.id) == pytest.approx([(0.4, 0.0), (0.25, 0.1)])
+        assert HoldingAnalyticsSnapshotService.update_position_ratios_and_contributions(mock_user.id) == {
+            'updated': 0}
+
+    def test_date_range_recomputes_existing_rows(self, db, mock_user, mock_holding):
+        self._seed(db, mock_user.id, mock_holding.id)
+        HoldingAnalyticsSnapshotService.update_position_ratios_and_contributions(mock_user.id)
+        HoldingSnapshot.query.filter_by(snapshot_date=date(2024, 3, 4)).update(
+            {HoldingSnapshot.hos_market_value: Decimal('1000')})
+        db.session.commit()
+
+        result = HoldingAnalyticsSnapshotService.update_position_ratios_and_contributions(
+            mock_user.id, date(2024, 3, 4), date(2024, 3, 4)
+        )
+
+        assert result['updated'] == 2
+        assert self._values(mock_user.id) == pytest.approx([(0.4, 0.0), (0.5, 0.1)])
+
+    def test_postgresql_sends_calendar_as_arrays(self, db, monkeypatch):
+        """Any date range is one statement on PostgreSQL: the calendar is unnested from two array parameters"""
+        calls = []
+        monkeypatch.setattr(db.session, 'get_bind',
+                            lambda *args, **kwargs: SimpleNamespace(dialect=SimpleNamespace(name='postgresql')))
+        monkeypatch.setattr(db.session, 'execute',
+                            lambda stmt, params: calls.append((str(stmt), params)) or SimpleNamespace(rowcount=3))
+        days = list(pd.bdate_range('2020-01-01', periods=1000).date)
+        prev_days = list(zip(days[1:], days[:-1]))
+
+        updated = holding_analytics_mapper.HoldingAnalyticsMapper.update_position_ratios(
+            1, prev_days, days[1], days[-1]
+        )
+
+        assert updated == 3
+        assert len(calls) == 1
+        sql, params = calls[0]
+        assert 'unnest(CAST(:trade_days AS date[]), CAST(:prev_days AS date[]))' in sql
+        assert params['trade_days'] == days[1:] and params['prev_days'] == days[:-1]
+
+
+class TestExpandingState:
+    """Accumulated expanding-window state matches the single-pass engine"""
+
+    @pytest.mark.parametrize('wipeout_at', [None, 120], ids=['regular', 'wipeout'])
+    @pytest.mark.parametrize('window', WINDOWS[2:], ids=lambda w: w.window_key)
+    def test_matches_engine(self, window, wipeout_at):
+        df = _holding_frame(wipeout_at=wipeout_at)
+        last = len(df) - 1
+        target_rows = np.array([last])
+        engine = RollingMetricsEngine(
+            df['daily_pnl_ratio'].to_numpy(), df['daily_pnl'].to_numpy(),
+            df['daily_cash_dividend'].to_numpy(), df['daily_reinvest_dividend'].to_numpy()
+        )
+        starts = HoldingAnalyticsSnapshotService._window_starts(df, window, target_rows)
+        raw = HoldingAnalyticsSnapshotService._window_metrics_single_pass(df, engine, window, starts, target_rows)
+        expected = HoldingAnalyticsSnapshotService._format_columns(raw, 0.02)
+
+        state = ExpandingState()
+        window_df = df.iloc[int(starts[0]):]
+        for day, row in zip(window_df.index.date, window_df.itertuples()):
+            state.push(day, row.daily_pnl_ratio, row.daily_pnl, row.daily_cash_dividend, row.daily_reinvest_dividend)
+        metrics = state.metrics(window.annualization_factor, 30)
+        state_raw = {key: np.array([value], dtype=object if 'mdd_' in key or key == 'recovery_date' else None)
+                     for key, value in metrics.items()}
+        state_raw['irr_ann'] = raw['irr_ann']
+        state_raw['irr_days'] = np.array([(df.index[-1].date() - state.window_start_date).days])
+        got = HoldingAnalyticsSnapshotService._format_columns(state_raw, 0.02)
+
+        for key, value in expected.items():
+            if value.dtype.kind == 'f':
+                np.testing.assert_allclose(got[key], value, atol=1e-9, rtol=0, err_msg=key)
+            else:
+                assert got[key].tolist() == value.tolist(), key
+
+
+class TestDailyAnalytics:
+    """Tests for the state-based single-day increment"""
+
+    @staticmethod
+    def _seed(db, user_id, ho_id):
+        db.session.add_all([
+            AnalyticsWindow(window_key=w.window_key, window_type=w.window_type, window_days=w.window_days,
+                            annualization_factor=w.annualization_factor)
+            for w in WINDOWS
+        ])
+        df = _holding_frame(n=120)
+        for day, row in zip(df.index.date, df.itertuples()):
+            db.session.add(HoldingSnapshot(
+                user_id=user_id, ho_id=ho_id, snapshot_date=day,
+                hos_daily_pnl_ratio=Decimal(str(row.daily_pnl_ratio)), hos_daily_pnl=Decimal(str(row.daily_pnl)),
+                holding_shares=Decimal('1000'), hos_daily_cash_dividend=Decimal(str(row.daily_cash_dividend)),
+                hos_daily_reinvest_dividend=Decimal(str(row.daily_reinvest_dividend)),
+                hos_net_external_cash_flow=Decimal(str(row.net_external_cash_flow)),
+                hos_market_value=Decimal(str(round(row.mv, 4))), tr_cycle=int(row.cycle)
+            ))
+        db.session.commit()
+        return list(df.index.date)
+
+    def test_increment_matches_full_recompute(self, db, mock_user, mock_holding, mock_user_holding, monkeypatch):
+        dates = self._seed(db, mock_user.id, mock_holding.id)
+
+        # 1. 第一次：无状态，全量计算并播种
+        seeded = HoldingAnalyticsSnapshotService.generate_daily_analytics(mock_user.id, dates[-2])
+        db.session.commit()
+        assert len(seeded) == len(WINDOWS)
+        states = HoldingAnalyticsState.query.filter_by(user_id=mock_user.id).all()
+        assert {s.window_key: s.last_date for s in states} == {w.window_key: dates[-2] for w in WINDOWS}
+
+        # 2. 第二次：只追加一天，不再加载全部历史
+        def no_full_load(*args, **kwargs):
+            raise AssertionError('full history should not be loaded')
+        monkeypatch.setattr(HoldingAnalyticsSnapshotService, '_seed_states', no_full_load)
+        daily = HoldingAnalyticsSnapshotService.generate_daily_analytics(mock_user.id, dates[-1])
+        db.session.commit()
+        monkeypatch.undo()
+
+        full = HoldingAnalyticsSnapshotService.generate_analytics(mock_user.id, dates[-1], dates[-1])
+        assert HoldingAnalyticsState.query.filter_by(user_id=mock_user.id).count() == len(WINDOWS)
+        assert daily.column('window_key').tolist() == full.column('window_key').tolist()
+        for key, expected in full.columns.items():
+            got = daily.column(key)
+            expected = full.column(key)
+            if expected.dtype.kind == 'f':
+                np.testing.assert_allclose(got, expected, atol=1e-8, rtol=0, err_msg=key)
+            else:
+                assert got.tolist() == expected.tolist(), key
+
+        # 3. 历史重算写库时，覆盖到的状态在同一事务内失效
+        HoldingAnalyticsSnapshotService.save_analytics(
+            mock_user.id, full, prune_scope=[HoldingAnalyticsSnapshot.user_id == mock_user.id],
+            invalidate_from=dates[-1]
+        )
+        db.session.commit()
+        assert HoldingAnalyticsState.query.filter_by(user_id=mock_user.id).count() == 0
+
+    def test_stale_state_falls_back_to_full_history(self, db, mock_user, mock_holding, mock_user_holding):
+        dates = self._seed(db, mock_user.id, mock_holding.id)
+        HoldingAnalyticsSnapshotService.generate_daily_analytics(mock_user.id, dates[-3])
+        db.session.commit()
+
+        # 跳过一天：状态与前一快照日期不衔接
+        daily = HoldingAnalyticsSnapshotService.generate_daily_analytics(mock_user.id, dates[-1])
+        db.session.commit()
+
+        assert len(daily) == len(WINDOWS)
+        assert {s.last_date for s in HoldingAnalyticsState.query.all()} == {dates[-1]}
+
+
+class TestRegenerateAnalytics:
+    """regenerate_analytics (async retry entry) persists what it computes"""
+
+    def test_persists_and_commits(self, db, mock_user, mock_holding, mock_user_holding):
+        dates = TestDailyAnalytics._seed(db, mock_user.id, mock_holding.id)
+
+        result = HoldingAnalyticsSnapshotService.regenerate_analytics(
+            mock_user.id, str(dates[-3]), str(dates[-1]), ho_ids=[mock_holding.id]
+        )
+        db.session.rollback()
+
+        stored = HoldingAnalyticsSnapshot.query.filter_by(user_id=mock_user.id, ho_id=mock_holding.id).count()
+        assert result['generated'] == stored == 3 * len(WINDOWS)
+
+class TestMaterializePolicy:
+    """LATEST windows keep one row per holding; ON_READ windows are not stored and are computed on read"""
+
+    def test_lazy_windows(self, db, mock_user, mock_holding, mock_user_holding):
+        dates = TestDailyAnalytics._seed(db, mock_user.id, mock_holding.id)
+        full = HoldingAnalyticsSnapshotService.generate_analytics(mock_user.id, dates[0], dates[-1])
+        BulkUpsertMapper.upsert(HoldingAnalyticsSnapshot, full)
+        db.session.commit()
+
+        policies = {'R20': AnalyticsMaterializeEnum.LATEST.value, 'R60': AnalyticsMaterializeEnum.ON_READ.value}
+        for window in AnalyticsWindow.query.all():
+            window.materialize_policy = policies.get(window.window_key, AnalyticsMaterializeEnum.ALL_DATES.value)
+        db.session.commit()
+
+        # 1. 区间生成：LATEST 只产出最后一天，ON_READ 不产出
+        batch = HoldingAnalyticsSnapshotService.generate_analytics(mock_user.id, dates[0], dates[-2])
+        keys = batch.column('window_key')
+        assert (keys == 'R20').sum() == 1
+        assert batch.column('snapshot_date')[keys == 'R20'].tolist() == [dates[-2]]
+        assert 'R60' not in keys.tolist()
+        assert (keys == 'ALL').sum() == len(dates) - 1
+        # 生成只计算不写库，清理在 save_analytics 中进行
+        assert HoldingAnalyticsSnapshot.query.filter_by(window_key='R60').count() == len(dates)
+        db.session.rollback()
+
+        # 2. 日增量写库：旧的 LATEST 行与 ON_READ 行被清理
+        daily = HoldingAnalyticsSnapshotService.generate_daily_analytics(mock_user.id, dates[-1])
+        HoldingAnalyticsSnapshotService.save_analytics(mock_user.id, daily, prune_scope=[
+            HoldingAnalyticsSnapshot.user_id == mock_user.id, HoldingAnalyticsSnapshot.snapshot_date == dates[-1]
+        ])
+        db.session.commit()
+        stored = HoldingAnalyticsSnapshot.query.filter_by(user_id=mock_user.id)
+        assert [r.snapshot_date for r in stored.filter_by(window_key='R20')] == [dates[-1]]
+        assert stored.filter_by(window_key='R60').count() == 0
+        assert stored.filter_by(window_key='ALL').count() == len(dates)
+
+        # 3. 读取时计算，与全量落库的结果一致
+        window = AnalyticsWindow.query.filter_by(window_key='R60').first()
+        on_read = HoldingAnalyticsSnapshotService.compute_on_read(mock_user.id, window, dates[-1])
+        expected = full.take(np.flatnonzero((full.column('window_key') == 'R60')
+                                            & (full.column('snapshot_date') == dates[-1])))
+        assert len(on_read) == 1
+        for key in ('twrr_cumulative', 'irr_annualized', 'has_cumulative_pnl', 'has_max_drawdown', 'has_sharpe_ratio'):
+            np.testing.assert_allclose(on_read.column(key), expected.column(key), atol=1e-12, rtol=0, err_msg=key)
+
+        allocation = DashboardService.get_holdings_allocation(mock_user.id, 'R60')
+        assert [item['window_key'] for item in allocation] == ['R60']
+        assert allocation[0]['has_cumulative_pnl'] == pytest.approx(on_read.column('has_cumulative_pnl')[0])
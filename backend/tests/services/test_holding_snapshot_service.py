@@ -5,11 +5,17 @@ from datetime import date, timedelta
 from decimal import Decimal
 from unittest.mock import patch, MagicMock
 
+import numpy as np
 import pytest
 
 from app.constant.biz_enums import TradeTypeEnum, HoldingStatusEnum
 from app.constant.sys_enums import GlobalYesOrNo
-from app.framework.exceptions import AsyncTaskException
+from app.engine.fixed_point import (
+    FixedPointMismatch, FixedPointOverflow, check_product, div_half_even, from_float, scaled_div, to_decimals, to_fixed
+)
+from app.engine.nav_series import NavSeries
+from app.engine.position_replay import AMOUNT_COLUMNS
+from app.framework.exceptions import AsyncTaskException, BizException
 from app.models import HoldingSnapshot, Holding, Trade, FundNavHistory, UserHolding
 from app.service.holding_snapshot_service import (
     HoldingSnapshotService, PositionState, ZERO
@@ -17,6 +23,11 @@ from app.service.holding_snapshot_service import (
 from tests.conftest import create_trade
 
 
+def _calendar_days(start, end):
+    """测试用日历：每个自然日都是交易日"""
+    return np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+
+
 class TestPositionState:
     """Tests for PositionState dataclass"""
 
@@ -360,6 +371,7 @@ class TestGenerateSnapshots:
         # Mock trade calendar
         mock_calendar.prev_trade_day.return_value = date.today() - timedelta(days=1)
         mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
 
         # Create trade
         trade = create_trade(
@@ -396,6 +408,17 @@ class TestGenerateSnapshots:
         # Should generate some snapshots
         assert result['total_generated'] >= 0  # May be 0 if no NAV in range
 
+    @pytest.mark.parametrize('kwargs', [{'engine': 'vector'}, {'chunk_by': 'WEEK'}])
+    def test_generate_snapshots_rejects_unknown_option(self, db, mock_user, kwargs):
+        """未知的 engine / chunk_by 直接报错，不回退到 Decimal 路径"""
+        with pytest.raises(BizException):
+            HoldingSnapshotService.generate_snapshots(
+                user_id=mock_user.id,
+                start_date=date.today() - timedelta(days=5),
+                end_date=date.today(),
+                **kwargs
+            )
+
 
 class TestCalculateRange:
     """Tests for HoldingSnapshotService._calculate_range"""
@@ -406,6 +429,7 @@ class TestCalculateRange:
     ):
         """Test calculating range with no trades"""
         mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
 
         navs = {}
         for i in range(5):
@@ -424,7 +448,7 @@ class TestCalculateRange:
             target_start=date.today() - timedelta(days=2),
             target_end=date.today(),
             trades=[],
-            navs=navs,
+            navs=NavSeries.from_records(navs.values()),
             prev_snapshot=None
         )
 
@@ -437,6 +461,7 @@ class TestCalculateRange:
     ):
         """Test calculating range with trades"""
         mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
 
         # Create trade
         trade = create_trade(
@@ -468,9 +493,549 @@ class TestCalculateRange:
             target_start=date.today() - timedelta(days=2),
             target_end=date.today(),
             trades=[trade],
-            navs=navs,
+            navs=NavSeries.from_records(navs.values()),
             prev_snapshot=None
         )
 
         # Should generate snapshots for days in target range after trade
         assert len(result) >= 1
+
+
+ARRAY_ENGINES = ['_calculate_range_vectorized', '_calculate_range_fixed', '_calculate_range_verified']
+
+
+class TestCalculateRangeVectorized:
+    """Tests for the array engines (vectorized, fixed-point, verify) against the Decimal path"""
+
+    COMPARED_FIELDS = (
+        'snapshot_date', 'holding_shares', 'hos_holding_cost', 'avg_cost', 'market_price',
+        'hos_market_value', 'hos_daily_buy_amount', 'hos_total_buy_amount', 'hos_daily_sell_amount',
+        'hos_total_sell_amount', 'hos_net_external_cash_flow', 'hos_realized_pnl', 'hos_unrealized_pnl',
+        'hos_daily_pnl', 'hos_daily_pnl_ratio', 'hos_total_pnl', 'hos_total_pnl_ratio',
+        'hos_daily_cash_dividend', 'hos_daily_reinvest_dividend', 'hos_total_cash_dividend',
+        'hos_total_reinvest_dividend', 'hos_total_dividend', 'tr_cycle', 'is_cleared',
+    )
+
+    @staticmethod
+    def _dividend(user_id, holding, tr_date, dividend_type, amount, shares=None):
+        return Trade(
+            user_id=user_id, ho_id=holding.id, ho_code=holding.ho_code,
+            tr_type=TradeTypeEnum.DIVIDEND.value, tr_date=tr_date,
+            tr_shares=shares, tr_amount=amount, cash_amount=amount,
+            dividend_type=dividend_type, tr_cycle=1
+        )
+
+    def _assert_same(self, expected, actual):
+        assert len(expected) == len(actual)
+        for exp, act in zip(expected, actual):
+            for field in self.COMPARED_FIELDS:
+                e, a = getattr(exp, field), getattr(act, field)
+                if isinstance(e, Decimal):
+                    assert float(a) == pytest.approx(float(e), abs=1e-4), field
+                else:
+                    assert a == e, field
+
+    @pytest.mark.parametrize('method', ARRAY_ENGINES)
+    @patch('app.service.holding_snapshot_service.trade_calendar')
+    def test_parity_full_lifecycle(self, mock_calendar, method, db, mock_user, mock_holding):
+        """Buy, partial sell, dividends, clear and rebuy produce identical snapshots"""
+        from app.constant.biz_enums import DividendTypeEnum
+        mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
+
+        base = date(2024, 3, 1)
+        kwargs = dict(user_id=mock_user.id, ho_id=mock_holding.id, ho_code=mock_holding.ho_code)
+        trades = [
+            create_trade(tr_type=TradeTypeEnum.BUY.value, tr_date=base, shares=Decimal('1000'),
+                         nav=Decimal('1.5'), fee=Decimal('1.5'), **kwargs),
+            create_trade(tr_type=TradeTypeEnum.BUY.value, tr_date=base + timedelta(days=2),
+                         shares=Decimal('300'), nav=Decimal('1.55'), fee=Decimal('0.5'), **kwargs),
+            create_trade(tr_type=TradeTypeEnum.SELL.value, tr_date=base + timedelta(days=4),
+                         shares=Decimal('400'), nav=Decimal('1.6'), fee=Decimal('0.6'), **kwargs),
+            self._dividend(mock_user.id, mock_holding, base + timedelta(days=5),
+                           DividendTypeEnum.CASH, Decimal('12.5')),
+            self._dividend(mock_user.id, mock_holding, base + timedelta(days=6),
+                           DividendTypeEnum.REINVEST, Decimal('8'), Decimal('5')),
+            create_trade(tr_type=TradeTypeEnum.SELL.value, tr_date=base + timedelta(days=8),
+                         shares=Decimal('905'), nav=Decimal('1.7'), fee=Decimal('1'), **kwargs),
+            create_trade(tr_type=TradeTypeEnum.BUY.value, tr_date=base + timedelta(days=10),
+                         shares=Decimal('200'), nav=Decimal('1.65'), fee=Decimal('0.2'), **kwargs),
+        ]
+        trades[-1].tr_cycle = 2
+
+        navs = {}
+        for i in range(14):
+            if i == 7:
+                continue  # 缺失净值日
+            d = base + timedelta(days=i)
+            navs[d.isoformat()] = FundNavHistory(
+                ho_id=mock_holding.id, ho_code=mock_holding.ho_code, nav_date=d,
+                nav_per_unit=Decimal('1.5') + Decimal(i) * Decimal('0.0125')
+            )
+
+        params = dict(
+            holding=mock_holding, user_id=mock_user.id,
+            target_start=base + timedelta(days=3), target_end=base + timedelta(days=13),
+            trades=trades, navs=NavSeries.from_records(navs.values()), prev_snapshot=None
+        )
+        expected = HoldingSnapshotService._calculate_range(**params)
+        actual = getattr(HoldingSnapshotService, method)(**params)
+
+        assert len(expected) == 10
+        self._assert_same(expected, actual)
+
+    @pytest.mark.parametrize('method', ARRAY_ENGINES)
+    @patch('app.service.holding_snapshot_service.trade_calendar')
+    def test_parity_warm_start(self, mock_calendar, method, db, mock_user, mock_holding):
+        """Warm start from a previous snapshot without trades in range"""
+        mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
+
+        start = date(2024, 4, 1)
+        prev_snapshot = HoldingSnapshot(
+            user_id=mock_user.id, ho_id=mock_holding.id, snapshot_date=start - timedelta(days=1),
+            holding_shares=Decimal('800'), hos_holding_cost=Decimal('1200'),
+            hos_total_buy_amount=Decimal('1500'), hos_total_sell_amount=Decimal('320'),
+            hos_total_cash_dividend=ZERO, hos_total_reinvest_dividend=ZERO,
+            hos_realized_pnl=Decimal('20'), hos_market_value=Decimal('1240')
+        )
+        navs = {
+            (start + timedelta(days=i)).isoformat(): FundNavHistory(
+                ho_id=mock_holding.id, nav_date=start + timedelta(days=i),
+                nav_per_unit=Decimal('1.55') + Decimal(i) * Decimal('0.01')
+            )
+            for i in range(5)
+        }
+        params = dict(
+            holding=mock_holding, user_id=mock_user.id, target_start=start,
+            target_end=start + timedelta(days=4), trades=[], navs=NavSeries.from_records(navs.values()),
+            prev_snapshot=prev_snapshot
+        )
+
+        self._assert_same(
+            HoldingSnapshotService._calculate_range(**params),
+            getattr(HoldingSnapshotService, method)(**params)
+        )
+
+    @pytest.mark.parametrize('method', ARRAY_ENGINES)
+    @patch('app.service.holding_snapshot_service.trade_calendar')
+    def test_vectorized_oversell_raises_exception(self, mock_calendar, method, db, mock_user, mock_holding):
+        """Selling without shares raises AsyncTaskException like the Decimal path"""
+        mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
+        trade = create_trade(
+            user_id=mock_user.id, ho_id=mock_holding.id, ho_code=mock_holding.ho_code,
+            tr_type=TradeTypeEnum.SELL.value, tr_date=date(2024, 5, 6),
+            shares=Decimal('100'), nav=Decimal('1.5')
+        )
+
+        with pytest.raises(AsyncTaskException):
+            getattr(HoldingSnapshotService, method)(
+                holding=mock_holding, user_id=mock_user.id,
+                target_start=date(2024, 5, 6), target_end=date(2024, 5, 8),
+                trades=[trade], prev_snapshot=None,
+                navs=NavSeries.from_records([(date(2024, 5, 6), Decimal('1.5'))])
+            )
+
+
+class TestFixedPointEngine:
+    """Tests for the int64 fixed-point helpers and the verify mode"""
+
+    def test_scaled_div_rounds_half_even(self):
+        """Ties go to the even neighbour, negatives round symmetrically, zero divisors give zero"""
+        result = scaled_div(np.array([5, 15, -5, 7, 1, 3]), np.array([10, 10, 10, 2, 3, 0]))
+        assert result.tolist() == [0, 2, 0, 4, 0, 0]
+        assert scaled_div(np.array([1]), np.array([3]), 4).tolist() == [3333]
+        assert div_half_even(25, 10) == 2 and div_half_even(35, 10) == 4
+
+    def test_decimal_round_trip_is_exact(self):
+        values = [Decimal('1234567.8901'), Decimal('-0.0001'), None]
+        assert to_decimals(to_fixed(values)) == [Decimal('1234567.8901'), Decimal('-0.0001'), Decimal('0.0000')]
+        assert from_float([0.1, 1.0005]).tolist() == [1000, 10005]
+
+    def test_overflow_is_reported(self):
+        with pytest.raises(FixedPointOverflow):
+            from_float([1e12])
+        with pytest.raises(FixedPointOverflow):
+            check_product(np.array([10 ** 12]), np.array([10 ** 8]))
+
+    @patch('app.service.holding_snapshot_service.trade_calendar')
+    def test_fixed_amounts_are_exact(self, mock_calendar, db, mock_user, mock_holding):
+        """Every column, cost-derived ones included, equals the quantized Decimal result exactly"""
+        mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
+        base = date(2024, 7, 1)
+        kwargs = dict(user_id=mock_user.id, ho_id=mock_holding.id, ho_code=mock_holding.ho_code)
+        trades = [
+            create_trade(tr_type=TradeTypeEnum.BUY.value, tr_date=base, shares=Decimal('333.33'),
+                         nav=Decimal('1.2345'), fee=Decimal('0.37'), **kwargs),
+            create_trade(tr_type=TradeTypeEnum.SELL.value, tr_date=base + timedelta(days=2),
+                         shares=Decimal('111.11'), nav=Decimal('1.3579'), fee=Decimal('0.13'), **kwargs),
+        ]
+        for t in trades:
+            # 与入库后的 Numeric(18,2) 金额列一致
+            t.tr_amount = t.tr_amount.quantize(Decimal('0.01'))
+            t.cash_amount = t.cash_amount.quantize(Decimal('0.01'))
+        navs = NavSeries.from_records([
+            (base + timedelta(days=i), Decimal('1.2345') + Decimal(i) * Decimal('0.0617')) for i in range(4)
+        ])
+        params = dict(holding=mock_holding, user_id=mock_user.id, target_start=base,
+                      target_end=base + timedelta(days=3), trades=trades, navs=navs, prev_snapshot=None)
+
+        expected = HoldingSnapshotService._calculate_range(**params)
+        actual = HoldingSnapshotService._calculate_range_fixed(**params)
+
+        quantum = Decimal('0.0001')
+        for exp, act in zip(expected, actual):
+            for field in AMOUNT_COLUMNS:
+                assert getattr(act, field) == getattr(exp, field).quantize(quantum), field
+        # 校验模式逐列比较，不再容许任何差异
+        HoldingSnapshotService._calculate_range_verified(**params)
+
+    @patch('app.service.holding_snapshot_service.trade_calendar')
+    def test_partial_sell_tie_matches_decimal_rounding(self, mock_calendar, db, mock_user, mock_holding):
+        """An exact half-unit cost tie is rounded the way the Decimal path's 28-digit context leaves it"""
+        mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
+        base = date(2024, 7, 1)
+        kwargs = dict(user_id=mock_user.id, ho_id=mock_holding.id, ho_code=mock_holding.ho_code)
+        # 成本 100.01 / 300 份，卖出 151.5 份：精确剩余成本 49.50495 恰为 0.5 个最小单位，
+        # Decimal 路径的单位成本 (28 位有效数字) 略大于精确值，剩余成本舍为 49.5049
+        trades = [
+            create_trade(tr_type=TradeTypeEnum.BUY.value, tr_date=base, shares=Decimal('300'),
+                         nav=Decimal('0.3333'), fee=Decimal('0.02'), **kwargs),
+            create_trade(tr_type=TradeTypeEnum.SELL.value, tr_date=base + timedelta(days=1),
+                         shares=Decimal('151.5'), nav=Decimal('0.5'), **kwargs),
+        ]
+        navs = NavSeries.from_records([(base + timedelta(days=i), Decimal('2.5')) for i in range(3)])
+        params = dict(holding=mock_holding, user_id=mock_user.id, target_start=base,
+                      target_end=base + timedelta(days=2), trades=trades, navs=navs, prev_snapshot=None)
+
+        expected = HoldingSnapshotService._calculate_range(**params)
+        actual = HoldingSnapshotService._calculate_range_fixed(**params)
+
+        assert actual[1].hos_holding_cost == Decimal('49.5049')
+        quantum = Decimal('0.0001')
+        for exp, act in zip(expected, actual):
+            for field in AMOUNT_COLUMNS:
+                assert getattr(act, field) == getattr(exp, field).quantize(quantum), field
+
+    @patch('app.service.holding_snapshot_service.trade_calendar')
+    def test_verify_mode_raises_on_mismatch(self, mock_calendar, db, mock_user, mock_holding):
+        """A fixed-point result that drifts from the Decimal path fails verification"""
+        mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
+        day = date(2024, 8, 1)
+        trade = create_trade(user_id=mock_user.id, ho_id=mock_holding.id, ho_code=mock_holding.ho_code,
+                             tr_type=TradeTypeEnum.BUY.value, tr_date=day, shares=Decimal('100'),
+                             nav=Decimal('1.5'))
+        params = dict(holding=mock_holding, user_id=mock_user.id, target_start=day, target_end=day,
+                      trades=[trade], navs=NavSeries.from_records([(day, Decimal('1.5'))]), prev_snapshot=None)
+        drifted = HoldingSnapshotService._calculate_range(**params)
+        drifted[0].hos_market_value += Decimal('0.0001')
+
+        with patch.object(HoldingSnapshotService, '_calculate_range_fixed', return_value=drifted):
+            with pytest.raises(FixedPointMismatch, match='hos_market_value'):
+                HoldingSnapshotService._calculate_range_verified(**params)
+
+
+class TestWarmStartCheckpoint:
+    """Tests for nearest-checkpoint warm start"""
+
+    @staticmethod
+    def _snapshot(user_id, ho_id, snapshot_date, shares='1000', cost='1500', market_value='1550'):
+        return HoldingSnapshot(
+            user_id=user_id, ho_id=ho_id, snapshot_date=snapshot_date,
+            holding_shares=Decimal(shares), hos_holding_cost=Decimal(cost),
+            hos_total_buy_amount=Decimal(cost), hos_total_sell_amount=ZERO,
+            hos_total_cash_dividend=ZERO, hos_total_reinvest_dividend=ZERO,
+            hos_total_dividend=ZERO, hos_realized_pnl=ZERO, hos_market_value=Decimal(market_value)
+        )
+
+    def test_load_checkpoints_picks_latest_before_start(self, db, mock_user, mock_holding):
+        """Falls back to the latest snapshot before start_date when the previous day is missing"""
+        start = date(2024, 6, 10)
+        db.session.add_all([
+            self._snapshot(mock_user.id, mock_holding.id, start - timedelta(days=6)),
+            self._snapshot(mock_user.id, mock_holding.id, start - timedelta(days=4), shares='1200'),
+            self._snapshot(mock_user.id, mock_holding.id, start, shares='1300'),
+        ])
+        db.session.commit()
+
+        checkpoints = HoldingSnapshotService._load_checkpoints(mock_user.id, [mock_holding.id], start)
+
+        assert checkpoints[mock_holding.id].snapshot_date == start - timedelta(days=4)
+        assert checkpoints[mock_holding.id].holding_shares == Decimal('1200')
+
+    def test_load_checkpoints_filters_user(self, db, mock_user, mock_holding):
+        """Snapshots of other users are never used as checkpoints"""
+        db.session.add(self._snapshot(mock_user.id + 1000, mock_holding.id, date(2024, 6, 7)))
+        db.session.commit()
+
+        assert HoldingSnapshotService._load_checkpoints(mock_user.id, [mock_holding.id], date(2024, 6, 10)) == {}
+
+    @patch('app.service.holding_snapshot_service.trade_calendar')
+    def test_stale_checkpoint_replays_gap_trades(self, mock_calendar, db, mock_user, mock_holding):
+        """Trades between an older checkpoint and start_date are applied before the target range"""
+        mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
+
+        start = date(2024, 6, 10)
+        first_buy = create_trade(
+            user_id=mock_user.id, ho_id=mock_holding.id, ho_code=mock_holding.ho_code,
+            tr_type=TradeTypeEnum.BUY.value, tr_date=start - timedelta(days=6),
+            shares=Decimal('1000'), nav=Decimal('1.5')
+        )
+        gap_buy = create_trade(
+            user_id=mock_user.id, ho_id=mock_holding.id, ho_code=mock_holding.ho_code,
+            tr_type=TradeTypeEnum.BUY.value, tr_date=start - timedelta(days=2),
+            shares=Decimal('200'), nav=Decimal('1.5')
+        )
+        navs = {
+            (start + timedelta(days=i)).isoformat(): FundNavHistory(
+                ho_id=mock_holding.id, nav_date=start + timedelta(days=i), nav_per_unit=Decimal('1.6')
+            )
+            for i in range(3)
+        }
+        checkpoint = self._snapshot(mock_user.id, mock_holding.id, start - timedelta(days=4))
+        params = dict(
+            holding=mock_holding, user_id=mock_user.id, target_start=start,
+            target_end=start + timedelta(days=2), trades=[first_buy, gap_buy],
+            navs=NavSeries.from_records(navs.values())
+        )
+
+        warm = HoldingSnapshotService._calculate_range(prev_snapshot=checkpoint, **params)
+        cold = HoldingSnapshotService._calculate_range(prev_snapshot=None, **params)
+        vector = HoldingSnapshotService._calculate_range_vectorized(prev_snapshot=checkpoint, **params)
+
+        assert len(warm) == len(cold) == len(vector) == 3
+        for w, c, v in zip(warm, cold, vector):
+            assert w.holding_shares == c.holding_shares == Decimal('1200')
+            assert w.hos_holding_cost == c.hos_holding_cost
+            assert float(v.hos_market_value) == pytest.approx(float(w.hos_market_value), abs=1e-4)
+
+        # First target day is measured against the checkpoint: the gap buy is a flow, not profit
+        gap_cost = gap_buy.cash_amount
+        expected_pnl = Decimal('1200') * Decimal('1.6') - Decimal('1550') - gap_cost
+        assert warm[0].hos_daily_pnl == expected_pnl
+        assert warm[0].hos_daily_buy_amount == gap_cost
+        assert float(vector[0].hos_daily_pnl) == pytest.approx(float(expected_pnl), abs=1e-4)
+        fixed = HoldingSnapshotService._calculate_range_fixed(prev_snapshot=checkpoint, **params)
+        assert fixed[0].hos_daily_pnl == expected_pnl
+        assert warm[1].hos_daily_pnl == vector[1].hos_daily_pnl == ZERO
+
+
+class TestLoadNavSeries:
+    """Tests for columnar NAV loading"""
+
+    def test_load_nav_series_is_range_bounded(self, db, mock_holding):
+        """Only NAVs within [start_date, end_date] are loaded, keyed by date ordinal"""
+        base = date(2024, 8, 1)
+        for i in range(10):
+            db.session.add(FundNavHistory(
+                ho_id=mock_holding.id, ho_code=mock_holding.ho_code, nav_date=base + timedelta(days=i),
+                nav_per_unit=Decimal('1.0') + Decimal(i) * Decimal('0.0123')
+            ))
+        db.session.commit()
+
+        series = HoldingSnapshotService._load_nav_series(
+            [mock_holding.id], base + timedelta(days=3), base + timedelta(days=6)
+        )[mock_holding.id]
+
+        assert len(series) == 4
+        assert series.ordinals[0] == (base + timedelta(days=3)).toordinal()
+        assert series.get(base + timedelta(days=4)).nav_per_unit == Decimal('1.0492')
+        assert series.get(base + timedelta(days=7)) is None
+        aligned = series.values_on([base + timedelta(days=2), base + timedelta(days=5)])
+        assert np.isnan(aligned[0]) and aligned[1] == pytest.approx(1.0615)
+
+
+class TestParallelSnapshots:
+    """Tests for process-pool snapshot generation"""
+
+    @staticmethod
+    def _make_trades(user_id, holding, base):
+        return [
+            create_trade(user_id=user_id, ho_id=holding.id, ho_code=holding.ho_code,
+                         tr_type=TradeTypeEnum.BUY.value, tr_date=base, shares=Decimal('1000'), nav=Decimal('1.5')),
+            create_trade(user_id=user_id, ho_id=holding.id, ho_code=holding.ho_code,
+                         tr_type=TradeTypeEnum.SELL.value, tr_date=base + timedelta(days=2),
+                         shares=Decimal('400'), nav=Decimal('1.6')),
+        ]
+
+    @patch('app.service.holding_snapshot_service.trade_calendar')
+    def test_pool_matches_sequential(self, mock_calendar, db, mock_user, mock_holding):
+        """Jobs replayed in worker processes equal in-process results; oversell comes back as an error"""
+        mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
+
+        base = date(2024, 9, 2)
+        navs = NavSeries.from_records([
+            (base + timedelta(days=i), Decimal('1.5') + Decimal(i) * Decimal('0.01')) for i in range(6)
+        ])
+        good, _ = HoldingSnapshotService._build_replay_job(
+            1, base + timedelta(days=1), base + timedelta(days=5),
+            self._make_trades(mock_user.id, mock_holding, base), navs, None
+        )
+        oversell = create_trade(user_id=mock_user.id, ho_id=mock_holding.id, ho_code=mock_holding.ho_code,
+                                tr_type=TradeTypeEnum.SELL.value, tr_date=base, shares=Decimal('1'),
+                                nav=Decimal('1.5'))
+        bad, _ = HoldingSnapshotService._build_replay_job(2, base, base + timedelta(days=5), [oversell], navs, None)
+
+        results = HoldingSnapshotService._run_jobs_in_pool([good, bad], workers=2)
+        sequential = HoldingSnapshotService._run_jobs_in_pool([good], workers=1)[1]
+
+        assert len(results[1]) == 5
+        for name in ('holding_shares', 'hos_holding_cost', 'hos_realized_pnl', 'hos_daily_pnl'):
+            np.testing.assert_allclose(results[1].columns[name], sequential.columns[name])
+        assert results[2].trade_index == 0
+
+    @patch('app.service.holding_snapshot_service.trade_calendar')
+    def test_generate_snapshots_parallel_mode(
+        self, mock_calendar, db, mock_user, mock_holding, mock_user_holding
+    ):
+        """Parallel mode merges job results into the same rows as the sequential vector engine"""
+        mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
+
+        base = date(2024, 9, 2)
+        db.session.add_all(self._make_trades(mock_user.id, mock_holding, base))
+        for i in range(6):
+            db.session.add(FundNavHistory(
+                ho_id=mock_holding.id, ho_code=mock_holding.ho_code, nav_date=base + timedelta(days=i),
+                nav_per_unit=Decimal('1.5') + Decimal(i) * Decimal('0.01')
+            ))
+        db.session.commit()
+
+        params = dict(user_id=mock_user.id, start_date=base, end_date=base + timedelta(days=5))
+        result = HoldingSnapshotService.generate_snapshots(parallel=True, workers=1, **params)
+        parallel_rows = [(s.snapshot_date, s.holding_shares, s.hos_total_pnl)
+                         for s in HoldingSnapshot.query.order_by(HoldingSnapshot.snapshot_date).all()]
+
+        HoldingSnapshotService.generate_snapshots(engine='VECTOR', **params)
+        vector_rows = [(s.snapshot_date, s.holding_shares, s.hos_total_pnl)
+                       for s in HoldingSnapshot.query.order_by(HoldingSnapshot.snapshot_date).all()]
+
+        assert result['errors'] == []
+        assert result['total_generated'] == 6
+        assert parallel_rows == vector_rows
+
+
+class TestStreamingSnapshots:
+    """Tests for chunked streaming snapshot generation"""
+
+    BASE = date(2024, 10, 1)
+
+    def _seed(self, db, user_id, holding):
+        trades = [
+            create_trade(user_id=user_id, ho_id=holding.id, ho_code=holding.ho_code,
+                         tr_type=TradeTypeEnum.BUY.value, tr_date=self.BASE, shares=Decimal('1000'),
+                         nav=Decimal('1.5')),
+            create_trade(user_id=user_id, ho_id=holding.id, ho_code=holding.ho_code,
+                         tr_type=TradeTypeEnum.BUY.value, tr_date=self.BASE + timedelta(days=3),
+                         shares=Decimal('500'), nav=Decimal('1.55')),
+            create_trade(user_id=user_id, ho_id=holding.id, ho_code=holding.ho_code,
+                         tr_type=TradeTypeEnum.SELL.value, tr_date=self.BASE + timedelta(days=6),
+                         shares=Decimal('600'), nav=Decimal('1.6')),
+        ]
+        trades[2].tr_cycle = 2
+        db.session.add_all(trades)
+        for i in range(10):
+            if i == 4:
+                continue  # 缺失净值的日期跨越块边界
+            db.session.add(FundNavHistory(
+                ho_id=holding.id, ho_code=holding.ho_code, nav_date=self.BASE + timedelta(days=i),
+                nav_per_unit=Decimal('1.5') + Decimal(i) * Decimal('0.01')
+            ))
+        db.session.commit()
+
+    @staticmethod
+    def _rows():
+        return [
+            (s.snapshot_date, s.holding_shares, s.hos_holding_cost, s.hos_realized_pnl,
+             s.hos_daily_pnl, s.hos_total_pnl, s.tr_cycle)
+            for s in HoldingSnapshot.query.order_by(HoldingSnapshot.snapshot_date).all()
+        ]
+
+    @pytest.mark.parametrize('engine', ['DECIMAL', 'VECTOR'])
+    @patch('app.service.holding_snapshot_service.trade_calendar')
+    def test_date_chunks_match_single_pass(
+        self, mock_calendar, engine, db, mock_user, mock_holding, mock_user_holding
+    ):
+        """State carried across date blocks reproduces the single-pass rows"""
+        mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
+        self._seed(db, mock_user.id, mock_holding)
+        params = dict(user_id=mock_user.id, start_date=self.BASE, end_date=self.BASE + timedelta(days=9),
+                      engine=engine)
+
+        HoldingSnapshotService.generate_snapshots(**params)
+        single_pass = self._rows()
+
+        result = HoldingSnapshotService.generate_snapshots(chunk_by='DATE', chunk_size=3, **params)
+
+        assert result['chunks'] == 4
+        assert result['errors'] == []
+        assert result['upsert']['updated'] == 0
+        assert self._rows() == single_pass
+        assert len(single_pass) == 9
+
+    @patch('app.service.holding_snapshot_service.trade_calendar')
+    def test_failed_holding_keeps_old_rows(self, mock_calendar, db, mock_user, mock_holding, mock_user_holding):
+        """A holding that fails in a later date block keeps all of its old rows, with no pruned gap"""
+        mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
+        self._seed(db, mock_user.id, mock_holding)
+        other = Holding(ho_code='000002', ho_name='Other Fund', ho_short_name='Other', ho_type='FUND', currency='CNY')
+        db.session.add(other)
+        db.session.flush()
+        db.session.add(UserHolding(user_id=mock_user.id, ho_id=other.id, ho_status=HoldingStatusEnum.HOLDING.value))
+        self._seed(db, mock_user.id, other)
+        params = dict(user_id=mock_user.id, start_date=self.BASE, end_date=self.BASE + timedelta(days=9))
+        HoldingSnapshotService.generate_snapshots(**params)
+        old_rows = {(s.snapshot_date, s.hos_total_pnl) for s in HoldingSnapshot.query.filter_by(ho_id=other.id)}
+
+        calculate_range = HoldingSnapshotService._calculate_range
+
+        def fail_other_after_first_block(**kwargs):
+            if kwargs['holding'].id == other.id and kwargs['target_start'] > self.BASE:
+                raise ValueError('boom')
+            return calculate_range(**kwargs)
+
+        with patch.object(HoldingSnapshotService, '_calculate_range', side_effect=fail_other_after_first_block), \
+                patch.object(HoldingSnapshotService, '_handle_holding_error'):
+            result = HoldingSnapshotService.generate_snapshots(chunk_by='DATE', chunk_size=3, **params)
+
+        assert result['failed_ids'] == [other.id]
+        assert result['upsert']['deleted'] == 0
+        assert {(s.snapshot_date, s.hos_total_pnl) for s in HoldingSnapshot.query.filter_by(ho_id=other.id)} == old_rows
+        assert len(old_rows) == 9
+
+    @patch('app.service.holding_snapshot_service.trade_calendar')
+    def test_holding_chunks(self, mock_calendar, db, mock_user, mock_holding, mock_user_holding):
+        """Holding blocks are written independently with the same totals"""
+        mock_calendar.next_trade_day.side_effect = lambda d: d + timedelta(days=1)
+        mock_calendar.trade_days_between.side_effect = _calendar_days
+        self._seed(db, mock_user.id, mock_holding)
+
+        result = HoldingSnapshotService.generate_snapshots(
+            user_id=mock_user.id, start_date=self.BASE, end_date=self.BASE + timedelta(days=9),
+            chunk_by='HOLDING', chunk_size=1
+        )
+
+        assert result['chunks'] == 1
+        assert result['total_generated'] == 9
+        assert result['upsert']['inserted'] == 9
+
+    def test_date_blocks(self):
+        """Blocks are contiguous and keep the caller's boundaries"""
+        start, end = date(2024, 10, 1), date(2024, 10, 7)
+        with patch('app.service.holding_snapshot_service.trade_calendar') as mock_calendar:
+            mock_calendar.trade_days_between.side_effect = _calendar_days
+            blocks = HoldingSnapshotService._date_blocks(start, end, 3)
+
+        assert blocks == [
+            (start, date(2024, 10, 3)),
+            (date(2024, 10, 4), date(2024, 10, 6)),
+            (date(2024, 10, 7), end),
+        ]
@@ -0,0 +1,228 @@
+"""
+Tests for InvestedAssetAnalyticsSnapshotService
+"""
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.constant.biz_enums import AnalyticsMaterializeEnum, ErrorMessageEnum
+from app.extension import db
+from app.framework.exceptions import BizException
+from app.models import AnalyticsWindow, InvestedAssetAnalyticsSnapshot, InvestedAssetSnapshot
+from app.service import invested_asset_analytics_snapshot_service as analytics_module
+from app.service.dashboard_service import DashboardService
+from app.service.invested_asset_analytics_snapshot_service import InvestedAssetAnalyticsSnapshotService
+
+WINDOWS = [
+    AnalyticsWindow(window_key='ALL', window_type='expanding'),
+    AnalyticsWindow(window_key='R21', window_type='rolling', window_days=21),
+    AnalyticsWindow(window_key='R63', window_type='rolling', window_days=63),
+]
+
+
+def _portfolio(days=120, seed=3):
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range('2024-01-02', periods=days)
+    ret = rng.normal(0.0005, 0.012, days)
+    net_flow = np.where(rng.random(days) < 0.1, -rng.integers(100, 1000, days), 0).astype(float)
+    net_flow[0] = -10000.0
+    mv = 10000 * np.cumprod(1 + ret) - np.cumsum(net_flow) - 10000
+    return pd.DataFrame({
+        'ret': ret,
+        'pnl': ret * mv,
+        'mv': mv,
+        'net_flow': net_flow,
+        'dividend': np.zeros(days),
+    }, index=index)
+
+
+class TestCalculateRange:
+    """The column-wise engine must reproduce the per-slice reference metrics"""
+
+    def test_matches_per_slice_metrics(self):
+        df = _portfolio()
+        start, end = df.index[10].date(), df.index[-1].date()
+
+        batch = InvestedAssetAnalyticsSnapshotService._calculate_range(df, WINDOWS, start, end, user_id=1)
+
+        assert len(batch) == (len(df) - 10) * len(WINDOWS)
+        keys = batch.column('window_key').tolist()
+        assert keys[:3] == ['ALL', 'R21', 'R63']
+        irr = batch.column('irr_annualized')
+        windows_by_key = {w.window_key: w for w in WINDOWS}
+        for i in range(0, len(batch), 17):
+            row = df.index.get_loc(pd.Timestamp(batch.column('snapshot_date')[i]))
+            window = windows_by_key[keys[i]]
+            start_row = 0 if window.window_type == 'expanding' else max(row - window.window_days + 1, 0)
+            expected = InvestedAssetAnalyticsSnapshotService._compute_metrics(
+                df.iloc[start_row:row + 1], irr_ann=None if np.isnan(irr[i]) else float(irr[i])
+            )
+            for key, column in (('twrr_cum', 'twrr_cumulative'), ('twrr_ann', 'twrr_annualized'),
+                                ('period_pnl_ratio', 'period_pnl_ratio'), ('volatility', 'volatility'),
+                                ('sharpe', 'sharpe_ratio'), ('sortino', 'sortino_ratio'),
+                                ('mdd', 'max_drawdown'), ('calmar', 'calmar_ratio'), ('irr_cum', 'irr_cumulative'),
+                                ('best_day', 'best_day_return'), ('worst_day', 'worst_day_return')):
+                assert batch.column(column)[i] == pytest.approx(expected[key], rel=1e-9, abs=1e-12, nan_ok=True), key
+            for key, column in (('mdd_start', 'max_drawdown_start_date'), ('mdd_end', 'max_drawdown_end_date'),
+                                ('mdd_recovery', 'max_drawdown_recovery_date')):
+                assert batch.column(column)[i] == expected[key], key
+
+    def test_unknown_window_type_is_skipped(self):
+        df = _portfolio(days=5)
+        windows = [AnalyticsWindow(window_key='X', window_type='other')]
+        batch = InvestedAssetAnalyticsSnapshotService._calculate_range(
+            df, windows, df.index[0].date(), df.index[-1].date(), user_id=1
+        )
+        assert len(batch) == 0
+
+
+def _store(user_id, df):
+    """Persist a synthetic portfolio as InvestedAssetSnapshot rows"""
+    db.session.add_all([
+        InvestedAssetSnapshot(
+            user_id=user_id,
+            snapshot_date=ts.date(),
+            ias_market_value=Decimal(f"{row.mv:.4f}"),
+            ias_holding_cost=Decimal('0'),
+            ias_unrealized_pnl=Decimal('0'),
+            ias_total_realized_pnl=Decimal('0'),
+            ias_total_cash_dividend=Decimal('0'),
+            ias_total_dividend=Decimal('0'),
+            ias_total_pnl=Decimal('0'),
+            ias_net_external_cash_flow=Decimal(f"{row.net_flow:.4f}"),
+            ias_daily_cash_dividend=Decimal('0'),
+            ias_daily_pnl=Decimal(f"{row.pnl:.4f}"),
+            ias_daily_pnl_ratio=Decimal(f"{row.ret:.6f}"),
+        ) for ts, row in df.iterrows()
+    ])
+    db.session.commit()
+
+
+class TestCustomRangeMetrics:
+    """On-demand metrics for an arbitrary range, served from the per-user array cache"""
+
+    @pytest.fixture(autouse=True)
+    def _clear_cache(self):
+        analytics_module._series_cache.invalidate()
+        yield
+        analytics_module._series_cache.invalidate()
+
+    def test_matches_reference_and_writes_nothing(self, db, mock_user):
+        _store(mock_user.id, _portfolio(days=80))
+        start, end = date(2024, 1, 13), date(2024, 3, 31)
+
+        result = InvestedAssetAnalyticsSnapshotService.get_custom_range_metrics(mock_user.id, start, end)
+
+        df = InvestedAssetAnalyticsSnapshotService._load_data(mock_user.id, date.max)
+        piece = df[(df.index >= pd.Timestamp(start)) & (df.index <= pd.Timestamp(end))]
+        expected = InvestedAssetAnalyticsSnapshotService._compute_metrics(
+            piece, risk_free_rate=0.02, irr_ann=InvestedAssetAnalyticsSnapshotService._calc_xirr(piece)
+        )
+        assert result['start_date'] == '2024-01-15'
+        assert result['end_date'] == '2024-03-29'
+        assert result['days'] == len(piece)
+        for key, column in (('twrr_cum', 'twrr_cumulative'), ('twrr_ann', 'twrr_annualized'),
+                            ('irr_ann', 'irr_annualized'), ('volatility', 'volatility'),
+                            ('sharpe', 'sharpe_ratio'), ('sortino', 'sortino_ratio'),
+                            ('mdd', 'max_drawdown'), ('win_rate', 'win_rate')):
+            value = None if np.isnan(expected[key]) else pytest.approx(expected[key], rel=1e-9, abs=1e-12)
+            assert result[column] == value, key
+        assert result['max_drawdown_start_date'] == expected['mdd_start'].isoformat()
+        assert InvestedAssetAnalyticsSnapshot.query.count() == 0
+
+    def test_cache_reloads_when_snapshots_change(self, db, mock_user, monkeypatch):
+        df = _portfolio(days=40)
+        _store(mock_user.id, df.iloc[:30])
+        loads = []
+        load_series = InvestedAssetAnalyticsSnapshotService._load_series.__func__
+        monkeypatch.setattr(InvestedAssetAnalyticsSnapshotService, '_load_series',
+                            classmethod(lambda cls, user_id: loads.append(user_id) or load_series(cls, user_id)))
+
+        first = InvestedAssetAnalyticsSnapshotService.get_custom_range_metrics(mock_user.id, date(2024, 1, 1), date(2024, 12, 31))
+        InvestedAssetAnalyticsSnapshotService.get_custom_range_metrics(mock_user.id, date(2024, 1, 10), date(2024, 1, 20))
+        assert len(loads) == 1
+        assert first['days'] == 30
+
+        _store(mock_user.id, df.iloc[30:])
+        second = InvestedAssetAnalyticsSnapshotService.get_custom_range_metrics(mock_user.id, date(2024, 1, 1), date(2024, 12, 31))
+        assert len(loads) == 2
+        assert second['days'] == 40
+
+    def test_empty_range_and_invalid_bounds(self, db, mock_user):
+        assert InvestedAssetAnalyticsSnapshotService.get_custom_range_metrics(
+            mock_user.id, date(2024, 1, 1), date(2024, 1, 31)) is None
+        _store(mock_user.id, _portfolio(days=10))
+        assert InvestedAssetAnalyticsSnapshotService.get_custom_range_metrics(
+            mock_user.id, date(2025, 1, 1), date(2025, 1, 31)) is None
+        with pytest.raises(BizException):
+            InvestedAssetAnalyticsSnapshotService.get_custom_range_metrics(mock_user.id, date(2024, 2, 1), date(2024, 1, 1))
+
+    def test_route(self, db, client, auth_headers, mock_user):
+        _store(mock_user.id, _portfolio(days=10))
+        resp = client.post('/time/invested_asset_analytics_snapshot/custom_range', headers=auth_headers,
+                           json={'start_date': '2024-01-01', 'end_date': '2024-01-31'})
+        body = resp.get_json()
+        assert body['data']['days'] == 10
+        assert body['data']['twrr_annualized'] is None
+
+        resp = client.post('/time/invested_asset_analytics_snapshot/custom_range', headers=auth_headers,
+                           json={'start_date': 'bad'})
+        assert resp.get_json()['code'] != 200
+
+    def test_route_rejects_inverted_range(self, db, client, auth_headers, mock_user):
+        resp = client.post('/time/invested_asset_analytics_snapshot/custom_range', headers=auth_headers,
+                           json={'start_date': '2024-02-01', 'end_date': '2024-01-01'})
+        body = resp.get_json()
+        assert body['code'] != 200
+        assert body['msg'] in ('INVALID_DATE_RANGE', str(ErrorMessageEnum.INVALID_DATE_RANGE.value),
+                               'Start date cannot be later than end date')
+
+
+class TestMaterializePolicy:
+    """LATEST windows keep the newest row; ON_READ windows are computed on read by the dashboard"""
+
+    @pytest.fixture(autouse=True)
+    def _clear_cache(self):
+        analytics_module._series_cache.invalidate()
+        yield
+        analytics_module._series_cache.invalidate()
+
+    def test_lazy_windows(self, db, mock_user):
+        df = _portfolio(days=90)
+        _store(mock_user.id, df)
+        db.session.add_all([
+            AnalyticsWindow(window_key='ALL', window_type='expanding'),
+            AnalyticsWindow(window_key='R21', window_type='rolling', window_days=21,
+                            materialize_policy=AnalyticsMaterializeEnum.LATEST.value),
+            AnalyticsWindow(window_key='R63', window_type='rolling', window_days=63,
+                            materialize_policy=AnalyticsMaterializeEnum.ON_READ.value),
+        ])
+        db.session.commit()
+        dates = list(df.index.date)
+
+        InvestedAssetAnalyticsSnapshotService.generate_analytics(mock_user.id, dates[0], dates[-2])
+        InvestedAssetAnalyticsSnapshotService.generate_analytics(mock_user.id, dates[-1], dates[-1])
+
+        stored = InvestedAssetAnalyticsSnapshot.query.filter_by(user_id=mock_user.id)
+        assert stored.filter_by(window_key='ALL').count() == len(dates)
+        assert [r.snapshot_date for r in stored.filter_by(window_key='R21')] == [dates[-1]]
+        assert stored.filter_by(window_key='R63').count() == 0
+
+        # 读取时计算，与逐日落库的口径一致
+        window = AnalyticsWindow.query.filter_by(window_key='R63').first()
+        on_read = InvestedAssetAnalyticsSnapshotService.compute_on_read(mock_user.id, window, dates[-1])
+        loaded = InvestedAssetAnalyticsSnapshotService._load_data(mock_user.id, dates[-1])
+        expected = InvestedAssetAnalyticsSnapshotService._calculate_range(
+            loaded, [AnalyticsWindow(window_key='R63', window_type='rolling', window_days=63)],
+            dates[-1], dates[-1], user_id=mock_user.id
+        )
+        assert on_read.snapshot_date == dates[-1]
+        for column in ('twrr_cumulative', 'volatility', 'sharpe_ratio', 'max_drawdown', 'win_rate'):
+            assert getattr(on_read, column) == pytest.approx(expected.column(column)[0], rel=1e-12), column
+
+        performance = DashboardService.get_performance(mock_user.id, 'R63', days=100000)
+        assert performance['window'] == 'R63'
+        assert performance['volatility'] == pytest.approx(expected.column('volatility')[0] * 100)
@@ -0,0 +1,130 @@
+"""
+Tests for InvestedAssetSnapshotService
+"""
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from app.constant.biz_enums import SnapshotEngineEnum
+from app.models import Holding, HoldingSnapshot, InvestedAssetIndex, InvestedAssetSnapshot
+from app.service.invested_asset_snapshot_service import InvestedAssetSnapshotService
+
+
+def _snapshot(user_id, ho_id, day, mv, cost, flow='0', buy='0'):
+    return HoldingSnapshot(
+        user_id=user_id, ho_id=ho_id, snapshot_date=day,
+        hos_market_value=Decimal(mv), hos_holding_cost=Decimal(cost),
+        hos_net_external_cash_flow=Decimal(flow), hos_daily_buy_amount=Decimal(buy)
+    )
+
+
+class TestInvestedAssetSnapshotService:
+    """Tests for the SQL-side daily aggregation"""
+
+    def test_daily_aggregates_are_exact_sums(self, db, mock_user, mock_holding):
+        """Per-day sums come back as exact decimals; missing values count as zero"""
+        other = Holding(ho_code='000002', ho_name='Other Fund', ho_type='FUND', currency='CNY')
+        db.session.add(other)
+        db.session.flush()
+        db.session.add_all([
+            _snapshot(mock_user.id, mock_holding.id, date(2024, 3, 1), '0.1', '1.0001'),
+            _snapshot(mock_user.id, other.id, date(2024, 3, 1), '0.2', '2.0002'),
+            HoldingSnapshot(user_id=mock_user.id, ho_id=other.id, snapshot_date=date(2024, 3, 4)),
+        ])
+        db.session.commit()
+
+        result = InvestedAssetSnapshotService._load_daily_aggregates(mock_user.id, date(2024, 3, 1), date(2024, 3, 4))
+
+        assert result[date(2024, 3, 1)]['mv'] == Decimal('0.3')
+        assert result[date(2024, 3, 1)]['cost'] == Decimal('3.0003')
+        assert result[date(2024, 3, 4)]['mv'] == Decimal('0')
+
+    def test_generate_snapshots_carries_state(self, db, mock_user, mock_holding):
+        """Daily pnl and totals chain from the previous trading day"""
+        db.session.add_all([
+            _snapshot(mock_user.id, mock_holding.id, date(2024, 3, 1), '1000', '1000', flow='-1000', buy='1000'),
+            _snapshot(mock_user.id, mock_holding.id, date(2024, 3, 4), '1100', '1000'),
+        ])
+        db.session.commit()
+
+        result = InvestedAssetSnapshotService.generate_snapshots(mock_user.id, date(2024, 3, 1), date(2024, 3, 4))
+
+        assert result['total_generated'] == 2
+        second = InvestedAssetSnapshot.query.filter_by(user_id=mock_user.id, snapshot_date=date(2024, 3, 4)).one()
+        assert second.ias_daily_pnl == Decimal('100')
+        assert second.ias_total_pnl == Decimal('100')
+        assert second.ias_daily_pnl_ratio == Decimal('0.1')
+        assert second.ias_total_pnl_ratio == Decimal('0.1')
+
+    def test_fixed_engine_matches_decimal(self, db, mock_user, mock_holding):
+        """FIXED stores the same values as DECIMAL; VERIFY checks both paths without raising"""
+        db.session.add_all([
+            _snapshot(mock_user.id, mock_holding.id, date(2024, 3, 1), '1000.0001', '1000', flow='-1000', buy='1000'),
+            _snapshot(mock_user.id, mock_holding.id, date(2024, 3, 4), '1033.3333', '1000', flow='-300', buy='300'),
+            _snapshot(mock_user.id, mock_holding.id, date(2024, 3, 5), '1212.1212', '1300'),
+        ])
+        db.session.commit()
+
+        def stored():
+            rows = InvestedAssetSnapshot.query.filter_by(user_id=mock_user.id) \
+                .order_by(InvestedAssetSnapshot.snapshot_date).all()
+            return [(r.ias_daily_pnl, r.ias_daily_pnl_ratio, r.ias_total_pnl, r.ias_total_pnl_ratio,
+                     r.ias_total_buy_amount, r.ias_total_realized_pnl) for r in rows]
+
+        InvestedAssetSnapshotService.generate_snapshots(mock_user.id, date(2024, 3, 1), date(2024, 3, 5))
+        expected = stored()
+        InvestedAssetSnapshotService.generate_snapshots(
+            mock_user.id, date(2024, 3, 1), date(2024, 3, 5), engine=SnapshotEngineEnum.FIXED.value
+        )
+        assert stored() == expected
+
+        result = InvestedAssetSnapshotService.generate_snapshots(
+            mock_user.id, date(2024, 3, 1), date(2024, 3, 5), engine=SnapshotEngineEnum.VERIFY.value
+        )
+        assert result['total_generated'] == 3
+
+
+class TestInvestedAssetIndex:
+    """Tests for the chained unit-value index"""
+
+    def test_index_chains_returns_and_flows(self, db, mock_user, mock_holding):
+        """Range returns and flows come from two index rows; the peak is carried forward"""
+        db.session.add_all([
+            _snapshot(mock_user.id, mock_holding.id, date(2024, 3, 1), '1000', '1000', flow='-1000', buy='1000'),
+            _snapshot(mock_user.id, mock_holding.id, date(2024, 3, 4), '1100', '1000'),
+            _snapshot(mock_user.id, mock_holding.id, date(2024, 3, 5), '990', '1000'),
+            _snapshot(mock_user.id, mock_holding.id, date(2024, 3, 6), '1490', '1500', flow='-500', buy='500'),
+        ])
+        db.session.commit()
+        InvestedAssetSnapshotService.generate_snapshots(mock_user.id, date(2024, 3, 1), date(2024, 3, 6))
+
+        rows = InvestedAssetIndex.query.filter_by(user_id=mock_user.id).order_by(InvestedAssetIndex.snapshot_date).all()
+        assert [r.unit_value for r in rows] == pytest.approx([1.0, 1.1, 0.99, 0.99])
+        assert rows[-1].peak_unit_value == pytest.approx(1.1)
+        assert rows[-1].peak_date == date(2024, 3, 4)
+        assert rows[-1].cumulative_net_flow == Decimal('-1500')
+
+        summary = InvestedAssetSnapshotService.get_period_summary(mock_user.id, date(2024, 3, 5), date(2024, 3, 6))
+        assert summary['twrr'] == pytest.approx(0.99 / 1.1 - 1)
+        assert summary['net_external_cash_flow'] == Decimal('-500')
+        assert summary['drawdown'] == pytest.approx(0.99 / 1.1 - 1)
+        assert InvestedAssetSnapshotService.get_period_summary(mock_user.id, date(2024, 4, 1), date(2024, 4, 30)) is None
+
+    def test_index_backfills_unindexed_history(self, db, mock_user, mock_holding):
+        """Snapshots generated before the index existed are chained in on the next run"""
+        db.session.add_all([
+            _snapshot(mock_user.id, mock_holding.id, date(2024, 3, 1), '1000', '1000', flow='-1000', buy='1000'),
+            _snapshot(mock_user.id, mock_holding.id, date(2024, 3, 4), '1200', '1000'),
+        ])
+        db.session.commit()
+        InvestedAssetSnapshotService.generate_snapshots(mock_user.id, date(2024, 3, 1), date(2024, 3, 4))
+        InvestedAssetIndex.query.delete()
+        db.session.commit()
+
+        InvestedAssetSnapshotService.generate_snapshots(mock_user.id, date(2024, 3, 4), date(2024, 3, 4))
+
+        summary = InvestedAssetSnapshotService.get_period_summary(mock_user.id, date(2024, 3, 1), date(2024, 3, 4))
+        assert InvestedAssetIndex.query.filter_by(user_id=mock_user.id).count() == 2
+        assert summary['twrr'] == pytest.approx(0.2)
+        assert summary['net_external_cash_flow'] == Decimal('-1000')
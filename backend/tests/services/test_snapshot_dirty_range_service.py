@@ -0,0 +1,116 @@
+"""
+Tests for SnapshotDirtyRangeService
+"""
+from datetime import date
+from unittest.mock import patch
+
+import pytest
+
+from app.models import Holding, SnapshotDirtyRange
+from app.service.holding_analytics_snapshot_service import HoldingAnalyticsSnapshotService
+from app.service.holding_snapshot_service import HoldingSnapshotService
+from app.service.invested_asset_analytics_snapshot_service import InvestedAssetAnalyticsSnapshotService
+from app.service.invested_asset_snapshot_service import InvestedAssetSnapshotService
+from app.service.snapshot_dirty_range_service import SnapshotDirtyRangeService
+from app.service.task_service import TaskService
+
+
+class TestSnapshotDirtyRangeService:
+    """Tests for dirty watermark marking and clearing"""
+
+    def test_mark_dirty_keeps_earliest_date(self, db, mock_user, mock_holding):
+        """Repeated marks keep the earliest dirty_from"""
+        SnapshotDirtyRangeService.mark_dirty(mock_user.id, mock_holding.id, date(2024, 3, 10))
+        SnapshotDirtyRangeService.mark_dirty(mock_user.id, mock_holding.id, date(2024, 2, 1))
+        SnapshotDirtyRangeService.mark_dirty(mock_user.id, mock_holding.id, date(2024, 5, 1))
+        db.session.commit()
+
+        records = SnapshotDirtyRange.query.filter_by(user_id=mock_user.id).all()
+        assert len(records) == 1
+        assert records[0].dirty_from == date(2024, 2, 1)
+
+    def test_mark_trades_dirty(self, db, mock_trades_buy_sell):
+        """Trades are grouped per holding using their earliest trade date"""
+        SnapshotDirtyRangeService.mark_trades_dirty(mock_trades_buy_sell)
+        db.session.commit()
+
+        trade = min(mock_trades_buy_sell, key=lambda t: t.tr_date)
+        watermarks = SnapshotDirtyRangeService.get_watermarks(trade.user_id)
+        assert watermarks[trade.ho_id][1] == trade.tr_date
+
+    def test_clear_keeps_watermark_lowered_during_run(self, db, mock_user, mock_holding):
+        """A watermark moved earlier after it was read survives clear()"""
+        SnapshotDirtyRangeService.mark_dirty(mock_user.id, mock_holding.id, date(2024, 3, 10))
+        db.session.commit()
+        watermarks = SnapshotDirtyRangeService.get_watermarks(mock_user.id)
+
+        SnapshotDirtyRangeService.mark_dirty(mock_user.id, mock_holding.id, date(2024, 1, 5))
+        db.session.commit()
+
+        assert SnapshotDirtyRangeService.clear(watermarks) == 0
+        assert SnapshotDirtyRangeService.get_watermarks(mock_user.id)[mock_holding.id][1] == date(2024, 1, 5)
+
+    def test_clear_removes_processed_watermark(self, db, mock_user, mock_holding):
+        """Unchanged watermarks are removed"""
+        SnapshotDirtyRangeService.mark_dirty(mock_user.id, mock_holding.id, date(2024, 3, 10))
+        db.session.commit()
+        watermarks = SnapshotDirtyRangeService.get_watermarks(mock_user.id)
+
+        assert SnapshotDirtyRangeService.clear(watermarks) == 1
+        assert SnapshotDirtyRangeService.get_watermarks(mock_user.id) == {}
+
+
+class TestRedoDirtySnapshot:
+    """Watermarks are only cleared for holdings that were regenerated successfully"""
+
+    END_DATE = date(2024, 6, 28)
+
+    @pytest.fixture
+    def two_dirty_holdings(self, db, mock_user, mock_holding):
+        other = Holding(ho_code='000002', ho_name='Other Fund', ho_short_name='Other', ho_type='FUND', currency='CNY')
+        db.session.add(other)
+        db.session.flush()
+        SnapshotDirtyRangeService.mark_dirty(mock_user.id, mock_holding.id, date(2024, 3, 1))
+        SnapshotDirtyRangeService.mark_dirty(mock_user.id, other.id, date(2024, 3, 1))
+        db.session.commit()
+        return mock_holding.id, other.id
+
+    def _redo(self, user_id, holding_result, portfolio_result):
+        with patch.object(HoldingSnapshotService, 'generate_snapshots', return_value=holding_result), \
+                patch.object(HoldingAnalyticsSnapshotService, 'generate_analytics', return_value=[]), \
+                patch.object(InvestedAssetSnapshotService, 'generate_snapshots', return_value=portfolio_result), \
+                patch.object(InvestedAssetAnalyticsSnapshotService, 'generate_analytics', return_value=None), \
+                patch.object(HoldingAnalyticsSnapshotService, 'update_position_ratios_and_contributions'):
+            return TaskService.redo_dirty_snapshot(user_id, end_date=self.END_DATE)
+
+    def test_failed_holding_keeps_watermark(self, db, mock_user, two_dirty_holdings):
+        failed_id, ok_id = two_dirty_holdings
+
+        result = self._redo(
+            mock_user.id,
+            {'total_generated': 10, 'errors': ['boom'], 'failed_ids': [failed_id]},
+            {'total_generated': 10, 'errors': []}
+        )
+
+        assert result['failed_holdings'] == [failed_id]
+        assert set(SnapshotDirtyRangeService.get_watermarks(mock_user.id)) == {failed_id}
+
+    def test_portfolio_error_keeps_all_watermarks(self, db, mock_user, two_dirty_holdings):
+        result = self._redo(
+            mock_user.id,
+            {'total_generated': 10, 'errors': [], 'failed_ids': []},
+            {'total_generated': 0, 'errors': ['commit failed']}
+        )
+
+        assert result['failed_holdings'] == sorted(two_dirty_holdings)
+        assert set(SnapshotDirtyRangeService.get_watermarks(mock_user.id)) == set(two_dirty_holdings)
+
+    def test_success_clears_all_watermarks(self, db, mock_user, two_dirty_holdings):
+        result = self._redo(
+            mock_user.id,
+            {'total_generated': 10, 'errors': [], 'failed_ids': []},
+            {'total_generated': 10, 'errors': []}
+        )
+
+        assert result['failed_holdings'] == []
+        assert SnapshotDirtyRangeService.get_watermarks(mock_user.id) == {}
@@ -507,6 +507,17 @@ class TestTradeServiceUpdateTradeRecord:
             TradeService.update_trade_record(99999, {'tr_shares': Decimal('100')})
 
 
+class TestTradeServiceDeleteTrade:
+    """Tests for TradeService.delete_trade"""
+
+    def test_delete_trade_success(self, db, mock_user, mock_holding, mock_user_holding, mock_trade):
+        """Test successful trade deletion"""
+        trade_id = mock_trade.id
+
+        assert TradeService.delete_trade(mock_trade) is True
+        assert Trade.query.get(trade_id) is None
+
+
 class TestTradeServiceCleanAndParseJson:
     """Tests for TradeService._clean_and_parse_json"""
 
@@ -0,0 +1,49 @@
+from datetime import date
+
+import numpy as np
+
+from app.calendars.trade_calendar import trade_calendar
+
+
+class TestTradeCalendarRangeApi:
+    """Test range/bulk trading-day APIs against the scalar ones"""
+
+    SAMPLE_DATES = [date(2025, 1, 1), date(2025, 1, 2), date(2025, 1, 4), date(2025, 1, 6), date(2025, 1, 31)]
+
+    def test_trade_days_between_matches_next_trade_day(self):
+        start, end = date(2024, 12, 25), date(2025, 2, 10)
+        expected = []
+        cursor = trade_calendar.next_trade_day(trade_calendar.prev_trade_day(start))
+        while cursor <= end:
+            expected.append(cursor)
+            cursor = trade_calendar.next_trade_day(cursor)
+
+        assert trade_calendar.trade_days_between(start, end).tolist() == expected
+        assert list(trade_calendar.iter_trade_days(start, end)) == expected
+
+    def test_trade_days_between_exclusive(self):
+        days = trade_calendar.trade_days_between('2025-01-02', '2025-01-07', inclusive=False)
+        assert days.tolist() == [date(2025, 1, 3), date(2025, 1, 6)]
+        assert len(trade_calendar.trade_days_between('2025-01-07', '2025-01-02')) == 0
+
+    def test_trade_day_index_counts_trade_days(self):
+        start_idx = trade_calendar.trade_day_index('2025-01-02')
+        end_idx = trade_calendar.trade_day_index('2025-01-10', side='right')
+        assert end_idx - start_idx == trade_calendar.count_trade_days_between('2025-01-02', '2025-01-10')
+        assert trade_calendar.trade_day_at(trade_calendar.trade_day_index('2025-01-04')) == date(2025, 1, 6)
+        assert trade_calendar.trade_day_at(-1) is None
+
+    def test_offset_matches_prev_and_next(self):
+        nexts = trade_calendar.offset_trade_days(self.SAMPLE_DATES, 1).tolist()
+        prevs = trade_calendar.offset_trade_days(self.SAMPLE_DATES, -1).tolist()
+        assert nexts == [trade_calendar.next_trade_day(d) for d in self.SAMPLE_DATES]
+        assert prevs == [trade_calendar.prev_trade_day(d) for d in self.SAMPLE_DATES]
+        assert trade_calendar.offset_trade_day('2025-01-02', 3) == date(2025, 1, 7)
+
+    def test_offset_out_of_range(self):
+        assert np.isnat(trade_calendar.offset_trade_days([date(1990, 12, 19)], -1)[0])
+        assert trade_calendar.offset_trade_day(date(1990, 12, 19), -1) is None
+
+    def test_is_trade_days(self):
+        result = trade_calendar.is_trade_days(self.SAMPLE_DATES)
+        assert result.tolist() == [trade_calendar.is_trade_day(d) for d in self.SAMPLE_DATES]